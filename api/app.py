@@ -1,271 +1,158 @@
+import gc
 import os
 import logging
-import urllib
-import pyodbc
-import time
-import sys
 
-from flask import Flask
+from flask import Flask, jsonify
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flasgger import Swagger
 from flask_login import LoginManager
-from sqlalchemy.exc import OperationalError, InterfaceError
-
-from models import db, User, Site
-from default_data import create_default_data
-
-# Initialisation de l'application Flask
-app = Flask(__name__)
-app.secret_key = 'ta_clé_secrète_unique_et_complexe'
-app.config['JWT_SECRET_KEY'] = app.secret_key  # Utiliser la même clé pour JWT
-CORS(app)
-
-# ===== Configuration de la base de données =====
-# Get database connection details from environment variables
-DB_USER = os.environ.get('DB_USER', 'Externe')
-DB_PASSWORD = os.environ.get('DB_PASSWORD', 'Secur3P@ssw0rd!')
-DB_HOST = os.environ.get('DB_HOST', 'mssql')
-DB_NAME = os.environ.get('DB_NAME', 'master')
-DB_PORT = os.environ.get('DB_PORT', '1433')
-
-connection_string = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    f"SERVER={DB_HOST};"
-    f"DATABASE={DB_NAME};"
-    f"UID={DB_USER};"
-    f"PWD={DB_PASSWORD}"
-)
-
-# connection_string = (
-#     "DRIVER={ODBC Driver 17 for SQL Server};"
-#     "SERVER=127.0.0.1;"
-#     "DATABASE=master;"
-#     "UID=Externe;"
-#     "PWD=Secur3P@ssw0rd!"
-# )
-
-params = urllib.parse.quote_plus(connection_string)
-app.config['SQLALCHEMY_DATABASE_URI'] = f"mssql+pyodbc:///?odbc_connect={params}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['DEBUG'] = True
-
-# ===== Configuration pour l'upload =====
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads')
-app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg'}
-
-# ===== Configuration du logging =====
-logging.basicConfig(level=logging.DEBUG)
-app.logger.setLevel(logging.DEBUG)
-
-# ===== Configuration Swagger avec définitions des modèles =====
-swagger_config = {
-    "headers": [],
-    "specs": [
-        {
-            "endpoint": "apispec",
-            "route": "/apispec.json",
-            # Exclure certaines routes legacy de la documentation pour éviter les doublons
-            "rule_filter": lambda rule: not (rule.rule.startswith('/erreurs') or rule.rule.startswith('/user-site-roles')),
-            "model_filter": lambda tag: True,
-        }
-    ],
-    "static_url_path": "/flasgger_static",
-    "swagger_ui": True,
-    "specs_route": "/swagger/",
-    "title": "BAES API - Documentation",
-    "description": "API de gestion des BAES, avec endpoints pour l'authentification, les sites, bâtiments, étages, BAES, statuts et cartes.",
-    "termsOfService": "",
-    "version": "1.0",
-}
-
-swagger_template = {
-    "swagger": "2.0",
-    "info": {
-        "title": "BAES API",
-        "description": "API pour la gestion des BAES",
-        "version": "1.0",
-    },
-    "tags": [
-        {"name": "Authentication", "description": "Authentification (login, logout)"},
-        {"name": "User CRUD", "description": "Gestion des utilisateurs"},
-        {"name": "Site CRUD", "description": "Gestion des sites"},
-        {"name": "Batiment CRUD", "description": "Gestion des bâtiments"},
-        {"name": "Etage CRUD", "description": "Gestion des étages"},
-        {"name": "BAES CRUD", "description": "Gestion des BAES (Blocs Autonomes d'Éclairage de Sécurité)"},
-        {"name": "Status CRUD", "description": "Gestion des statuts/erreurs des BAES"},
-        {"name": "carte crud", "description": "Gestion des cartes (plans, coordonnées, zoom)"},
-        {"name": "general", "description": "Routes utilitaires et agrégées (ex: version API, données consolidées)"},
-        {"name": "Configuration CRUD", "description": "Paramètres de configuration"}
-    ],
-    "definitions": {
-        "Baes": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "name": {"type": "string"},
-                "label": {"type": "string"},
-                "position": {"type": "object"},
-                "etage_id": {"type": "integer", "format": "int64"},
-                "is_ignored": {"type": "boolean"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "User": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "login": {"type": "string"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "Carte": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "chemin": {"type": "string"},
-                "etage_id": {"type": "integer", "format": "int64", "nullable": "true" },
-                "site_id": {"type": "integer", "format": "int64", "nullable": "true"},
-                "center_lat": {"type": "number", "format": "float"},
-                "center_lng": {"type": "number", "format": "float"},
-                "zoom": {"type": "number", "format": "float"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "Batiment": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "name": {"type": "string"},
-                "site_id": {"type": "integer", "format": "int64"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "Etage": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "name": {"type": "string"},
-                "batiment_id": {"type": "integer", "format": "int64"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "Status": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "baes_id": {"type": "integer", "format": "int64"},
-                "erreur": {"type": "integer"},
-                "is_solved": {"type": "boolean"},
-                "acknowledged_by_user_id": {"type": "integer", "nullable": True},
-                "acknowledged_at": {"type": "string", "format": "date-time", "nullable": True},
-                "timestamp": {"type": "string", "format": "date-time"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "Role": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "name": {"type": "string"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "Site": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "name": {"type": "string"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        },
-        "UserSiteRole": {
-            "type": "object",
-            "properties": {
-                "id": {"type": "integer", "format": "int64"},
-                "user_id": {"type": "integer", "format": "int64"},
-                "site_id": {"type": "integer", "format": "int64"},
-                "role_id": {"type": "integer", "format": "int64"},
-                "created_at": {"type": "string", "format": "date-time"},
-                "updated_at": {"type": "string", "format": "date-time"}
-            }
-        }
-    }
-}
-
-# ===== Initialisation des extensions =====
-db.init_app(app)
-migrate = Migrate(app, db)
-swagger = Swagger(app, config=swagger_config, template=swagger_template)
-
-# ===== Configuration de Flask-Login =====
+
+import database
+import swagger_spec
+from models import db, User
+
+# ===== Extensions partagées (initialisées par create_app) =====
+migrate = Migrate()
+
 login_manager = LoginManager()
-login_manager.init_app(app)
 # Désactiver la redirection HTML pour les endpoints API, retourner un JSON 401 à la place
 login_manager.login_view = None
 
 @login_manager.unauthorized_handler
 def unauthorized():
-    from flask import jsonify
     return jsonify({"error": "unauthorized"}), 401
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-# ===== Enregistrement des blueprints =====
-from routes import init_app as init_routes
-init_routes(app)
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def log_level():
+    """Niveau de log : LOG_LEVEL (DEBUG, INFO, WARNING...), DEBUG par défaut en mode debug, INFO sinon."""
+    default = 'DEBUG' if _env_bool('FLASK_DEBUG', False) else 'INFO'
+    return os.environ.get('LOG_LEVEL', default).strip().upper()
+
+
+def create_app(config=None):
+    """
+    Construit l'application. `config` (dict) surcharge la configuration par défaut,
+    par exemple {'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SWAGGER_ENABLED': False}.
+    """
+    app = Flask(__name__)
+    app.secret_key = 'ta_clé_secrète_unique_et_complexe'
+    app.config['JWT_SECRET_KEY'] = app.secret_key  # Utiliser la même clé pour JWT
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Mode debug (débogueur, rechargement) uniquement en développement : FLASK_DEBUG=1
+    app.config['DEBUG'] = _env_bool('FLASK_DEBUG', False)
+
+    # ===== Configuration pour l'upload =====
+    app.config['UPLOAD_FOLDER'] = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'uploads')
+    app.config['MAX_CONTENT_LENGTH'] = 32 * 1024 * 1024
+    app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg'}
+
+    # ===== Documentation Swagger =====
+    # SWAGGER_ENABLED=false la désactive (production) ; la spec est servie depuis SWAGGER_SPEC_FILE
+    # si le fichier a été généré au build (flask --app app swagger build)
+    app.config['SWAGGER_ENABLED'] = _env_bool('SWAGGER_ENABLED', True)
+    app.config['SWAGGER_SPEC_FILE'] = os.environ.get('SWAGGER_SPEC_FILE', swagger_spec.DEFAULT_SPEC_FILE)
+
+    # ===== Cache de configuration (services.config_store) =====
+    # Délai maximal avant qu'un worker voie une modification de config faite par un autre worker
+    app.config['CONFIG_CACHE_INTERVAL'] = float(os.environ.get('CONFIG_CACHE_INTERVAL', 5))
+
+    # ===== Cache des séries de température (services.timeseries) =====
+    # Séries réduites des périodes terminées depuis TIMESERIES_CLOSED_DELAY secondes ; 0 désactive le cache
+    app.config['TIMESERIES_CACHE_SIZE'] = int(os.environ.get('TIMESERIES_CACHE_SIZE', 1024))
+    app.config['TIMESERIES_CACHE_TTL'] = int(os.environ.get('TIMESERIES_CACHE_TTL', 3600))
+    app.config['TIMESERIES_CLOSED_DELAY'] = int(os.environ.get('TIMESERIES_CLOSED_DELAY', 60))
+
+    # ===== Détection des BAES silencieux (services.watchdog, programme supervisord 'watchdog') =====
+    # Silence toléré par défaut (secondes) ; Baes.silence_threshold le remplace pour un BAES
+    app.config['WATCHDOG_SILENCE_THRESHOLD'] = int(os.environ.get('WATCHDOG_SILENCE_THRESHOLD', 900))
+    app.config['WATCHDOG_INTERVAL'] = float(os.environ.get('WATCHDOG_INTERVAL', 5))
+    app.config['WATCHDOG_REFRESH_INTERVAL'] = float(os.environ.get('WATCHDOG_REFRESH_INTERVAL', 60))
+
+    # ===== Tâches de fond (services.jobs, programme supervisord 'jobs') =====
+    # Threads d'exécution du worker ; une tâche sans signe de vie depuis JOB_STALE_AFTER secondes est reprise
+    app.config['JOB_WORKER_THREADS'] = int(os.environ.get('JOB_WORKER_THREADS', 2))
+    app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+    app.config['JOB_STALE_AFTER'] = int(os.environ.get('JOB_STALE_AFTER', 300))
+    # Tâches terminées et fichiers produits (exports) conservés JOB_RETENTION_DAYS jours
+    app.config['JOB_RETENTION_DAYS'] = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+    app.config['JOB_FILES_DIR'] = os.environ.get(
+        'JOB_FILES_DIR', os.path.join(os.path.abspath(os.path.dirname(__file__)), 'job_files'))
+
+    if config:
+        app.config.update(config)
+
+    # Les en-têtes de pagination et de routage lecture/écriture doivent être lisibles par le front (CORS)
+    CORS(app, expose_headers=['X-Total-Count', 'X-Page', 'X-Per-Page', 'X-Read-Primary-Until', 'X-DB-Route', 'X-Profile-Id'])
+
+    # ===== Configuration de la base de données =====
+    # URI et options du moteur (pool, pre-ping, fast_executemany, isolation) lues depuis l'environnement,
+    # voir database.py
+    database.init_app(app)
+
+    # ===== Instrumentation (requêtes SQL par requête HTTP, Server-Timing, /metrics) =====
+    from services import instrumentation
+    instrumentation.init_app(app)
+
+    # ===== Profilage à la demande (en-tête X-Profile ou échantillonnage, /admin/profiles) =====
+    from services import profiling
+    profiling.init_app(app)
+
+    # ===== Configuration du logging =====
+    app.logger.setLevel(log_level())
+
+    # ===== Initialisation des extensions =====
+    db.init_app(app)
+    migrate.init_app(app, db)
+    login_manager.init_app(app)
+    swagger_spec.init_app(app)
+
+    # ===== Enregistrement des blueprints =====
+    from routes import init_app as init_routes
+    init_routes(app)
+
+    # ===== Commandes CLI de maintenance =====
+    from commands import init_app as init_commands
+    init_commands(app)
+
+    return app
+
+
+logging.basicConfig(level=log_level())
+
+# Instance utilisée par wsgi.py, supervisord et la CLI flask (flask --app app ...)
+app = create_app()
+
+# Les objets créés au démarrage (modèles, routes, spec) vivent autant que le processus : les sortir
+# du suivi du ramasse-miettes évite qu'une collection complète les reparcoure pendant les premières
+# requêtes, et limite les copies de pages entre workers forkés.
+gc.freeze()
 
 # ===== Point d'entrée principal =====
+# Le schéma et les données par défaut ne sont plus créés ici : voir `flask --app app bootstrap`
+# (bootstrap.py), lancé une fois par déploiement. Le worker ne fait qu'une lecture de version.
 if __name__ == '__main__':
-    app.logger.debug("Démarrage de l'application et test de connexion à la base...")
-    print("Pilotes ODBC installés :", pyodbc.drivers())
-
-    # Paramètres de retry
-    max_retries = 30
-    retry_interval = 5  # secondes
-
-    with app.app_context():
-        # Boucle de retry pour la connexion à la base de données
-        for retry in range(max_retries):
-            try:
-                app.logger.debug(f"Tentative de connexion à la base de données ({retry+1}/{max_retries})...")
-                connection = db.engine.connect()
-                connection.close()
-                app.logger.debug("Connexion réussie à la base de données.")
-
-                # Créer les tables si elles n'existent pas
-                app.logger.debug("Création des tables si elles n'existent pas...")
-                db.create_all()
-                app.logger.debug("Tables créées avec succès.")
-
-                # Création des données par défaut
-                create_default_data()
-
-                # Si on arrive ici, tout s'est bien passé, on sort de la boucle
-                break
-
-            except (OperationalError, InterfaceError) as e:
-                app.logger.warning(f"Erreur de connexion à la base de données (tentative {retry+1}/{max_retries}): {e}")
-                if retry < max_retries - 1:
-                    app.logger.info(f"Nouvelle tentative dans {retry_interval} secondes...")
-                    time.sleep(retry_interval)
-                else:
-                    app.logger.error(f"Échec de connexion à la base de données après {max_retries} tentatives.")
-                    # On continue quand même pour démarrer l'application, elle réessaiera à chaque requête
-            except Exception as e:
-                app.logger.error(f"Erreur inattendue lors de l'initialisation de la base de données: {e}")
-                # On continue quand même pour démarrer l'application
-
+    try:
+        import pyodbc
+        print("Pilotes ODBC installés :", pyodbc.drivers())
+    except ImportError:
+        pass
+
+    import bootstrap
+    bootstrap.check_schema(app)
+    from services import known_baes
+    known_baes.preload(app)
+
+    # Serveur de développement Flask ; en production l'application est servie par uwsgi (uwsgi.ini)
     port = int(os.getenv('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=True, use_reloader=True)
+    app.run(host='0.0.0.0', port=port, debug=app.debug, use_reloader=app.debug)
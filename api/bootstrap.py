@@ -0,0 +1,209 @@
+"""
+Initialisation de la base, séparée du démarrage des processus.
+
+`flask --app app bootstrap` est lancé une fois par déploiement (programme one-shot de supervisord) :
+il attend la base, applique le schéma (migrations Flask-Migrate si le dossier migrations existe,
+sinon db.create_all() puis ajout des colonnes et index manquants aux tables existantes), crée les
+données par défaut et enregistre SCHEMA_VERSION, le tout dans
+une seule transaction pour les données. Il peut être relancé sans effet de bord. Une base
+antérieure à la table incidents voit ses incidents reconstruits depuis l'historique des status,
+une base antérieure aux colonnes baes.pos_x/pos_y les voit remplies depuis baes.position.
+Les compteurs d'alarmes des portées qui n'en ont pas encore sont calculés à chaque passage.
+
+Les workers ne font qu'une lecture de schema_version au démarrage (check_schema) ;
+la route /general/ready répond 503 tant que la base n'est pas à la version attendue.
+"""
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+from sqlalchemy.schema import CreateColumn
+
+from models import db, ConfigVersion, SchemaVersion
+from default_data import create_default_data
+from services import config_store
+
+# À incrémenter à chaque changement de schéma livré (nouvelle table, colonne, index...)
+# 2 : config.value_type, table config_version
+# 3 : index ix_status_baes_timestamp et ix_status_timestamp
+# 4 : baes.silence_threshold
+# 5 : table incidents (remplie depuis l'historique des status)
+# 6 : table jobs (tâches de fond)
+# 7 : baes.pos_x/pos_y et index ix_baes_etage_position (copiés de position)
+# 8 : baes.is_deleting (BAES d'un site en cours de suppression, refusés à l'ingestion)
+# 9 : index ix_status_acknowledged (acquittements lus par services.status_events)
+SCHEMA_VERSION = 9
+# Première version avec la table incidents : une base plus ancienne est reconstruite depuis les status
+INCIDENTS_VERSION = 5
+# Première version avec baes.pos_x/pos_y : une base plus ancienne les remplit depuis baes.position
+POSITIONS_VERSION = 7
+
+MIGRATIONS_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'migrations')
+
+# Dernier résultat de check_schema pour ce processus : la version n'est relue que tant qu'elle est en retard
+_state = {'version': None}
+_state_lock = threading.Lock()
+
+
+def wait_for_database(retries=30, interval=5):
+    """Attend que la base accepte les connexions ; retourne False après `retries` échecs."""
+    for attempt in range(1, retries + 1):
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            current_app.logger.debug("Connexion réussie à la base de données.")
+            return True
+        except (OperationalError, InterfaceError) as e:
+            current_app.logger.warning(
+                f"Erreur de connexion à la base de données (tentative {attempt}/{retries}): {e}"
+            )
+            if attempt < retries:
+                time.sleep(interval)
+    current_app.logger.error(f"Échec de connexion à la base de données après {retries} tentatives.")
+    return False
+
+
+def current_version():
+    """Version enregistrée en base, None si la table n'existe pas encore ou si la base est injoignable."""
+    try:
+        return db.session.execute(select(func.max(SchemaVersion.version))).scalar()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return None
+
+
+def add_missing_columns():
+    """
+    Ajoute aux tables existantes les colonnes déclarées dans les modèles mais absentes de la base
+    (create_all ne modifie pas une table existante). Une colonne NOT NULL doit avoir un
+    server_default pour que les lignes existantes reçoivent une valeur. Retourne les colonnes ajoutées.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(f"Colonne {table.name}.{column.name} NOT NULL sans server_default : "
+                                       f"migration manuelle nécessaire")
+                ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                table_name = connection.dialect.identifier_preparer.format_table(table)
+                connection.execute(text(f"ALTER TABLE {table_name} ADD {ddl}"))
+                added.append(f"{table.name}.{column.name}")
+                current_app.logger.info(f"Colonne ajoutée : {table.name}.{column.name}")
+    return added
+
+
+def add_missing_indexes():
+    """Crée les index déclarés dans les modèles et absents des tables existantes ; retourne leurs noms."""
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in present:
+                    continue
+                current_app.logger.info(f"Création de l'index {index.name} sur {table.name}...")
+                index.create(connection)
+                added.append(index.name)
+    return added
+
+
+def upgrade_schema():
+    """Applique les migrations Alembic si elles existent, sinon crée les tables, colonnes et index manquants."""
+    if os.path.isdir(MIGRATIONS_DIR):
+        from flask_migrate import upgrade
+        current_app.logger.debug("Application des migrations...")
+        upgrade(directory=MIGRATIONS_DIR)
+    else:
+        current_app.logger.debug("Création des tables si elles n'existent pas...")
+        db.create_all()
+        add_missing_columns()
+        add_missing_indexes()
+
+
+def run(seed=True):
+    """Schéma, données par défaut et version ; retourne (version précédente, nombre d'éléments créés)."""
+    upgrade_schema()
+    previous = current_version()
+    created = 0
+    try:
+        if seed:
+            created = create_default_data(commit=False)
+        if previous is None or previous < INCIDENTS_VERSION:
+            from services import incidents
+            rebuilt = incidents.rebuild()
+            current_app.logger.info(f"Incidents reconstruits depuis l'historique : {rebuilt}")
+        if previous is None or previous < POSITIONS_VERSION:
+            from services import floor_map
+            filled = floor_map.backfill_coordinates()
+            current_app.logger.info(f"Coordonnées des BAES copiées depuis position : {filled}")
+        # Compteurs d'alarmes de toutes les portées : l'ingestion n'a pas à les créer
+        from services import alarm_counters
+        refreshed = alarm_counters.create_missing()
+        if refreshed:
+            current_app.logger.info(f"Compteurs d'alarmes calculés pour {refreshed} site(s)")
+        # Compteurs de version des caches en mémoire (services.config_store.COUNTERS)
+        for counter_id in config_store.COUNTERS:
+            if db.session.get(ConfigVersion, counter_id) is None:
+                db.session.add(ConfigVersion(id=counter_id, version=0))
+        if previous is None or previous < SCHEMA_VERSION:
+            db.session.add(SchemaVersion(version=SCHEMA_VERSION))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    with _state_lock:
+        _state['version'] = SCHEMA_VERSION
+    return previous, created
+
+
+def check_schema(app):
+    """
+    Lecture unique de schema_version au démarrage d'un worker. Ne bloque pas et ne modifie rien :
+    si la base est absente ou en retard, le worker sert quand même et /general/ready répond 503.
+    """
+    # La fin du contexte d'application rend la connexion au pool
+    with app.app_context():
+        version = current_version()
+    with _state_lock:
+        _state['version'] = version
+    if version is None:
+        app.logger.warning("Schéma absent ou base injoignable : lancer `flask --app app bootstrap`.")
+    elif version < SCHEMA_VERSION:
+        app.logger.warning(f"Schéma en version {version}, version {SCHEMA_VERSION} attendue : "
+                           f"lancer `flask --app app bootstrap`.")
+    return version
+
+
+def readiness():
+    """(prêt, détail) ; relit la version tant qu'elle est en retard, puis vérifie seulement la connexion."""
+    with _state_lock:
+        version = _state['version']
+    if version is None or version < SCHEMA_VERSION:
+        version = current_version()
+        with _state_lock:
+            _state['version'] = version
+        if version is None or version < SCHEMA_VERSION:
+            return False, {'schema_version': version, 'expected_version': SCHEMA_VERSION}
+        return True, {'schema_version': version}
+
+    try:
+        db.session.execute(text('SELECT 1'))
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return False, {'schema_version': version, 'error': str(e)}
+    return True, {'schema_version': version}
@@ -0,0 +1,165 @@
+"""
+Commandes CLI de maintenance (flask --app app <commande>).
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+from models import db
+
+alarm_counters_cli = AppGroup('alarm-counters', help="Compteurs d'alarmes précalculés.")
+
+
+@alarm_counters_cli.command('reconcile')
+@click.option('--dry-run', is_flag=True, help="Affiche les écarts sans corriger les compteurs.")
+def reconcile_alarm_counters(dry_run):
+    """Recalcule les compteurs depuis l'historique des status et affiche les écarts."""
+    from services import alarm_counters
+
+    drift = alarm_counters.reconcile(apply=not dry_run)
+    if dry_run:
+        db.session.rollback()
+    else:
+        db.session.commit()
+    for item in drift:
+        click.echo(f"{item['scope_type']}={item['scope_id']} {item['field']}: "
+                   f"stocké={item['stored']} attendu={item['expected']}")
+    current_app.logger.info(f"Réconciliation des compteurs : {len(drift)} écart(s)")
+    click.echo(f"{len(drift)} écart(s){' (non corrigés)' if dry_run else ' corrigé(s)'}")
+
+
+@click.command('bootstrap')
+@click.option('--wait/--no-wait', default=True, help="Attend que la base accepte les connexions.")
+@click.option('--retries', default=30, show_default=True, help="Tentatives de connexion avec --wait.")
+@click.option('--interval', default=5, show_default=True, help="Secondes entre deux tentatives.")
+@click.option('--skip-seed', is_flag=True, help="N'applique que le schéma, sans les données par défaut.")
+@with_appcontext
+def bootstrap_database(wait, retries, interval, skip_seed):
+    """Schéma, données par défaut et version du schéma ; à lancer une fois par déploiement."""
+    import bootstrap
+
+    if wait and not bootstrap.wait_for_database(retries, interval):
+        raise click.ClickException("Base de données injoignable")
+    previous, created = bootstrap.run(seed=not skip_seed)
+    click.echo(f"Schéma en version {bootstrap.SCHEMA_VERSION} (précédente : {previous}), "
+               f"{created} élément(s) par défaut créé(s)")
+
+
+export_cli = AppGroup('export', help="Exports de données.")
+
+
+@export_cli.command('status')
+@click.option('--output', '-o', required=True, help="Fichier de sortie (- : sortie standard).")
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'parquet']), default='csv', show_default=True)
+@click.option('--from', 'start', default=None, help="Début de période inclus (ISO 8601, UTC si sans fuseau).")
+@click.option('--to', 'end', default=None, help="Fin de période exclue (ISO 8601).")
+@click.option('--site-id', type=int, default=None)
+@click.option('--batiment-id', type=int, default=None)
+@click.option('--etage-id', type=int, default=None)
+@click.option('--baes-id', default=None, help="Identifiants de BAES séparés par des virgules.")
+@click.option('--erreur', default=None, help="Codes d'erreur séparés par des virgules.")
+@click.option('--chunk-rows', type=int, default=None, help="Lignes par paquet (défaut : 10000 en CSV, 25000 en Parquet).")
+def export_statuses(output, fmt, start, end, site_id, batiment_id, etage_id, baes_id, erreur, chunk_rows):
+    """Exporte l'historique des status (CSV ou Parquet) en flux, à mémoire constante."""
+    import sys
+    import time
+    from werkzeug.datastructures import MultiDict
+    from services import exports, status_history
+
+    args = MultiDict({key: value for key, value in (
+        ('from', start), ('to', end), ('site_id', site_id), ('batiment_id', batiment_id),
+        ('etage_id', etage_id), ('baes_id', baes_id), ('erreur', erreur)) if value is not None})
+    try:
+        export = exports.StatusExport(status_history.HistoryFilter(args).criteria(), fmt, chunk_rows)
+    except (status_history.HistoryQueryError, exports.ExportError) as e:
+        raise click.ClickException(str(e))
+    started = time.perf_counter()
+    if output == '-':
+        size = export.open().write_to(sys.stdout.buffer)
+    else:
+        with open(output, 'wb') as stream:
+            size = export.open().write_to(stream)
+    db.session.rollback()
+    elapsed = time.perf_counter() - started
+    click.echo(f"{export.rows} status exportés ({size / 1e6:.1f} Mo) en {elapsed:.1f} s", err=True)
+
+
+incidents_cli = AppGroup('incidents', help="Épisodes de panne des BAES.")
+
+
+@incidents_cli.command('rebuild')
+@click.option('--baes-id', 'baes_ids', multiple=True, type=int,
+              help="BAES à recalculer (répétable) ; tous par défaut.")
+def rebuild_incidents(baes_ids):
+    """Recalcule les incidents depuis l'historique des status (après une suppression ou une reprise de données)."""
+    from services import incidents
+
+    created = incidents.rebuild(list(baes_ids) or None)
+    db.session.commit()
+    current_app.logger.info(f"Reconstruction des incidents : {created} incident(s)")
+    click.echo(f"{created} incident(s) recalculé(s)")
+
+
+jobs_cli = AppGroup('jobs', help="Tâches de fond.")
+
+
+@jobs_cli.command('work')
+@click.option('--threads', type=int, default=None, help="Tâches exécutées en parallèle (défaut : JOB_WORKER_THREADS).")
+@click.option('--once', is_flag=True, help="Exécute les tâches prêtes puis s'arrête.")
+def work_jobs(threads, once):
+    """Exécute les tâches mises en file par l'API ; arrêt propre sur SIGTERM (tâches en cours menées à terme)."""
+    import signal
+    import threading
+    from services.jobs import Worker
+
+    worker = Worker(current_app._get_current_object(), threads=threads)
+    if once:
+        click.echo(f"{worker.run_once()} tâche(s) exécutée(s)")
+        return
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        worker.run(stop)
+    except KeyboardInterrupt:
+        pass
+
+
+watchdog_cli = AppGroup('watchdog', help="Détection des BAES silencieux.")
+
+
+@watchdog_cli.command('run')
+def run_watchdog():
+    """Surveille les status ingérés et signale les BAES silencieux (erreur 0) ; un seul processus."""
+    import signal
+    import threading
+    from services.watchdog import Watchdog
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        Watchdog(current_app._get_current_object()).run(stop)
+    except KeyboardInterrupt:
+        pass
+
+
+swagger_cli = AppGroup('swagger', help="Documentation OpenAPI.")
+
+
+@swagger_cli.command('build')
+@click.option('--output', default=None, help="Fichier de sortie (défaut : SWAGGER_SPEC_FILE).")
+def build_swagger_spec(output):
+    """Génère la spec OpenAPI une fois (au build de l'image) pour qu'elle soit servie depuis un fichier."""
+    import swagger_spec
+
+    path = swagger_spec.build_spec_file(current_app, output)
+    click.echo(f"Spec OpenAPI écrite dans {path}")
+
+
+def init_app(app):
+    app.cli.add_command(alarm_counters_cli)
+    app.cli.add_command(export_cli)
+    app.cli.add_command(incidents_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(swagger_cli)
+    app.cli.add_command(watchdog_cli)
+    app.cli.add_command(bootstrap_database)
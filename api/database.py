@@ -0,0 +1,256 @@
+"""
+Configuration de la connexion à la base (URI et options du moteur SQLAlchemy).
+
+Tout est piloté par variables d'environnement :
+
+  DATABASE_URL            URI complète (prioritaire sur les DB_* ci-dessous, ex. sqlite:///baes.db)
+  DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME, DB_ODBC_DRIVER
+                          connexion MSSQL via pyodbc
+  DB_POOL_SIZE            connexions gardées ouvertes par processus
+                          (défaut : threads du worker uwsgi + 1)
+  DB_MAX_OVERFLOW         connexions supplémentaires temporaires (défaut : threads du worker)
+  DB_POOL_TIMEOUT         attente max d'une connexion libre, en secondes (défaut 30)
+  DB_POOL_RECYCLE         durée de vie max d'une connexion, en secondes (défaut 1800, -1 pour désactiver)
+  DB_POOL_PRE_PING        teste la connexion avant usage, utile après un basculement (défaut true)
+  DB_FAST_EXECUTEMANY     executemany pyodbc en mode tableau pour les insertions en masse (défaut true)
+  DB_ISOLATION_LEVEL      niveau d'isolation des sessions (défaut : celui du serveur)
+  DB_ODBC_POOLING         pooling du pilote ODBC en plus du pool SQLAlchemy (défaut false)
+  DATABASE_REPLICA_URL    URI d'un réplica en lecture (secondaire AlwaysOn lisible, ...) ; si défini,
+                          les routes marquées @read_only y lisent (voir RoutingSession)
+  READ_YOUR_WRITES_WINDOW secondes pendant lesquelles un client qui vient d'écrire lit le primaire (défaut 5)
+  REPLICA_RETRY_INTERVAL  secondes avant de réessayer un réplica injoignable (défaut 30)
+  REPLICA_CHECK_INTERVAL  secondes pendant lesquelles un réplica joignable n'est pas revérifié (défaut 5)
+
+Avec READ_COMMITTED_SNAPSHOT activé sur la base (ALTER DATABASE ... SET READ_COMMITTED_SNAPSHOT ON),
+le niveau READ COMMITTED lit des versions de lignes : les lectures des tableaux de bord ne sont
+plus bloquées par les écritures de l'ingestion MQTT.
+"""
+import functools
+import math
+import os
+import threading
+import time
+import urllib.parse
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.sql.dml import UpdateBase
+
+DEFAULT_ODBC_DRIVER = 'ODBC Driver 17 for SQL Server'
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return int(value)
+
+
+def worker_threads():
+    """Nombre de threads servant des requêtes dans ce processus (option threads d'uwsgi)."""
+    try:
+        import uwsgi  # disponible uniquement sous uwsgi
+        threads = uwsgi.opt.get('threads')
+        if isinstance(threads, bytes):
+            threads = threads.decode()
+        if threads:
+            return max(int(threads), 1)
+    except (ImportError, AttributeError, ValueError):
+        pass
+    return max(_env_int('WORKER_THREADS', 1), 1)
+
+
+def database_uri():
+    """URI SQLAlchemy : DATABASE_URL si défini, sinon MSSQL via pyodbc à partir des variables DB_*."""
+    uri = os.environ.get('DATABASE_URL')
+    if uri:
+        return uri
+
+    connection_string = (
+        f"DRIVER={{{os.environ.get('DB_ODBC_DRIVER', DEFAULT_ODBC_DRIVER)}}};"
+        f"SERVER={os.environ.get('DB_HOST', 'mssql')},{os.environ.get('DB_PORT', '1433')};"
+        f"DATABASE={os.environ.get('DB_NAME', 'master')};"
+        f"UID={os.environ.get('DB_USER', 'Externe')};"
+        f"PWD={os.environ.get('DB_PASSWORD', 'Secur3P@ssw0rd!')}"
+    )
+    return f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(connection_string)}"
+
+
+def engine_options(uri):
+    """Options passées à create_engine (SQLALCHEMY_ENGINE_OPTIONS) pour l'URI donnée."""
+    if uri.startswith('sqlite'):
+        # SQLite (développement, benchmarks) : pool par défaut du dialecte, pas de dimensionnement
+        return {}
+
+    threads = worker_threads()
+    options = {
+        'pool_size': _env_int('DB_POOL_SIZE', threads + 1),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', threads),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+    }
+    if uri.startswith('mssql+pyodbc'):
+        options['fast_executemany'] = _env_bool('DB_FAST_EXECUTEMANY', True)
+
+    isolation_level = os.environ.get('DB_ISOLATION_LEVEL')
+    if isolation_level:
+        options['isolation_level'] = isolation_level.strip().upper()
+    return options
+
+
+def configure_odbc_pooling():
+    """
+    Désactive par défaut le pooling du pilote ODBC : SQLAlchemy gère déjà un pool, et les deux
+    niveaux empêchent pre_ping/recycle de voir les connexions mortes. Doit précéder toute connexion.
+    """
+    try:
+        import pyodbc
+    except ImportError:
+        return
+    pyodbc.pooling = _env_bool('DB_ODBC_POOLING', False)
+
+
+def init_app(app):
+    """Renseigne l'URI et les options du moteur sans écraser une configuration explicite."""
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or database_uri()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    options = engine_options(uri)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    if uri.startswith('mssql+pyodbc'):
+        configure_odbc_pooling()
+
+    replica = os.environ.get('DATABASE_REPLICA_URL')
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    if replica and REPLICA_BIND not in binds:
+        binds[REPLICA_BIND] = {'url': replica, **engine_options(replica)}
+    app.config.setdefault('READ_YOUR_WRITES_WINDOW', _env_int('READ_YOUR_WRITES_WINDOW', 5))
+    app.config.setdefault('REPLICA_RETRY_INTERVAL', _env_int('REPLICA_RETRY_INTERVAL', 30))
+    app.config.setdefault('REPLICA_CHECK_INTERVAL', _env_int('REPLICA_CHECK_INTERVAL', 5))
+    app.after_request(_mark_write)
+
+
+# ===== Routage des lectures vers un réplica =====
+# Les vues décorées par @read_only lisent sur le bind 'replica' s'il est configuré et joignable.
+# Les écritures (flush, INSERT/UPDATE/DELETE) vont toujours au primaire. Après une écriture
+# réussie, le client reçoit un cookie et un en-tête X-Read-Primary-Until : tant que cette date
+# n'est pas passée, ses lectures restent sur le primaire (lecture de ses propres écritures).
+
+REPLICA_BIND = 'replica'
+PRIMARY_UNTIL_COOKIE = 'baes_primary_until'
+PRIMARY_UNTIL_HEADER = 'X-Read-Primary-Until'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_replica_down_until = 0.0
+_replica_up_until = 0.0
+_replica_lock = threading.Lock()
+
+
+def _replica_engine():
+    from models import db
+    return db.engines.get(REPLICA_BIND)
+
+
+def _primary_requested():
+    """Le client a écrit récemment (cookie ou en-tête renvoyé) ou demande une lecture cohérente."""
+    if request.headers.get('X-Consistency', '').lower() == 'strong':
+        return True
+    now = time.time()
+    for raw in (request.headers.get(PRIMARY_UNTIL_HEADER), request.cookies.get(PRIMARY_UNTIL_COOKIE)):
+        try:
+            if raw and float(raw) > now:
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def _check_replica(engine):
+    """Connexion de vérification ; un échec met le réplica de côté pendant REPLICA_RETRY_INTERVAL."""
+    global _replica_down_until, _replica_up_until
+    try:
+        with engine.connect():
+            pass
+        with _replica_lock:
+            _replica_up_until = time.monotonic() + current_app.config.get('REPLICA_CHECK_INTERVAL', 5)
+        return True
+    except (OperationalError, InterfaceError) as e:
+        with _replica_lock:
+            _replica_down_until = time.monotonic() + current_app.config.get('REPLICA_RETRY_INTERVAL', 30)
+            _replica_up_until = 0.0
+        current_app.logger.warning(f"Réplica injoignable, lectures redirigées vers le primaire : {e}")
+        return False
+
+
+def _replica_usable(engine):
+    """
+    Disjoncteur du réplica : écarté pendant REPLICA_RETRY_INTERVAL après un échec, cru joignable
+    pendant REPLICA_CHECK_INTERVAL après un succès. Seules les requêtes hors de ces fenêtres paient
+    une connexion de vérification.
+    """
+    now = time.monotonic()
+    if now < _replica_down_until:
+        return False
+    if now < _replica_up_until:
+        return True
+    return _check_replica(engine)
+
+
+def read_only(view):
+    """Marque une vue en lecture seule : ses requêtes peuvent être servies par le réplica."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        engine = _replica_engine()
+        g.db_route = 'primary'
+        if engine is None or _primary_requested() or not _replica_usable(engine):
+            return view(*args, **kwargs)
+        g.db_route = REPLICA_BIND
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code >= 500 and not _check_replica(engine):
+            # Réplica tombé depuis sa dernière vérification : la vue, en lecture seule, est rejouée sur le primaire
+            from models import db
+            db.session.rollback()
+            g.db_route = 'primary'
+            return view(*args, **kwargs)
+        return response
+    wrapper.read_only = True
+    return wrapper
+
+
+def _mark_write(response):
+    if request.method in WRITE_METHODS and response.status_code < 400 and _replica_engine() is not None:
+        window = current_app.config.get('READ_YOUR_WRITES_WINDOW', 5)
+        if window > 0:
+            until = f"{time.time() + window:.3f}"
+            response.set_cookie(PRIMARY_UNTIL_COOKIE, until, max_age=math.ceil(window),
+                                httponly=True, samesite='Lax')
+            response.headers[PRIMARY_UNTIL_HEADER] = until
+    elif g.get('db_route'):
+        response.headers['X-DB-Route'] = g.db_route
+    return response
+
+
+class RoutingSession(Session):
+    """Session Flask-SQLAlchemy qui envoie les lectures des vues @read_only vers le réplica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+            and has_request_context()
+            and g.get('db_route') == REPLICA_BIND
+        ):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
@@ -5,99 +5,83 @@ from models.site import Site
 from models.role import Role
 from models.user_site_role import UserSiteRole
 
-def create_default_data():
+DEFAULT_ROLES = ['user', 'technicien', 'admin', 'super-admin']
+DEFAULT_SITE_NAME = "Site par défaut"
+
+# login -> (mot de passe, rôle sur le site par défaut)
+DEFAULT_USERS = {
+    'user': ('user_password', 'user'),
+    'technicien': ('tech_password', 'technicien'),
+    'admin': ('admin_password', 'admin'),
+    # Le super-admin a accès à tous les sites, mais il est associé au site par défaut
+    # car la colonne site_id ne peut pas être NULL (contrainte de clé primaire)
+    'superadmin': ('superadmin_password', 'super-admin'),
+}
+
+
+def create_default_data(commit=True):
     """
     Create default data for the application:
     - Default roles
     - Default site
     - Default users with appropriate roles
     - Super-admin user with default site association (but with global access)
+
+    Idempotent : les données existantes sont lues en une requête par table, seuls les éléments
+    manquants sont créés (hachage des mots de passe compris) et le tout est validé en une transaction.
+    Avec commit=False, la validation est laissée à l'appelant (flask bootstrap).
+    Retourne le nombre d'éléments créés.
     """
     current_app.logger.debug("Création des données par défaut...")
+    created = 0
 
-    # 1. Création des rôles par défaut
-    default_roles = ['user', 'technicien', 'admin', 'super-admin']
-    roles = {}
-
-    for role_name in default_roles:
-        role = Role.query.filter_by(name=role_name).first()
-        if not role:
-            role = Role(name=role_name)
-            db.session.add(role)
+    # 1. Rôles par défaut
+    roles = {role.name: role for role in Role.query.filter(Role.name.in_(DEFAULT_ROLES))}
+    for role_name in DEFAULT_ROLES:
+        if role_name not in roles:
+            roles[role_name] = Role(name=role_name)
+            db.session.add(roles[role_name])
+            created += 1
             current_app.logger.debug("Création du rôle %s", role_name)
-        roles[role_name] = role
-    db.session.commit()
 
-    # 2. Création d'un site par défaut
-    default_site_name = "Site par défaut"
-    site = Site.query.filter_by(name=default_site_name).first()
+    # 2. Site par défaut
+    site = Site.query.filter_by(name=DEFAULT_SITE_NAME).first()
     if not site:
-        site = Site(name=default_site_name)
+        site = Site(name=DEFAULT_SITE_NAME)
         db.session.add(site)
-        current_app.logger.debug("Création du site %s", default_site_name)
-    db.session.commit()
-
-    # 3. Création des utilisateurs par défaut et association via UserSiteRole
-    default_users = {
-        'user': {'login': 'user', 'password': 'user_password'},
-        'technicien': {'login': 'technicien', 'password': 'tech_password'},
-        'admin': {'login': 'admin', 'password': 'admin_password'},
-    }
+        created += 1
+        current_app.logger.debug("Création du site %s", DEFAULT_SITE_NAME)
 
-    # Création des utilisateurs standard (avec site)
-    for role_name, user_data in default_users.items():
-        user = User.query.filter_by(login=user_data['login']).first()
-        if not user:
-            user = User(login=user_data['login'])
-            user.set_password(user_data['password'])
+    # 3. Utilisateurs par défaut
+    users = {user.login: user for user in User.query.filter(User.login.in_(list(DEFAULT_USERS)))}
+    for login, (password, _) in DEFAULT_USERS.items():
+        if login not in users:
+            user = User(login=login)
+            user.set_password(password)
             db.session.add(user)
-            current_app.logger.debug("Création de l'utilisateur %s", user_data['login'])
-            db.session.commit()
+            users[login] = user
+            created += 1
+            current_app.logger.debug("Création de l'utilisateur %s", login)
 
-        association = UserSiteRole.query.filter_by(
-            user_id=user.id,
-            site_id=site.id,
-            role_id=roles[role_name].id
-        ).first()
+    # Les identifiants des nouveaux rôles, site et utilisateurs sont nécessaires aux associations
+    db.session.flush()
 
-        if not association:
-            association = UserSiteRole(
-                user_id=user.id,
-                site_id=site.id,
-                role_id=roles[role_name].id
-            )
-            db.session.add(association)
-            current_app.logger.debug("Association de l'utilisateur %s au rôle %s sur le site %s", 
-                                    user.login, role_name, site.name)
-
-    # 4. Création du super-admin avec association au site par défaut
-    superadmin_data = {'login': 'superadmin', 'password': 'superadmin_password'}
-    superadmin = User.query.filter_by(login=superadmin_data['login']).first()
-
-    if not superadmin:
-        superadmin = User(login=superadmin_data['login'])
-        superadmin.set_password(superadmin_data['password'])
-        db.session.add(superadmin)
-        current_app.logger.debug("Création de l'utilisateur super-admin")
-        db.session.commit()
-
-    # Association du super-admin au rôle super-admin avec le site par défaut
-    # Note: Le super-admin a accès à tous les sites, mais nous devons l'associer à un site
-    # car la colonne site_id ne peut pas être NULL (contrainte de clé primaire)
-    superadmin_role = roles['super-admin']
-    association = UserSiteRole.query.filter_by(
-        user_id=superadmin.id,
-        site_id=site.id,
-        role_id=superadmin_role.id
-    ).first()
-
-    if not association:
-        association = UserSiteRole(
-            user_id=superadmin.id,
-            site_id=site.id,  # Utilisation du site par défaut pour satisfaire la contrainte de clé primaire
-            role_id=superadmin_role.id
+    # 4. Associations utilisateur / site par défaut / rôle
+    existing = {
+        (row.user_id, row.role_id)
+        for row in UserSiteRole.query.filter(
+            UserSiteRole.site_id == site.id,
+            UserSiteRole.user_id.in_([user.id for user in users.values()])
         )
-        db.session.add(association)
-        current_app.logger.debug("Association de l'utilisateur super-admin au rôle super-admin avec le site par défaut")
+    }
+    for login, (_, role_name) in DEFAULT_USERS.items():
+        user, role = users[login], roles[role_name]
+        if (user.id, role.id) not in existing:
+            db.session.add(UserSiteRole(user_id=user.id, site_id=site.id, role_id=role.id))
+            created += 1
+            current_app.logger.debug("Association de l'utilisateur %s au rôle %s sur le site %s",
+                                     login, role_name, site.name)
 
-    db.session.commit()
+    if commit:
+        db.session.commit()
+    return created
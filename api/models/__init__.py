@@ -1,6 +1,9 @@
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from database import RoutingSession
+
+# RoutingSession : lectures des routes @read_only servies par le réplica s'il est configuré
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # Importation des modèles une fois que db est défini
 from .batiment import Batiment
@@ -10,6 +13,10 @@ from .carte import Carte
 from .etage import Etage
 from .baes import Baes
 from .status import Status
+from .incident import Incident  # Épisodes de panne (services.incidents)
+from .job import Job  # Tâches de fond (services.jobs)
 from .user import User
 from .user_site_role import UserSiteRole  # Nouveau modèle d'association
-from .config import Config  # Modèle de configuration
+from .config import Config, ConfigVersion  # Modèle de configuration et version du cache
+from .alarm_counter import AlarmCounter  # Compteurs d'alarmes précalculés
+from .schema_version import SchemaVersion  # Version du schéma posée par flask bootstrap
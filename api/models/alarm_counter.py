@@ -0,0 +1,26 @@
+from templates.TimestampMixin import TimestampMixin
+from . import db
+
+
+class AlarmCounter(TimestampMixin, db.Model):
+    """
+    Compteurs d'alarmes précalculés pour un site, un bâtiment ou un étage.
+    Chaque BAES de la portée est compté dans une seule catégorie selon son dernier status.
+    Maintenus incrémentalement par services.alarm_counters.
+    """
+    __tablename__ = 'alarm_counters'
+    id = db.Column(db.Integer, primary_key=True)
+    scope_type = db.Column(db.String(20), nullable=False)  # 'site', 'batiment' ou 'etage'
+    scope_id = db.Column(db.Integer, nullable=False)
+    connection_errors = db.Column(db.Integer, default=0, nullable=False)
+    battery_errors = db.Column(db.Integer, default=0, nullable=False)
+    ok = db.Column(db.Integer, default=0, nullable=False)
+    unknown = db.Column(db.Integer, default=0, nullable=False)
+    unsolved = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('scope_type', 'scope_id', name='uq_alarm_counter_scope'),
+    )
+
+    def __repr__(self):
+        return f"<AlarmCounter {self.scope_type}={self.scope_id}>"
@@ -1,23 +1,54 @@
 
 
+from sqlalchemy.orm import validates
+
 from templates.TimestampMixin import TimestampMixin
 from . import db
 
 
+def position_coordinates(position):
+    """(x, y) numériques d'un JSON de position {"x": .., "y": ..} ; (None, None) s'ils sont absents ou invalides."""
+    if not isinstance(position, dict):
+        return None, None
+    try:
+        return float(position['x']), float(position['y'])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+
 class Baes(TimestampMixin,db.Model):
     __tablename__ = 'baes'
     id = db.Column(db.BigInteger, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=True)
     label = db.Column(db.String(50), nullable=True)
     position = db.Column(db.JSON, nullable=False)
+    # Copie numérique de position (x, y) sur le plan de l'étage, pour les requêtes par zone (services.floor_map) ;
+    # tenue à jour par _sync_coordinates et par les écritures en masse (services.baes_import)
+    pos_x = db.Column(db.Float, nullable=True)
+    pos_y = db.Column(db.Float, nullable=True)
     is_ignored = db.Column(db.Boolean, default=False, nullable=False)
+    # Site en cours de suppression (services.site_deletion) : les status de ce BAES sont refusés
+    is_deleting = db.Column(db.Boolean, default=False, server_default=db.text('0'), nullable=False)
+    # Silence toléré (secondes) avant que le watchdog signale une perte de connexion ; NULL : seuil par défaut
+    silence_threshold = db.Column(db.Integer, nullable=True)
 
     # La clé étrangère est optionnelle (nullable=True) car une BAES peut ne pas être affectée à un étage.
     etage_id = db.Column(db.Integer, db.ForeignKey('etages.id', ondelete='SET NULL'), nullable=True)
     # Relation one-to-many : Une BAES a plusieurs statuts.
     # Cascade delete-orphan pour supprimer les statuts associés lors de la suppression d'une BAES
     statuses = db.relationship('Status', backref='baes', lazy=True, cascade="all, delete-orphan")
+    # Épisodes de panne dérivés des statuts, supprimés avec la BAES
+    incidents = db.relationship('Incident', backref='baes', lazy=True, cascade="all, delete-orphan")
+
+    # Index spatial par étage : zone affichée d'un plan (intervalle sur pos_x, filtre sur pos_y)
+    __table_args__ = (
+        db.Index('ix_baes_etage_position', 'etage_id', 'pos_x', 'pos_y'),
+    )
 
+    @validates('position')
+    def _sync_coordinates(self, key, position):
+        self.pos_x, self.pos_y = position_coordinates(position)
+        return position
 
     def __repr__(self):
         return f"<BAES {self.name}>"
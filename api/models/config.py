@@ -1,3 +1,4 @@
+from templates.TimestampMixin import TimestampMixin
 from . import db
 
 class Config(db.Model):
@@ -6,6 +7,22 @@ class Config(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     key = db.Column(db.String(50), unique=True, nullable=False)
     value = db.Column(db.String(255), nullable=False)
+    # Type de la valeur stockée en texte : string, integer, float, boolean ou json (voir services.config_store)
+    value_type = db.Column(db.String(10), nullable=False, default='string', server_default='string')
 
     def __repr__(self):
-        return f"<Config {self.key}: {self.value}>"
\ No newline at end of file
+        return f"<Config {self.key}: {self.value}>"
+
+
+class ConfigVersion(TimestampMixin, db.Model):
+    """
+    Compteurs de version des caches en mémoire, incrémentés dans la transaction de chaque écriture
+    concernée : id=1 pour la configuration, autres lignes voir services.config_store.COUNTERS.
+    Les workers les comparent à la version de leur cache pour savoir s'il faut le recharger.
+    """
+    __tablename__ = 'config_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ConfigVersion {self.version}>"
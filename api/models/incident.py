@@ -0,0 +1,39 @@
+from sqlalchemy import DateTime
+
+from templates.TimestampMixin import TimestampMixin
+from . import db
+
+
+class Incident(TimestampMixin, db.Model):
+    """
+    Épisode de panne d'un BAES : ouvert par le premier status d'un code d'erreur, clos par le
+    retour au code 6 (ou par un autre code, hors perte de connexion). Maintenu à l'ingestion par
+    services.incidents ; acquitté une fois pour tout l'épisode.
+    """
+    __tablename__ = 'incidents'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    baes_id = db.Column(db.BigInteger, db.ForeignKey('baes.id'), nullable=False)
+    erreur = db.Column(db.Integer, nullable=False)
+    opened_at = db.Column(DateTime(timezone=True), nullable=False)
+    closed_at = db.Column(DateTime(timezone=True), nullable=True)
+    # Status d'ouverture et de clôture (sans clé étrangère : un status peut être supprimé)
+    opening_status_id = db.Column(db.Integer, nullable=True)
+    closing_status_id = db.Column(db.Integer, nullable=True)
+    acknowledged_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    acknowledged_at = db.Column(DateTime(timezone=True), nullable=True)
+
+    acknowledged_by = db.relationship('User', foreign_keys=[acknowledged_by_user_id])
+
+    # Incidents ouverts d'un BAES (ingestion) ; incidents ouverts ou clos sur une période (listes, MTTR).
+    # Un seul incident ouvert par BAES et par code, même avec plusieurs workers qui ingèrent en parallèle.
+    __table_args__ = (
+        db.Index('ix_incident_baes_closed', 'baes_id', 'closed_at'),
+        db.Index('ix_incident_closed_opened', 'closed_at', 'opened_at'),
+        db.Index('uq_incident_open', 'baes_id', 'erreur', unique=True,
+                 mssql_where=db.text('closed_at IS NULL'),
+                 postgresql_where=db.text('closed_at IS NULL'),
+                 sqlite_where=db.text('closed_at IS NULL')),
+    )
+
+    def __repr__(self):
+        return f"<Incident(baes_id={self.baes_id}, erreur={self.erreur}, opened_at={self.opened_at})>"
@@ -0,0 +1,41 @@
+from sqlalchemy import DateTime
+
+from templates.TimestampMixin import TimestampMixin, current_time
+from . import db
+
+
+class Job(TimestampMixin, db.Model):
+    """
+    Tâche de fond (suppression de site, import, export, recalculs) : mise en file par l'API,
+    exécutée par le worker (flask --app app jobs work) hors du délai des requêtes uwsgi.
+    Voir services.jobs.
+    """
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(50), nullable=False)
+    state = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    payload = db.Column(db.JSON, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    progress_current = db.Column(db.Integer, nullable=True)
+    progress_total = db.Column(db.Integer, nullable=True)
+    progress_message = db.Column(db.String(255), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    # Pas de lancement avant cette date (nouvel essai différé après un échec)
+    run_after = db.Column(DateTime(timezone=True), nullable=False, default=current_time)
+    started_at = db.Column(DateTime(timezone=True), nullable=True)
+    finished_at = db.Column(DateTime(timezone=True), nullable=True)
+    # Signe de vie du worker pendant l'exécution : une tâche sans signe de vie est reprise
+    heartbeat_at = db.Column(DateTime(timezone=True), nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    created_by_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+
+    # Tâches prêtes (worker) ; tâches en cours par type (limites de concurrence)
+    __table_args__ = (
+        db.Index('ix_job_state_run_after', 'state', 'run_after'),
+        db.Index('ix_job_kind_state', 'kind', 'state'),
+    )
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, kind={self.kind}, state={self.state})>"
@@ -0,0 +1,15 @@
+from templates.TimestampMixin import TimestampMixin
+from . import db
+
+
+class SchemaVersion(TimestampMixin, db.Model):
+    """
+    Version du schéma appliquée par `flask bootstrap` (une ligne par montée de version).
+    Les workers la lisent au démarrage pour savoir si la base est prête.
+    """
+    __tablename__ = 'schema_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, unique=True)
+
+    def __repr__(self):
+        return f"<SchemaVersion {self.version}>"
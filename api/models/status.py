@@ -30,6 +30,14 @@ class Status(TimestampMixin,db.Model):
     #    db.UniqueConstraint('baes_id', 'erreur', name='uq_baes_erreur'),
     #)
 
+    # Historique d'un BAES et dernier status par BAES (ROW_NUMBER par baes_id, timestamp) ;
+    # plages de dates sur tout le parc (historique, agrégats) ; acquittements récents (flux temps réel)
+    __table_args__ = (
+        db.Index('ix_status_baes_timestamp', 'baes_id', 'timestamp', 'id'),
+        db.Index('ix_status_timestamp', 'timestamp', 'id'),
+        db.Index('ix_status_acknowledged', 'acknowledged_at', 'id'),
+    )
+
     timestamp = db.Column(
         DateTime(timezone=True),
         default=current_time,
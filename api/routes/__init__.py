@@ -1,21 +1,26 @@
-from .batiment_routes import batiment_bp
-from .etage_carte_routes import etage_carte_bp
-from .etage_routes import etage_bp
-from .site_carte_routes import site_carte_bp
-from .site_routes import site_bp
-from .carte_routes import carte_bp
-from .user_routes import user_bp
-from .user_site_routes import user_site_bp
-from .baes_routes import baes_bp
-from .status_routes import status_bp
-from .auth import auth_bp
-from .role_routes import role_bp
-from .user_site_role_routes import user_site_role_bp
-from .general_routes import general_routes_bp
-from .config_routes import config_bp
-from .me_routes import me_bp
-
 def init_app(app):
+    # Les modules de routes sont importés ici, à la construction de l'application (create_app),
+    # et non à l'import du package
+    from .batiment_routes import batiment_bp
+    from .etage_carte_routes import etage_carte_bp
+    from .etage_routes import etage_bp
+    from .site_carte_routes import site_carte_bp
+    from .site_routes import site_bp
+    from .carte_routes import carte_bp
+    from .user_routes import user_bp
+    from .user_site_routes import user_site_bp
+    from .baes_routes import baes_bp
+    from .status_routes import status_bp
+    from .auth import auth_bp
+    from .role_routes import role_bp
+    from .user_site_role_routes import user_site_role_bp
+    from .general_routes import general_routes_bp
+    from .config_routes import config_bp
+    from .me_routes import me_bp
+    from .admin_routes import admin_bp
+    from .incident_routes import incident_bp
+    from .job_routes import job_bp
+
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(role_bp, url_prefix='/roles')
     app.register_blueprint(carte_bp, url_prefix='/cartes')
@@ -36,6 +41,9 @@ def init_app(app):
     app.register_blueprint(user_site_role_bp, url_prefix='/user-site-roles', name='user_site_role_bp_legacy')
     app.register_blueprint(general_routes_bp, url_prefix='/general')
     app.register_blueprint(config_bp, url_prefix='/config')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(incident_bp, url_prefix='/incidents')
+    app.register_blueprint(job_bp, url_prefix='/jobs')
     # Root-level routes (e.g., /me)
     app.register_blueprint(me_bp, url_prefix='')
 
@@ -0,0 +1,135 @@
+from flask import Blueprint, Response, current_app, jsonify, request
+from flasgger import swag_from
+
+from services import profiling
+from services.visibility import get_visibility
+from .auth import _get_current_user
+
+admin_bp = Blueprint('admin_bp', __name__)
+
+AUTH_PARAMETER = {
+    'name': 'Authorization',
+    'in': 'header',
+    'type': 'string',
+    'required': True,
+    'description': 'Bearer <token> d\'un super-admin'
+}
+
+
+def _require_super_admin():
+    """Retourne une réponse d'erreur si l'appelant n'est pas super-admin, None sinon."""
+    user = _get_current_user()
+    if not user:
+        return jsonify({'error': 'unauthorized'}), 401
+    if not get_visibility(user.id, cached=False).is_global:
+        return jsonify({'error': 'Accès réservé aux super-admins.'}), 403
+    return None
+
+
+@admin_bp.route('/profiles', methods=['GET'])
+@swag_from({
+    'tags': ['Administration'],
+    'description': "Liste les profils de requêtes conservés (du plus récent au plus ancien). Les requêtes sont "
+                   "profilées avec l'en-tête X-Profile: <PROFILING_TOKEN> ou par tirage (PROFILING_SAMPLE_RATE).",
+    'parameters': [AUTH_PARAMETER],
+    'responses': {
+        200: {
+            'description': 'Résumés des profils.',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'id': {'type': 'string', 'example': '20251019103000-4242-3'},
+                        'created_at': {'type': 'string', 'format': 'date-time'},
+                        'worker': {'type': 'integer', 'example': 4242},
+                        'mode': {'type': 'string', 'example': 'sampler'},
+                        'method': {'type': 'string', 'example': 'GET'},
+                        'path': {'type': 'string', 'example': '/status/user/3'},
+                        'endpoint': {'type': 'string', 'example': 'status_bp_new.get_statuses_by_user'},
+                        'status': {'type': 'integer', 'example': 200},
+                        'duration_ms': {'type': 'number', 'example': 412.5},
+                        'sql_count': {'type': 'integer', 'example': 6},
+                        'sql_ms': {'type': 'number', 'example': 380.1},
+                        'samples': {'type': 'integer', 'example': 80}
+                    }
+                }
+            }
+        },
+        401: {'description': 'Unauthorized'},
+        403: {'description': 'Accès réservé aux super-admins.'}
+    }
+})
+def list_profiles():
+    error = _require_super_admin()
+    if error:
+        return error
+    try:
+        return jsonify(profiling.get_store().list()), 200
+    except Exception as e:
+        current_app.logger.error(f"Error in list_profiles: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@admin_bp.route('/profiles/<string:profile_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Administration'],
+    'description': "Télécharge un profil : JSON complet (piles, instructions SQL), piles repliées pour "
+                   "flamegraph.pl/speedscope (format=collapsed) ou rapport cProfile (format=pstats).",
+    'parameters': [
+        AUTH_PARAMETER,
+        {'name': 'profile_id', 'in': 'path', 'type': 'string', 'required': True},
+        {'name': 'format', 'in': 'query', 'type': 'string', 'enum': ['json', 'collapsed', 'pstats'],
+         'default': 'json'}
+    ],
+    'responses': {
+        200: {'description': 'Profil.'},
+        400: {'description': 'Format inconnu ou indisponible pour ce profil.'},
+        401: {'description': 'Unauthorized'},
+        403: {'description': 'Accès réservé aux super-admins.'},
+        404: {'description': 'Profil non trouvé (remplacé par des profils plus récents).'}
+    }
+})
+def get_profile(profile_id):
+    error = _require_super_admin()
+    if error:
+        return error
+    try:
+        profile = profiling.get_store().get(profile_id)
+        if profile is None:
+            return jsonify({'error': 'Profil non trouvé.'}), 404
+        output = request.args.get('format', 'json')
+        if output == 'json':
+            return jsonify(profile), 200
+        if output == 'collapsed':
+            return Response(profiling.collapsed_text(profile), mimetype='text/plain',
+                            headers={'Content-Disposition': f'attachment; filename={profile_id}.folded'})
+        if output == 'pstats' and profile.get('pstats'):
+            return Response(profile['pstats'], mimetype='text/plain')
+        return jsonify({'error': f"Format '{output}' indisponible pour ce profil."}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in get_profile: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@admin_bp.route('/profiles', methods=['DELETE'])
+@swag_from({
+    'tags': ['Administration'],
+    'description': 'Supprime tous les profils conservés.',
+    'parameters': [AUTH_PARAMETER],
+    'responses': {
+        200: {'description': 'Nombre de profils supprimés.',
+              'schema': {'type': 'object', 'properties': {'deleted': {'type': 'integer', 'example': 12}}}},
+        401: {'description': 'Unauthorized'},
+        403: {'description': 'Accès réservé aux super-admins.'}
+    }
+})
+def clear_profiles():
+    error = _require_super_admin()
+    if error:
+        return error
+    try:
+        return jsonify({'deleted': profiling.get_store().clear()}), 200
+    except Exception as e:
+        current_app.logger.error(f"Error in clear_profiles: {e}")
+        return jsonify({'error': str(e)}), 500
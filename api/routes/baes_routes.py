@@ -1,9 +1,22 @@
 # routes/baes_routes.py
+import csv
+import io
+import json
+
 from flask import Blueprint, request, jsonify, current_app
 from flasgger import swag_from
 from models import Baes, User, UserSiteRole, Site, Batiment, Etage, Status, db
-from sqlalchemy import desc, func
+from models.baes import position_coordinates
+from sqlalchemy import desc, func, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import aliased
+from routes.job_routes import ACCEPTED_RESPONSE, accept_job, wants_async
+from services import known_baes
+from services.alarm_counters import track_baes
+from services.baes_import import existing_baes_ids, import_rows, missing_etage_ids
+from services.status_queries import latest_status_by_baes
+from services.visibility import get_visibility
+from templates.TimestampMixin import current_time
 
 
 baes_bp = Blueprint('baes_bp', __name__)
@@ -72,7 +85,8 @@ def get_baes():
                     'name': {'type': 'string', 'example': 'BAES 1'},
                     'label': {'type': 'string', 'example': 'Étiquette BAES 1'},
                     'position': {'type': 'object', 'example': {"x": 100, "y": 200}},
-                    'etage_id': {'type': 'integer', 'example': 1}
+                    'etage_id': {'type': 'integer', 'example': 1},
+                    'silence_threshold': {'type': 'integer', 'example': 900, 'nullable': True}
                 }
             }
         },
@@ -90,7 +104,8 @@ def get_baes_by_id(baes_id):
             'label': baes.label,
             'position': baes.position,
             'etage_id': baes.etage_id,
-            'is_ignored': baes.is_ignored
+            'is_ignored': baes.is_ignored,
+            'silence_threshold': baes.silence_threshold
         }
         return jsonify(result), 200
     except Exception as e:
@@ -149,7 +164,12 @@ def create_baes():
             is_ignored=bool(data.get('is_ignored', False))
         )
         db.session.add(baes)
+        db.session.flush()
+        counters = track_baes()
+        counters.add_new([baes.id])
+        counters.apply()
         db.session.commit()
+        known_baes.remember({baes.id: (baes.name, baes.label)})
         result = {
             'id': baes.id,
             'name': baes.name,
@@ -188,7 +208,9 @@ def create_baes():
                     'name': {'type': 'string', 'example': 'BAES mis à jour'},
                     'label': {'type': 'string', 'example': 'Étiquette BAES mise à jour'},
                     'position': {'type': 'object', 'example': {"x": 150, "y": 250}},
-                    'etage_id': {'type': 'integer', 'example': 2}
+                    'etage_id': {'type': 'integer', 'example': 2},
+                    'silence_threshold': {'type': 'integer', 'example': 900, 'nullable': True,
+                                          'description': "Silence toléré (secondes) avant perte de connexion ; null : seuil par défaut"}
                 }
             }
         }
@@ -203,10 +225,12 @@ def create_baes():
                     'name': {'type': 'string', 'example': 'BAES mis à jour'},
                     'label': {'type': 'string', 'example': 'Étiquette BAES mise à jour'},
                     'position': {'type': 'object', 'example': {"x": 150, "y": 250}},
-                    'etage_id': {'type': 'integer', 'example': 2}
+                    'etage_id': {'type': 'integer', 'example': 2},
+                    'silence_threshold': {'type': 'integer', 'example': 900, 'nullable': True}
                 }
             }
         },
+        400: {'description': "silence_threshold invalide."},
         404: {'description': "BAES non trouvé."}
     }
 })
@@ -216,6 +240,7 @@ def update_baes(baes_id):
         if not baes:
             return jsonify({'error': 'BAES non trouvé'}), 404
         data = request.get_json()
+        counters = track_baes([baes_id] if 'etage_id' in data else [])
         if 'name' in data:
             baes.name = data['name']
         if 'label' in data:
@@ -226,14 +251,24 @@ def update_baes(baes_id):
             baes.etage_id = data['etage_id']
         if 'is_ignored' in data:
             baes.is_ignored = bool(data['is_ignored'])
+        if 'silence_threshold' in data:
+            threshold = data['silence_threshold']
+            if threshold is not None and (isinstance(threshold, bool) or not isinstance(threshold, int) or threshold <= 0):
+                db.session.rollback()
+                return jsonify({'error': 'silence_threshold doit être un nombre de secondes positif ou null'}), 400
+            baes.silence_threshold = threshold
+        counters.apply()
         db.session.commit()
+        if 'name' in data or 'label' in data:
+            known_baes.remember({baes.id: (baes.name, baes.label)})
         result = {
             'id': baes.id,
             'name': baes.name,
             'label': baes.label,
             'position': baes.position,
             'etage_id': baes.etage_id,
-            'is_ignored': baes.is_ignored
+            'is_ignored': baes.is_ignored,
+            'silence_threshold': baes.silence_threshold
         }
         return jsonify(result), 200
     except Exception as e:
@@ -273,8 +308,11 @@ def delete_baes(baes_id):
         baes = Baes.query.get(baes_id)
         if not baes:
             return jsonify({'error': 'BAES non trouvé'}), 404
+        counters = track_baes([baes_id])
         db.session.delete(baes)
+        counters.apply()
         db.session.commit()
+        known_baes.discard([baes_id])
         return jsonify({'message': 'BAES supprimé avec succès'}), 200
     except Exception as e:
         db.session.rollback()
@@ -379,39 +417,17 @@ def get_baes_by_user(user_id):
         if not user:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
 
-        # 1. Récupérer tous les sites auxquels l'utilisateur a accès
-        sites = db.session.query(Site).join(
-            UserSiteRole, UserSiteRole.site_id == Site.id
-        ).filter(
-            UserSiteRole.user_id == user_id
-        ).distinct().all()
-
-        site_ids = [site.id for site in sites]
-
-        # 2. Récupérer tous les BAES visibles par l'utilisateur (dans les sites auxquels il a accès)
-        visible_baes = db.session.query(Baes).join(
-            Etage, Baes.etage_id == Etage.id
-        ).join(
-            Batiment, Etage.batiment_id == Batiment.id
-        ).filter(
-            Batiment.site_id.in_(site_ids)
-        ).all()
-
-        # 3. Récupérer tous les BAES non attribués à un étage
-        unassigned_baes = Baes.query.filter_by(etage_id=None).all()
-
-        # Combiner les deux listes de BAES (en évitant les doublons)
-        all_baes = {b.id: b for b in visible_baes}
-        for b in unassigned_baes:
-            if b.id not in all_baes:
-                all_baes[b.id] = b
-
-        # 4. Pour chaque BAES, récupérer son dernier status
+        # BAES visibles (sites de l'utilisateur) et BAES non attribués, en une requête
+        scope = get_visibility(user_id)
+        baes_list = Baes.query.filter(scope.baes(include_unassigned=True)).order_by(Baes.id).all()
+
+        # Dernier status de chaque BAES visible, en une requête
+        latest_by_baes = latest_status_by_baes(scope.status(include_unassigned=True))
+
         result = []
-        for baes_id, baes in all_baes.items():
-            # Récupérer le dernier status pour ce BAES
-            latest_status = Status.query.filter_by(baes_id=baes_id).order_by(Status.timestamp.desc()).first()
-            
+        for baes in baes_list:
+            latest_status = latest_by_baes.get(baes.id)
+
             baes_dict = {
                 'id': baes.id,
                 'name': baes.name,
@@ -511,3 +527,296 @@ def set_baes_ignore(baes_id):
         db.session.rollback()
         current_app.logger.error(f"Error in set_baes_ignore: {e}")
         return jsonify({'error': str(e)}), 500
+
+
+# ===== Opérations en masse (placement sur plan, import de mise en service) =====
+
+# Champs modifiables par le placement en masse
+BULK_FIELDS = ('position', 'etage_id', 'label', 'is_ignored')
+# Champs acceptés par l'import (placement + nom)
+IMPORT_FIELDS = ('name',) + BULK_FIELDS
+
+# Baes.id est un BIGINT signé
+BAES_ID_MIN, BAES_ID_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _parse_baes_id(value):
+    """
+    Accepte un entier ou une adresse hexadécimale ('aa:bb:cc:...') comme le bridge MQTT : les 64 bits
+    de l'adresse sont lus en complément à deux, pour tenir dans le BIGINT signé.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"id invalide: {value!r}")
+    if isinstance(value, int):
+        baes_id = value
+    else:
+        raw = str(value).strip()
+        try:
+            if ':' in raw:
+                baes_id = int(raw.replace(':', ''), 16) & 0xFFFFFFFFFFFFFFFF
+                return baes_id - (1 << 64) if baes_id > BAES_ID_MAX else baes_id
+            baes_id = int(raw)
+        except ValueError:
+            raise ValueError(f"id invalide: {value!r}")
+    if not BAES_ID_MIN <= baes_id <= BAES_ID_MAX:
+        raise ValueError(f"id hors de l'intervalle BIGINT: {value!r}")
+    return baes_id
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ['1', 'true', 'yes', 'on', 'oui']
+    return bool(value)
+
+
+def _parse_position(raw):
+    if 'position' in raw:
+        position = raw['position']
+        if isinstance(position, str):
+            position = json.loads(position)
+        if not isinstance(position, dict):
+            raise ValueError("position doit être un objet JSON")
+        return position
+    if 'x' in raw or 'y' in raw:
+        return {'x': float(raw.get('x', 0)), 'y': float(raw.get('y', 0))}
+    return None
+
+
+def _normalize_baes_row(raw, fields):
+    """Valide une ligne de placement/import et retourne un dict prêt pour un UPDATE/INSERT en masse."""
+    if not isinstance(raw, dict) or raw.get('id') is None:
+        raise ValueError("le champ id est requis")
+    row = {'id': _parse_baes_id(raw['id'])}
+
+    if 'position' in fields:
+        try:
+            position = _parse_position(raw)
+        except (TypeError, ValueError):
+            raise ValueError("position invalide")
+        if position is not None:
+            row['position'] = position
+            row['pos_x'], row['pos_y'] = position_coordinates(position)
+    if 'etage_id' in fields and 'etage_id' in raw:
+        try:
+            row['etage_id'] = int(raw['etage_id']) if raw['etage_id'] is not None else None
+        except (TypeError, ValueError):
+            raise ValueError(f"etage_id invalide: {raw['etage_id']!r}")
+    if 'label' in fields and 'label' in raw:
+        row['label'] = raw['label']
+    if 'name' in fields and raw.get('name'):
+        row['name'] = str(raw['name'])
+    if 'is_ignored' in fields and 'is_ignored' in raw:
+        row['is_ignored'] = _parse_bool(raw['is_ignored'])
+    return row
+
+
+def _normalize_rows(items, fields):
+    rows, errors = [], []
+    for index, raw in enumerate(items):
+        try:
+            rows.append(_normalize_baes_row(raw, fields))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    ids = [r['id'] for r in rows]
+    if len(set(ids)) != len(ids):
+        seen, duplicates = set(), set()
+        for baes_id in ids:
+            (duplicates if baes_id in seen else seen).add(baes_id)
+        errors.append({'error': 'ids en double', 'ids': sorted(duplicates)})
+    return rows, errors
+
+
+def _read_import_items():
+    """Lit les lignes à importer depuis un fichier (CSV/JSON), un corps JSON ou un corps CSV brut."""
+    upload = request.files.get('file')
+    if upload is not None:
+        content = upload.read().decode('utf-8-sig')
+        is_json = upload.filename.lower().endswith('.json')
+    elif request.is_json:
+        data = request.get_json(silent=True)
+        content, is_json = data, True
+    else:
+        content, is_json = request.get_data(as_text=True), False
+
+    if is_json:
+        data = json.loads(content) if isinstance(content, str) else content
+        items = data.get('baes') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError("Le JSON doit être une liste de BAES ou un objet {'baes': [...]}")
+        return items
+
+    if not content or not content.strip():
+        raise ValueError("Fichier CSV vide")
+    try:
+        dialect = csv.Sniffer().sniff(content.splitlines()[0], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(content), dialect=dialect)
+    # Les cellules vides sont ignorées pour ne pas écraser les valeurs existantes
+    return [
+        {k.strip(): v.strip() for k, v in row.items() if k and v is not None and v.strip() != ''}
+        for row in reader
+    ]
+
+
+@baes_bp.route('/bulk', methods=['PUT'])
+@swag_from({
+    'tags': ['BAES Operations'],
+    'description': "Place ou déplace des BAES en masse (position, etage_id, label, is_ignored) "
+                   "dans une seule transaction. Les champs absents d'une ligne ne sont pas modifiés.",
+    'consumes': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'baes': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer', 'format': 'int64', 'example': 1},
+                                'position': {'type': 'object', 'example': {"x": 100, "y": 200}},
+                                'etage_id': {'type': 'integer', 'example': 1, 'nullable': True},
+                                'label': {'type': 'string', 'example': 'Couloir nord'},
+                                'is_ignored': {'type': 'boolean', 'example': False}
+                            },
+                            'required': ['id']
+                        }
+                    }
+                },
+                'required': ['baes']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'BAES mis à jour.',
+            'schema': {'type': 'object', 'properties': {'updated': {'type': 'integer', 'example': 120}}}
+        },
+        400: {'description': 'Données invalides.'},
+        404: {'description': 'BAES ou étage non trouvé.'}
+    }
+})
+def bulk_update_baes():
+    try:
+        data = request.get_json(silent=True)
+        items = data.get('baes') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': "Le champ 'baes' doit être une liste non vide"}), 400
+
+        rows, errors = _normalize_rows(items, BULK_FIELDS)
+        errors += [{'index': i, 'error': 'Aucun champ à mettre à jour'} for i, r in enumerate(rows) if len(r) == 1]
+        if errors:
+            return jsonify({'error': 'Données invalides', 'details': errors}), 400
+
+        missing = sorted({r['id'] for r in rows} - existing_baes_ids([r['id'] for r in rows]))
+        if missing:
+            return jsonify({'error': 'BAES non trouvés', 'missing_ids': missing}), 404
+        missing_etages = missing_etage_ids(rows)
+        if missing_etages:
+            return jsonify({'error': 'Étages non trouvés', 'missing_etage_ids': missing_etages}), 404
+
+        counters = track_baes([r['id'] for r in rows if 'etage_id' in r])
+        now = current_time()
+        for row in rows:
+            row['updated_at'] = now
+        # UPDATE en masse par clé primaire (executemany), une seule transaction
+        db.session.execute(update(Baes), rows)
+        counters.apply()
+        db.session.commit()
+        return jsonify({'updated': len(rows)}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in bulk_update_baes: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@baes_bp.route('/import', methods=['POST'])
+@swag_from({
+    'tags': ['BAES Operations'],
+    'description': "Importe des BAES en masse pour la mise en service d'un bâtiment (CSV ou JSON). "
+                   "Les BAES existants sont mis à jour, les autres sont créés. Colonnes CSV acceptées : "
+                   "id (entier ou adresse 'aa:bb:..'), name, label, etage_id, x, y (ou position en JSON), is_ignored. "
+                   "Le séparateur CSV (',' ou ';') est détecté automatiquement. Avec async=true, le fichier "
+                   "est validé dans la requête puis écrit par le worker de tâches.",
+    'consumes': ['multipart/form-data', 'application/json', 'text/csv'],
+    'parameters': [
+        {
+            'name': 'file',
+            'in': 'formData',
+            'type': 'file',
+            'required': False,
+            'description': 'Fichier CSV ou JSON (.json)'
+        },
+        {
+            'name': 'etage_id',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': "Étage appliqué aux lignes qui n'en précisent pas"
+        },
+        {
+            'name': 'async',
+            'in': 'query',
+            'type': 'boolean',
+            'required': False,
+            'description': "Écriture en tâche de fond après validation (réponse 202, suivi par GET /jobs/<id>)"
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Import effectué.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'created': {'type': 'integer', 'example': 580},
+                    'updated': {'type': 'integer', 'example': 20}
+                }
+            }
+        },
+        400: {'description': 'Fichier ou données invalides.'},
+        202: ACCEPTED_RESPONSE,
+        404: {'description': 'Étage non trouvé.'},
+        409: {'description': "Conflit d'unicité (nom de BAES déjà utilisé)."}
+    }
+})
+def import_baes():
+    try:
+        default_etage_id = request.args.get('etage_id', type=int)
+        try:
+            items = _read_import_items()
+        except (ValueError, UnicodeDecodeError) as e:
+            return jsonify({'error': f"Import illisible: {e}"}), 400
+        if not items:
+            return jsonify({'error': 'Aucune ligne à importer'}), 400
+
+        rows, errors = _normalize_rows(items, IMPORT_FIELDS)
+        if errors:
+            return jsonify({'error': 'Données invalides', 'details': errors}), 400
+        if default_etage_id is not None:
+            for row in rows:
+                row.setdefault('etage_id', default_etage_id)
+
+        missing_etages = missing_etage_ids(rows)
+        if missing_etages:
+            return jsonify({'error': 'Étages non trouvés', 'missing_etage_ids': missing_etages}), 404
+
+        if wants_async():
+            # Lignes déjà validées : le worker n'a plus qu'à les écrire
+            return accept_job('baes.import', {'rows': rows})
+
+        result = import_rows(rows)
+        db.session.commit()
+        return jsonify(result), 200
+    except IntegrityError as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Integrity error in import_baes: {e}")
+        return jsonify({'error': "Conflit d'unicité lors de l'import (nom de BAES déjà utilisé ?)"}), 409
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in import_baes: {e}")
+        return jsonify({'error': str(e)}), 500
@@ -2,6 +2,7 @@
 from flask import Blueprint, request, jsonify, current_app
 from flasgger import swag_from
 from models import Batiment, Etage, Baes, Carte, db
+from services import alarm_counters
 
 
 batiment_bp = Blueprint('batiment_bp', __name__)
@@ -136,6 +137,8 @@ def create_batiment():
             site_id=data.get('site_id')
         )
         db.session.add(batiment)
+        db.session.flush()
+        alarm_counters.create_empty_scope('batiment', batiment.id)
         db.session.commit()
         result = {
             'id': batiment.id,
@@ -202,8 +205,12 @@ def update_batiment(batiment_id):
             batiment.name = data['name']
         if 'polygon_points' in data:
             batiment.polygon_points = data['polygon_points']
+        old_site_id = batiment.site_id
         if 'site_id' in data:
             batiment.site_id = data['site_id']
+        if batiment.site_id != old_site_id:
+            # Le bâtiment change de site : recalcul des compteurs des deux sites
+            alarm_counters.refresh_sites([old_site_id, batiment.site_id])
         db.session.commit()
         result = {
             'id': batiment.id,
@@ -251,6 +258,10 @@ def delete_batiment(batiment_id):
 
         # Récupérer tous les étages du bâtiment
         etages = Etage.query.filter_by(batiment_id=batiment_id).all()
+        etage_ids = [etage.id for etage in etages]
+        counters = alarm_counters.track_baes(
+            baes_id for (baes_id,) in db.session.query(Baes.id).filter(Baes.etage_id.in_(etage_ids))
+        )
 
         for etage in etages:
             # Détacher les BAES de cet étage (etage_id = NULL)
@@ -268,6 +279,9 @@ def delete_batiment(batiment_id):
 
         # Enfin, supprimer le bâtiment
         db.session.delete(batiment)
+        counters.apply()
+        alarm_counters.discard_scopes('etage', etage_ids)
+        alarm_counters.discard_scopes('batiment', [batiment_id])
         db.session.commit()
         return jsonify({'message': 'Bâtiment supprimé avec succès'}), 200
     except Exception as e:
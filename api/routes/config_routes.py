@@ -1,38 +1,68 @@
 from flask import Blueprint, request, jsonify, current_app
 from flasgger import swag_from
 from models import Config, db
+from services import config_store
+from services.config_store import ConfigValueError
 from sqlalchemy.exc import IntegrityError
 
 
 config_bp = Blueprint('config_bp', __name__)
-@config_bp.route('/', methods=['GET'])
+
+CONFIG_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer', 'format': 'int64', 'example': 1},
+        'key': {'type': 'string', 'example': 'site_name'},
+        'value': {'description': 'Valeur typée (chaîne, nombre, booléen ou JSON)', 'example': 'Mon Site'},
+        'type': {'type': 'string', 'enum': list(config_store.TYPES), 'example': 'string'}
+    }
+}
+
+
+def _write_response(config, status_code, **extra):
+    """Réponse d'une écriture validée : le cache local est invalidé, les autres workers suivent par version."""
+    config_store.invalidate()
+    return jsonify({**config_store.to_dict(config), **extra}), status_code
+
+
+@config_bp.route('/', methods=['GET'], strict_slashes=False)
 @swag_from({
     'tags': ['Configuration CRUD'],
-    'description': 'Récupère la liste de toutes les configurations.',
+    'description': "Récupère toutes les configurations, ou seulement celles de `keys` (lecture groupée au "
+                   "chargement du front). Servi depuis le cache du worker ; l'ETag change à chaque écriture "
+                   "(If-None-Match -> 304).",
+    'parameters': [
+        {
+            'name': 'keys',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': "Clés séparées par des virgules (ex: site_name,refresh_interval) ; les clés absentes sont ignorées"
+        }
+    ],
     'responses': {
         200: {
             'description': 'Liste des configurations.',
-            'schema': {
-                'type': 'array',
-                'items': {
-                    'type': 'object',
-                    'properties': {
-                        'id': {'type': 'integer', 'format': 'int64', 'example': 1},
-                        'key': {'type': 'string', 'example': 'site_name'},
-                        'value': {'type': 'string', 'example': 'Mon Site'}
-                    }
-                }
-            }
+            'schema': {'type': 'array', 'items': CONFIG_SCHEMA}
         },
+        304: {'description': 'Configuration inchangée depuis l\'ETag fourni.'},
         500: {'description': 'Erreur interne.'}
     }
 })
 #routes to get all configurations
 def get_configs():
     try:
-        configs = Config.query.all()
-        result = [{'id': c.id, 'key': c.key, 'value': c.value} for c in configs]
-        return jsonify(result), 200
+        keys = request.args.get('keys')
+        if keys is not None:
+            result, version = config_store.get_many([key.strip() for key in keys.split(',') if key.strip()])
+        else:
+            result, version = config_store.all_entries()
+        etag = f'config-{version}'
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': f'"{etag}"'}
+        response = jsonify(result)
+        response.set_etag(etag)
+        return response, 200
     except Exception as e:
         current_app.logger.error(f"Error in get_configs: {e}")
         return jsonify({'error': str(e)}), 500
@@ -51,7 +81,9 @@ def get_configs():
                     'required': ['key', 'value'],
                     'properties': {
                         'key': {'type': 'string', 'example': 'site_name'},
-                        'value': {'type': 'string', 'example': 'Mon Site'}
+                        'value': {'description': 'Valeur JSON (chaîne, nombre, booléen, objet ou liste)', 'example': 'Mon Site'},
+                        'type': {'type': 'string', 'enum': list(config_store.TYPES),
+                                 'description': 'Type de la valeur ; déduit de la valeur JSON si absent'}
                     }
                 }
             }
@@ -60,14 +92,7 @@ def get_configs():
     'responses': {
         201: {
             'description': 'Configuration créée avec succès.',
-            'schema': {
-                'type': 'object',
-                'properties': {
-                    'id': {'type': 'integer', 'format': 'int64', 'example': 1},
-                    'key': {'type': 'string', 'example': 'site_name'},
-                    'value': {'type': 'string', 'example': 'Mon Site'}
-                }
-            }
+            'schema': CONFIG_SCHEMA
         },
         400: {'description': 'Données invalides ou manquantes.'},
         409: {'description': 'Une configuration avec cette clé existe déjà.'},
@@ -84,20 +109,21 @@ def create_config():
             return jsonify({'error': 'Les champs "key" et "value" sont requis'}), 400
             
         # Create new config
+        value, value_type = config_store.encode(data['value'], data.get('type'))
         new_config = Config(
             key=data['key'],
-            value=data['value']
+            value=value,
+            value_type=value_type
         )
         
         db.session.add(new_config)
+        config_store.bump_version()
         db.session.commit()
         
         # Return the created config
-        return jsonify({
-            'id': new_config.id,
-            'key': new_config.key,
-            'value': new_config.value
-        }), 201
+        return _write_response(new_config, 201)
+    except ConfigValueError as e:
+        return jsonify({'error': str(e)}), 400
     except IntegrityError:
         db.session.rollback()
         return jsonify({'error': 'Une configuration avec cette clé existe déjà'}), 409
@@ -130,27 +156,43 @@ def create_config():
                     'type': 'object',
                     'properties': {
                         'key': {'type': 'string', 'example': 'site_name'},
-                        'value': {'type': 'string', 'example': 'Mon Site'}
+                        'value': {'description': 'Valeur JSON (chaîne, nombre, booléen, objet ou liste)', 'example': 'Mon Site'},
+                        'type': {'type': 'string', 'enum': list(config_store.TYPES),
+                                 'description': 'Nouveau type ; par défaut celui déduit de la nouvelle valeur'}
                     }
                 }
             }
         }
     },
     'responses': {
-        200: {'description': 'Configuration modifiée avec succès.'},
+        200: {'description': 'Configuration modifiée avec succès.', 'schema': CONFIG_SCHEMA},
+        400: {'description': 'Valeur invalide pour son type.'},
         404: {'description': "Configuration non trouvée."},
+        409: {'description': 'Une configuration avec cette clé existe déjà.'},
         500: {'description': "Erreur interne."}
     }
 })
 def update_config(config_id):
     try:
-        config = Config.query.get_or_404(config_id)
-        data = request.get_json()
+        config = db.session.get(Config, config_id)
+        if not config:
+            return jsonify({'error': 'Configuration non trouvée'}), 404
+        data = request.get_json() or {}
         config.key = data.get('key', config.key)
-        config.value = data.get('value', config.value)
+        if 'value' in data or 'type' in data:
+            value = data['value'] if 'value' in data else config_store.to_dict(config)['value']
+            config.value, config.value_type = config_store.encode(value, data.get('type'))
+        config_store.bump_version()
         db.session.commit()
-        return jsonify({'message': 'Configuration updated successfully'}), 200
+        return _write_response(config, 200, message='Configuration updated successfully')
+    except ConfigValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'Une configuration avec cette clé existe déjà'}), 409
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error in update_config: {e}")
         return jsonify({'error': str(e)}), 500
 
@@ -158,7 +200,7 @@ def update_config(config_id):
 @config_bp.route('/key/<string:key>', methods=['GET'])
 @swag_from({
     'tags': ['Configuration CRUD'],
-    'description': 'Récupère une configuration par sa clé.',
+    'description': 'Récupère une configuration par sa clé (depuis le cache du worker).',
     'parameters': [
         {
             'name': 'key',
@@ -171,14 +213,7 @@ def update_config(config_id):
     'responses': {
         200: {
             'description': 'Configuration récupérée avec succès.',
-            'schema': {
-                'type': 'object',
-                'properties': {
-                    'id': {'type': 'integer', 'format': 'int64', 'example': 1},
-                    'key': {'type': 'string', 'example': 'site_name'},
-                    'value': {'type': 'string', 'example': 'Mon Site'}
-                }
-            }
+            'schema': CONFIG_SCHEMA
         },
         404: {'description': "Configuration non trouvée."},
         500: {'description': "Erreur interne."}
@@ -186,15 +221,11 @@ def update_config(config_id):
 })
 def get_config_by_key(key):
     try:
-        config = Config.query.filter_by(key=key).first()
-        if not config:
+        configs, _ = config_store.get_many([key])
+        if not configs:
             return jsonify({'error': f"Configuration avec la clé '{key}' non trouvée"}), 404
             
-        return jsonify({
-            'id': config.id,
-            'key': config.key,
-            'value': config.value
-        }), 200
+        return jsonify(configs[0]), 200
     except Exception as e:
         current_app.logger.error(f"Error in get_config_by_key: {e}")
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
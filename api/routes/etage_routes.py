@@ -1,8 +1,12 @@
 # routes/etage_routes.py
 from flask import Blueprint, request, jsonify, current_app
 from flasgger import swag_from
-from models import Etage, Baes, Carte, db
+from sqlalchemy import select
+from database import read_only
+from models import Batiment, Etage, Baes, Carte, db
 from routes.general_routes import status_to_dict
+from services import alarm_counters, floor_map
+from templates.TimestampMixin import current_time
 
 etage_bp = Blueprint('etage_bp', __name__)
 
@@ -118,6 +122,8 @@ def create_etage():
             return jsonify({'error': 'Les champs name et batiment_id sont requis'}), 400
         etage = Etage(name=data['name'], batiment_id=data['batiment_id'])
         db.session.add(etage)
+        db.session.flush()
+        alarm_counters.create_empty_scope('etage', etage.id)
         db.session.commit()
         result = {'id': etage.id, 'name': etage.name, 'batiment_id': etage.batiment_id}
         return jsonify(result), 201
@@ -173,10 +179,17 @@ def update_etage(etage_id):
         if not etage:
             return jsonify({'error': "Étage non trouvé"}), 404
         data = request.get_json()
+        old_batiment_id = etage.batiment_id
         if 'name' in data:
             etage.name = data['name']
         if 'batiment_id' in data:
             etage.batiment_id = data['batiment_id']
+        if etage.batiment_id != old_batiment_id:
+            # L'étage change de bâtiment : recalcul des compteurs des sites concernés
+            sites = db.session.query(Batiment.site_id).filter(
+                Batiment.id.in_([old_batiment_id, etage.batiment_id])
+            ).all()
+            alarm_counters.refresh_sites(site_id for (site_id,) in sites)
         db.session.commit()
         result = {'id': etage.id, 'name': etage.name, 'batiment_id': etage.batiment_id}
         return jsonify(result), 200
@@ -226,16 +239,19 @@ def delete_etage(etage_id):
             db.session.delete(carte)
             carte_deleted = 1
 
-        # Récupérer tous les BAES associés à cet étage
-        baes_list = Baes.query.filter_by(etage_id=etage_id).all()
-        baes_count = len(baes_list)
+        counters = alarm_counters.track_baes(
+            baes_id for (baes_id,) in db.session.query(Baes.id).filter_by(etage_id=etage_id)
+        )
 
-        # Mettre à jour les BAES pour définir etage_id à null au lieu de les supprimer
-        for baes in baes_list:
-            baes.etage_id = None
+        # Détacher les BAES de cet étage (etage_id = null) en un seul UPDATE au lieu de les supprimer
+        baes_count = Baes.query.filter_by(etage_id=etage_id).update(
+            {Baes.etage_id: None, Baes.updated_at: current_time()}, synchronize_session=False
+        )
 
         # Supprimer l'étage
         db.session.delete(etage)
+        counters.apply()
+        alarm_counters.discard_scopes('etage', [etage_id])
         db.session.commit()
 
         return jsonify({
@@ -259,6 +275,14 @@ def delete_etage(etage_id):
             'type': 'integer',
             'required': True,
             'description': "ID de l'étage dont on veut récupérer les BAES"
+        },
+        {
+            'name': 'bbox',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': "Zone affichée min_x,min_y,max_x,max_y (repère du plan) : seuls les BAES placés "
+                           "dans cette zone sont retournés"
         }
     ],
     'responses': {
@@ -290,16 +314,18 @@ def delete_etage(etage_id):
                 }
             }
         },
+        400: {'description': 'Paramètre bbox invalide.'},
         404: {'description': "Étage non trouvé."}
     }
 })
 def get_baes_by_etage_id(etage_id):
     try:
+        bbox = floor_map.parse_bbox(request.args.get('bbox'))
         etage = Etage.query.get(etage_id)
         if not etage:
             return jsonify({'error': "Étage non trouvé"}), 404
 
-        baes_list = Baes.query.filter_by(etage_id=etage_id).all()
+        baes_list = Baes.query.filter(Baes.etage_id == etage_id, *floor_map.bbox_criteria(bbox)).all()
         result = [
             {
                 'id': b.id,
@@ -312,6 +338,91 @@ def get_baes_by_etage_id(etage_id):
             } for b in baes_list
         ]
         return jsonify(result), 200
+    except floor_map.MapQueryError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error in get_baes_by_etage_id: {e}")
         return jsonify({'error': str(e)}), 500
+
+@etage_bp.route('/<int:etage_id>/baes/clusters', methods=['GET'])
+@swag_from({
+    'tags': ['Etage CRUD'],
+    'description': "Regroupe les BAES d'un étage par cellules du plan, selon le niveau de zoom de la carte : "
+                   "une cellule mesure radius / 2^zoom unités du plan (radius pixels à l'écran). Chaque "
+                   "groupe donne son barycentre, son emprise, le nombre de BAES par catégorie de dernier "
+                   "status et la pire d'entre elles (connection_errors > battery_errors > unknown > ok).",
+    'parameters': [
+        {'name': 'etage_id', 'in': 'path', 'type': 'integer', 'required': True},
+        {'name': 'zoom', 'in': 'query', 'type': 'number', 'required': False,
+         'description': f"Niveau de zoom ({floor_map.MIN_ZOOM} à {floor_map.MAX_ZOOM}) ; par défaut celui "
+                        f"de la carte de l'étage, 0 sans carte"},
+        {'name': 'radius', 'in': 'query', 'type': 'number', 'required': False,
+         'default': floor_map.DEFAULT_CLUSTER_RADIUS,
+         'description': "Taille d'une cellule en pixels à l'écran"},
+        {'name': 'bbox', 'in': 'query', 'type': 'string', 'required': False,
+         'description': "Zone affichée min_x,min_y,max_x,max_y (repère du plan)"}
+    ],
+    'responses': {
+        200: {
+            'description': "Groupes de BAES (un BAES isolé forme un groupe de 1 avec son baes_id).",
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'etage_id': {'type': 'integer', 'example': 1},
+                    'zoom': {'type': 'number', 'example': 1},
+                    'cell_size': {'type': 'number', 'example': 30},
+                    'bbox': {'type': 'array', 'items': {'type': 'number'}, 'example': None},
+                    'total': {'type': 'integer', 'example': 42, 'description': 'BAES placés dans la zone'},
+                    'unplaced': {'type': 'integer', 'example': 0, 'description': 'BAES sans coordonnées'},
+                    'clusters': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'x': {'type': 'number', 'example': 112.5},
+                                'y': {'type': 'number', 'example': 204.0},
+                                'count': {'type': 'integer', 'example': 4},
+                                'worst': {'type': 'string', 'enum': list(floor_map.SEVERITY),
+                                          'example': 'battery_errors'},
+                                'counts': {'type': 'object', 'example': {
+                                    'connection_errors': 0, 'battery_errors': 1, 'ok': 3, 'unknown': 0}},
+                                'unsolved': {'type': 'integer', 'example': 1},
+                                'bounds': {'type': 'array', 'items': {'type': 'number'},
+                                           'example': [100, 190, 125, 220]},
+                                'baes_id': {'type': 'integer', 'example': None, 'nullable': True}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {'description': 'Paramètre invalide.'},
+        404: {'description': "Étage non trouvé."}
+    }
+})
+@read_only
+def get_baes_clusters(etage_id):
+    try:
+        bbox = floor_map.parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', type=float)
+        radius = request.args.get('radius', floor_map.DEFAULT_CLUSTER_RADIUS, type=float)
+        if db.session.execute(select(Etage.id).where(Etage.id == etage_id)).scalar() is None:
+            return jsonify({'error': "Étage non trouvé"}), 404
+        if zoom is None:
+            zoom = db.session.execute(select(Carte.zoom).where(Carte.etage_id == etage_id)).scalar() or 0
+        size = floor_map.cell_size(zoom, radius)
+        clusters, unplaced = floor_map.clusters(etage_id, size, bbox)
+        return jsonify({
+            'etage_id': etage_id,
+            'zoom': zoom,
+            'cell_size': size,
+            'bbox': list(bbox) if bbox is not None else None,
+            'total': sum(cluster['count'] for cluster in clusters),
+            'unplaced': unplaced,
+            'clusters': clusters
+        }), 200
+    except floor_map.MapQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in get_baes_clusters: {e}")
+        return jsonify({'error': str(e)}), 500
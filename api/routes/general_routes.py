@@ -3,6 +3,9 @@ import os
 from flask import Blueprint, request, jsonify ,url_for, current_app
 from flasgger import swag_from
 from models import User, Site, Batiment, Etage, Baes, Status
+from sqlalchemy.orm import selectinload
+from services.visibility import get_visibility
+from database import read_only
 
 general_routes_bp = Blueprint('general_routes_bp', __name__)
 
@@ -208,6 +211,7 @@ def site_to_dict(s: Site) -> dict:
     }
 })
 @general_routes_bp.route('/user/<int:user_id>/alldata', methods=['GET'])
+@read_only
 def get_all_user_site_data(user_id):
     """
     Route qui retourne pour un utilisateur donné l'ensemble des sites auxquels il a accès,
@@ -218,14 +222,14 @@ def get_all_user_site_data(user_id):
     if not user:
         return jsonify({'error': 'Utilisateur non trouvé.'}), 404
 
-    # Récupération des sites distincts via l'association user_site_roles
-    sites = []
-    seen = set()
-    for assoc in user.user_site_roles.all():
-        site = assoc.site
-        if site and site.id not in seen:
-            seen.add(site.id)
-            sites.append(site)
+    # Sites visibles par l'utilisateur (tous pour un super-admin), hiérarchie chargée par lots
+    scope = get_visibility(user_id)
+    sites = Site.query.filter(scope.sites()).options(
+        selectinload(Site.carte),
+        selectinload(Site.batiments).selectinload(Batiment.etages).selectinload(Etage.carte),
+        selectinload(Site.batiments).selectinload(Batiment.etages)
+        .selectinload(Etage.baes).selectinload(Baes.statuses),
+    ).order_by(Site.id).all()
 
     sites_data = [site_to_dict(site) for site in sites]
     return jsonify({'sites': sites_data}), 200
@@ -308,12 +312,17 @@ def get_all_user_site_data(user_id):
     }
 })
 @general_routes_bp.route('/batiment/<int:batiment_id>/alldata', methods=['GET'])
+@read_only
 def get_all_batiment_data(batiment_id):
     """
     Route qui retourne pour un bâtiment donné l'ensemble de ses étages,
     ainsi que pour chaque étage, sa carte et ses BAES avec leurs erreurs.
     """
-    batiment = Batiment.query.get(batiment_id)
+    # Hiérarchie chargée par lots : un nombre de requêtes fixe quel que soit le nombre d'étages et de BAES
+    batiment = Batiment.query.options(
+        selectinload(Batiment.etages).selectinload(Etage.carte),
+        selectinload(Batiment.etages).selectinload(Etage.baes).selectinload(Baes.statuses),
+    ).filter(Batiment.id == batiment_id).first()
     if not batiment:
         return jsonify({'error': 'Bâtiment non trouvé.'}), 404
 
@@ -342,3 +351,45 @@ def get_api_version():
     """
     # Retourner la version de l'API (définie comme "1.0" dans app.py)
     return jsonify({'version': '1.0'}), 200
+
+
+@swag_from({
+    'tags': ['general'],
+    'description': "Sonde de disponibilité : 200 si la base répond et que son schéma est à la version "
+                   "attendue (flask bootstrap exécuté), 503 sinon. Aucune écriture ni donnée par défaut.",
+    'responses': {
+        '200': {
+            'description': "Prêt à servir",
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string', 'example': "ready"},
+                    'schema_version': {'type': 'integer', 'example': 1}
+                }
+            }
+        },
+        '503': {
+            'description': "Base injoignable ou schéma absent / en retard",
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string', 'example': "not_ready"},
+                    'schema_version': {'type': 'integer', 'x-nullable': True},
+                    'expected_version': {'type': 'integer'},
+                    'error': {'type': 'string'}
+                }
+            }
+        }
+    }
+})
+@general_routes_bp.route('/ready', methods=['GET'])
+def get_readiness():
+    """
+    Route de disponibilité pour les sondes (healthcheck docker, répartiteur de charge).
+    """
+    import bootstrap
+
+    ready, detail = bootstrap.readiness()
+    if not ready:
+        return jsonify({'status': 'not_ready', **detail}), 503
+    return jsonify({'status': 'ready', **detail}), 200
@@ -0,0 +1,330 @@
+from datetime import datetime, timedelta, timezone
+
+from flask import Blueprint, current_app, jsonify, request
+from flasgger import swag_from
+from flask_login import current_user
+from sqlalchemy import select
+
+from database import read_only
+from models import db, Baes, Incident, User
+from routes.job_routes import ACCEPTED_RESPONSE, accept_job
+from services import alarm_counters, incidents
+from services.pagination import DEFAULT_PER_PAGE, get_page_args, paginate, pagination_headers
+from services.status_history import HistoryQueryError, iso, parse_bool, parse_datetime, parse_int_list
+from services.user_relations import names_by_id
+from services.visibility import get_visibility
+
+incident_bp = Blueprint('incident_bp', __name__)
+
+STATES = ('open', 'closed', 'all')
+DEFAULT_STATS_RANGE = timedelta(days=30)
+MAX_STATS_RANGE = timedelta(days=366)
+
+INCIDENT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer', 'example': 42},
+        'baes_id': {'type': 'integer', 'format': 'int64', 'example': 1},
+        'baes_name': {'type': 'string', 'example': 'BAES-1', 'nullable': True},
+        'erreur': {'type': 'integer', 'example': 4},
+        'is_open': {'type': 'boolean', 'example': True},
+        'opened_at': {'type': 'string', 'format': 'date-time', 'example': '2023-01-01T12:00:00Z'},
+        'closed_at': {'type': 'string', 'format': 'date-time', 'nullable': True},
+        'duration_seconds': {'type': 'number', 'example': 3600.0,
+                             'description': "Durée de l'épisode (jusqu'à maintenant s'il est ouvert)"},
+        'opening_status_id': {'type': 'integer', 'example': 1200, 'nullable': True},
+        'closing_status_id': {'type': 'integer', 'example': 1250, 'nullable': True},
+        'acknowledged_by_user_id': {'type': 'integer', 'example': 1, 'nullable': True},
+        'acknowledged_by_login': {'type': 'string', 'example': 'user1', 'nullable': True},
+        'acknowledged_at': {'type': 'string', 'format': 'date-time', 'nullable': True}
+    }
+}
+
+SCOPE_PARAMETERS = [
+    {'name': 'erreur', 'in': 'query', 'type': 'string', 'required': False,
+     'description': "Codes d'erreur séparés par des virgules (ex: 0,4)"},
+    {'name': 'baes_id', 'in': 'query', 'type': 'string', 'required': False,
+     'description': 'Identifiants de BAES séparés par des virgules'},
+    {'name': 'etage_id', 'in': 'query', 'type': 'integer', 'required': False},
+    {'name': 'batiment_id', 'in': 'query', 'type': 'integer', 'required': False},
+    {'name': 'site_id', 'in': 'query', 'type': 'integer', 'required': False},
+    {'name': 'user_id', 'in': 'query', 'type': 'integer', 'required': False,
+     'description': "Limite aux BAES visibles par cet utilisateur"}
+]
+
+
+def _scope_criteria():
+    user_id = request.args.get('user_id', type=int)
+    return incidents.scope_criteria(
+        etage_id=request.args.get('etage_id', type=int),
+        batiment_id=request.args.get('batiment_id', type=int),
+        site_id=request.args.get('site_id', type=int),
+        baes_ids=parse_int_list(request.args.get('baes_id'), 'baes_id'),
+        erreurs=parse_int_list(request.args.get('erreur'), 'erreur'),
+        scope=get_visibility(user_id) if user_id is not None else None,
+    )
+
+
+def _utc(value):
+    """Date lue en base (aware ou naïve UTC selon le pilote) en datetime UTC."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _serialize(items):
+    now = datetime.now(timezone.utc)
+    baes_names = names_by_id(Baes, {i.baes_id for i in items})
+    logins = names_by_id(User, {i.acknowledged_by_user_id for i in items if i.acknowledged_by_user_id}, column='login')
+    result = []
+    for incident in items:
+        closed_at = incident.closed_at
+        end = _utc(closed_at) if closed_at is not None else now
+        result.append({
+            'id': incident.id,
+            'baes_id': incident.baes_id,
+            'baes_name': baes_names.get(incident.baes_id),
+            'erreur': incident.erreur,
+            'is_open': closed_at is None,
+            'opened_at': iso(incident.opened_at),
+            'closed_at': iso(closed_at),
+            'duration_seconds': round((end - _utc(incident.opened_at)).total_seconds(), 1),
+            'opening_status_id': incident.opening_status_id,
+            'closing_status_id': incident.closing_status_id,
+            'acknowledged_by_user_id': incident.acknowledged_by_user_id,
+            'acknowledged_by_login': logins.get(incident.acknowledged_by_user_id),
+            'acknowledged_at': iso(incident.acknowledged_at)
+        })
+    return result
+
+
+@incident_bp.route('/', methods=['GET'])
+@swag_from({
+    'tags': ['Incidents'],
+    'description': "Épisodes de panne des BAES, du plus récent au plus ancien. Par défaut, les incidents "
+                   "ouverts (alarmes en cours), non paginés ; les incidents clos sont toujours paginés "
+                   "(page 1 de 50 si ?page= n'est pas fourni).",
+    'parameters': [
+        {'name': 'state', 'in': 'query', 'type': 'string', 'enum': list(STATES), 'default': 'open',
+         'required': False},
+        {'name': 'acknowledged', 'in': 'query', 'type': 'boolean', 'required': False,
+         'description': 'true : incidents acquittés, false : non acquittés'},
+        {'name': 'from', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False,
+         'description': "Ouverts à partir de cette date (ISO 8601, UTC si sans fuseau)"},
+        {'name': 'to', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False,
+         'description': "Ouverts avant cette date (exclue)"},
+        {'name': 'page', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'per_page', 'in': 'query', 'type': 'integer', 'required': False}
+    ] + SCOPE_PARAMETERS,
+    'responses': {
+        200: {
+            'description': "Liste d'incidents (en-têtes X-Total-Count, X-Page et X-Per-Page si paginée).",
+            'schema': {'type': 'array', 'items': INCIDENT_SCHEMA}
+        },
+        400: {'description': 'Paramètre invalide.'},
+        500: {'description': 'Erreur interne.'}
+    }
+})
+@read_only
+def list_incidents():
+    try:
+        state = request.args.get('state', 'open')
+        if state not in STATES:
+            return jsonify({'error': f"state doit valoir {', '.join(STATES)}"}), 400
+        criteria = _scope_criteria()
+        if state == 'open':
+            criteria.append(Incident.closed_at.is_(None))
+        elif state == 'closed':
+            criteria.append(Incident.closed_at.is_not(None))
+        acknowledged = parse_bool(request.args.get('acknowledged'), 'acknowledged')
+        if acknowledged is not None:
+            criteria.append(Incident.acknowledged_at.is_not(None) if acknowledged
+                            else Incident.acknowledged_at.is_(None))
+        start = parse_datetime(request.args.get('from'), 'from')
+        end = parse_datetime(request.args.get('to'), 'to')
+        if start is not None:
+            criteria.append(Incident.opened_at >= start)
+        if end is not None:
+            criteria.append(Incident.opened_at < end)
+
+        page, per_page = get_page_args()
+        if page is None and state != 'open':
+            # L'historique des incidents clos n'est jamais renvoyé en entier
+            page, per_page = 1, DEFAULT_PER_PAGE
+        query = Incident.query.filter(*criteria).order_by(Incident.opened_at.desc(), Incident.id.desc())
+        items, total = paginate(query, page, per_page)
+        return jsonify(_serialize(items)), 200, pagination_headers(total, page, per_page)
+    except HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in list_incidents: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@incident_bp.route('/stats', methods=['GET'])
+@swag_from({
+    'tags': ['Incidents'],
+    'description': "Statistiques par code d'erreur sur une période (30 derniers jours par défaut, 366 jours "
+                   "au maximum) : incidents ouverts actuellement, ouverts et clos sur la période, durée "
+                   "moyenne de résolution (MTTR, incidents clos sur la période) et d'acquittement (MTTA, "
+                   "incidents ouverts sur la période), en secondes.",
+    'parameters': [
+        {'name': 'from', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False},
+        {'name': 'to', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False}
+    ] + SCOPE_PARAMETERS,
+    'responses': {
+        200: {
+            'description': 'Statistiques des incidents.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'from': {'type': 'string', 'format': 'date-time'},
+                    'to': {'type': 'string', 'format': 'date-time'},
+                    'by_erreur': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'erreur': {'type': 'integer', 'example': 4},
+                                'open': {'type': 'integer', 'example': 12},
+                                'opened': {'type': 'integer', 'example': 40},
+                                'closed': {'type': 'integer', 'example': 35},
+                                'mttr_seconds': {'type': 'number', 'example': 86400.0, 'nullable': True},
+                                'acknowledged': {'type': 'integer', 'example': 30},
+                                'mtta_seconds': {'type': 'number', 'example': 1800.0, 'nullable': True}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {'description': 'Paramètre invalide.'},
+        500: {'description': 'Erreur interne.'}
+    }
+})
+@read_only
+def get_incident_stats():
+    try:
+        end = parse_datetime(request.args.get('to'), 'to') or datetime.now(timezone.utc)
+        start = parse_datetime(request.args.get('from'), 'from') or end - DEFAULT_STATS_RANGE
+        if start >= end:
+            return jsonify({'error': 'Le paramètre from doit précéder to'}), 400
+        if end - start > MAX_STATS_RANGE:
+            return jsonify({'error': f'Période trop longue ({MAX_STATS_RANGE.days} jours au maximum)'}), 400
+        stats = incidents.statistics(_scope_criteria(), start, end)
+        return jsonify({'from': iso(start), 'to': iso(end), 'by_erreur': stats}), 200
+    except HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in get_incident_stats: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@incident_bp.route('/<int:incident_id>/acknowledge', methods=['PUT'])
+@swag_from({
+    'tags': ['Incidents'],
+    'description': "Acquitte un incident et tous ses status (même BAES, même code, de l'ouverture à la "
+                   "clôture) en une seule mise à jour. is_solved=false retire l'acquittement.",
+    'consumes': ['application/json'],
+    'parameters': [
+        {'name': 'incident_id', 'in': 'path', 'type': 'integer', 'required': True},
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'is_solved': {'type': 'boolean', 'example': True, 'default': True},
+                    'user_id': {'type': 'integer', 'example': 1,
+                                'description': "ID de l'utilisateur qui acquitte (si aucun utilisateur n'est connecté)"}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Incident acquitté.',
+            'schema': {
+                'type': 'object',
+                'properties': dict(INCIDENT_SCHEMA['properties'], statuses_acknowledged={'type': 'integer', 'example': 18})
+            }
+        },
+        400: {'description': 'Mauvaise requête.'},
+        404: {'description': 'Incident non trouvé.'}
+    }
+})
+def acknowledge_incident(incident_id):
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Corps de requête invalide'}), 400
+        is_solved = data.get('is_solved', True)
+        if not isinstance(is_solved, bool):
+            return jsonify({'error': 'is_solved doit être un booléen'}), 400
+
+        # Même attribution que l'acquittement d'un status : utilisateur connecté, sinon user_id fourni
+        if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
+            user_id = current_user.id
+        else:
+            user_id = data.get('user_id')
+
+        incident = db.session.get(Incident, incident_id)
+        if incident is not None and user_id is not None:
+            scope = get_visibility(user_id, cached=False)
+            visible = scope.is_global or db.session.execute(
+                select(Baes.id).where(Baes.id == incident.baes_id, scope.baes(include_unassigned=True))
+            ).first() is not None
+            if not visible:
+                incident = None
+        if incident is None:
+            return jsonify({'error': 'Incident non trouvé'}), 404
+
+        now = datetime.now(timezone.utc)
+        counters = alarm_counters.track_baes([incident.baes_id])
+        incidents.set_acknowledgement(incident, is_solved, user_id, now)
+        count = incidents.acknowledge_statuses_of(incident, is_solved, user_id, now)
+        counters.apply()
+        db.session.commit()
+        return jsonify({**_serialize([incident])[0], 'statuses_acknowledged': count}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in acknowledge_incident: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@incident_bp.route('/rebuild', methods=['POST'])
+@swag_from({
+    'tags': ['Incidents'],
+    'description': "Recalcule les incidents depuis l'historique des status, en tâche de fond (réponse 202, "
+                   "suivi par GET /jobs/<id>). Équivalent de flask --app app incidents rebuild.",
+    'consumes': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': False,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'baes_ids': {'type': 'array', 'items': {'type': 'integer', 'format': 'int64'},
+                                 'description': 'BAES à recalculer ; tous par défaut'}
+                }
+            }
+        }
+    ],
+    'responses': {
+        202: ACCEPTED_RESPONSE,
+        400: {'description': 'Mauvaise requête.'}
+    }
+})
+def rebuild_incidents():
+    try:
+        data = request.get_json(silent=True) or {}
+        baes_ids = data.get('baes_ids') if isinstance(data, dict) else None
+        if baes_ids is not None and (not isinstance(baes_ids, list)
+                                     or not all(isinstance(i, int) and not isinstance(i, bool) for i in baes_ids)):
+            return jsonify({'error': "baes_ids doit être une liste d'entiers"}), 400
+        return accept_job('incidents.rebuild', {'baes_ids': baes_ids})
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in rebuild_incidents: {e}")
+        return jsonify({'error': str(e)}), 500
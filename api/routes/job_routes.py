@@ -0,0 +1,151 @@
+from flask import Blueprint, current_app, jsonify, request, send_file
+from flasgger import swag_from
+from flask_login import current_user
+
+from models import db, Job
+from services import jobs
+from services.pagination import DEFAULT_PER_PAGE, get_page_args, paginate, pagination_headers
+
+job_bp = Blueprint('job_bp', __name__)
+
+JOB_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'id': {'type': 'integer', 'example': 12},
+        'kind': {'type': 'string', 'example': 'site.delete'},
+        'state': {'type': 'string', 'enum': list(jobs.STATES), 'example': 'running'},
+        'progress': {
+            'type': 'object',
+            'properties': {
+                'current': {'type': 'integer', 'example': 120, 'nullable': True},
+                'total': {'type': 'integer', 'example': 600, 'nullable': True},
+                'percent': {'type': 'number', 'example': 20.0, 'nullable': True},
+                'message': {'type': 'string', 'example': 'Historique des BAES supprimé', 'nullable': True}
+            }
+        },
+        'attempts': {'type': 'integer', 'example': 1},
+        'max_attempts': {'type': 'integer', 'example': 3},
+        'result': {'type': 'object', 'nullable': True, 'description': 'Résultat de la tâche une fois terminée'},
+        'error': {'type': 'string', 'nullable': True, 'description': "Erreur du dernier essai"},
+        'created_by_user_id': {'type': 'integer', 'example': 1, 'nullable': True},
+        'created_at': {'type': 'string', 'format': 'date-time'},
+        'run_after': {'type': 'string', 'format': 'date-time'},
+        'started_at': {'type': 'string', 'format': 'date-time', 'nullable': True},
+        'finished_at': {'type': 'string', 'format': 'date-time', 'nullable': True},
+        'heartbeat_at': {'type': 'string', 'format': 'date-time', 'nullable': True}
+    }
+}
+
+# Réponse des routes qui mettent une opération en file (?async=true)
+ACCEPTED_RESPONSE = {
+    'description': "Tâche mise en file ; suivre son avancement par GET /jobs/<id> (en-tête Location).",
+    'schema': JOB_SCHEMA
+}
+
+
+def wants_async():
+    return request.args.get('async', 'false').lower() in ('1', 'true', 'yes')
+
+
+def accept_job(kind, payload):
+    """Met une tâche en file pour l'utilisateur courant et retourne la réponse 202 ; l'appelant gère les erreurs."""
+    if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
+        user_id = current_user.id
+    else:
+        user_id = request.args.get('user_id', type=int)
+    job = jobs.enqueue(kind, payload, user_id=user_id)
+    db.session.commit()
+    return jsonify(jobs.serialize(job)), 202, {'Location': f"/jobs/{job.id}"}
+
+
+@job_bp.route('/', methods=['GET'])
+@swag_from({
+    'tags': ['Jobs'],
+    'description': "Tâches de fond, de la plus récente à la plus ancienne (page 1 de 50 si ?page= n'est pas fourni).",
+    'parameters': [
+        {'name': 'state', 'in': 'query', 'type': 'string', 'enum': list(jobs.STATES), 'required': False},
+        {'name': 'kind', 'in': 'query', 'type': 'string', 'required': False,
+         'description': "Type de tâche (ex: site.delete, baes.import, status.export)"},
+        {'name': 'page', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'per_page', 'in': 'query', 'type': 'integer', 'required': False}
+    ],
+    'responses': {
+        200: {
+            'description': 'Liste de tâches (en-têtes X-Total-Count, X-Page et X-Per-Page).',
+            'schema': {'type': 'array', 'items': JOB_SCHEMA}
+        },
+        400: {'description': 'Paramètre invalide.'}
+    }
+})
+def list_jobs():
+    try:
+        criteria = []
+        state = request.args.get('state')
+        if state is not None:
+            if state not in jobs.STATES:
+                return jsonify({'error': f"state doit valoir {', '.join(jobs.STATES)}"}), 400
+            criteria.append(Job.state == state)
+        kind = request.args.get('kind')
+        if kind is not None:
+            criteria.append(Job.kind == kind)
+        page, per_page = get_page_args()
+        if page is None:
+            page, per_page = 1, DEFAULT_PER_PAGE
+        items, total = paginate(Job.query.filter(*criteria).order_by(Job.id.desc()), page, per_page)
+        return jsonify([jobs.serialize(job) for job in items]), 200, pagination_headers(total, page, per_page)
+    except Exception as e:
+        current_app.logger.error(f"Error in list_jobs: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@job_bp.route('/<int:job_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Jobs'],
+    'description': "État et avancement d'une tâche de fond (à interroger toutes les quelques secondes). "
+                   "state : queued, running, succeeded ou failed ; une tâche en échec inattendu est remise "
+                   "en file (queued, error renseigné) tant qu'il lui reste un essai.",
+    'parameters': [
+        {'name': 'job_id', 'in': 'path', 'type': 'integer', 'required': True}
+    ],
+    'responses': {
+        200: {'description': 'Tâche.', 'schema': JOB_SCHEMA},
+        404: {'description': 'Tâche non trouvée.'}
+    }
+})
+def get_job(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return jsonify({'error': 'Tâche non trouvée'}), 404
+        return jsonify(jobs.serialize(job)), 200
+    except Exception as e:
+        current_app.logger.error(f"Error in get_job: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@job_bp.route('/<int:job_id>/download', methods=['GET'])
+@swag_from({
+    'tags': ['Jobs'],
+    'description': "Fichier produit par une tâche terminée (export). Conservé JOB_RETENTION_DAYS jours.",
+    'parameters': [
+        {'name': 'job_id', 'in': 'path', 'type': 'integer', 'required': True}
+    ],
+    'produces': ['text/csv', 'application/vnd.apache.parquet'],
+    'responses': {
+        200: {'description': 'Fichier.'},
+        404: {'description': "Tâche non trouvée, non terminée ou sans fichier."}
+    }
+})
+def download_job_file(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return jsonify({'error': 'Tâche non trouvée'}), 404
+        path = jobs.result_file(job, current_app.config['JOB_FILES_DIR']) if job.state == jobs.SUCCEEDED else None
+        if path is None:
+            return jsonify({'error': 'Aucun fichier pour cette tâche'}), 404
+        return send_file(path, mimetype=job.result.get('mimetype'), as_attachment=True,
+                         download_name=job.result['file'])
+    except Exception as e:
+        current_app.logger.error(f"Error in download_job_file: {e}")
+        return jsonify({'error': str(e)}), 500
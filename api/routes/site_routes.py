@@ -1,7 +1,13 @@
 # routes/site_routes.py
 from flask import Blueprint, request, jsonify, current_app
 from flasgger import swag_from
-from models import Site, db
+from models import Site, Status, db
+from routes.job_routes import ACCEPTED_RESPONSE, accept_job, wants_async
+from services import alarm_counters, site_deletion
+from services.batching import chunked
+from services.user_relations import names_by_id
+from services.visibility import get_visibility
+from database import read_only
 
 site_bp = Blueprint('site_bp', __name__)
 
@@ -136,6 +142,8 @@ def create_site():
             return jsonify({'error': 'Les champs name est requis'}), 400
         site = Site(name=data['name'])
         db.session.add(site)
+        db.session.flush()
+        alarm_counters.create_empty_scope('site', site.id)
         db.session.commit()
         result = {'id': site.id, 'name': site.name}
         return jsonify(result), 201
@@ -204,7 +212,11 @@ def update_site(site_id):
 @site_bp.route('/<int:site_id>/', methods=['DELETE'])
 @swag_from({
     'tags': ['Site CRUD'],
-    'description': "Supprime un site par son ID et tous les éléments associés (bâtiments, étages, BAES, erreurs, cartes) en cascade. Les liaisons user-site-role sont conservées avec site_id=NULL pour maintenir les relations user-role.",
+    'description': "Supprime un site par son ID et tous les éléments associés (bâtiments, étages, BAES, erreurs, "
+                   "incidents, cartes) en cascade. Les liaisons user-site-role sont conservées avec site_id=NULL "
+                   "pour maintenir les relations user-role. Avec async=true, la suppression est confiée au worker "
+                   "de tâches (réponse 202, suivi par GET /jobs/<id>) : à utiliser pour un site à l'historique "
+                   "volumineux, qui dépasserait le délai d'une requête.",
     'parameters': [
         {
             'name': 'site_id',
@@ -212,6 +224,13 @@ def update_site(site_id):
             'type': 'integer',
             'required': True,
             'description': "ID du site à supprimer"
+        },
+        {
+            'name': 'async',
+            'in': 'query',
+            'type': 'boolean',
+            'required': False,
+            'description': "Suppression en tâche de fond"
         }
     ],
     'responses': {
@@ -224,100 +243,27 @@ def update_site(site_id):
                     'batiments_deleted': {'type': 'integer', 'example': 2},
                     'etages_deleted': {'type': 'integer', 'example': 5},
                     'baes_deleted': {'type': 'integer', 'example': 10},
-                    'erreurs_deleted': {'type': 'integer', 'example': 15},
+                    'statuses_deleted': {'type': 'integer', 'example': 15},
+                    'incidents_deleted': {'type': 'integer', 'example': 4},
                     'cartes_deleted': {'type': 'integer', 'example': 3},
                     'user_site_roles_preserved': {'type': 'integer', 'example': 4}
                 }
             }
         },
+        202: ACCEPTED_RESPONSE,
         404: {'description': 'Site non trouvé.'}
     }
 })
 def delete_site(site_id):
     try:
-        site = Site.query.get(site_id)
-        if not site:
+        if db.session.get(Site, site_id) is None:
             return jsonify({'error': 'Site non trouvé'}), 404
+        if wants_async():
+            return accept_job('site.delete', {'site_id': site_id})
 
-        # Initialiser les compteurs
-        batiments_count = 0
-        etages_count = 0
-        baes_count = 0
-        statuses_count = 0
-        cartes_count = 0
-        user_site_roles_count = 0
-
-        # 1. Supprimer la carte associée directement au site, si elle existe
-        from models.carte import Carte
-        site_carte = Carte.query.filter_by(site_id=site_id).first()
-        if site_carte:
-            db.session.delete(site_carte)
-            cartes_count += 1
-
-        # 2. Récupérer tous les bâtiments associés à ce site
-        from models.batiment import Batiment
-        batiments = Batiment.query.filter_by(site_id=site_id).all()
-        batiments_count = len(batiments)
-
-        # 3. Pour chaque bâtiment, supprimer ses étages et tout ce qui leur est associé
-        from models.etage import Etage
-        from models.baes import Baes
-        from models.status import Status
-
-        for batiment in batiments:
-            # Récupérer tous les étages de ce bâtiment
-            etages = Etage.query.filter_by(batiment_id=batiment.id).all()
-            etages_count += len(etages)
-
-            for etage in etages:
-                # Supprimer la carte associée à cet étage, si elle existe
-                etage_carte = Carte.query.filter_by(etage_id=etage.id).first()
-                if etage_carte:
-                    db.session.delete(etage_carte)
-                    cartes_count += 1
-
-                # Récupérer tous les BAES associés à cet étage
-                baes_list = Baes.query.filter_by(etage_id=etage.id).all()
-                baes_count += len(baes_list)
-
-                for baes in baes_list:
-                    # Supprimer toutes les erreurs associées à ce BAES
-                    statuses = Status.query.filter_by(baes_id=baes.id).all()
-                    statuses_count += len(statuses)
-                    for status in statuses:
-                        db.session.delete(status)
-
-                    # Supprimer le BAES
-                    db.session.delete(baes)
-
-                # Supprimer l'étage
-                db.session.delete(etage)
-
-            # Supprimer le bâtiment
-            db.session.delete(batiment)
-
-        # 4. Mettre à jour les liaisons user-site-role pour conserver les relations user-role
-        from models.user_site_role import UserSiteRole
-        user_site_roles = UserSiteRole.query.filter_by(site_id=site_id).all()
-        user_site_roles_count = len(user_site_roles)
-
-        # Mettre à jour site_id à NULL pour conserver les relations user-role
-        for user_site_role in user_site_roles:
-            user_site_role.site_id = None
-
-        # 5. Supprimer le site
-        db.session.delete(site)
+        result = site_deletion.delete_site(site_id)
         db.session.commit()
-
-        return jsonify({
-            'message': 'Site supprimé avec succès',
-            'batiments_deleted': batiments_count,
-            'etages_deleted': etages_count,
-            'baes_deleted': baes_count,
-            'statuses_deleted': statuses_count,
-            'cartes_deleted': cartes_count,
-            'user_site_roles_preserved': user_site_roles_count
-        }), 200
+        return jsonify({'message': 'Site supprimé avec succès', **result}), 200
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error in delete_site: {e}")
@@ -340,9 +286,20 @@ def delete_site(site_id):
     ],
     'responses': {200: {'description': 'Hiérarchie du site.'}, 404: {'description': 'Site non trouvé'}}
 })
+@read_only
 def get_site_full(site_id):
     try:
-        site = Site.query.get(site_id)
+        from sqlalchemy.orm import selectinload
+        from models import Batiment, Etage, User
+        from services.status_queries import latest_status_by_baes
+
+        # Hiérarchie chargée par lots, puis dernier status de chaque BAES et logins des acquittements
+        # en une requête chacun : le nombre de requêtes ne dépend pas de la taille du site
+        site = Site.query.options(
+            selectinload(Site.carte),
+            selectinload(Site.batiments).selectinload(Batiment.etages).selectinload(Etage.carte),
+            selectinload(Site.batiments).selectinload(Batiment.etages).selectinload(Etage.baes),
+        ).filter(Site.id == site_id).first()
         if not site:
             return jsonify({'error': 'Site non trouvé'}), 404
 
@@ -351,7 +308,6 @@ def get_site_full(site_id):
 
         from flask import url_for
         import os
-        from models.status import Status
 
         def carte_to_dict(carte):
             if not carte:
@@ -371,26 +327,27 @@ def get_site_full(site_id):
                 'zoom': getattr(carte, 'zoom', None),
             }
 
+        baes_ids = [b.id for bat in site.batiments for etage in bat.etages for b in etage.baes]
+        latest_by_baes = {}
+        for chunk in chunked(baes_ids):
+            latest_by_baes.update(latest_status_by_baes(Status.baes_id.in_(chunk)))
+        ack_user_ids = {st.acknowledged_by_user_id for st in latest_by_baes.values() if st.acknowledged_by_user_id}
+        logins = names_by_id(User, ack_user_ids, column='login') if ack_user_ids else {}
+
         batiments_payload = []
         for bat in (site.batiments or []):
             etages_payload = []
             for etage in (bat.etages or []):
                 baes_payload = []
                 for b in (etage.baes or []):
-                    latest = Status.query.filter_by(baes_id=b.id).order_by(Status.timestamp.desc()).first()
+                    latest = latest_by_baes.get(b.id)
                     latest_dict = None
                     if latest:
-                        # acknowledged_by_login lookup
-                        acknowledged_by_login = None
-                        if latest.acknowledged_by_user_id:
-                            from models.user import User
-                            u = User.query.get(latest.acknowledged_by_user_id)
-                            if u:
-                                acknowledged_by_login = u.login
                         latest_dict = {
                             'id': latest.id,
                             'erreur': latest.erreur,
-                            'is_ignored': latest.is_ignored,
+                            # is_ignored est porté par le BAES depuis le 26/09/2025
+                            'is_ignored': b.is_ignored,
                             'is_solved': latest.is_solved,
                             'temperature': latest.temperature,
                             'timestamp': latest.timestamp.isoformat() if latest.timestamp else None,
@@ -398,7 +355,7 @@ def get_site_full(site_id):
                             'baes_id': latest.baes_id,
                             'updated_at': latest.updated_at.isoformat() if getattr(latest, 'updated_at', None) else None,
                             'acknowledged_at': latest.acknowledged_at.isoformat() if getattr(latest, 'acknowledged_at', None) else None,
-                            'acknowledged_by_login': acknowledged_by_login,
+                            'acknowledged_by_login': logins.get(latest.acknowledged_by_user_id),
                             'acknowledged_by_user_id': latest.acknowledged_by_user_id,
                         }
                     baes_payload.append({
@@ -497,10 +454,8 @@ def get_my_sites():
     if not user_id:
         return jsonify({'error': 'unauthorized'}), 401
     try:
-        from models.site import Site
-        from models.user_site_role import UserSiteRole
-        sites = db.session.query(Site).join(UserSiteRole, UserSiteRole.site_id == Site.id).\
-            filter(UserSiteRole.user_id == user_id).distinct().all()
+        scope = get_visibility(user_id)
+        sites = db.session.query(Site.id, Site.name).filter(scope.sites()).order_by(Site.id).all()
         result = [{'id': s.id, 'name': s.name} for s in sites]
         return jsonify(result), 200
     except Exception as e:
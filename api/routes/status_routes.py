@@ -1,13 +1,28 @@
 # routes/status_routes.py
-from flask import Blueprint, request, jsonify, current_app
+import queue
+import time
+
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from flasgger import swag_from
 from models import Status, Baes, User, Site, UserSiteRole, Batiment, Etage, db
 from flask_login import current_user, login_required
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from services import acknowledgements, alarm_counters, exports, incidents, known_baes, status_events, status_history, timeseries
+from routes.job_routes import ACCEPTED_RESPONSE, accept_job, wants_async
+from services.status_queries import latest_status_by_baes
+from services.user_relations import names_by_id
+from services.visibility import get_visibility
+from database import read_only
 
 
 status_bp = Blueprint('status_bp', __name__)
 
+# Taille maximale d'une liste d'ids pour l'acquittement en masse
+MAX_ACKNOWLEDGE_IDS = 10000
+
+
 @status_bp.route('/', methods=['GET'])
 @swag_from({
     'tags': ['Status CRUD'],
@@ -35,6 +50,7 @@ status_bp = Blueprint('status_bp', __name__)
         500: {'description': 'Erreur interne.'}
     }
 })
+@read_only
 def get_statuses():
     try:
         statuses = Status.query.all()
@@ -86,6 +102,7 @@ def get_statuses():
         404: {'description': "Erreur non trouvée."}
     }
 })
+@read_only
 def get_status(status_id):
     try:
         status = Status.query.get(status_id)
@@ -147,6 +164,7 @@ def get_status(status_id):
         500: {'description': 'Erreur interne.'}
     }
 })
+@read_only
 def get_statuses_after_timestamp(updated_at):
     try:
         # Convertir le timestamp ISO 8601 en objet datetime
@@ -226,6 +244,7 @@ def get_statuses_after_timestamp(updated_at):
         404: {'description': "BAES non trouvé."}
     }
 })
+@read_only
 def get_statuses_by_baes(baes_id):
     try:
         # Vérifier si le BAES existe
@@ -262,6 +281,27 @@ def get_statuses_by_baes(baes_id):
         current_app.logger.error(f"Error in get_erreurs_by_baes: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _record_status(data):
+    """
+    Insère le status (et le BAES s'il est inconnu, avec etage_id à null) puis valide ;
+    retourne (status, (name, label) du BAES). Un BAES connu du cache ne coûte aucune lecture.
+    """
+    name, label, _ = known_baes.ensure(data['baes_id'], data.get('name'), data.get('label'))
+    counters = alarm_counters.track_baes([data['baes_id']])
+    status = Status(
+        baes_id=data['baes_id'],
+        erreur=data['erreur'],
+        is_solved=data.get('is_solved', False),
+        temperature=data.get('temperature'),  # Utiliser la température fournie ou null
+        vibration=data.get('vibration', False)  # Utiliser la vibration fournie ou False par défaut
+    )
+    db.session.add(status)
+    # Ouverture ou clôture de l'épisode de panne du BAES
+    incidents.record([status])
+    counters.apply()
+    db.session.commit()
+    return status, (name, label)
+
 @status_bp.route('/', methods=['POST'])
 @swag_from({
     'tags': ['Status CRUD'],
@@ -312,7 +352,8 @@ def get_statuses_by_baes(baes_id):
             }
         },
         400: {'description': "Mauvaise requête."},
-        404: {'description': "BAES non trouvé."}
+        404: {'description': "BAES non trouvé."},
+        409: {'description': "BAES en cours de suppression (suppression de son site) : status refusé."}
     }
 })
 def create_status():
@@ -321,32 +362,13 @@ def create_status():
         if not data or 'baes_id' not in data or 'erreur' not in data:
             return jsonify({'error': 'Les champs baes_id et erreur sont requis'}), 400
 
-        # Vérifier si le BAES existe
-        baes = Baes.query.get(data['baes_id'])
-        if not baes:
-            # Si le BAES n'existe pas, on le crée avec etage_id à null
-            new_baes = Baes(
-                id=data['baes_id'],
-                name=data.get('name', f"BAES-{data['baes_id']}"),  # Utiliser le nom fourni ou un nom générique
-                label=data.get('label'),  # Utiliser le label fourni ou null
-                position={"x": 0, "y": 0},  # Position par défaut
-                etage_id=None  # Site_id à null (via etage_id)
-            )
-            db.session.add(new_baes)
-            db.session.commit()
-            baes = new_baes
-
-        # Vérifier si le type d'erreur est valide
-
-        status = Status(
-            baes_id=data['baes_id'],
-            erreur=data['erreur'],
-            is_solved=data.get('is_solved', False),
-            temperature=data.get('temperature'),  # Utiliser la température fournie ou null
-            vibration=data.get('vibration', False)  # Utiliser la vibration fournie ou False par défaut
-        )
-        db.session.add(status)
-        db.session.commit()
+        try:
+            status, (name, label) = _record_status(data)
+        except IntegrityError:
+            # BAES supprimé par un autre worker depuis sa mise en cache : second essai, avec création
+            db.session.rollback()
+            known_baes.discard([data['baes_id']])
+            status, (name, label) = _record_status(data)
 
         result = {
             'id': status.id,
@@ -357,12 +379,15 @@ def create_status():
             'vibration': status.vibration,
             'timestamp': status.timestamp.isoformat() if status.timestamp else None,
             'baes': {
-                'id': baes.id,
-                'name': baes.name,
-                'label': baes.label
+                'id': status.baes_id,
+                'name': name,
+                'label': label
             }
         }
         return jsonify(result), 201
+    except known_baes.BaesDeletingError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error in create_status: {e}")
@@ -425,6 +450,8 @@ def update_status_status(status_id):
         if not data:
             return jsonify({'error': 'Aucune donnée fournie'}), 400
 
+        counters = alarm_counters.track_baes([status.baes_id])
+
         # Vérifier si l'état de l'erreur change
         status_changed = False
         if 'is_solved' in data and status.is_solved != data['is_solved']:
@@ -444,7 +471,10 @@ def update_status_status(status_id):
                 status.acknowledged_by_user_id = None
 
             status.acknowledged_at = datetime.now(timezone.utc)
+            # L'acquittement porte sur l'épisode de panne auquel appartient le status
+            incidents.acknowledge_from_status(status, status.acknowledged_by_user_id, status.acknowledged_at)
 
+        counters.apply()
         db.session.commit()
 
         # Récupérer le login de l'utilisateur qui a acquitté l'erreur
@@ -503,6 +533,7 @@ def update_status_status(status_id):
                 'type': 'object',
                 'properties': {
                     'is_solved': {'type': 'boolean', 'example': False},
+                    'user_id': {'type': 'integer', 'example': 1, 'description': 'ID de l\'utilisateur qui acquitte l\'erreur (optionnel)'},
                     'temperature': {'type': 'number', 'format': 'float', 'example': 25.5, 'nullable': True},
                     'vibration': {'type': 'boolean', 'example': True, 'nullable': True}
                 }
@@ -538,8 +569,9 @@ def update_status(baes_id, erreur):
         if not baes:
             return jsonify({'error': 'BAES non trouvé'}), 404
 
-        # Rechercher l'erreur par baes_id et erreur
-        status_obj = Status.query.filter_by(baes_id=baes_id, erreur=erreur).first()
+        # Dernier status de ce type pour le BAES (le plus récent, et non un status quelconque)
+        status_obj = (Status.query.filter_by(baes_id=baes_id, erreur=erreur)
+                      .order_by(Status.timestamp.desc(), Status.id.desc()).first())
         if not status_obj:
             return jsonify({'error': f'Erreur de type {erreur} non trouvée pour le BAES {baes_id}'}), 404
 
@@ -547,10 +579,21 @@ def update_status(baes_id, erreur):
         if not data:
             return jsonify({'error': 'Aucune donnée fournie'}), 400
 
-        # Mise à jour des champs
-        if 'is_solved' in data:
-            status_obj.is_solved = data['is_solved']
+        counters = alarm_counters.track_baes([baes_id])
 
+        # Mise à jour des champs ; un changement d'état est enregistré comme dans PUT /status/<id>/status
+        # (événement 'acknowledged' du flux temps réel) et reporté sur l'épisode de panne
+        if 'is_solved' in data and status_obj.is_solved != data['is_solved']:
+            status_obj.is_solved = data['is_solved']
+            if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
+                status_obj.acknowledged_by_user_id = current_user.id
+            elif 'user_id' in data:
+                status_obj.acknowledged_by_user_id = data['user_id']
+            else:
+                status_obj.acknowledged_by_user_id = None
+            status_obj.acknowledged_at = datetime.now(timezone.utc)
+            incidents.acknowledge_from_status(status_obj, status_obj.acknowledged_by_user_id,
+                                              status_obj.acknowledged_at)
 
         # Facultatif: mise à jour des valeurs de mesure
         if 'temperature' in data:
@@ -567,6 +610,7 @@ def update_status(baes_id, erreur):
             else:
                 status_obj.vibration = bool(val)
 
+        counters.apply()
         db.session.commit()
 
         # Récupérer le login de l'utilisateur qui a acquitté l'erreur
@@ -595,6 +639,100 @@ def update_status(baes_id, erreur):
         current_app.logger.error(f"Error in update_status: {e}")
         return jsonify({'error': str(e)}), 500
 
+@status_bp.route('/acknowledge', methods=['PUT'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Acquitte en masse les status d'une liste d'ids, d'un étage, d'un bâtiment ou d'un site, "
+                   "éventuellement limités à certains codes d'erreur, en une seule mise à jour. Seuls les status "
+                   "dont l'état change sont modifiés ; l'acquittement est restreint au périmètre de l'utilisateur.",
+    'consumes': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status_ids': {'type': 'array', 'items': {'type': 'integer'}, 'example': [12, 13, 14]},
+                    'etage_id': {'type': 'integer', 'example': 3},
+                    'batiment_id': {'type': 'integer', 'example': 1},
+                    'site_id': {'type': 'integer', 'example': 1},
+                    'erreur': {'type': 'array', 'items': {'type': 'integer'}, 'example': [0, 4],
+                               'description': "Code ou liste de codes d'erreur"},
+                    'is_solved': {'type': 'boolean', 'example': True, 'default': True},
+                    'user_id': {'type': 'integer', 'example': 1,
+                                'description': "ID de l'utilisateur qui acquitte (si aucun utilisateur n'est connecté)"}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Nombre de status acquittés.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'acknowledged': {'type': 'integer', 'example': 240},
+                    'by_erreur': {'type': 'object', 'example': {'0': 12, '4': 228}},
+                    'baes_count': {'type': 'integer', 'example': 230},
+                    'incidents': {'type': 'integer', 'example': 230,
+                                  'description': "Incidents ouverts acquittés (ou désacquittés)"},
+                    'acknowledged_at': {'type': 'string', 'format': 'date-time', 'example': '2023-01-02T14:30:00Z'},
+                    'acknowledged_by_user_id': {'type': 'integer', 'example': 1, 'nullable': True}
+                }
+            }
+        },
+        400: {'description': "Sélection vide ou invalide."}
+    }
+})
+def acknowledge_statuses():
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Aucune donnée fournie'}), 400
+
+        status_ids = data.get('status_ids')
+        if status_ids is not None and (not isinstance(status_ids, list)
+                                       or not all(isinstance(i, int) and not isinstance(i, bool) for i in status_ids)):
+            return jsonify({'error': "status_ids doit être une liste d'entiers"}), 400
+        if status_ids and len(status_ids) > MAX_ACKNOWLEDGE_IDS:
+            return jsonify({'error': f'{MAX_ACKNOWLEDGE_IDS} status_ids au maximum par requête'}), 400
+        erreurs = data.get('erreur')
+        if isinstance(erreurs, int) and not isinstance(erreurs, bool):
+            erreurs = [erreurs]
+        if erreurs is not None and (not isinstance(erreurs, list)
+                                    or not all(isinstance(e, int) and not isinstance(e, bool) for e in erreurs)):
+            return jsonify({'error': "erreur doit être un entier ou une liste d'entiers"}), 400
+        scope_ids = {}
+        for name in ('etage_id', 'batiment_id', 'site_id'):
+            value = data.get(name)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                return jsonify({'error': f'{name} doit être un entier'}), 400
+            scope_ids[name] = value
+        is_solved = data.get('is_solved', True)
+        if not isinstance(is_solved, bool):
+            return jsonify({'error': 'is_solved doit être un booléen'}), 400
+
+        # Même attribution que l'acquittement unitaire : utilisateur connecté, sinon user_id fourni
+        if hasattr(current_user, 'is_authenticated') and current_user.is_authenticated:
+            user_id = current_user.id
+        else:
+            user_id = data.get('user_id')
+        scope = get_visibility(user_id, cached=False) if user_id is not None else None
+
+        criteria = acknowledgements.selection_criteria(status_ids, erreurs=erreurs, scope=scope, **scope_ids)
+        result = acknowledgements.acknowledge(criteria, status_ids, user_id, is_solved)
+        db.session.commit()
+        return jsonify({**result, 'acknowledged_at': result['acknowledged_at'].isoformat(),
+                        'acknowledged_by_user_id': user_id}), 200
+    except acknowledgements.AcknowledgeError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in acknowledge_statuses: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @status_bp.route('/acknowledged', methods=['GET'])
 @swag_from({
     'tags': ['Status CRUD'],
@@ -625,6 +763,7 @@ def update_status(baes_id, erreur):
         500: {'description': 'Erreur interne.'}
     }
 })
+@read_only
 def get_acknowledged_statuses():
     try:
         # Récupérer toutes les erreurs qui ont été acquittées
@@ -700,6 +839,7 @@ def get_acknowledged_statuses():
         500: {'description': "Erreur interne."}
     }
 })
+@read_only
 def get_statuses_by_etage(etage_id):
     try:
         # Vérifier si l'étage existe
@@ -708,38 +848,29 @@ def get_statuses_by_etage(etage_id):
         if not etage:
             return jsonify({'error': 'Étage non trouvé'}), 404
 
-        # Récupérer tous les BAES de cet étage
-        baes_list = Baes.query.filter_by(etage_id=etage_id).all()
-        if not baes_list:
-            return jsonify([]), 200  # Retourne une liste vide si aucun BAES n'est trouvé
+        # Toutes les erreurs des BAES de l'étage avec le login de l'acquittement, en une requête
+        rows = db.session.query(Status, Baes.name, User.login).\
+            join(Baes, Status.baes_id == Baes.id).\
+            outerjoin(User, Status.acknowledged_by_user_id == User.id).\
+            filter(Baes.etage_id == etage_id).\
+            order_by(Baes.id, Status.id).all()
 
-        # Récupérer toutes les erreurs pour ces BAES
         result = []
-        for baes in baes_list:
-            statuses = Status.query.filter_by(baes_id=baes.id).all()
-            for e in statuses:
-                # Récupérer le login de l'utilisateur qui a acquitté l'erreur
-                acknowledged_by_login = None
-                if e.acknowledged_by_user_id:
-                    from models.user import User
-                    user = User.query.get(e.acknowledged_by_user_id)
-                    if user:
-                        acknowledged_by_login = user.login
-
-                result.append({
-                    'id': e.id,
-                    'baes_id': e.baes_id,
-                    'baes_name': baes.name,
-                    'erreur': e.erreur,
-                    'is_solved': e.is_solved,
-                    'temperature': e.temperature,
-                    'vibration': e.vibration,
-                    'timestamp': e.timestamp.isoformat() if e.timestamp else None,
-                    'updated_at': e.updated_at.isoformat() if e.updated_at else None,
-                    'acknowledged_by_user_id': e.acknowledged_by_user_id,
-                    'acknowledged_at': e.acknowledged_at.isoformat() if e.acknowledged_at else None,
-                    'acknowledged_by_login': acknowledged_by_login
-                })
+        for e, baes_name, acknowledged_by_login in rows:
+            result.append({
+                'id': e.id,
+                'baes_id': e.baes_id,
+                'baes_name': baes_name,
+                'erreur': e.erreur,
+                'is_solved': e.is_solved,
+                'temperature': e.temperature,
+                'vibration': e.vibration,
+                'timestamp': e.timestamp.isoformat() if e.timestamp else None,
+                'updated_at': e.updated_at.isoformat() if e.updated_at else None,
+                'acknowledged_by_user_id': e.acknowledged_by_user_id,
+                'acknowledged_at': e.acknowledged_at.isoformat() if e.acknowledged_at else None,
+                'acknowledged_by_login': acknowledged_by_login
+            })
 
         return jsonify(result), 200
     except Exception as e:
@@ -773,6 +904,7 @@ def get_statuses_by_etage(etage_id):
         404: {'description': "Aucune erreur trouvée."}
     }
 })
+@read_only
 def get_latest_status():
     try:
         # Récupérer l'erreur la plus récente basée sur le timestamp
@@ -840,7 +972,9 @@ def delete_status(status_id):
         if not status:
             return jsonify({'error': 'Erreur non trouvée'}), 404
 
+        counters = alarm_counters.track_baes([status.baes_id])
         db.session.delete(status)
+        counters.apply()
         db.session.commit()
 
         return jsonify({'message': 'Erreur supprimée avec succès'}), 200
@@ -900,54 +1034,28 @@ def delete_status(status_id):
         500: {'description': 'Erreur interne.'}
     }
 })
+@read_only
 def get_status_by_user(user_id):
     """
     Récupère le dernier message de status pour chaque BAES visible par un utilisateur et chaque BAES non attribué à un étage.
     """
     try:
         # Vérifier si l'utilisateur existe
-        from models.user import User
         user = User.query.get(user_id)
         if not user:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
 
-        # 1. Récupérer tous les sites auxquels l'utilisateur a accès
-        from models.site import Site
-        from models.user_site_role import UserSiteRole
-        sites = db.session.query(Site).join(
-            UserSiteRole, UserSiteRole.site_id == Site.id
-        ).filter(
-            UserSiteRole.user_id == user_id
-        ).distinct().all()
+        # BAES visibles (sites de l'utilisateur) et BAES non attribués, en une requête
+        scope = get_visibility(user_id)
+        baes_list = Baes.query.filter(scope.baes(include_unassigned=True)).order_by(Baes.id).all()
 
-        site_ids = [site.id for site in sites]
+        # Dernier status de chaque BAES visible, en une requête
+        latest_by_baes = latest_status_by_baes(scope.status(include_unassigned=True))
 
-        # 2. Récupérer tous les BAES visibles par l'utilisateur (dans les sites auxquels il a accès)
-        from models.batiment import Batiment
-        from models.etage import Etage
-        visible_baes = db.session.query(Baes).join(
-            Etage, Baes.etage_id == Etage.id
-        ).join(
-            Batiment, Etage.batiment_id == Batiment.id
-        ).filter(
-            Batiment.site_id.in_(site_ids)
-        ).all()
-
-        # 3. Récupérer tous les BAES non attribués à un étage
-        unassigned_baes = Baes.query.filter_by(etage_id=None).all()
-
-        # Combiner les deux listes de BAES (en évitant les doublons)
-        all_baes = {b.id: b for b in visible_baes}
-        for b in unassigned_baes:
-            if b.id not in all_baes:
-                all_baes[b.id] = b
-
-        # 4. Pour chaque BAES, récupérer son dernier status
         result = []
-        for baes_id, baes in all_baes.items():
-            # Récupérer le dernier status pour ce BAES
-            latest_status = Status.query.filter_by(baes_id=baes_id).order_by(Status.timestamp.desc()).first()
-            
+        for baes in baes_list:
+            latest_status = latest_by_baes.get(baes.id)
+
             baes_dict = {
                 'id': baes.id,
                 'name': baes.name,
@@ -983,6 +1091,7 @@ def get_status_by_user(user_id):
     'parameters': [{ 'name': 'site_id', 'in': 'path', 'type': 'integer', 'required': True }],
     'responses': {200: {'description': 'Liste des derniers statuts.'}, 404: {'description': 'Site ou BAES non trouvés.'}}
 })
+@read_only
 def get_latest_status_by_site(site_id):
     try:
         from models.site import Site
@@ -993,38 +1102,33 @@ def get_latest_status_by_site(site_id):
         if not site:
             return jsonify({'error': 'Site non trouvé'}), 404
 
-        # Get all BAES that belong to the site
-        baes_list = Baes.query.join(Etage, Baes.etage_id == Etage.id).\
+        # Dernier status (le plus récemment modifié) de chaque BAES du site et logins des
+        # acquittements : deux requêtes quel que soit le nombre de BAES
+        site_baes = select(Baes.id).join(Etage, Baes.etage_id == Etage.id).\
             join(Batiment, Etage.batiment_id == Batiment.id).\
-            filter(Batiment.site_id == site_id).all()
-
-        if not baes_list:
-            return jsonify([]), 200
+            where(Batiment.site_id == site_id)
+        latest_by_baes = latest_status_by_baes(
+            Status.baes_id.in_(site_baes), order_by=(Status.updated_at.desc(), Status.id.desc())
+        )
+        ack_user_ids = {st.acknowledged_by_user_id for st in latest_by_baes.values() if st.acknowledged_by_user_id}
+        logins = names_by_id(User, ack_user_ids, column='login') if ack_user_ids else {}
 
         results = []
-        from models.status import Status
-        for b in baes_list:
-            latest = Status.query.filter_by(baes_id=b.id).order_by(Status.updated_at.desc()).first()
-            if latest:
-                acknowledged_by_login = None
-                if latest.acknowledged_by_user_id:
-                    from models.user import User
-                    u = User.query.get(latest.acknowledged_by_user_id)
-                    if u:
-                        acknowledged_by_login = u.login
-                results.append({
-                    'id': latest.id,
-                    'erreur': latest.erreur,
-                    'is_solved': latest.is_solved,
-                    'temperature': latest.temperature,
-                    'timestamp': latest.timestamp.isoformat() if latest.timestamp else None,
-                    'vibration': latest.vibration,
-                    'baes_id': latest.baes_id,
-                    'updated_at': latest.updated_at.isoformat() if getattr(latest, 'updated_at', None) else None,
-                    'acknowledged_at': latest.acknowledged_at.isoformat() if getattr(latest, 'acknowledged_at', None) else None,
-                    'acknowledged_by_login': acknowledged_by_login,
-                    'acknowledged_by_user_id': latest.acknowledged_by_user_id,
-                })
+        for baes_id in sorted(latest_by_baes):
+            latest = latest_by_baes[baes_id]
+            results.append({
+                'id': latest.id,
+                'erreur': latest.erreur,
+                'is_solved': latest.is_solved,
+                'temperature': latest.temperature,
+                'timestamp': latest.timestamp.isoformat() if latest.timestamp else None,
+                'vibration': latest.vibration,
+                'baes_id': latest.baes_id,
+                'updated_at': latest.updated_at.isoformat() if getattr(latest, 'updated_at', None) else None,
+                'acknowledged_at': latest.acknowledged_at.isoformat() if getattr(latest, 'acknowledged_at', None) else None,
+                'acknowledged_by_login': logins.get(latest.acknowledged_by_user_id),
+                'acknowledged_by_user_id': latest.acknowledged_by_user_id,
+            })
         return jsonify(results), 200
     except Exception as e:
         current_app.logger.error(f"Error in get_latest_status_by_site: {e}")
@@ -1040,40 +1144,627 @@ def get_latest_status_by_site(site_id):
 })
 def get_status_summary_by_site(site_id):
     try:
-        from models.site import Site
-        from models.batiment import Batiment
-        from models.etage import Etage
-        from models.baes import Baes
-        from models.status import Status
-        site = Site.query.get(site_id)
-        if not site:
+        counters = alarm_counters.get_counters('site', site_id)
+        if counters is None:
             return jsonify({'error': 'Site non trouvé'}), 404
+        # Les compteurs d'un site jamais calculé viennent d'être initialisés
+        db.session.commit()
+        return jsonify({bucket: counters[bucket] for bucket in alarm_counters.BUCKETS}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in get_status_summary_by_site: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        baes_list = Baes.query.join(Etage, Baes.etage_id == Etage.id).\
-            join(Batiment, Etage.batiment_id == Batiment.id).\
-            filter(Batiment.site_id == site_id).all()
 
-        counters = {
-            'connection_errors': 0,
-            'battery_errors': 0,
-            'ok': 0,
-            'unknown': 0
-        }
+@status_bp.route('/kpi/<string:scope>/<int:scope_id>', methods=['GET'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Compteurs d'alarmes précalculés d'un site, d'un bâtiment ou d'un étage "
+                   "(selon le dernier status de chaque BAES : connexion=0, batterie=4, ok=6, inconnu).",
+    'parameters': [
+        {'name': 'scope', 'in': 'path', 'type': 'string', 'enum': ['site', 'batiment', 'etage'], 'required': True},
+        {'name': 'scope_id', 'in': 'path', 'type': 'integer', 'required': True}
+    ],
+    'responses': {
+        200: {
+            'description': 'Compteurs de la portée.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'scope': {'type': 'string', 'example': 'site'},
+                    'id': {'type': 'integer', 'example': 1},
+                    'connection_errors': {'type': 'integer', 'example': 2},
+                    'battery_errors': {'type': 'integer', 'example': 1},
+                    'ok': {'type': 'integer', 'example': 40},
+                    'unknown': {'type': 'integer', 'example': 3},
+                    'unsolved': {'type': 'integer', 'example': 2},
+                    'total': {'type': 'integer', 'example': 46},
+                    'updated_at': {'type': 'string', 'format': 'date-time', 'nullable': True}
+                }
+            }
+        },
+        400: {'description': 'Portée invalide.'},
+        404: {'description': 'Portée non trouvée.'}
+    }
+})
+def get_alarm_kpi(scope, scope_id):
+    try:
+        if scope not in alarm_counters.SCOPES:
+            return jsonify({'error': f"Portée invalide, valeurs possibles : {', '.join(alarm_counters.SCOPES)}"}), 400
+        counters = alarm_counters.get_counters(scope, scope_id)
+        if counters is None:
+            return jsonify({'error': f'{scope} {scope_id} non trouvé'}), 404
+        db.session.commit()
+        return jsonify({'scope': scope, 'id': scope_id, **counters}), 200
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in get_alarm_kpi: {e}")
+        return jsonify({'error': str(e)}), 500
 
-        for b in baes_list:
-            latest = Status.query.filter_by(baes_id=b.id).order_by(Status.updated_at.desc()).first()
-            if not latest:
-                counters['unknown'] += 1
-            else:
-                if latest.erreur == 0:
-                    counters['connection_errors'] += 1
-                elif latest.erreur == 4:
-                    counters['battery_errors'] += 1
-                elif latest.erreur == 6:
-                    counters['ok'] += 1
-                else:
-                    counters['unknown'] += 1
-        return jsonify(counters), 200
+
+@status_bp.route('/kpi/reconcile', methods=['POST'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Recalcule tous les compteurs d'alarmes depuis l'historique des status et retourne les écarts "
+                   "constatés. Avec dry_run=true, les compteurs ne sont pas modifiés. Avec async=true, le calcul "
+                   "est confié au worker de tâches (réponse 202, écarts dans le résultat de GET /jobs/<id>).",
+    'parameters': [
+        {'name': 'dry_run', 'in': 'query', 'type': 'boolean', 'required': False},
+        {'name': 'async', 'in': 'query', 'type': 'boolean', 'required': False}
+    ],
+    'responses': {
+        200: {
+            'description': 'Écarts constatés.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'drift': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'scope_type': {'type': 'string', 'example': 'etage'},
+                                'scope_id': {'type': 'integer', 'example': 3},
+                                'field': {'type': 'string', 'example': 'ok'},
+                                'stored': {'type': 'integer', 'example': 10, 'nullable': True},
+                                'expected': {'type': 'integer', 'example': 11, 'nullable': True}
+                            }
+                        }
+                    },
+                    'applied': {'type': 'boolean', 'example': True}
+                }
+            }
+        },
+        202: ACCEPTED_RESPONSE
+    }
+})
+def reconcile_alarm_counters():
+    try:
+        dry_run = request.args.get('dry_run', 'false').lower() in ('1', 'true', 'yes')
+        if wants_async():
+            return accept_job('alarm_counters.reconcile', {'dry_run': dry_run})
+        drift = alarm_counters.reconcile(apply=not dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        if drift:
+            current_app.logger.warning(f"Alarm counters drift: {len(drift)} écart(s)")
+        return jsonify({'drift': drift, 'applied': not dry_run}), 200
     except Exception as e:
-        current_app.logger.error(f"Error in get_status_summary_by_site: {e}")
+        db.session.rollback()
+        current_app.logger.error(f"Error in reconcile_alarm_counters: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== Historique et agrégats =====
+
+HISTORY_FILTER_PARAMETERS = [
+    {'name': 'from', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False,
+     'description': 'Début de période inclus (ISO 8601, UTC si sans fuseau)'},
+    {'name': 'to', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False,
+     'description': 'Fin de période exclue (ISO 8601, UTC si sans fuseau)'},
+    {'name': 'erreur', 'in': 'query', 'type': 'string', 'required': False,
+     'description': "Codes d'erreur séparés par des virgules (ex: 0,4)"},
+    {'name': 'is_solved', 'in': 'query', 'type': 'boolean', 'required': False},
+    {'name': 'acknowledged', 'in': 'query', 'type': 'boolean', 'required': False,
+     'description': 'true : status acquittés, false : non acquittés'},
+    {'name': 'baes_id', 'in': 'query', 'type': 'string', 'required': False,
+     'description': 'Identifiants de BAES séparés par des virgules'},
+    {'name': 'etage_id', 'in': 'query', 'type': 'integer', 'required': False},
+    {'name': 'batiment_id', 'in': 'query', 'type': 'integer', 'required': False},
+    {'name': 'site_id', 'in': 'query', 'type': 'integer', 'required': False},
+    {'name': 'user_id', 'in': 'query', 'type': 'integer', 'required': False,
+     'description': "Limite aux BAES visibles par cet utilisateur"}
+]
+
+
+def _history_filter():
+    user_id = request.args.get('user_id', type=int)
+    scope = get_visibility(user_id) if user_id is not None else None
+    return status_history.HistoryFilter(request.args, scope)
+
+
+@status_bp.route('/history', methods=['GET'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Historique des status filtré, du plus récent au plus ancien, paginé par curseur : "
+                   "passer next_cursor de la réponse dans ?cursor= pour obtenir la page suivante.",
+    'parameters': HISTORY_FILTER_PARAMETERS + [
+        {'name': 'limit', 'in': 'query', 'type': 'integer', 'required': False, 'default': 500,
+         'description': 'Taille de page (5000 au maximum)'},
+        {'name': 'cursor', 'in': 'query', 'type': 'string', 'required': False}
+    ],
+    'responses': {
+        200: {
+            'description': 'Page de status.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'items': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'id': {'type': 'integer', 'example': 13},
+                                'baes_id': {'type': 'integer', 'format': 'int64', 'example': 1},
+                                'erreur': {'type': 'integer', 'example': 0},
+                                'is_solved': {'type': 'boolean', 'example': False},
+                                'temperature': {'type': 'number', 'format': 'float', 'example': 25.5, 'nullable': True},
+                                'vibration': {'type': 'boolean', 'example': False, 'nullable': True},
+                                'timestamp': {'type': 'string', 'format': 'date-time', 'example': '2023-01-01T12:00:00Z'},
+                                'acknowledged_by_user_id': {'type': 'integer', 'example': 1, 'nullable': True},
+                                'acknowledged_by_login': {'type': 'string', 'example': 'user1', 'nullable': True},
+                                'acknowledged_at': {'type': 'string', 'format': 'date-time', 'nullable': True}
+                            }
+                        }
+                    },
+                    'next_cursor': {'type': 'string', 'nullable': True, 'example': 'WyIyMDIzLTAxLTAxVDEyOjAwOjAwKzAwOjAwIiwgMTNd'}
+                }
+            }
+        },
+        400: {'description': 'Paramètre invalide.'},
+        500: {'description': 'Erreur interne.'}
+    }
+})
+@read_only
+def get_status_history():
+    try:
+        limit = request.args.get('limit', status_history.DEFAULT_LIMIT, type=int)
+        if limit < 1 or limit > status_history.MAX_LIMIT:
+            return jsonify({'error': f'limit doit être compris entre 1 et {status_history.MAX_LIMIT}'}), 400
+        statuses, next_cursor = status_history.history(_history_filter(), limit, request.args.get('cursor'))
+        logins = names_by_id(User, {s.acknowledged_by_user_id for s in statuses if s.acknowledged_by_user_id}, column='login')
+        items = [{
+            'id': s.id,
+            'baes_id': s.baes_id,
+            'erreur': s.erreur,
+            'is_solved': s.is_solved,
+            'temperature': s.temperature,
+            'vibration': s.vibration,
+            'timestamp': status_history.iso(s.timestamp),
+            'acknowledged_by_user_id': s.acknowledged_by_user_id,
+            'acknowledged_by_login': logins.get(s.acknowledged_by_user_id),
+            'acknowledged_at': status_history.iso(s.acknowledged_at)
+        } for s in statuses]
+        return jsonify({'items': items, 'next_cursor': next_cursor}), 200
+    except status_history.HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in get_status_history: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@status_bp.route('/history/aggregate', methods=['GET'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Agrégats de l'historique calculés par la base, par tranche horaire ou journalière (UTC) : "
+                   "nombre de status par code d'erreur (metric=counts) ou température min/max/moyenne "
+                   "(metric=temperature). Sans from/to, couvre les dernières 24 h (hour) ou les 30 derniers "
+                   "jours (day) ; la période est limitée à 31 jours (hour) ou 366 jours (day).",
+    'parameters': HISTORY_FILTER_PARAMETERS + [
+        {'name': 'bucket', 'in': 'query', 'type': 'string', 'enum': ['hour', 'day'], 'default': 'hour'},
+        {'name': 'metric', 'in': 'query', 'type': 'string', 'enum': ['counts', 'temperature'], 'default': 'counts'},
+        {'name': 'group_by', 'in': 'query', 'type': 'string', 'enum': ['baes'], 'required': False,
+         'description': 'Une série par BAES'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Tranches agrégées, par ordre chronologique.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'bucket': {'type': 'string', 'example': 'hour'},
+                    'metric': {'type': 'string', 'example': 'counts'},
+                    'from': {'type': 'string', 'format': 'date-time'},
+                    'to': {'type': 'string', 'format': 'date-time'},
+                    'items': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'bucket': {'type': 'string', 'format': 'date-time', 'example': '2023-01-01T12:00:00Z'},
+                                'baes_id': {'type': 'integer', 'format': 'int64', 'example': 1},
+                                'erreur': {'type': 'integer', 'example': 0},
+                                'count': {'type': 'integer', 'example': 12},
+                                'acknowledged': {'type': 'integer', 'example': 3},
+                                'min': {'type': 'number', 'example': 21.5},
+                                'max': {'type': 'number', 'example': 27.0},
+                                'avg': {'type': 'number', 'example': 24.125}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {'description': 'Paramètre invalide ou période trop longue.'},
+        500: {'description': 'Erreur interne.'}
+    }
+})
+@read_only
+def get_status_history_aggregate():
+    try:
+        bucket = request.args.get('bucket', 'hour')
+        metric = request.args.get('metric', 'counts')
+        group_by = request.args.get('group_by')
+        if bucket not in status_history.BUCKETS:
+            return jsonify({'error': f"bucket invalide, valeurs possibles : {', '.join(status_history.BUCKETS)}"}), 400
+        if metric not in ('counts', 'temperature'):
+            return jsonify({'error': 'metric invalide, valeurs possibles : counts, temperature'}), 400
+        if group_by not in (None, 'baes'):
+            return jsonify({'error': 'group_by invalide, valeur possible : baes'}), 400
+        filters = _history_filter().with_default_range(bucket)
+        aggregate = status_history.aggregate_counts if metric == 'counts' else status_history.aggregate_temperature
+        items = aggregate(filters, bucket, by_baes=group_by == 'baes')
+        return jsonify({'bucket': bucket, 'metric': metric, 'from': status_history.iso(filters.start),
+                        'to': status_history.iso(filters.end), 'items': items}), 200
+    except status_history.HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in get_status_history_aggregate: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@status_bp.route('/timeseries/temperature', methods=['GET'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Séries de température par BAES pour les graphiques, réduites à au plus `points` points par "
+                   "série : lttb conserve la forme de la courbe, minmax garde le minimum et le maximum de chaque "
+                   "tranche. Sans from/to, couvre les 30 derniers jours ; période limitée à 366 jours. Les "
+                   "séries d'une période terminée sont servies depuis un cache.",
+    'parameters': [
+        {'name': 'baes_id', 'in': 'query', 'type': 'string', 'required': False,
+         'description': 'Identifiants de BAES séparés par des virgules (ou etage_id)'},
+        {'name': 'etage_id', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': "Tous les BAES de l'étage"},
+        {'name': 'user_id', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': "Ignore les BAES non visibles par cet utilisateur"},
+        {'name': 'from', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False},
+        {'name': 'to', 'in': 'query', 'type': 'string', 'format': 'date-time', 'required': False},
+        {'name': 'points', 'in': 'query', 'type': 'integer', 'required': False, 'default': 500,
+         'description': 'Nombre maximal de points par série (10 à 5000)'},
+        {'name': 'method', 'in': 'query', 'type': 'string', 'enum': ['lttb', 'minmax'], 'default': 'lttb'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Une série par BAES, points [timestamp, température] dans l\'ordre chronologique.',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'from': {'type': 'string', 'format': 'date-time'},
+                    'to': {'type': 'string', 'format': 'date-time'},
+                    'points': {'type': 'integer', 'example': 500},
+                    'method': {'type': 'string', 'example': 'lttb'},
+                    'cached': {'type': 'integer', 'example': 2, 'description': 'Séries servies depuis le cache'},
+                    'series': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'baes_id': {'type': 'integer', 'format': 'int64', 'example': 1},
+                                'count': {'type': 'integer', 'example': 43200, 'description': 'Mesures sur la période'},
+                                'points': {'type': 'array', 'items': {'type': 'array', 'items': {}},
+                                           'example': [['2023-01-01T12:00:00Z', 24.5]]}
+                            }
+                        }
+                    }
+                }
+            }
+        },
+        400: {'description': 'Paramètre invalide, période trop longue ou trop de BAES.'},
+        500: {'description': 'Erreur interne.'}
+    }
+})
+@read_only
+def get_temperature_timeseries():
+    try:
+        points = request.args.get('points', timeseries.DEFAULT_POINTS, type=int)
+        method = request.args.get('method', 'lttb')
+        if not timeseries.MIN_POINTS <= points <= timeseries.MAX_POINTS:
+            return jsonify({'error': f'points doit être compris entre {timeseries.MIN_POINTS} et {timeseries.MAX_POINTS}'}), 400
+        if method not in timeseries.METHODS:
+            return jsonify({'error': f"method invalide, valeurs possibles : {', '.join(timeseries.METHODS)}"}), 400
+        end = status_history.parse_datetime(request.args.get('to'), 'to') or datetime.now(timezone.utc)
+        start = status_history.parse_datetime(request.args.get('from'), 'from') or end - timedelta(days=30)
+        if start >= end:
+            return jsonify({'error': 'Le paramètre from doit précéder to'}), 400
+        if end - start > timeseries.MAX_RANGE:
+            return jsonify({'error': f'Période trop longue ({timeseries.MAX_RANGE.days} jours au maximum)'}), 400
+
+        baes_ids = status_history.parse_int_list(request.args.get('baes_id'), 'baes_id')
+        etage_id = request.args.get('etage_id', type=int)
+        if not baes_ids and etage_id is None:
+            return jsonify({'error': 'Paramètre baes_id ou etage_id requis'}), 400
+        query = select(Baes.id).order_by(Baes.id)
+        if baes_ids:
+            query = query.where(Baes.id.in_(baes_ids))
+        if etage_id is not None:
+            query = query.where(Baes.etage_id == etage_id)
+        user_id = request.args.get('user_id', type=int)
+        if user_id is not None:
+            query = query.where(get_visibility(user_id).baes(include_unassigned=True))
+        baes_ids = db.session.execute(query.limit(timeseries.MAX_SERIES + 1)).scalars().all()
+        if len(baes_ids) > timeseries.MAX_SERIES:
+            return jsonify({'error': f'Trop de BAES ({timeseries.MAX_SERIES} séries au maximum par requête)'}), 400
+
+        series, cached = timeseries.temperature_series(baes_ids, start, end, points, method)
+        return jsonify({'from': status_history.iso(start), 'to': status_history.iso(end), 'points': points,
+                        'method': method, 'cached': cached, 'series': series}), 200
+    except status_history.HistoryQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in get_temperature_timeseries: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@status_bp.route('/export', methods=['GET'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Export de l'historique filtré (mêmes filtres que /status/history), du plus ancien au plus "
+                   "récent, avec les noms du BAES, de l'étage, du bâtiment et du site. Le fichier est envoyé "
+                   "en flux, par paquets, à mémoire constante quel que soit le volume. Sous uwsgi, une requête "
+                   "est interrompue après harakiri secondes : exporter les longues périodes avec "
+                   "`flask --app app export status`.",
+    'produces': ['text/csv', 'application/vnd.apache.parquet'],
+    'parameters': [
+        {'name': 'format', 'in': 'query', 'type': 'string', 'enum': ['csv', 'parquet'], 'default': 'csv',
+         'description': 'parquet nécessite pyarrow côté serveur'}
+    ] + HISTORY_FILTER_PARAMETERS,
+    'responses': {
+        200: {'description': "Fichier CSV (en-tête : status_id, timestamp, baes_id, baes_name, baes_label, etage_id, "
+                             "etage_name, batiment_id, batiment_name, site_id, site_name, erreur, is_solved, "
+                             "temperature, vibration, acknowledged_by_login, acknowledged_at) ou Parquet "
+                             "(mêmes colonnes)."},
+        400: {'description': 'Paramètre ou format invalide.'},
+        500: {'description': 'Erreur interne.'}
+    }
+})
+@read_only
+def export_statuses():
+    try:
+        fmt = request.args.get('format', 'csv')
+        export = exports.StatusExport(_history_filter().criteria(), fmt).open()
+    except (status_history.HistoryQueryError, exports.ExportError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in export_statuses: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        try:
+            yield from export
+        except Exception as e:
+            # En-têtes déjà envoyés : le fichier est tronqué, l'erreur n'est visible que dans les logs
+            current_app.logger.error(f"Error in export_statuses after {export.rows} rows: {e}")
+            raise
+
+    filename = f"status_{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.{fmt}"
+    response = Response(stream_with_context(generate()), mimetype=export.mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # pas de mise en tampon par nginx
+    return response
+
+
+@status_bp.route('/export', methods=['POST'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Même export que GET /status/export, produit par le worker de tâches dans un fichier "
+                   "(réponse 202, suivi par GET /jobs/<id>, fichier servi par GET /jobs/<id>/download). "
+                   "Sans limite de durée : pour les longues périodes.",
+    'parameters': [
+        {'name': 'format', 'in': 'query', 'type': 'string', 'enum': ['csv', 'parquet'], 'default': 'csv'}
+    ] + HISTORY_FILTER_PARAMETERS,
+    'responses': {
+        202: ACCEPTED_RESPONSE,
+        400: {'description': 'Paramètre ou format invalide.'},
+        500: {'description': 'Erreur interne.'}
+    }
+})
+def export_statuses_job():
+    try:
+        fmt = request.args.get('format', 'csv')
+        # Filtres et format validés ici : une tâche en file est exécutable
+        exports.StatusExport(_history_filter().criteria(), fmt)
+        filters = {key: value for key, value in request.args.items() if key not in ('format', 'async')}
+        return accept_job('status.export', {'format': fmt, 'filters': filters})
+    except (status_history.HistoryQueryError, exports.ExportError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in export_statuses_job: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== Flux temps réel (SSE et long-poll) =====
+# Destinées au serveur gevent (stream_server.py) : chaque connexion y est un greenlet et les accès
+# à la base passent par le poller partagé de services.status_events. Sous uwsgi, le nombre de
+# connexions simultanées est limité par STREAM_MAX_CLIENTS pour ne pas immobiliser les threads.
+
+def _stream_subscription(broker):
+    """Abonne la requête courante selon ?user_id= et ?site_id= ; retourne (abonnement, réponse d'erreur)."""
+    user_id = request.args.get('user_id', type=int)
+    site_id = request.args.get('site_id', type=int)
+    scope = broker.call(get_visibility, user_id) if user_id is not None else None
+    if scope is not None and site_id is not None and not scope.can_see_site(site_id):
+        return None, (jsonify({'error': 'Site non accessible.'}), 403)
+    subscription = broker.subscribe(scope, site_id)
+    if subscription is None:
+        return None, (jsonify({'error': 'Trop de connexions de flux sur ce processus, réessayer plus tard.'}), 503)
+    return subscription, None
+
+
+def _visible_backlog(broker, subscription, since, late=True):
+    """Rattrapage depuis `since` filtré pour l'abonné : (événements, complet)."""
+    events, complete = broker.call(status_events.fetch_backlog, since, late)
+    return [event for event in events if subscription.accepts(event)], complete
+
+
+@status_bp.route('/stream', methods=['GET'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Flux Server-Sent Events des nouveaux status et des acquittements, filtré par le périmètre "
+                   "de l'utilisateur. L'en-tête Last-Event-ID (envoyé automatiquement par EventSource) "
+                   "rejoue les status manqués depuis la déconnexion, y compris ceux validés en retard "
+                   "(un status déjà reçu peut être renvoyé : dédupliquer par id). Un commentaire ': ping' "
+                   "est envoyé toutes les STREAM_HEARTBEAT secondes ; un événement 'resync' signale une "
+                   "perte d'événements (client trop lent, ou plus de MAX_BACKLOG status à rejouer) : "
+                   "recharger l'état complet.",
+    'produces': ['text/event-stream'],
+    'parameters': [
+        {'name': 'user_id', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': "Limite le flux aux sites visibles par cet utilisateur"},
+        {'name': 'site_id', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': "Limite le flux à un site"},
+        {'name': 'Last-Event-ID', 'in': 'header', 'type': 'integer', 'required': False,
+         'description': "Dernier id de status reçu"}
+    ],
+    'responses': {
+        200: {'description': "Flux text/event-stream (événements 'status', 'acknowledged', 'resync')."},
+        403: {'description': "Site non accessible."},
+        503: {'description': "Nombre maximal de connexions de flux atteint sur ce processus."}
+    }
+})
+def stream_statuses():
+    broker = status_events.get_broker(current_app._get_current_object())
+    subscription, error = _stream_subscription(broker)
+    if error:
+        return error
+
+    heartbeat = current_app.config.get('STREAM_HEARTBEAT', 15)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    try:
+        backlog, complete = ([], True) if last_event_id is None else \
+            _visible_backlog(broker, subscription, last_event_id)
+    except Exception as e:
+        broker.unsubscribe(subscription)
+        current_app.logger.error(f"Error in stream_statuses: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            if not complete:
+                # Trop de status manqués : le client recharge l'état complet puis se reconnecte
+                yield 'event: resync\ndata: {}\n\n'
+                return
+            sent_id = last_event_id or 0
+            replayed = set()
+            for event in backlog:
+                # Un status validé en retard (id inférieur) ne fait pas reculer l'id de reprise
+                sent_id = max(sent_id, event['id'])
+                replayed.add(event['id'])
+                yield status_events.format_sse(event, sent_id)
+            while True:
+                try:
+                    event = subscription.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if event is status_events.RESYNC:
+                    yield 'event: resync\ndata: {}\n\n'
+                    return
+                if event['type'] == 'status':
+                    # Déjà envoyé avec le rattrapage Last-Event-ID ; un id inférieur est un status validé en retard
+                    if event['id'] in replayed:
+                        continue
+                    sent_id = max(sent_id, event['id'])
+                yield status_events.format_sse(event, sent_id)
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # pas de mise en tampon par nginx
+    return response
+
+
+@status_bp.route('/poll', methods=['GET'])
+@swag_from({
+    'tags': ['Status CRUD'],
+    'description': "Long-poll : retourne immédiatement les status d'id supérieur à 'since' s'il y en a, "
+                   "sinon attend au plus 'timeout' secondes un nouveau status ou un acquittement. "
+                   "Relancer avec since=last_id. Les status validés en retard juste avant 'since' sont "
+                   "aussi rendus (dédupliquer par id) ; resync=true si plus de MAX_BACKLOG status sont "
+                   "à rejouer ou si le client a pris trop de retard : recharger l'état complet.",
+    'parameters': [
+        {'name': 'since', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': "Dernier id de status connu (défaut : id courant, seuls les événements futurs sont attendus)"},
+        {'name': 'timeout', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': "Attente maximale en secondes (défaut 25, plafonné par POLL_MAX_TIMEOUT)"},
+        {'name': 'user_id', 'in': 'query', 'type': 'integer', 'required': False},
+        {'name': 'site_id', 'in': 'query', 'type': 'integer', 'required': False}
+    ],
+    'responses': {
+        200: {
+            'description': "Événements (éventuellement vide si le délai est écoulé).",
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'events': {'type': 'array', 'items': {'type': 'object'}},
+                    'last_id': {'type': 'integer', 'example': 1024},
+                    'resync': {'type': 'boolean', 'example': True}
+                }
+            }
+        },
+        403: {'description': "Site non accessible."},
+        503: {'description': "Nombre maximal de connexions de flux atteint sur ce processus."}
+    }
+})
+def poll_statuses():
+    broker = status_events.get_broker(current_app._get_current_object())
+    timeout = min(request.args.get('timeout', 25, type=int), current_app.config.get('POLL_MAX_TIMEOUT', 30))
+    subscription, error = _stream_subscription(broker)
+    if error:
+        return error
+    try:
+        since = request.args.get('since', type=int)
+        # Sans since, seuls les événements futurs sont attendus : pas de status validés en retard à rejouer
+        late = since is not None
+        if since is None:
+            since = broker.current_id()
+        events, complete = _visible_backlog(broker, subscription, since, late)
+        resync = not complete
+        deadline = time.monotonic() + max(timeout, 0)
+        while not events and not resync:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = subscription.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is status_events.RESYNC:
+                resync = True
+            elif event['type'] != 'status' or event['id'] > since:
+                events.append(event)
+        last_id = max([since] + [event['id'] for event in events if event['type'] == 'status'])
+        result = {'events': events, 'last_id': last_id}
+        if resync:
+            result['resync'] = True
+        return jsonify(result), 200
+    except Exception as e:
+        current_app.logger.error(f"Error in poll_statuses: {e}")
         return jsonify({'error': str(e)}), 500
+    finally:
+        broker.unsubscribe(subscription)
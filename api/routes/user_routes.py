@@ -1,14 +1,51 @@
 from flask import Blueprint, request, jsonify, current_app
 from flasgger import swag_from
-from models import User, db
-from sqlalchemy import text
+from models import User, Role, Site, UserSiteRole, db
+from sqlalchemy import select, text
+from services.batching import chunked
+from services.pagination import get_page_args, paginate, pagination_headers
+from services.user_relations import apply_relation_plan, names_by_id, parse_roles_by_site, plan_user_relations
 
 user_bp = Blueprint('user_bp', __name__)
 
+
+def _roles_and_sites_by_user(user_ids):
+    """
+    Charge les rôles et sites de plusieurs utilisateurs, en une requête (jointures) par lot de
+    1000 IDs (limite de paramètres MSSQL). Retourne {user_id: {'roles': [noms], 'sites': [{'id', 'name'}]}}.
+    """
+    rows = []
+    for chunk in chunked(user_ids):
+        rows.extend(db.session.execute(
+            select(UserSiteRole.user_id, Role.name, Site.id, Site.name)
+            .outerjoin(Role, Role.id == UserSiteRole.role_id)
+            .outerjoin(Site, Site.id == UserSiteRole.site_id)
+            .where(UserSiteRole.user_id.in_(chunk))
+            .order_by(UserSiteRole.user_id, UserSiteRole.id)
+        ).all())
+
+    relations = {}
+    for user_id, role_name, site_id, site_name in rows:
+        entry = relations.setdefault(user_id, {'roles': [], 'sites': []})
+        if role_name and role_name not in entry['roles']:
+            entry['roles'].append(role_name)
+        if site_id is not None and all(s['id'] != site_id for s in entry['sites']):
+            entry['sites'].append({'id': site_id, 'name': site_name})
+    return relations
+
 @user_bp.route('/', methods=['GET'])
 @swag_from({
     'tags': ['User CRUD'],
-    'description': 'Récupère la liste de tous les utilisateurs avec leurs sites et rôles associés.',
+    'description': 'Récupère la liste des utilisateurs avec leurs sites et rôles associés. '
+                   'Pagination optionnelle (page, per_page) : le total est renvoyé dans l\'en-tête X-Total-Count.',
+    'parameters': [
+        {'name': 'site_id', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Ne retourner que les utilisateurs ayant accès à ce site'},
+        {'name': 'role_id', 'in': 'query', 'type': 'integer', 'required': False,
+         'description': 'Ne retourner que les utilisateurs ayant ce rôle'},
+        {'name': 'page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Numéro de page (à partir de 1)'},
+        {'name': 'per_page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Taille de page (max 500)'}
+    ],
     'responses': {
         '200': {
             'description': 'Liste des utilisateurs avec leurs sites et rôles.',
@@ -47,25 +84,33 @@ user_bp = Blueprint('user_bp', __name__)
 })
 def get_users():
     try:
-        users = User.query.all()
+        site_id = request.args.get('site_id', type=int)
+        role_id = request.args.get('role_id', type=int)
+        page, per_page = get_page_args()
+
+        query = db.session.query(User.id, User.login).order_by(User.id)
+        if site_id is not None or role_id is not None:
+            matching = select(UserSiteRole.user_id)
+            if site_id is not None:
+                matching = matching.where(UserSiteRole.site_id == site_id)
+            if role_id is not None:
+                matching = matching.where(UserSiteRole.role_id == role_id)
+            query = query.filter(User.id.in_(matching))
+
+        users, total = paginate(query, page, per_page)
+        # Une requête jointe par lot de 1000 utilisateurs retournés pour leurs rôles et sites
+        relations = _roles_and_sites_by_user([u.id for u in users]) if users else {}
+
         result = []
-        for user in users:
-            # Récupérer les rôles distincts via l'association
-            roles_set = {assoc.role.name for assoc in user.user_site_roles if assoc.role}
-            # Récupérer les sites distincts via l'association
-            sites = []
-            sites_ids = set()
-            for assoc in user.user_site_roles:
-                if assoc.site and assoc.site.id not in sites_ids:
-                    sites.append({'id': assoc.site.id, 'name': assoc.site.name})
-                    sites_ids.add(assoc.site.id)
+        for user_id, login in users:
+            entry = relations.get(user_id, {'roles': [], 'sites': []})
             result.append({
-                'id': user.id,
-                'login': user.login,
-                'roles': list(roles_set),
-                'sites': sites
+                'id': user_id,
+                'login': login,
+                'roles': entry['roles'],
+                'sites': entry['sites']
             })
-        return jsonify(result), 200
+        return jsonify(result), 200, pagination_headers(total, page, per_page)
     except Exception as e:
         current_app.logger.error(f"Error in get_users: {e}")
         return jsonify({'error': str(e)}), 500
@@ -115,18 +160,12 @@ def get_user(user_id):
         user = User.query.get(user_id)
         if not user:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
-        roles_set = {assoc.role.name for assoc in user.user_site_roles if assoc.role}
-        sites = []
-        sites_ids = set()
-        for assoc in user.user_site_roles:
-            if assoc.site and assoc.site.id not in sites_ids:
-                sites.append({'id': assoc.site.id, 'name': assoc.site.name})
-                sites_ids.add(assoc.site.id)
+        entry = _roles_and_sites_by_user([user.id]).get(user.id, {'roles': [], 'sites': []})
         result = {
             'id': user.id,
             'login': user.login,
-            'roles': list(roles_set),
-            'sites': sites
+            'roles': entry['roles'],
+            'sites': entry['sites']
         }
         return jsonify(result), 200
     except Exception as e:
@@ -690,230 +729,42 @@ def update_user_with_relations(user_id):
         if 'password' in data:
             user.set_password(data['password'])
 
-        # 2. Mettre à jour les relations user-site-role si fournies
+        # 2. Synchroniser les relations user-site-role par différence (une seule transaction)
         relations = []
+        removed_relations = None
 
         if 'rolesBySite' in data:
-            roles_by_site = data['rolesBySite']
             replace_existing = data.get('replaceExistingRelations', False)
+            try:
+                desired = parse_roles_by_site(data['rolesBySite'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
 
-            # Si on remplace toutes les relations existantes
+            # Vérifier l'existence des sites et des rôles (une requête chacun)
+            site_names = names_by_id(Site, desired.keys())
+            role_names = names_by_id(Role, desired.values())
             if replace_existing:
-                try:
-                    # Récupérer toutes les relations existantes pour les supprimer une par une
-                    existing_relations = UserSiteRole.query.filter_by(user_id=user_id).all()
-                    current_app.logger.info(f"Found {len(existing_relations)} existing relations for user {user_id}")
-
-                    # Log each relation for debugging
-                    for relation in existing_relations:
-                        current_app.logger.info(f"Deleting relation: user_id={relation.user_id}, site_id={relation.site_id}, role_id={relation.role_id}")
-                        db.session.delete(relation)
-
-                    # Commit immédiat de la suppression
-                    db.session.commit()
-                    current_app.logger.info(f"Deleted {len(existing_relations)} existing relations for user {user_id}")
-                except Exception as delete_error:
-                    db.session.rollback()
-                    current_app.logger.error(f"Error deleting existing relations: {delete_error}")
-                    return jsonify({'error': f"Erreur lors de la suppression des relations existantes: {str(delete_error)}"}), 500
-
-                # Créer un dictionnaire pour suivre les relations déjà créées
-                created_relations = set()
-
-                # Nouvelle session pour les insertions
-                try:
-                    # Vérifier d'abord s'il existe des relations qui pourraient causer des conflits
-                    # Utiliser une requête SQL directe pour s'assurer qu'aucune relation n'existe
-                    for site_id_str, role_id in roles_by_site.items():
-                        try:
-                            site_id = int(site_id_str)
-                            role_id = int(role_id)
-                        except (ValueError, TypeError):
-                            continue  # Ignorer les valeurs non numériques
-
-                        # Vérifier si la relation existe déjà dans la base de données avec une requête SQL directe
-                        sql = text(f"SELECT * FROM user_site_role WHERE user_id = {user_id} AND site_id = {site_id}")
-                        result = db.session.execute(sql).fetchall()
-
-                        if result:
-                            current_app.logger.warning(f"Found {len(result)} existing relations with user_id={user_id}, site_id={site_id}")
-                            # Supprimer toutes les relations avec ce user_id et site_id
-                            delete_sql = text(f"DELETE FROM user_site_role WHERE user_id = {user_id} AND site_id = {site_id}")
-                            db.session.execute(delete_sql)
-                            db.session.commit()  # Commit immédiatement pour s'assurer que la suppression est appliquée
-                            current_app.logger.warning(f"Deleted all relations with user_id={user_id}, site_id={site_id}")
-
-                    # Les suppressions ont déjà été commitées individuellement
-
-                    # Maintenant créer les nouvelles relations
-                    for site_id_str, role_id in roles_by_site.items():
-                        try:
-                            site_id = int(site_id_str)
-                            role_id = int(role_id)
-                        except (ValueError, TypeError):
-                            continue  # Ignorer les valeurs non numériques
-
-                        # Vérifier l'existence du site et du rôle
-                        site = Site.query.get(site_id)
-                        role = Role.query.get(role_id)
-
-                        if not site or not role:
-                            continue  # Ignorer les sites ou rôles non existants
-
-                        # Vérifier si nous avons déjà créé cette relation (pour éviter les doublons)
-                        relation_key = (user_id, site_id, role_id)
-                        if relation_key in created_relations:
-                            continue
-
-                        # Vérifier une dernière fois si la relation existe déjà
-                        check_sql = text(f"SELECT COUNT(*) FROM user_site_role WHERE user_id = {user_id} AND site_id = {site_id} AND role_id = {role_id}")
-                        count = db.session.execute(check_sql).scalar()
-
-                        if count > 0:
-                            current_app.logger.warning(f"Relation already exists and will be skipped: user_id={user_id}, site_id={site_id}, role_id={role_id}")
-                            continue
-
-                        try:
-                            # Vérifier une dernière fois si la relation existe et la supprimer si nécessaire
-                            check_and_delete_sql = text(f"""
-                            DELETE FROM user_site_role 
-                            WHERE user_id = {user_id} AND site_id = {site_id} AND role_id = {role_id}
-                            """)
-                            db.session.execute(check_and_delete_sql)
-                            db.session.commit()  # Commit la suppression avant d'insérer
-
-                            # Créer la relation avec une requête SQL directe pour éviter les problèmes d'ORM
-                            insert_sql = text(f"""
-                            INSERT INTO user_site_role (user_id, site_id, role_id, created_at, updated_at) 
-                            VALUES ({user_id}, {site_id}, {role_id}, GETDATE(), GETDATE())
-                            """)
-                            db.session.execute(insert_sql)
-                            db.session.commit()  # Commit après chaque insertion pour éviter les conflits
-
-                            created_relations.add(relation_key)
-                            current_app.logger.info(f"Successfully created relation: user_id={user_id}, site_id={site_id}, role_id={role_id}")
-
-                            relations.append({
-                                'site_id': site_id,
-                                'site_name': site.name,
-                                'role_id': role_id,
-                                'role_name': role.name,
-                                'status': 'created'
-                            })
-                        except Exception as relation_error:
-                            db.session.rollback()
-                            current_app.logger.error(f"Error creating relation: user_id={user_id}, site_id={site_id}, role_id={role_id}, error={relation_error}")
-
-                            # Si c'est une violation de clé primaire, essayer de supprimer explicitement et réessayer
-                            if "Violation of PRIMARY KEY constraint" in str(relation_error):
-                                try:
-                                    current_app.logger.warning(f"Primary key violation detected. Attempting to explicitly delete and retry.")
-                                    # Supprimer explicitement avec une requête directe
-                                    delete_sql = text(f"DELETE FROM user_site_role WHERE user_id = {user_id} AND site_id = {site_id}")
-                                    db.session.execute(delete_sql)
-                                    db.session.commit()
-
-                                    # Réessayer l'insertion
-                                    insert_sql = text(f"""
-                                    INSERT INTO user_site_role (user_id, site_id, role_id, created_at, updated_at) 
-                                    VALUES ({user_id}, {site_id}, {role_id}, GETDATE(), GETDATE())
-                                    """)
-                                    db.session.execute(insert_sql)
-                                    db.session.commit()
-
-                                    created_relations.add(relation_key)
-                                    current_app.logger.info(f"Successfully created relation on retry: user_id={user_id}, site_id={site_id}, role_id={role_id}")
-
-                                    relations.append({
-                                        'site_id': site_id,
-                                        'site_name': site.name,
-                                        'role_id': role_id,
-                                        'role_name': role.name,
-                                        'status': 'created_after_retry'
-                                    })
-                                except Exception as retry_error:
-                                    db.session.rollback()
-                                    current_app.logger.error(f"Error on retry: user_id={user_id}, site_id={site_id}, role_id={role_id}, error={retry_error}")
-
-                            # Continue with other relations instead of failing completely
-                            continue
-
-                    current_app.logger.info(f"Created {len(created_relations)} new relations for user {user_id}")
-                except Exception as insert_error:
-                    db.session.rollback()
-                    current_app.logger.error(f"Error creating new relations: {insert_error}")
-                    return jsonify({'error': f"Erreur lors de la création des nouvelles relations: {str(insert_error)}"}), 500
+                # En mode remplacement, les sites ou rôles inexistants sont ignorés
+                desired = {site_id: role_id for site_id, role_id in desired.items()
+                           if site_id in site_names and role_id in role_names}
             else:
-                # Traitement normal pour les mises à jour sans remplacement complet
-                for site_id_str, role_id in roles_by_site.items():
-                    try:
-                        site_id = int(site_id_str)
-                    except ValueError:
-                        continue  # Ignorer les clés non numériques
-
-                    try:
-                        role_id = int(role_id)
-                    except (ValueError, TypeError):
-                        return jsonify({'error': f'ID de rôle invalide: {role_id}'}), 400
-
-                    # Vérifier l'existence du site et du rôle
-                    site = Site.query.get(site_id)
-                    role = Role.query.get(role_id)
-
-                    if not site:
-                        return jsonify({'error': f'Site avec ID {site_id} non trouvé'}), 404
-
-                    if not role:
-                        return jsonify({'error': f'Rôle avec ID {role_id} non trouvé'}), 404
-
-                    # Vérifier si une relation identique existe déjà
-                    existing_relation = UserSiteRole.query.filter_by(
-                        user_id=user_id,
-                        site_id=site_id,
-                        role_id=role_id
-                    ).first()
-
-                    if existing_relation:
-                        # La relation existe déjà, pas besoin de la modifier
-                        relations.append({
-                            'site_id': site_id,
-                            'site_name': site.name,
-                            'role_id': role_id,
-                            'role_name': role.name,
-                            'status': 'unchanged'
-                        })
-                    else:
-                        # Vérifier si une relation avec le même site mais un rôle différent existe
-                        existing_site_relation = UserSiteRole.query.filter_by(
-                            user_id=user_id,
-                            site_id=site_id
-                        ).first()
-
-                        if existing_site_relation:
-                            # Mettre à jour le rôle pour ce site
-                            old_role_id = existing_site_relation.role_id
-                            old_role = Role.query.get(old_role_id)
-                            existing_site_relation.role_id = role_id
-                            relations.append({
-                                'site_id': site_id,
-                                'site_name': site.name,
-                                'role_id': role_id,
-                                'role_name': role.name,
-                                'old_role_id': old_role_id,
-                                'old_role_name': old_role.name if old_role else None,
-                                'status': 'updated'
-                            })
-                        else:
-                            # Créer une nouvelle relation
-                            new_relation = UserSiteRole(user_id=user_id, site_id=site_id, role_id=role_id)
-                            db.session.add(new_relation)
-                            relations.append({
-                                'site_id': site_id,
-                                'site_name': site.name,
-                                'role_id': role_id,
-                                'role_name': role.name,
-                                'status': 'created'
-                            })
+                unknown_site = next((site_id for site_id in desired if site_id not in site_names), None)
+                if unknown_site is not None:
+                    return jsonify({'error': f'Site avec ID {unknown_site} non trouvé'}), 404
+                unknown_role = next((role_id for role_id in desired.values() if role_id not in role_names), None)
+                if unknown_role is not None:
+                    return jsonify({'error': f'Rôle avec ID {unknown_role} non trouvé'}), 404
+
+            plan = plan_user_relations(user_id, desired, replace=replace_existing,
+                                       site_names=site_names, role_names=role_names)
+            apply_relation_plan(plan)
+            relations = plan.relations
+            if replace_existing:
+                removed_relations = len(plan.deletes)
+            current_app.logger.info(
+                f"User {user_id} relations: {len(plan.inserts)} created, {len(plan.updates)} updated, "
+                f"{len(plan.deletes)} deleted"
+            )
 
         # Valider les modifications
         db.session.commit()
@@ -924,6 +775,8 @@ def update_user_with_relations(user_id):
             'login': user.login,
             'relations': relations
         }
+        if removed_relations is not None:
+            result['removed_relations'] = removed_relations
 
         return jsonify(result), 200
 
@@ -3,11 +3,31 @@ from flask import Blueprint, jsonify, request
 from flasgger import swag_from
 from sqlalchemy.exc import IntegrityError
 from models import db, UserSiteRole, User, Site, Role
+from services.pagination import get_page_args, paginate, pagination_headers, pagination_payload
+from services.user_relations import bulk_assign_role, names_by_id
 
 # Créer le blueprint pour les routes user-site-role
 user_site_role_bp = Blueprint('user_site_role', __name__)
 
 
+def _relations_query():
+    """Relations user-site-role avec login, nom de site et nom de rôle chargés par jointure (une seule requête)."""
+    return db.session.query(
+        UserSiteRole.id,
+        UserSiteRole.user_id,
+        UserSiteRole.site_id,
+        UserSiteRole.role_id,
+        UserSiteRole.created_at,
+        UserSiteRole.updated_at,
+        User.login.label('user_login'),
+        Site.name.label('site_name'),
+        Role.name.label('role_name'),
+    ).outerjoin(User, User.id == UserSiteRole.user_id) \
+        .outerjoin(Site, Site.id == UserSiteRole.site_id) \
+        .outerjoin(Role, Role.id == UserSiteRole.role_id) \
+        .order_by(UserSiteRole.id)
+
+
 @user_site_role_bp.route('', methods=['GET'])
 @swag_from({
     'tags': ['UserSiteRole'],
@@ -34,7 +54,9 @@ user_site_role_bp = Blueprint('user_site_role', __name__)
             'type': 'integer',
             'required': False,
             'description': 'Filtrer par ID rôle'
-        }
+        },
+        {'name': 'page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Numéro de page (à partir de 1)'},
+        {'name': 'per_page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Taille de page (max 500)'}
     ],
     'responses': {
         200: {
@@ -59,18 +81,20 @@ def get_user_site_roles():
         site_id = request.args.get('site_id', type=int)
         role_id = request.args.get('role_id', type=int)
 
-        # Construire la requête
-        query = UserSiteRole.query
+        page, per_page = get_page_args()
+
+        # Construire la requête (jointures sur utilisateur, site et rôle)
+        query = _relations_query()
 
         if user_id:
-            query = query.filter_by(user_id=user_id)
+            query = query.filter(UserSiteRole.user_id == user_id)
         if site_id:
-            query = query.filter_by(site_id=site_id)
+            query = query.filter(UserSiteRole.site_id == site_id)
         if role_id:
-            query = query.filter_by(role_id=role_id)
+            query = query.filter(UserSiteRole.role_id == role_id)
 
         # Exécuter la requête
-        user_site_roles = query.all()
+        user_site_roles, total = paginate(query, page, per_page)
 
         # Formater la réponse
         result = []
@@ -80,14 +104,14 @@ def get_user_site_roles():
                 'user_id': usr.user_id,
                 'site_id': usr.site_id,
                 'role_id': usr.role_id,
-                'user_login': usr.user.login if usr.user else None,
-                'site_name': usr.site.name if usr.site else None,
-                'role_name': usr.role.name if usr.role else None,
+                'user_login': usr.user_login,
+                'site_name': usr.site_name,
+                'role_name': usr.role_name,
                 'created_at': usr.created_at.isoformat() if usr.created_at else None,
                 'updated_at': usr.updated_at.isoformat() if usr.updated_at else None
             })
 
-        return jsonify(result), 200
+        return jsonify(result), 200, pagination_headers(total, page, per_page)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -451,7 +475,11 @@ def delete_user_site_role(id):
             'type': 'integer',
             'required': True,
             'description': 'ID de l\'utilisateur'
-        }
+        },
+        {'name': 'site_id', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Filtrer par ID site'},
+        {'name': 'role_id', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Filtrer par ID rôle'},
+        {'name': 'page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Numéro de page (à partir de 1)'},
+        {'name': 'per_page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Taille de page (max 500)'}
     ],
     'responses': {
         200: {
@@ -490,21 +518,30 @@ def get_user_permissions(user_id):
         if not user:
             return jsonify({'error': 'Utilisateur non trouvé'}), 404
 
-        permissions = UserSiteRole.query.filter_by(user_id=user_id).all()
+        query = _relations_query().filter(UserSiteRole.user_id == user_id)
+        site_id = request.args.get('site_id', type=int)
+        role_id = request.args.get('role_id', type=int)
+        if site_id:
+            query = query.filter(UserSiteRole.site_id == site_id)
+        if role_id:
+            query = query.filter(UserSiteRole.role_id == role_id)
+        page, per_page = get_page_args()
+        permissions, total = paginate(query, page, per_page)
 
         result = {
             'user_id': user_id,
             'user_login': user.login,
-            'permissions': []
+            'permissions': [],
+            **pagination_payload(total, page, per_page)
         }
 
         for perm in permissions:
             result['permissions'].append({
                 'id': perm.id,
                 'site_id': perm.site_id,
-                'site_name': perm.site.name if perm.site else 'Tous les sites',
+                'site_name': perm.site_name if perm.site_name is not None else 'Tous les sites',
                 'role_id': perm.role_id,
-                'role_name': perm.role.name,
+                'role_name': perm.role_name,
                 'created_at': perm.created_at.isoformat() if perm.created_at else None
             })
 
@@ -525,7 +562,10 @@ def get_user_permissions(user_id):
             'type': 'integer',
             'required': True,
             'description': 'ID du site'
-        }
+        },
+        {'name': 'role_id', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Filtrer par ID rôle'},
+        {'name': 'page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Numéro de page (à partir de 1)'},
+        {'name': 'per_page', 'in': 'query', 'type': 'integer', 'required': False, 'description': 'Taille de page (max 500)'}
     ],
     'responses': {
         200: {
@@ -564,21 +604,27 @@ def get_site_users(site_id):
         if not site:
             return jsonify({'error': 'Site non trouvé'}), 404
 
-        users_roles = UserSiteRole.query.filter_by(site_id=site_id).all()
+        query = _relations_query().filter(UserSiteRole.site_id == site_id)
+        role_id = request.args.get('role_id', type=int)
+        if role_id:
+            query = query.filter(UserSiteRole.role_id == role_id)
+        page, per_page = get_page_args()
+        users_roles, total = paginate(query, page, per_page)
 
         result = {
             'site_id': site_id,
             'site_name': site.name,
-            'users': []
+            'users': [],
+            **pagination_payload(total, page, per_page)
         }
 
         for ur in users_roles:
             result['users'].append({
                 'id': ur.id,
                 'user_id': ur.user_id,
-                'user_login': ur.user.login,
+                'user_login': ur.user_login,
                 'role_id': ur.role_id,
-                'role_name': ur.role.name,
+                'role_name': ur.role_name,
                 'created_at': ur.created_at.isoformat() if ur.created_at else None
             })
 
@@ -760,4 +806,75 @@ def assign_global_role(user_id):
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+@user_site_role_bp.route('/bulk', methods=['POST'])
+@swag_from({
+    'tags': ['UserSiteRole'],
+    'summary': 'Attribue un rôle à plusieurs utilisateurs en une seule transaction',
+    'description': 'Attribue role_id à chaque utilisateur de user_ids, sur chaque site de site_ids '
+                   '(ou globalement si site_ids est absent). Les relations déjà présentes sont ignorées.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'required': ['role_id', 'user_ids'],
+                'properties': {
+                    'role_id': {'type': 'integer', 'example': 2},
+                    'user_ids': {'type': 'array', 'items': {'type': 'integer'}, 'example': [1, 2, 3]},
+                    'site_ids': {'type': 'array', 'items': {'type': 'integer'}, 'example': [1]}
+                }
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Attribution effectuée',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'created': {'type': 'integer', 'example': 5},
+                    'existing': {'type': 'integer', 'example': 1}
+                }
+            }
+        },
+        400: {'description': 'Données invalides'},
+        404: {'description': 'Rôle, utilisateurs ou sites non trouvés'}
+    }
+})
+def bulk_assign_user_site_role():
+    """Attribue un rôle à plusieurs utilisateurs (et sites) en une seule transaction"""
+    try:
+        data = request.get_json()
+        if not data or 'role_id' not in data or not data.get('user_ids'):
+            return jsonify({'error': 'role_id et user_ids sont requis'}), 400
+
+        try:
+            role_id = int(data['role_id'])
+            user_ids = [int(uid) for uid in data['user_ids']]
+            site_ids = [int(sid) for sid in data.get('site_ids') or []]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'role_id, user_ids et site_ids doivent être des entiers'}), 400
+
+        if not db.session.get(Role, role_id):
+            return jsonify({'error': 'Rôle non trouvé'}), 404
+
+        missing_users = sorted(set(user_ids) - names_by_id(User, user_ids, 'login').keys())
+        if missing_users:
+            return jsonify({'error': 'Utilisateurs non trouvés', 'missing_user_ids': missing_users}), 404
+
+        missing_sites = sorted(set(site_ids) - names_by_id(Site, site_ids).keys())
+        if missing_sites:
+            return jsonify({'error': 'Sites non trouvés', 'missing_site_ids': missing_sites}), 404
+
+        created, existing = bulk_assign_role(role_id, user_ids, site_ids)
+        db.session.commit()
+
+        return jsonify({'created': created, 'existing': existing}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1 @@
+# Composants applicatifs partagés par les routes (pagination, périmètres de visibilité, caches, ...)
@@ -0,0 +1,92 @@
+"""
+Acquittement de status en masse.
+
+Un seul UPDATE ensembliste (par lot de 1000 ids quand une liste est fournie) renseigne
+is_solved, acknowledged_by_user_id et acknowledged_at sur tous les status visés dont l'état
+change, au lieu d'un chargement, d'un commit et d'une recherche d'utilisateur par status.
+Les compteurs d'alarmes des BAES concernés sont mis à jour dans la même transaction, et les
+tableaux de bord reçoivent un événement 'acknowledged' par status, comme pour un acquittement
+unitaire (services.status_events lit acknowledged_at). Les incidents ouverts des BAES et codes
+concernés sont acquittés de même (services.incidents).
+"""
+from collections import Counter
+
+from sqlalchemy import func, select, update
+
+from models import db, Status
+from services import alarm_counters, incidents
+from services.batching import chunked
+from services.status_queries import located_in
+from templates.TimestampMixin import current_time
+
+
+class AcknowledgeError(ValueError):
+    """Sélection invalide (message destiné au client, réponse 400)."""
+
+
+def selection_criteria(status_ids=None, etage_id=None, batiment_id=None, site_id=None, erreurs=None,
+                       scope=None):
+    """Prédicats communs à toutes les lignes visées (hors liste d'ids, traitée par lots)."""
+    if not status_ids and etage_id is None and batiment_id is None and site_id is None and not erreurs:
+        raise AcknowledgeError("Sélection vide : fournir status_ids, etage_id, batiment_id, site_id ou erreur")
+    criteria = []
+    located = located_in(etage_id, batiment_id, site_id)
+    if located is not None:
+        criteria.append(located)
+    if erreurs:
+        criteria.append(Status.erreur.in_(erreurs))
+    if scope is not None:
+        criteria.append(scope.status(include_unassigned=True))
+    return criteria
+
+
+def _id_batches(status_ids):
+    """Critère par lot d'ids (limite de paramètres MSSQL), ou un seul lot sans restriction d'id."""
+    if not status_ids:
+        return [[]]
+    return [[Status.id.in_(chunk)] for chunk in chunked(sorted(set(status_ids)))]
+
+
+def acknowledge(criteria, status_ids=None, user_id=None, is_solved=True):
+    """
+    Passe à `is_solved` les status visés qui ne l'étaient pas et enregistre l'acquittement.
+    Retourne {'acknowledged', 'by_erreur', 'baes_count', 'incidents', 'acknowledged_at'} ; l'appelant valide.
+    """
+    batches = _id_batches(status_ids)
+    changing = [Status.is_solved != is_solved]
+
+    # Une requête groupée : comptes par code et BAES concernés (photographie des compteurs)
+    by_erreur, baes_ids, pairs = Counter(), set(), set()
+    for batch in batches:
+        rows = db.session.execute(
+            select(Status.baes_id, Status.erreur, func.count())
+            .where(*criteria, *batch, *changing)
+            .group_by(Status.baes_id, Status.erreur)
+        ).all()
+        for baes_id, erreur, count in rows:
+            by_erreur[erreur] += count
+            baes_ids.add(baes_id)
+            pairs.add((baes_id, erreur))
+    now = current_time()
+    if not baes_ids:
+        return {'acknowledged': 0, 'by_erreur': {}, 'baes_count': 0, 'incidents': 0, 'acknowledged_at': now}
+
+    counters = alarm_counters.track_baes(baes_ids)
+    acknowledged = 0
+    for batch in batches:
+        result = db.session.execute(
+            update(Status)
+            .where(*criteria, *batch, *changing)
+            .values(is_solved=is_solved, acknowledged_by_user_id=user_id, acknowledged_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        acknowledged += result.rowcount
+    acknowledged_incidents = incidents.acknowledge_open(pairs, is_solved, user_id, now)
+    counters.apply()
+    return {
+        'acknowledged': acknowledged,
+        'by_erreur': {str(erreur): count for erreur, count in sorted(by_erreur.items())},
+        'baes_count': len(baes_ids),
+        'incidents': acknowledged_incidents,
+        'acknowledged_at': now,
+    }
@@ -0,0 +1,399 @@
+"""
+Compteurs d'alarmes par site, bâtiment et étage (table alarm_counters).
+
+Chaque BAES placé sur un étage est compté dans une catégorie selon son dernier status :
+connection_errors (erreur 0), battery_errors (erreur 4), ok (erreur 6) ou unknown
+(aucun status ou autre code). unsolved compte les BAES dont le dernier status est une
+erreur non résolue.
+
+Les compteurs sont maintenus par différence : track_baes() photographie l'état des BAES
+avant une modification, apply() le compare à l'état après flush et applique les écarts
+(UPDATE ... SET n = n + delta) à l'étage, au bâtiment et au site concernés.
+
+Les lignes de compteurs sont créées à l'avance : à zéro avec la portée (create_empty_scope), par
+bootstrap pour les portées antérieures (create_missing) et par reconcile(). Une portée encore sans
+ligne est recalculée entièrement (refresh_sites) dans un SAVEPOINT : si un autre worker crée les
+mêmes lignes au même moment, la violation de uq_alarm_counter_scope n'annule que ce calcul, et
+l'écart est appliqué aux lignes de l'autre worker. reconcile() recalcule tout depuis
+l'historique et signale les écarts.
+Aucune fonction ne fait de commit : l'appelant valide avec le reste de la transaction.
+"""
+from collections import Counter, defaultdict
+
+from sqlalchemy import and_, bindparam, case, delete, false, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, AlarmCounter, Baes, Batiment, Etage, Site, Status
+from services.batching import chunked
+from services.status_queries import latest_status_subquery
+from templates.TimestampMixin import current_time
+
+CONNECTION_ERROR = 0
+BATTERY_ERROR = 4
+OK = 6
+
+SCOPES = ('site', 'batiment', 'etage')
+BUCKETS = ('connection_errors', 'battery_errors', 'ok', 'unknown')
+FIELDS = BUCKETS + ('unsolved',)
+
+
+def _bucket(erreur):
+    if erreur is None:
+        return 'unknown'
+    return {CONNECTION_ERROR: 'connection_errors', BATTERY_ERROR: 'battery_errors', OK: 'ok'}.get(erreur, 'unknown')
+
+
+def _contribution(erreur, is_solved):
+    contribution = Counter({_bucket(erreur): 1})
+    if erreur is not None and erreur != OK and not is_solved:
+        contribution['unsolved'] = 1
+    return contribution
+
+
+def _scope_keys(etage_id, batiment_id, site_id):
+    keys = []
+    if etage_id is not None:
+        keys.append(('etage', etage_id))
+    if batiment_id is not None:
+        keys.append(('batiment', batiment_id))
+    if site_id is not None:
+        keys.append(('site', site_id))
+    return keys
+
+
+def _baes_states(baes_ids):
+    """{baes_id: (etage_id, batiment_id, site_id, contribution)} pour les BAES placés sur un étage."""
+    states = {}
+    for chunk in chunked(baes_ids):
+        latest = latest_status_subquery(Status.baes_id.in_(chunk))
+        rows = db.session.execute(
+            select(Baes.id, Baes.etage_id, Etage.batiment_id, Batiment.site_id, Status.erreur, Status.is_solved)
+            .join(Etage, Etage.id == Baes.etage_id)
+            .outerjoin(Batiment, Batiment.id == Etage.batiment_id)
+            .outerjoin(latest, and_(latest.c.baes_id == Baes.id, latest.c.rn == 1))
+            .outerjoin(Status, Status.id == latest.c.status_id)
+            .where(Baes.id.in_(chunk))
+        ).all()
+        for baes_id, etage_id, batiment_id, site_id, erreur, is_solved in rows:
+            states[baes_id] = (etage_id, batiment_id, site_id, _contribution(erreur, is_solved))
+    return states
+
+
+class BaesTracker:
+    """
+    Suit l'effet d'une modification sur les compteurs :
+        tracker = track_baes([baes_id])
+        ... modifications ...
+        tracker.apply()
+        db.session.commit()
+    """
+
+    def __init__(self, baes_ids=()):
+        self._before = {}
+        self.add(baes_ids)
+
+    def add(self, baes_ids):
+        new_ids = {baes_id for baes_id in baes_ids if baes_id is not None and baes_id not in self._before}
+        if not new_ids:
+            return
+        states = _baes_states(new_ids)
+        for baes_id in new_ids:
+            self._before[baes_id] = states.get(baes_id)
+
+    def add_new(self, baes_ids):
+        """BAES créés dans la transaction : pas d'état antérieur à photographier."""
+        for baes_id in baes_ids:
+            self._before.setdefault(baes_id, None)
+
+    def apply(self):
+        if not self._before:
+            return
+        db.session.flush()
+        after = _baes_states(self._before.keys())
+        deltas = defaultdict(Counter)
+        for baes_id, before in self._before.items():
+            now = after.get(baes_id)
+            if before == now:
+                continue
+            for state, sign in ((before, -1), (now, 1)):
+                if state is None:
+                    continue
+                etage_id, batiment_id, site_id, contribution = state
+                for key in _scope_keys(etage_id, batiment_id, site_id):
+                    for field, value in contribution.items():
+                        deltas[key][field] += sign * value
+        _apply_deltas(deltas)
+        self._before = {}
+
+
+def track_baes(baes_ids=()):
+    return BaesTracker(baes_ids)
+
+
+def _existing_keys(keys):
+    existing = set()
+    by_type = defaultdict(set)
+    for scope_type, scope_id in keys:
+        by_type[scope_type].add(scope_id)
+    for scope_type, ids in by_type.items():
+        for chunk in chunked(ids):
+            existing.update(
+                (scope_type, scope_id) for scope_id in db.session.execute(
+                    select(AlarmCounter.scope_id).where(
+                        AlarmCounter.scope_type == scope_type, AlarmCounter.scope_id.in_(chunk)
+                    )
+                ).scalars()
+            )
+    return existing
+
+
+def _site_of(scope_type, scope_id):
+    if scope_type == 'site':
+        return scope_id
+    if scope_type == 'batiment':
+        return db.session.execute(select(Batiment.site_id).where(Batiment.id == scope_id)).scalar()
+    return db.session.execute(
+        select(Batiment.site_id).join(Etage, Etage.batiment_id == Batiment.id).where(Etage.id == scope_id)
+    ).scalar()
+
+
+def _apply_deltas(deltas):
+    deltas = {key: delta for key, delta in deltas.items() if any(delta.values())}
+    if not deltas:
+        return
+    missing = set(deltas) - _existing_keys(deltas)
+    if missing:
+        # Portée jamais calculée : son site est recalculé, modification comprise
+        refreshed = _refresh_missing({_site_of(*key) for key in missing})
+        # Course perdue : les lignes créées par l'autre worker ne comptent pas cette modification
+        skipped = missing - refreshed
+        skipped -= _existing_keys(skipped)
+        deltas = {key: delta for key, delta in deltas.items() if key not in refreshed and key not in skipped}
+        if not deltas:
+            return
+
+    table = AlarmCounter.__table__
+    stmt = (
+        update(table)
+        .where(table.c.scope_type == bindparam('b_scope_type'), table.c.scope_id == bindparam('b_scope_id'))
+        .values({**{field: table.c[field] + bindparam(f'd_{field}') for field in FIELDS},
+                 'updated_at': bindparam('b_now')})
+    )
+    now = current_time()
+    params = [
+        dict({'b_scope_type': scope_type, 'b_scope_id': scope_id, 'b_now': now},
+             **{f'd_{field}': delta.get(field, 0) for field in FIELDS})
+        for (scope_type, scope_id), delta in deltas.items()
+    ]
+    db.session.execute(stmt, params)
+
+
+def _expected_counters(site_ids=None):
+    """Recalcule les compteurs depuis l'historique ; site_ids=None pour tous les sites."""
+    site_query = select(Site.id)
+    batiment_query = select(Batiment.id, Batiment.site_id)
+    if site_ids is not None:
+        site_ids = list(site_ids)
+        site_query = site_query.where(Site.id.in_(site_ids))
+        batiment_query = batiment_query.where(Batiment.site_id.in_(site_ids))
+    else:
+        batiment_query = batiment_query.where(Batiment.site_id.isnot(None))
+
+    expected = {('site', site_id): Counter() for site_id in db.session.execute(site_query).scalars()}
+    batiments = dict(db.session.execute(batiment_query).all())
+    for batiment_id in batiments:
+        expected[('batiment', batiment_id)] = Counter()
+    if not batiments:
+        return expected
+
+    etages = {}
+    for chunk in chunked(batiments):
+        etages.update(db.session.execute(
+            select(Etage.id, Etage.batiment_id).where(Etage.batiment_id.in_(chunk))
+        ).all())
+    for etage_id in etages:
+        expected[('etage', etage_id)] = Counter()
+
+    in_scope = Baes.etage_id.in_(
+        select(Etage.id).join(Batiment, Batiment.id == Etage.batiment_id).where(
+            Batiment.site_id.in_(site_ids) if site_ids is not None else Batiment.site_id.isnot(None)
+        )
+    )
+    latest = latest_status_subquery(Status.baes_id.in_(select(Baes.id).where(in_scope)))
+    has_status = Status.id.isnot(None)
+    rows = db.session.execute(
+        select(
+            Baes.etage_id,
+            func.count(Baes.id),
+            func.sum(case((Status.erreur == CONNECTION_ERROR, 1), else_=0)),
+            func.sum(case((Status.erreur == BATTERY_ERROR, 1), else_=0)),
+            func.sum(case((Status.erreur == OK, 1), else_=0)),
+            func.sum(case((and_(has_status, Status.erreur != OK, Status.is_solved == false()), 1), else_=0)),
+        )
+        .outerjoin(latest, and_(latest.c.baes_id == Baes.id, latest.c.rn == 1))
+        .outerjoin(Status, Status.id == latest.c.status_id)
+        .where(in_scope)
+        .group_by(Baes.etage_id)
+    ).all()
+
+    for etage_id, total, connection_errors, battery_errors, ok, unsolved in rows:
+        counts = Counter({
+            'connection_errors': connection_errors or 0,
+            'battery_errors': battery_errors or 0,
+            'ok': ok or 0,
+            'unsolved': unsolved or 0,
+        })
+        counts['unknown'] = total - counts['connection_errors'] - counts['battery_errors'] - counts['ok']
+        batiment_id = etages.get(etage_id)
+        for key in _scope_keys(etage_id, batiment_id, batiments.get(batiment_id)):
+            expected.setdefault(key, Counter()).update(counts)
+    return expected
+
+
+def _delete_keys(keys):
+    by_type = defaultdict(set)
+    for scope_type, scope_id in keys:
+        by_type[scope_type].add(scope_id)
+    for scope_type, ids in by_type.items():
+        for chunk in chunked(ids):
+            db.session.execute(delete(AlarmCounter).where(
+                AlarmCounter.scope_type == scope_type, AlarmCounter.scope_id.in_(chunk)
+            ))
+
+
+def _write(expected):
+    _delete_keys(expected.keys())
+    now = current_time()
+    rows = [
+        dict({'scope_type': scope_type, 'scope_id': scope_id, 'created_at': now, 'updated_at': now},
+             **{field: counts.get(field, 0) for field in FIELDS})
+        for (scope_type, scope_id), counts in expected.items()
+    ]
+    if rows:
+        db.session.execute(insert(AlarmCounter), rows)
+
+
+def _refresh_missing(site_ids):
+    """
+    refresh_sites pour des portées encore sans ligne, dans un SAVEPOINT. Retourne les portées
+    réécrites, ou un ensemble vide si un autre worker a créé les mêmes lignes entre-temps.
+    """
+    try:
+        with db.session.begin_nested():
+            return refresh_sites(site_ids)
+    except IntegrityError:
+        return set()
+
+
+def create_empty_scope(scope_type, scope_id):
+    """
+    Compteurs à zéro d'une portée qui vient d'être créée (donc sans BAES), dans la transaction de
+    création. Rien pour un bâtiment ou un étage rattaché à aucun site (non compté).
+    """
+    if _site_of(scope_type, scope_id) is None:
+        return
+    now = current_time()
+    db.session.execute(insert(AlarmCounter).values(
+        scope_type=scope_type, scope_id=scope_id, created_at=now, updated_at=now, **dict.fromkeys(FIELDS, 0)
+    ))
+
+
+def create_missing():
+    """
+    Calcule les compteurs des portées qui n'en ont pas encore (bootstrap, données antérieures aux
+    compteurs) ; retourne le nombre de sites recalculés.
+    """
+    def counted(scope_type):
+        return select(AlarmCounter.scope_id).where(AlarmCounter.scope_type == scope_type)
+
+    site_ids = set(db.session.execute(select(Site.id).where(Site.id.not_in(counted('site')))).scalars())
+    site_ids.update(db.session.execute(
+        select(Batiment.site_id).where(Batiment.site_id.isnot(None), Batiment.id.not_in(counted('batiment')))
+    ).scalars())
+    site_ids.update(db.session.execute(
+        select(Batiment.site_id).join(Etage, Etage.batiment_id == Batiment.id)
+        .where(Batiment.site_id.isnot(None), Etage.id.not_in(counted('etage')))
+    ).scalars())
+    for chunk in chunked(sorted(site_ids)):
+        refresh_sites(chunk)
+    return len(site_ids)
+
+
+def refresh_sites(site_ids):
+    """
+    Recalcule entièrement les compteurs des sites donnés (et de leurs bâtiments et étages).
+    Retourne l'ensemble des portées réécrites.
+    """
+    site_ids = {site_id for site_id in site_ids if site_id is not None}
+    if not site_ids:
+        return set()
+    db.session.flush()
+    expected = _expected_counters(site_ids)
+    _write(expected)
+    return set(expected)
+
+
+def discard_scopes(scope_type, scope_ids):
+    """Supprime les compteurs de portées supprimées."""
+    _delete_keys((scope_type, scope_id) for scope_id in scope_ids)
+
+
+def counters_to_dict(counter):
+    result = {field: getattr(counter, field) for field in FIELDS}
+    result['total'] = sum(result[bucket] for bucket in BUCKETS)
+    result['updated_at'] = counter.updated_at.isoformat() if counter.updated_at else None
+    return result
+
+
+def get_counters(scope_type, scope_id):
+    """
+    Lecture O(1) des compteurs d'une portée. Si la portée n'a jamais été calculée,
+    son site est recalculé une fois (l'appelant valide la transaction).
+    Retourne None si la portée n'existe pas.
+    """
+    counter = AlarmCounter.query.filter_by(scope_type=scope_type, scope_id=scope_id).first()
+    if counter is None:
+        site_id = _site_of(scope_type, scope_id)
+        exists = {'site': Site, 'batiment': Batiment, 'etage': Etage}[scope_type]
+        if db.session.get(exists, scope_id) is None:
+            return None
+        if site_id is None:
+            # Bâtiment ou étage rattaché à aucun site : ses BAES ne sont pas comptés
+            return dict.fromkeys(FIELDS, 0) | {'total': 0, 'updated_at': None}
+        # Relu dans tous les cas : calculé ici ou, course perdue, par un autre worker
+        _refresh_missing([site_id])
+        counter = AlarmCounter.query.filter_by(scope_type=scope_type, scope_id=scope_id).first()
+    return counters_to_dict(counter)
+
+
+def reconcile(apply=True):
+    """
+    Recalcule tous les compteurs depuis l'historique et retourne les écarts
+    [{scope_type, scope_id, field, stored, expected}]. Avec apply=True, les compteurs
+    sont réécrits et les lignes orphelines supprimées.
+    """
+    db.session.flush()
+    expected = _expected_counters()
+    stored = {
+        (row.scope_type, row.scope_id): row
+        for row in AlarmCounter.query.all()
+    }
+    drift = []
+    for key in sorted(set(expected) | set(stored)):
+        counts = expected.get(key)
+        row = stored.get(key)
+        for field in FIELDS:
+            stored_value = getattr(row, field) if row is not None else None
+            expected_value = counts.get(field, 0) if counts is not None else None
+            if stored_value != expected_value and not (row is None and expected_value == 0):
+                drift.append({
+                    'scope_type': key[0],
+                    'scope_id': key[1],
+                    'field': field,
+                    'stored': stored_value,
+                    'expected': expected_value,
+                })
+    if apply:
+        _delete_keys(set(stored) - set(expected))
+        _write(expected)
+    return drift
@@ -0,0 +1,76 @@
+"""
+Écriture en masse des BAES (PUT /baes/bulk, POST /baes/import et tâche de fond 'baes.import').
+
+Les lignes arrivent normalisées par les routes ({'id', 'name', 'label', 'position', 'pos_x', 'pos_y',
+'etage_id', 'is_ignored'}, champs absents non modifiés) ; l'appelant valide la transaction.
+"""
+from sqlalchemy import insert, select, update
+
+from models import db, Baes, Etage
+from models.baes import position_coordinates
+from services import known_baes
+from services.alarm_counters import track_baes
+from services.batching import chunked
+from templates.TimestampMixin import current_time
+
+# Lignes écrites par requête executemany (avancement d'une tâche de fond entre deux lots)
+WRITE_BATCH = 1000
+
+
+def existing_baes_ids(ids):
+    existing = set()
+    for chunk in chunked(ids):
+        existing.update(db.session.execute(select(Baes.id).where(Baes.id.in_(chunk))).scalars())
+    return existing
+
+
+def missing_etage_ids(rows):
+    etage_ids = {r['etage_id'] for r in rows if r.get('etage_id') is not None}
+    found = set()
+    for chunk in chunked(etage_ids):
+        found.update(db.session.execute(select(Etage.id).where(Etage.id.in_(chunk))).scalars())
+    return sorted(etage_ids - found)
+
+
+def import_rows(rows, progress=None):
+    """
+    Met à jour les BAES existants et crée les autres, compteurs d'alarmes compris.
+    progress(faits, total) est appelé après chaque lot. Retourne {'created', 'updated'}.
+    """
+    existing = existing_baes_ids([r['id'] for r in rows])
+    counters = track_baes([r['id'] for r in rows if r['id'] in existing and 'etage_id' in r])
+    now = current_time()
+    to_insert, to_update = [], []
+    for row in rows:
+        if row['id'] in existing:
+            row['updated_at'] = now
+            to_update.append(row)
+        else:
+            position = row.get('position', {"x": 0, "y": 0})
+            pos_x, pos_y = position_coordinates(position)
+            to_insert.append({
+                'id': row['id'],
+                'name': row.get('name', f"BAES-{row['id']}"),
+                'label': row.get('label'),
+                'position': position,
+                'pos_x': pos_x,
+                'pos_y': pos_y,
+                'etage_id': row.get('etage_id'),
+                'is_ignored': row.get('is_ignored', False),
+                'created_at': now,
+                'updated_at': now
+            })
+
+    done = 0
+    for statement, batch_rows in ((insert(Baes), to_insert), (update(Baes), to_update)):
+        for batch in chunked(batch_rows, WRITE_BATCH):
+            db.session.execute(statement, batch)
+            done += len(batch)
+            if progress is not None:
+                progress(done, len(rows))
+    counters.add_new([r['id'] for r in to_insert if r['etage_id'] is not None])
+    counters.apply()
+    # Cache d'ingestion : un nom ou un label modifié est relu à la prochaine réception (services.known_baes)
+    known_baes.remember({r['id']: (r['name'], r['label']) for r in to_insert})
+    known_baes.discard([r['id'] for r in to_update if 'name' in r or 'label' in r])
+    return {'created': len(to_insert), 'updated': len(to_update)}
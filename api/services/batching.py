@@ -0,0 +1,9 @@
+# MSSQL limite une requête à 2100 paramètres : les clauses IN sont découpées en lots
+IN_CLAUSE_CHUNK = 1000
+
+
+def chunked(values, size=IN_CLAUSE_CHUNK):
+    """Découpe une séquence en listes de `size` éléments au plus."""
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
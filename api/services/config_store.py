@@ -0,0 +1,200 @@
+"""
+Cache de la table config : toutes les clés chargées en une requête, valeurs typées.
+
+Chaque écriture incrémente config_version (bump_version, dans la transaction de l'écriture).
+Un worker ne relit ce compteur qu'au plus toutes les CONFIG_CACHE_INTERVAL secondes et ne
+recharge la table que s'il a changé : les lectures sont servies depuis la mémoire, et une
+modification faite par un autre worker uwsgi (ou un autre conteneur) est vue au plus tard après
+l'intervalle. Le worker qui écrit invalide son cache immédiatement (invalidate).
+
+La table config_version porte aussi les compteurs d'autres caches en mémoire (une ligne par cache,
+voir COUNTERS) ; VersionWatch leur applique la même relecture espacée.
+
+Types (value_type) : string, integer, float, boolean, json ; la valeur reste stockée en texte.
+"""
+import json
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+
+from models import db, Config, ConfigVersion
+
+TYPES = ('string', 'integer', 'float', 'boolean', 'json')
+DEFAULT_CACHE_INTERVAL = 5.0
+MAX_VALUE_LENGTH = 255
+
+# Lignes de config_version : un compteur par cache en mémoire partagé entre workers
+CONFIG_COUNTER = 1
+VISIBILITY_COUNTER = 2  # services.visibility
+KNOWN_BAES_COUNTER = 3  # services.known_baes
+COUNTERS = (CONFIG_COUNTER, VISIBILITY_COUNTER, KNOWN_BAES_COUNTER)
+
+_cache = {'version': None, 'entries': {}, 'checked_at': 0.0}
+_cache_lock = threading.Lock()
+
+
+class ConfigValueError(ValueError):
+    """Valeur incompatible avec le type demandé ou trop longue pour la colonne."""
+
+
+def infer_type(value):
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'integer'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str):
+        return 'string'
+    return 'json'
+
+
+def encode(value, value_type=None):
+    """(texte stocké, type) ; une chaîne avec un type explicite est convertie ('42' en integer)."""
+    value_type = value_type or infer_type(value)
+    if value_type not in TYPES:
+        raise ConfigValueError(f"Type inconnu '{value_type}' (attendu : {', '.join(TYPES)})")
+    try:
+        if isinstance(value, str) and value_type != 'string':
+            value = decode(value, value_type)
+        if value_type == 'string':
+            if not isinstance(value, str):
+                raise ConfigValueError("Une valeur de type string doit être une chaîne")
+            text = value
+        elif value_type == 'boolean':
+            if not isinstance(value, bool):
+                raise ConfigValueError("Une valeur de type boolean doit valoir true ou false")
+            text = 'true' if value else 'false'
+        elif value_type == 'integer':
+            if isinstance(value, bool) or int(value) != value:
+                raise ConfigValueError("Une valeur de type integer doit être un entier")
+            text = str(int(value))
+        elif value_type == 'float':
+            if isinstance(value, bool):
+                raise ConfigValueError("Une valeur de type float doit être un nombre")
+            text = repr(float(value))
+        else:
+            text = json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+    except (TypeError, ValueError) as e:
+        if isinstance(e, ConfigValueError):
+            raise
+        raise ConfigValueError(f"Valeur invalide pour le type {value_type} : {e}")
+    if len(text) > MAX_VALUE_LENGTH:
+        raise ConfigValueError(f"Valeur trop longue ({len(text)} caractères, {MAX_VALUE_LENGTH} au maximum)")
+    return text, value_type
+
+
+def decode(text, value_type):
+    if value_type == 'integer':
+        return int(text)
+    if value_type == 'float':
+        return float(text)
+    if value_type == 'boolean':
+        if text.strip().lower() not in ('true', 'false', '1', '0'):
+            raise ValueError(f"booléen attendu, reçu '{text}'")
+        return text.strip().lower() in ('true', '1')
+    if value_type == 'json':
+        return json.loads(text)
+    return text
+
+
+def to_dict(config):
+    """Représentation d'une ligne Config avec sa valeur typée."""
+    value_type = config.value_type or 'string'
+    try:
+        value = decode(config.value, value_type)
+    except ValueError:
+        # Valeur écrite hors API et illisible dans son type : renvoyée telle quelle
+        value = config.value
+    return {'id': config.id, 'key': config.key, 'value': value, 'type': value_type}
+
+
+def bump_version(counter_id=CONFIG_COUNTER, session=None):
+    """
+    Incrémente un compteur de config_version dans la transaction courante (toute écriture de config
+    pour CONFIG_COUNTER). `session` : session de la transaction, db.session par défaut.
+    """
+    session = session or db.session
+    result = session.execute(
+        update(ConfigVersion).where(ConfigVersion.id == counter_id).values(version=ConfigVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        session.execute(insert(ConfigVersion).values(id=counter_id, version=1))
+
+
+def invalidate():
+    """Force la vérification de version à la prochaine lecture (après commit d'une écriture locale)."""
+    with _cache_lock:
+        _cache['checked_at'] = 0.0
+
+
+def stored_version(counter_id=CONFIG_COUNTER):
+    return db.session.execute(select(ConfigVersion.version).where(ConfigVersion.id == counter_id)).scalar() or 0
+
+
+class VersionWatch:
+    """
+    Version d'un compteur de config_version, relue au plus toutes les CONFIG_CACHE_INTERVAL secondes.
+    Un cache construit sous une version est périmé dès que current() en retourne une autre.
+    """
+
+    def __init__(self, counter_id):
+        self.counter_id = counter_id
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        interval = current_app.config.get('CONFIG_CACHE_INTERVAL', DEFAULT_CACHE_INTERVAL)
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._checked_at < interval:
+                return self._version
+        version = stored_version(self.counter_id)
+        with self._lock:
+            self._version, self._checked_at = version, now
+        return version
+
+    def expire(self):
+        """Force la relecture au prochain appel (après commit d'une écriture locale)."""
+        with self._lock:
+            self._checked_at = 0.0
+
+
+def _entries():
+    """Entrées du cache, rechargées si la version en base a changé depuis le dernier chargement."""
+    interval = current_app.config.get('CONFIG_CACHE_INTERVAL', DEFAULT_CACHE_INTERVAL)
+    now = time.monotonic()
+    with _cache_lock:
+        if _cache['version'] is not None and now - _cache['checked_at'] < interval:
+            return _cache['entries'], _cache['version']
+    version = stored_version()
+    with _cache_lock:
+        if version == _cache['version']:
+            _cache['checked_at'] = now
+            return _cache['entries'], version
+    entries = {config.key: to_dict(config) for config in Config.query.order_by(Config.id).all()}
+    with _cache_lock:
+        _cache.update(version=version, entries=entries, checked_at=now)
+    return entries, version
+
+
+def all_entries():
+    """(liste des configurations, version du cache)."""
+    entries, version = _entries()
+    return list(entries.values()), version
+
+
+def get_many(keys):
+    """(configurations des clés demandées présentes, dans l'ordre demandé ; version du cache)."""
+    entries, version = _entries()
+    return [entries[key] for key in dict.fromkeys(keys) if key in entries], version
+
+
+def get(key, default=None):
+    """Valeur typée d'une clé, pour usage interne."""
+    entries, _ = _entries()
+    entry = entries.get(key)
+    return entry['value'] if entry is not None else default
@@ -0,0 +1,189 @@
+"""
+Export de l'historique des status en flux (CSV ou Parquet), à mémoire constante.
+
+Les status filtrés (mêmes filtres que l'historique, services.status_history) sont joints aux
+noms du BAES, de l'étage, du bâtiment et du site et lus par paquets de lignes (yield_per :
+curseur côté serveur quand le pilote le permet, lecture incrémentale sinon). Chaque paquet est
+écrit puis rendu aussitôt : un bloc de texte CSV, ou un row group Parquet. La mémoire ne dépend
+que de la taille d'un paquet, jamais du nombre de lignes exportées.
+
+Parquet nécessite pyarrow (pip install ".[export]") ; sans lui, seul le CSV est proposé.
+"""
+import csv
+import io
+from datetime import timezone
+
+from sqlalchemy import select
+
+from models import db, Baes, Batiment, Etage, Site, Status, User
+
+FORMATS = ('csv', 'parquet')
+MIMETYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+# Lignes lues et écrites par paquet (un row group Parquet par paquet) : la mémoire d'un export
+# est proportionnelle à cette taille (quelques ko par ligne en Python avant conversion Arrow)
+CHUNK_ROWS = {'csv': 10000, 'parquet': 25000}
+
+COLUMNS = (
+    'status_id', 'timestamp', 'baes_id', 'baes_name', 'baes_label', 'etage_id', 'etage_name',
+    'batiment_id', 'batiment_name', 'site_id', 'site_name', 'erreur', 'is_solved', 'temperature',
+    'vibration', 'acknowledged_by_login', 'acknowledged_at',
+)
+TIMESTAMP_COLUMNS = (COLUMNS.index('timestamp'), COLUMNS.index('acknowledged_at'))
+
+
+class ExportError(ValueError):
+    """Format d'export invalide ou indisponible (message destiné au client, réponse 400)."""
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_query(criteria):
+    """Status filtrés avec les noms de leur emplacement, dans l'ordre chronologique (index timestamp, id)."""
+    return (
+        select(Status.id, Status.timestamp, Status.baes_id, Baes.name, Baes.label, Etage.id, Etage.name,
+               Batiment.id, Batiment.name, Site.id, Site.name, Status.erreur, Status.is_solved,
+               Status.temperature, Status.vibration, User.login, Status.acknowledged_at)
+        .join(Baes, Baes.id == Status.baes_id)
+        .outerjoin(Etage, Etage.id == Baes.etage_id)
+        .outerjoin(Batiment, Batiment.id == Etage.batiment_id)
+        .outerjoin(Site, Site.id == Batiment.site_id)
+        .outerjoin(User, User.id == Status.acknowledged_by_user_id)
+        .where(*criteria)
+        .order_by(Status.timestamp, Status.id)
+    )
+
+
+def _as_utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Fichier en écriture seule dont le contenu est récupéré (drain) après chaque row group."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+class StatusExport:
+    """
+    Export itérable (blocs d'octets) :
+        export = StatusExport(criteria, 'csv').open()   # requête exécutée ici
+        for block in export: ...
+        export.rows                                      # lignes écrites
+    """
+
+    def __init__(self, criteria, fmt='csv', chunk_rows=None):
+        if fmt not in FORMATS:
+            raise ExportError(f"format doit valoir {', '.join(FORMATS)}")
+        if fmt == 'parquet' and not parquet_available():
+            raise ExportError("Export Parquet indisponible : pyarrow n'est pas installé")
+        self.criteria = criteria
+        self.format = fmt
+        self.chunk_rows = chunk_rows or CHUNK_ROWS[fmt]
+        self.rows = 0
+        self._result = None
+
+    @property
+    def mimetype(self):
+        return MIMETYPES[self.format]
+
+    def open(self):
+        """Exécute la requête (erreur de base levée avant le premier octet envoyé)."""
+        self._result = db.session.execute(
+            export_query(self.criteria).execution_options(yield_per=self.chunk_rows)
+        )
+        return self
+
+    def _chunks(self):
+        if self._result is None:
+            self.open()
+        try:
+            for rows in self._result.partitions():
+                self.rows += len(rows)
+                yield rows
+        finally:
+            self._result.close()
+
+    def __iter__(self):
+        return self._csv() if self.format == 'csv' else self._parquet()
+
+    def _csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(COLUMNS)
+        for rows in self._chunks():
+            for row in rows:
+                values = list(row)
+                for index in TIMESTAMP_COLUMNS:
+                    if values[index] is not None:
+                        values[index] = _as_utc(values[index]).isoformat()
+                writer.writerow(values)
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+
+    def _parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        timestamp = pa.timestamp('us', tz='UTC')
+        schema = pa.schema([
+            ('status_id', pa.int64()), ('timestamp', timestamp), ('baes_id', pa.int64()),
+            ('baes_name', pa.string()), ('baes_label', pa.string()), ('etage_id', pa.int64()),
+            ('etage_name', pa.string()), ('batiment_id', pa.int64()), ('batiment_name', pa.string()),
+            ('site_id', pa.int64()), ('site_name', pa.string()), ('erreur', pa.int32()),
+            ('is_solved', pa.bool_()), ('temperature', pa.float64()), ('vibration', pa.bool_()),
+            ('acknowledged_by_login', pa.string()), ('acknowledged_at', timestamp),
+        ])
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        try:
+            for rows in self._chunks():
+                columns = list(zip(*rows))
+                for index in TIMESTAMP_COLUMNS:
+                    columns[index] = [_as_utc(value) for value in columns[index]]
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    def write_to(self, stream):
+        """Écrit tout l'export dans un fichier binaire ouvert ; retourne le nombre d'octets."""
+        size = 0
+        for block in self:
+            stream.write(block)
+            size += len(block)
+        return size
@@ -0,0 +1,141 @@
+"""
+Requêtes spatiales sur le plan d'un étage : zone affichée (bbox) et regroupement des BAES.
+
+Les coordonnées sont celles de Baes.position ({"x", "y"}, dans le repère du plan de l'étage),
+copiées dans les colonnes numériques pos_x et pos_y et indexées par étage
+(ix_baes_etage_position). Une zone ?bbox=min_x,min_y,max_x,max_y devient un intervalle sur
+pos_x et un filtre sur pos_y pour cet étage.
+
+Le regroupement suit le niveau de zoom de la carte (Carte.zoom, repère Leaflet CRS.Simple : une
+unité du plan vaut 2^zoom pixels à l'écran). Le plan est découpé en cellules de radius / 2^zoom
+unités ; la base calcule pour chaque cellule le nombre de BAES, leur barycentre, leur emprise et
+leur nombre par catégorie de dernier status (comme les compteurs d'alarmes). Seules les
+cellules quittent la base, jamais les BAES un à un.
+"""
+from sqlalchemy import and_, case, false, func, select, update
+
+from models import db, Baes, Status
+from models.baes import position_coordinates
+from services.alarm_counters import BATTERY_ERROR, CONNECTION_ERROR, OK
+from services.batching import chunked
+from services.status_queries import latest_status_subquery, located_in
+
+DEFAULT_CLUSTER_RADIUS = 60
+MIN_ZOOM, MAX_ZOOM = -8, 12
+# Catégories de dernier status, de la plus grave à la moins grave
+SEVERITY = ('connection_errors', 'battery_errors', 'unknown', 'ok')
+BACKFILL_BATCH = 1000
+
+
+class MapQueryError(ValueError):
+    """Paramètre de zone ou de zoom invalide (message destiné au client, réponse 400)."""
+
+
+def parse_bbox(raw):
+    """'min_x,min_y,max_x,max_y' -> tuple de 4 flottants, ou None si absent."""
+    if raw is None or raw == '':
+        return None
+    try:
+        values = tuple(float(value) for value in raw.split(','))
+    except ValueError:
+        values = ()
+    if len(values) != 4:
+        raise MapQueryError("bbox doit valoir min_x,min_y,max_x,max_y")
+    min_x, min_y, max_x, max_y = values
+    if min_x > max_x or min_y > max_y:
+        raise MapQueryError("bbox : min_x et min_y doivent précéder max_x et max_y")
+    return values
+
+
+def bbox_criteria(bbox):
+    """Prédicats sur Baes pour une zone (bornes incluses) ; aucun si bbox est None."""
+    if bbox is None:
+        return []
+    min_x, min_y, max_x, max_y = bbox
+    return [Baes.pos_x >= min_x, Baes.pos_x <= max_x, Baes.pos_y >= min_y, Baes.pos_y <= max_y]
+
+
+def cell_size(zoom, radius=DEFAULT_CLUSTER_RADIUS):
+    """Côté d'une cellule, en unités du plan, pour un rayon de regroupement en pixels écran."""
+    if not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        raise MapQueryError(f"zoom doit être compris entre {MIN_ZOOM} et {MAX_ZOOM}")
+    if radius <= 0:
+        raise MapQueryError("radius doit être positif")
+    return radius / 2.0 ** zoom
+
+
+def clusters(etage_id, size, bbox=None):
+    """
+    Cellules de `size` unités des BAES de l'étage (dans bbox si fournie). Retourne
+    (cellules, nombre de BAES sans coordonnées) ; une requête.
+    """
+    latest = latest_status_subquery(located_in(etage_id=etage_id))
+    placed_criteria = and_(Baes.pos_x.isnot(None), Baes.pos_y.isnot(None))
+    # Cellule calculée dans une sous-requête : le GROUP BY porte sur ses colonnes (MSSQL refuse
+    # de regrouper sur une expression contenant un paramètre lié)
+    placed = (
+        select(
+            Baes.id.label('baes_id'), Baes.pos_x, Baes.pos_y,
+            # Les BAES sans coordonnées forment la cellule (NULL, NULL)
+            case((placed_criteria, func.floor(Baes.pos_x / size))).label('cell_x'),
+            case((placed_criteria, func.floor(Baes.pos_y / size))).label('cell_y'),
+            Status.id.label('status_id'), Status.erreur, Status.is_solved,
+        )
+        .outerjoin(latest, and_(latest.c.baes_id == Baes.id, latest.c.rn == 1))
+        .outerjoin(Status, Status.id == latest.c.status_id)
+        .where(Baes.etage_id == etage_id, *bbox_criteria(bbox))
+        .subquery('placed')
+    )
+    has_status = placed.c.status_id.isnot(None)
+    rows = db.session.execute(
+        select(
+            placed.c.cell_x, placed.c.cell_y, func.count(), func.min(placed.c.baes_id),
+            func.avg(placed.c.pos_x), func.avg(placed.c.pos_y),
+            func.min(placed.c.pos_x), func.min(placed.c.pos_y),
+            func.max(placed.c.pos_x), func.max(placed.c.pos_y),
+            func.sum(case((placed.c.erreur == CONNECTION_ERROR, 1), else_=0)),
+            func.sum(case((placed.c.erreur == BATTERY_ERROR, 1), else_=0)),
+            func.sum(case((placed.c.erreur == OK, 1), else_=0)),
+            func.sum(case((and_(has_status, placed.c.erreur != OK, placed.c.is_solved == false()), 1), else_=0)),
+        )
+        .group_by(placed.c.cell_x, placed.c.cell_y)
+    ).all()
+
+    result, unplaced = [], 0
+    for (cell_x, cell_y, count, first_id, x, y, min_x, min_y, max_x, max_y,
+         connection_errors, battery_errors, ok, unsolved) in rows:
+        if cell_x is None or cell_y is None:
+            unplaced += count
+            continue
+        counts = {
+            'connection_errors': int(connection_errors or 0),
+            'battery_errors': int(battery_errors or 0),
+            'ok': int(ok or 0),
+        }
+        counts['unknown'] = count - sum(counts.values())
+        result.append({
+            'x': float(x),
+            'y': float(y),
+            'count': count,
+            'worst': next(category for category in SEVERITY if counts[category]),
+            'counts': counts,
+            'unsolved': int(unsolved or 0),
+            'bounds': [min_x, min_y, max_x, max_y],
+            'baes_id': first_id if count == 1 else None
+        })
+    result.sort(key=lambda cell: (cell['y'], cell['x']))
+    return result, unplaced
+
+
+def backfill_coordinates():
+    """Remplit pos_x et pos_y depuis position pour tous les BAES (bootstrap) ; retourne le nombre de BAES lus."""
+    ids = db.session.execute(select(Baes.id).order_by(Baes.id)).scalars().all()
+    for chunk in chunked(ids, BACKFILL_BATCH):
+        rows = db.session.execute(select(Baes.id, Baes.position).where(Baes.id.in_(chunk))).all()
+        updates = []
+        for baes_id, position in rows:
+            pos_x, pos_y = position_coordinates(position)
+            updates.append({'id': baes_id, 'pos_x': pos_x, 'pos_y': pos_y})
+        if updates:
+            db.session.execute(update(Baes), updates)
+    return len(ids)
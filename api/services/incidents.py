@@ -0,0 +1,319 @@
+"""
+Épisodes de panne (table incidents) dérivés des status à l'ingestion.
+
+Un BAES envoie son code courant à chaque trame. Pour une trame de code c :
+- les incidents ouverts du BAES d'un autre code sont clos, sauf si c est une perte de
+  connexion (0) : l'état réel du BAES est alors inconnu, une panne batterie reste ouverte ;
+- si c n'est pas 6 (OK) et qu'aucun incident de code c n'est ouvert, un incident est ouvert.
+Une suite de trames identiques ne coûte donc qu'une lecture des incidents ouverts du BAES.
+
+L'acquittement porte sur l'incident : acquitter l'un de ses status acquitte l'incident, et
+acquitter l'incident acquitte tous ses status. Les listes d'alarmes ouvertes et les durées
+moyennes (MTTR, MTTA) lisent cette table au lieu de l'historique complet.
+
+Un index unique filtré (uq_incident_open) garantit un seul incident ouvert par BAES et par
+code : un worker qui perd la course à l'ouverture garde l'incident de l'autre (SAVEPOINT).
+rebuild() recalcule les incidents depuis l'historique (bootstrap, flask incidents rebuild).
+Aucune fonction ne fait de commit : l'appelant valide avec le reste de la transaction.
+"""
+from collections import defaultdict
+
+from sqlalchemy import Float, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from models import db, Baes, Incident, Status
+from services.batching import chunked
+from services.status_queries import baes_located_in
+
+CONNECTION_ERROR = 0
+OK = 6
+# BAES traités par lecture de l'historique dans rebuild()
+REBUILD_BATCH = 100
+INSERT_BATCH = 1000
+
+
+# ===== Durées =====
+
+class seconds_between(FunctionElement):
+    """Nombre de secondes de `start` à `end`, calculé par la base."""
+    type = Float()
+    inherit_cache = True
+    name = 'seconds_between'
+
+
+@compiles(seconds_between)
+def _seconds_between_default(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"EXTRACT(EPOCH FROM ({end} - {start}))"
+
+
+@compiles(seconds_between, 'mssql')
+def _seconds_between_mssql(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"CAST(DATEDIFF(second, {start}, {end}) AS FLOAT)"
+
+
+@compiles(seconds_between, 'sqlite')
+def _seconds_between_sqlite(element, compiler, **kw):
+    start, end = (compiler.process(clause, **kw) for clause in element.clauses)
+    return f"((julianday({end}) - julianday({start})) * 86400.0)"
+
+
+# ===== Transitions =====
+
+def transition(open_codes, erreur):
+    """(codes des incidents à clore, code de l'incident à ouvrir ou None) pour une trame `erreur`."""
+    if erreur == CONNECTION_ERROR:
+        close = []
+    else:
+        close = [code for code in open_codes if code != erreur]
+    opened = erreur if erreur != OK and erreur not in open_codes else None
+    return close, opened
+
+
+def _open_incidents(baes_ids):
+    """{baes_id: {erreur: Incident}} des incidents ouverts (une requête par lot)."""
+    found = defaultdict(dict)
+    for chunk in chunked(sorted(baes_ids)):
+        rows = db.session.execute(
+            select(Incident).where(Incident.baes_id.in_(chunk), Incident.closed_at.is_(None))
+        ).scalars()
+        for incident in rows:
+            found[incident.baes_id][incident.erreur] = incident
+    return found
+
+
+def _open(baes_id, status):
+    """Ouvre un incident ; retourne l'incident ouvert par un autre worker si la course est perdue."""
+    incident = Incident(baes_id=baes_id, erreur=status.erreur, opened_at=status.timestamp,
+                        opening_status_id=status.id)
+    try:
+        with db.session.begin_nested():
+            db.session.add(incident)
+    except IntegrityError:
+        incident = db.session.execute(
+            select(Incident).where(Incident.baes_id == baes_id, Incident.erreur == status.erreur,
+                                   Incident.closed_at.is_(None))
+        ).scalar_one_or_none()
+    return incident
+
+
+def record(statuses):
+    """
+    Applique aux incidents des status insérés et flushés (id et timestamp connus), dans l'ordre
+    d'arrivée par BAES. Retourne le nombre d'incidents ouverts et clos.
+    """
+    if not statuses:
+        return 0
+    db.session.flush()
+    frames = defaultdict(list)
+    for status in statuses:
+        frames[status.baes_id].append(status)
+    open_by_baes = _open_incidents(frames)
+    changes = 0
+    for baes_id, baes_frames in frames.items():
+        current = open_by_baes[baes_id]
+        for status in sorted(baes_frames, key=lambda s: (s.timestamp, s.id)):
+            close, opened = transition(current, status.erreur)
+            for code in close:
+                incident = current.pop(code)
+                incident.closed_at = status.timestamp
+                incident.closing_status_id = status.id
+                changes += 1
+            if opened is not None:
+                incident = _open(baes_id, status)
+                if incident is not None:
+                    current[opened] = incident
+                    changes += 1
+    return changes
+
+
+# ===== Acquittement =====
+
+def _status_window(incident):
+    """Prédicats des status d'un incident : même BAES et même code, de l'ouverture à la clôture."""
+    criteria = [Status.baes_id == incident.baes_id, Status.erreur == incident.erreur,
+                Status.timestamp >= incident.opened_at]
+    if incident.closed_at is not None:
+        criteria.append(Status.timestamp < incident.closed_at)
+    return criteria
+
+
+def incident_of(status):
+    """Incident auquel appartient un status (None pour un status 6 ou hors épisode)."""
+    return db.session.execute(
+        select(Incident)
+        .where(Incident.baes_id == status.baes_id, Incident.erreur == status.erreur,
+               Incident.opened_at <= status.timestamp,
+               or_(Incident.closed_at.is_(None), Incident.closed_at > status.timestamp))
+        .order_by(Incident.opened_at.desc(), Incident.id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def set_acknowledgement(incident, is_solved, user_id, at):
+    """Acquitte l'incident (le premier acquittement est conservé) ou retire son acquittement."""
+    if is_solved:
+        if incident.acknowledged_at is None:
+            incident.acknowledged_by_user_id = user_id
+            incident.acknowledged_at = at
+    else:
+        incident.acknowledged_by_user_id = None
+        incident.acknowledged_at = None
+
+
+def acknowledge_from_status(status, user_id, at):
+    """Reporte sur son incident l'acquittement (ou le désacquittement) d'un status."""
+    incident = incident_of(status)
+    if incident is not None:
+        set_acknowledgement(incident, status.is_solved, user_id, at)
+    return incident
+
+
+def acknowledge_statuses_of(incident, is_solved, user_id, at):
+    """Passe à `is_solved` les status de l'incident qui ne l'étaient pas (un UPDATE) ; retourne leur nombre."""
+    result = db.session.execute(
+        update(Status)
+        .where(*_status_window(incident), Status.is_solved != is_solved)
+        .values(is_solved=is_solved, acknowledged_by_user_id=user_id, acknowledged_at=at)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def acknowledge_open(pairs, is_solved, user_id, at):
+    """
+    Reporte un acquittement en masse sur les incidents ouverts des couples (baes_id, erreur)
+    concernés : un UPDATE par code et par lot de BAES. Retourne le nombre d'incidents modifiés.
+    """
+    baes_by_erreur = defaultdict(set)
+    for baes_id, erreur in pairs:
+        baes_by_erreur[erreur].add(baes_id)
+    if is_solved:
+        changing, values = Incident.acknowledged_at.is_(None), {'acknowledged_by_user_id': user_id,
+                                                                'acknowledged_at': at}
+    else:
+        changing, values = Incident.acknowledged_at.is_not(None), {'acknowledged_by_user_id': None,
+                                                                   'acknowledged_at': None}
+    changed = 0
+    for erreur, baes_ids in sorted(baes_by_erreur.items()):
+        for chunk in chunked(sorted(baes_ids)):
+            result = db.session.execute(
+                update(Incident)
+                .where(Incident.erreur == erreur, Incident.baes_id.in_(chunk),
+                       Incident.closed_at.is_(None), changing)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            changed += result.rowcount
+    return changed
+
+
+# ===== Lectures =====
+
+def scope_criteria(etage_id=None, batiment_id=None, site_id=None, baes_ids=None, erreurs=None, scope=None):
+    """Prédicats sur Incident : portée géographique, BAES, codes et visibilité de l'utilisateur."""
+    criteria = []
+    located = baes_located_in(etage_id, batiment_id, site_id)
+    if located is not None:
+        criteria.append(Incident.baes_id.in_(located))
+    if baes_ids:
+        criteria.append(Incident.baes_id.in_(baes_ids))
+    if erreurs:
+        criteria.append(Incident.erreur.in_(erreurs))
+    if scope is not None and not scope.is_global:
+        criteria.append(Incident.baes_id.in_(select(Baes.id).where(scope.baes(include_unassigned=True))))
+    return criteria
+
+
+def statistics(criteria, start, end):
+    """
+    Par code d'erreur : incidents ouverts actuellement, ouverts et clos sur [start, end),
+    durée moyenne jusqu'à la clôture (MTTR) et jusqu'à l'acquittement (MTTA), en secondes.
+    Trois requêtes groupées sur la table incidents.
+    """
+    stats = defaultdict(lambda: {'open': 0, 'opened': 0, 'closed': 0, 'mttr_seconds': None,
+                                 'acknowledged': 0, 'mtta_seconds': None})
+    rows = db.session.execute(
+        select(Incident.erreur, func.count())
+        .where(*criteria, Incident.closed_at.is_(None))
+        .group_by(Incident.erreur)
+    ).all()
+    for erreur, count in rows:
+        stats[erreur]['open'] = count
+
+    rows = db.session.execute(
+        select(Incident.erreur, func.count(),
+               func.count(Incident.acknowledged_at),
+               func.avg(seconds_between(Incident.opened_at, Incident.acknowledged_at)))
+        .where(*criteria, Incident.opened_at >= start, Incident.opened_at < end)
+        .group_by(Incident.erreur)
+    ).all()
+    for erreur, opened, acknowledged, mtta in rows:
+        stats[erreur].update(opened=opened, acknowledged=acknowledged,
+                             mtta_seconds=round(mtta, 1) if mtta is not None else None)
+
+    rows = db.session.execute(
+        select(Incident.erreur, func.count(),
+               func.avg(seconds_between(Incident.opened_at, Incident.closed_at)))
+        .where(*criteria, Incident.closed_at >= start, Incident.closed_at < end)
+        .group_by(Incident.erreur)
+    ).all()
+    for erreur, closed, mttr in rows:
+        stats[erreur].update(closed=closed, mttr_seconds=round(mttr, 1) if mttr is not None else None)
+    return [{'erreur': erreur, **values} for erreur, values in sorted(stats.items())]
+
+
+# ===== Reconstruction =====
+
+def _replay(baes_id, rows, output):
+    """Rejoue l'historique d'un BAES (trié par timestamp, id) ; ajoute ses incidents à `output`."""
+    current = {}
+    for status_id, erreur, timestamp, is_solved, acknowledged_by, acknowledged_at in rows:
+        close, opened = transition(current, erreur)
+        for code in close:
+            incident = current.pop(code)
+            incident.update(closed_at=timestamp, closing_status_id=status_id)
+            output.append(incident)
+        if opened is not None:
+            current[opened] = {'baes_id': baes_id, 'erreur': erreur, 'opened_at': timestamp,
+                               'closed_at': None, 'opening_status_id': status_id, 'closing_status_id': None,
+                               'acknowledged_by_user_id': None, 'acknowledged_at': None}
+        incident = current.get(erreur)
+        if incident is not None and is_solved and acknowledged_at is not None and incident['acknowledged_at'] is None:
+            incident.update(acknowledged_by_user_id=acknowledged_by, acknowledged_at=acknowledged_at)
+    output.extend(current.values())
+
+
+def rebuild(baes_ids=None):
+    """
+    Recalcule les incidents de tous les BAES (ou de `baes_ids`) depuis l'historique des status,
+    REBUILD_BATCH BAES à la fois. Retourne le nombre d'incidents créés.
+    """
+    if baes_ids is None:
+        db.session.execute(delete(Incident))
+        baes_ids = db.session.execute(select(Baes.id).order_by(Baes.id)).scalars().all()
+    else:
+        baes_ids = sorted(set(baes_ids))
+        for chunk in chunked(baes_ids):
+            db.session.execute(delete(Incident).where(Incident.baes_id.in_(chunk)))
+    created = 0
+    for chunk in chunked(baes_ids, REBUILD_BATCH):
+        rows = db.session.execute(
+            select(Status.baes_id, Status.id, Status.erreur, Status.timestamp, Status.is_solved,
+                   Status.acknowledged_by_user_id, Status.acknowledged_at)
+            .where(Status.baes_id.in_(chunk))
+            .order_by(Status.baes_id, Status.timestamp, Status.id)
+        ).all()
+        by_baes = defaultdict(list)
+        for baes_id, *frame in rows:
+            by_baes[baes_id].append(frame)
+        output = []
+        for baes_id, frames in by_baes.items():
+            _replay(baes_id, frames, output)
+        for batch in chunked(output, INSERT_BATCH):
+            db.session.execute(insert(Incident), batch)
+        created += len(output)
+    return created
@@ -0,0 +1,235 @@
+"""
+Instrumentation par requête : nombre de requêtes SQL, temps passé en base et latence.
+
+- Chaque requête HTTP compte ses instructions SQL et leur durée (événements SQLAlchemy sur tous
+  les moteurs, réplica compris) ; la réponse porte un en-tête Server-Timing lisible dans les
+  outils de développement du navigateur : db;dur=12.4;desc="8 SQL", app;dur=40.2
+- Les latences, nombres de requêtes SQL et temps base sont agrégés par endpoint Flask
+  (blueprint.vue) dans des histogrammes exposés au format Prometheus sur GET /metrics.
+- Au-delà de QUERY_BUDGET requêtes SQL, un avertissement est journalisé avec l'endpoint : c'est
+  le signe d'un N+1.
+
+Les métriques sont propres à chaque processus : elles portent le label worker (pid), à sommer
+côté Prometheus (sum by (endpoint) (...)).
+
+Configuration : INSTRUMENTATION_ENABLED (true), QUERY_BUDGET (50, 0 pour désactiver),
+SERVER_TIMING (true), METRICS_ENABLED (true).
+"""
+import os
+import threading
+import time
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+DEFAULT_QUERY_BUDGET = 50
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+
+    def inc(self, labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Histogramme cumulatif à bornes fixes (buckets Prometheus)."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['counts'][i] += 1
+                break
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+class Registry:
+    """Métriques du processus ; un verrou unique suffit (mises à jour de quelques microsecondes)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter('http_requests_total', "Requêtes HTTP traitées.")
+        self.latency = Histogram('http_request_duration_seconds', "Durée de traitement des requêtes HTTP.",
+                                 LATENCY_BUCKETS)
+        self.queries = Histogram('http_request_db_queries', "Instructions SQL exécutées par requête HTTP.",
+                                 QUERY_BUCKETS)
+        self.db_time = Histogram('http_request_db_seconds', "Temps passé en base par requête HTTP.",
+                                 LATENCY_BUCKETS)
+        self.over_budget = Counter('http_request_query_budget_exceeded_total',
+                                   "Requêtes HTTP ayant dépassé QUERY_BUDGET instructions SQL.")
+
+    def record(self, endpoint, method, status, duration, query_count, db_seconds, over_budget):
+        worker = ('worker', os.getpid())
+        labels = (('endpoint', endpoint), ('method', method), worker)
+        with self.lock:
+            self.requests.inc(labels + (('status', status),))
+            self.latency.observe(labels, duration)
+            self.queries.observe(labels, query_count)
+            self.db_time.observe(labels, db_seconds)
+            if over_budget:
+                self.over_budget.inc(labels)
+
+    def render(self, extra_lines=()):
+        with self.lock:
+            lines = []
+            for metric in (self.requests, self.latency, self.queries, self.db_time, self.over_budget):
+                lines.extend(metric.render())
+        lines.extend(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+# ===== Comptage des instructions SQL =====
+# Enregistré une fois sur la classe Engine : couvre le primaire, le réplica et les moteurs des benchmarks.
+# Hors requête HTTP (CLI, poller des flux), rien n'est compté.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'sql_count' in g:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts or not has_request_context() or 'sql_count' not in g:
+        return
+    g.sql_time += time.perf_counter() - starts.pop()
+    g.sql_count += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    # Une instruction en erreur ne passe pas par after_cursor_execute : on retire son horodatage
+    connection = exception_context.connection
+    if connection is not None:
+        starts = connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+# ===== Hooks de requête =====
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+
+
+def _finish_request(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    duration = time.perf_counter() - start
+    query_count = g.get('sql_count', 0)
+    db_seconds = g.get('sql_time', 0.0)
+    endpoint = request.endpoint or '<unmatched>'
+
+    budget = current_app.config.get('QUERY_BUDGET', DEFAULT_QUERY_BUDGET)
+    over_budget = bool(budget) and query_count > budget
+    if over_budget:
+        current_app.logger.warning(
+            f"Budget de requêtes SQL dépassé : {endpoint} ({request.method} {request.path}) "
+            f"a exécuté {query_count} requêtes ({db_seconds * 1000:.1f} ms en base, budget {budget})"
+        )
+
+    registry.record(endpoint, request.method, response.status_code, duration, query_count, db_seconds, over_budget)
+
+    if current_app.config.get('SERVER_TIMING', True):
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_seconds * 1000:.1f};desc="{query_count} SQL", '
+            f'app;dur={(duration - db_seconds) * 1000:.1f}, total;dur={duration * 1000:.1f}'
+        )
+        # Rend l'en-tête lisible par l'API Performance du front servi sur une autre origine
+        response.headers.setdefault('Timing-Allow-Origin', '*')
+    return response
+
+
+def _pool_lines():
+    """Jauges des pools de connexions SQLAlchemy (lues au moment de la collecte)."""
+    from models import db
+
+    lines = ["# HELP db_pool_checked_out Connexions du pool actuellement utilisées.",
+             "# TYPE db_pool_checked_out gauge"]
+    for bind, engine in db.engines.items():
+        checked_out = getattr(engine.pool, 'checkedout', None)
+        if checked_out is not None:
+            labels = (('bind', bind or 'default'), ('worker', os.getpid()))
+            lines.append(f"db_pool_checked_out{_format_labels(labels)} {checked_out()}")
+    return lines
+
+
+def metrics():
+    """GET /metrics : métriques du processus au format texte Prometheus."""
+    return Response(registry.render(_pool_lines()), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.config.setdefault('INSTRUMENTATION_ENABLED', _env_bool('INSTRUMENTATION_ENABLED', True))
+    app.config.setdefault('QUERY_BUDGET', int(os.environ.get('QUERY_BUDGET', DEFAULT_QUERY_BUDGET)))
+    app.config.setdefault('SERVER_TIMING', _env_bool('SERVER_TIMING', True))
+    app.config.setdefault('METRICS_ENABLED', _env_bool('METRICS_ENABLED', True))
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    if app.config['METRICS_ENABLED']:
+        app.add_url_rule('/metrics', 'metrics', metrics, methods=['GET'])
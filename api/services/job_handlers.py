@@ -0,0 +1,115 @@
+"""
+Gestionnaires des tâches de fond (services.jobs).
+
+Chaque gestionnaire reçoit un JobContext (payload, progress, file_path) et retourne un résultat
+sérialisable en JSON, enregistré dans jobs.result. Le worker valide la transaction à la fin ;
+un gestionnaire qui travaille par lots valide lui-même chaque lot.
+"""
+import os
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+
+from models import db, Baes, Status
+from services import alarm_counters, baes_import, exports, incidents, site_deletion, status_history
+from services.batching import chunked
+from services.jobs import JobError, handler
+from services.visibility import get_visibility
+
+# BAES dont les incidents sont recalculés et validés ensemble
+INCIDENTS_BATCH = 1000
+
+
+@handler('site.delete', concurrency=1, max_attempts=3)
+def delete_site(context):
+    """Suppression d'un site ; l'historique est supprimé et validé par lots de BAES."""
+    def checkpoint(done, total):
+        db.session.commit()
+        context.progress(done, total, "Historique des BAES supprimé")
+
+    result = site_deletion.delete_site(context.payload['site_id'], checkpoint=checkpoint)
+    if result is None:
+        raise JobError('Site non trouvé')
+    return result
+
+
+@handler('baes.import', concurrency=2, max_attempts=2)
+def import_baes(context):
+    """Import de BAES déjà validé par POST /baes/import ; une seule transaction."""
+    rows = context.payload['rows']
+    missing = baes_import.missing_etage_ids(rows)
+    if missing:
+        raise JobError(f"Étages non trouvés : {', '.join(str(etage_id) for etage_id in missing)}")
+    try:
+        result = baes_import.import_rows(
+            rows, progress=lambda done, total: context.progress(done, total, "BAES écrits")
+        )
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise JobError("Conflit d'unicité lors de l'import (nom de BAES déjà utilisé ?)")
+    return result
+
+
+@handler('status.export', concurrency=2, max_attempts=2)
+def export_statuses(context):
+    """Export de l'historique dans un fichier, servi ensuite par GET /jobs/<id>/download."""
+    args = MultiDict(context.payload.get('filters') or {})
+    user_id = args.get('user_id', type=int)
+    try:
+        filters = status_history.HistoryFilter(args, get_visibility(user_id) if user_id is not None else None)
+        export = exports.StatusExport(filters.criteria(), context.payload.get('format', 'csv'))
+    except (status_history.HistoryQueryError, exports.ExportError) as e:
+        raise JobError(str(e))
+
+    total = db.session.execute(select(func.count()).select_from(Status).where(*filters.criteria())).scalar()
+    context.progress(0, total, "Status exportés")
+    path = context.file_path(f".{export.format}")
+    partial = f"{path}.part"
+    started = time.perf_counter()
+    size = 0
+    try:
+        with open(partial, 'wb') as output:
+            for block in export.open():
+                output.write(block)
+                size += len(block)
+                context.progress(export.rows, total, "Status exportés")
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return {
+        'file': os.path.basename(path),
+        'format': export.format,
+        'mimetype': export.mimetype,
+        'rows': export.rows,
+        'bytes': size,
+        'seconds': round(time.perf_counter() - started, 1)
+    }
+
+
+@handler('incidents.rebuild', concurrency=1, max_attempts=2)
+def rebuild_incidents(context):
+    """Recalcul des incidents depuis l'historique, validé par lots de BAES."""
+    baes_ids = context.payload.get('baes_ids')
+    if baes_ids is None:
+        baes_ids = db.session.execute(select(Baes.id).order_by(Baes.id)).scalars().all()
+    created = done = 0
+    for chunk in chunked(sorted(set(baes_ids)), INCIDENTS_BATCH):
+        created += incidents.rebuild(chunk)
+        db.session.commit()
+        done += len(chunk)
+        context.progress(done, len(baes_ids), "BAES recalculés")
+    return {'baes': done, 'incidents': created}
+
+
+@handler('alarm_counters.reconcile', concurrency=1, max_attempts=2)
+def reconcile_alarm_counters(context):
+    """Recalcul des compteurs d'alarmes ; avec dry_run, les écarts sont seulement constatés."""
+    dry_run = bool(context.payload.get('dry_run'))
+    drift = alarm_counters.reconcile(apply=not dry_run)
+    if dry_run:
+        db.session.rollback()
+    return {'drift': drift, 'applied': not dry_run}
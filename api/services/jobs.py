@@ -0,0 +1,407 @@
+"""
+Tâches de fond : file d'attente en base (table jobs) et worker.
+
+Les opérations longues (suppression d'un site et de son historique, import de BAES, export de
+l'historique, recalcul des incidents ou des compteurs) dépassent le délai des workers uwsgi
+(harakiri, 60 s). Les routes les mettent en file (enqueue, réponse 202) et le client suit
+l'avancement par GET /jobs/<id>.
+
+Le worker (flask --app app jobs work, programme supervisord 'jobs') exécute les tâches dans un
+pool de JOB_WORKER_THREADS threads. Une tâche prête est réservée par un UPDATE conditionnel
+(state = 'queued') : un seul worker la prend, sans verrou de table ni SKIP LOCKED. Chaque type de
+tâche déclare (handler) le nombre de tâches simultanées qu'il accepte, compté en base à la
+réservation, et son nombre d'essais : un échec inattendu est retenté après un délai doublé à
+chaque essai ; JobError est un échec définitif (données invalides).
+
+Un gestionnaire signale son avancement par context.progress(). La valeur reste en mémoire et la
+boucle du worker l'écrit avec le signe de vie de la tâche (heartbeat_at), sur sa propre session :
+le gestionnaire ne valide jamais sa transaction pour publier un avancement. Une tâche en cours
+sans signe de vie depuis JOB_STALE_AFTER secondes (worker arrêté brutalement) est remise en file
+ou passe en échec si elle n'a plus d'essai.
+"""
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select, update
+
+from models import db, Job
+from services.batching import chunked
+from services.status_history import iso
+from templates.TimestampMixin import current_time
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+STATES = (QUEUED, RUNNING, SUCCEEDED, FAILED)
+FINISHED = (SUCCEEDED, FAILED)
+
+DEFAULT_THREADS = 2
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_STALE_AFTER = 300
+DEFAULT_RETENTION_DAYS = 7
+PURGE_INTERVAL = 3600
+ERROR_MAX_LENGTH = 2000
+INTERRUPTED = "Worker interrompu pendant l'exécution"
+
+
+class JobError(Exception):
+    """Échec définitif d'une tâche (données invalides) : pas de nouvel essai, message conservé."""
+
+
+class JobKind:
+    """Type de tâche : gestionnaire, tâches simultanées au plus, essais, délai avant le 2e essai (s)."""
+
+    def __init__(self, name, function, concurrency, max_attempts, retry_delay):
+        self.name = name
+        self.function = function
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+
+_kinds = {}
+
+
+def handler(kind, concurrency=1, max_attempts=1, retry_delay=30):
+    """Déclare le gestionnaire d'un type de tâche : function(context) -> résultat sérialisable en JSON."""
+    def decorator(function):
+        _kinds[kind] = JobKind(kind, function, concurrency, max_attempts, retry_delay)
+        return function
+    return decorator
+
+
+def kinds():
+    """Types de tâche déclarés (services.job_handlers, importé ici pour éviter un import circulaire)."""
+    from services import job_handlers  # noqa: F401
+    return _kinds
+
+
+def enqueue(kind, payload=None, user_id=None):
+    """Met une tâche en file ; l'appelant valide la transaction. Retourne le Job (id attribué)."""
+    spec = kinds().get(kind)
+    if spec is None:
+        raise ValueError(f"Type de tâche inconnu : {kind}")
+    job = Job(kind=kind, state=QUEUED, payload=payload, attempts=0, max_attempts=spec.max_attempts,
+              run_after=current_time(), created_by_user_id=user_id)
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def result_file(job, files_dir):
+    """Chemin du fichier produit par une tâche terminée (result['file']), ou None."""
+    name = (job.result or {}).get('file') if isinstance(job.result, dict) else None
+    if not name:
+        return None
+    path = os.path.join(files_dir, os.path.basename(name))
+    return path if os.path.isfile(path) else None
+
+
+def serialize(job):
+    current, total = job.progress_current, job.progress_total
+    if job.state == SUCCEEDED:
+        percent = 100.0
+    elif total and current is not None:
+        percent = round(100.0 * min(current, total) / total, 1)
+    else:
+        percent = None
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'state': job.state,
+        'progress': {'current': current, 'total': total, 'percent': percent, 'message': job.progress_message},
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'result': job.result,
+        'error': job.error,
+        'created_by_user_id': job.created_by_user_id,
+        'created_at': iso(job.created_at),
+        'run_after': iso(job.run_after),
+        'started_at': iso(job.started_at),
+        'finished_at': iso(job.finished_at),
+        'heartbeat_at': iso(job.heartbeat_at)
+    }
+
+
+class JobContext:
+    """Ce qu'un gestionnaire voit de sa tâche : paramètres, avancement, fichier produit."""
+
+    def __init__(self, job, files_dir):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.payload = job.payload or {}
+        self.attempt = job.attempts
+        self.user_id = job.created_by_user_id
+        self.files_dir = files_dir
+        self._lock = threading.Lock()
+        self._progress = (None, None, None)
+        self._version = 0
+        self._written = 0
+
+    def progress(self, current, total=None, message=None):
+        """Avancement (current sur total), publié au prochain signe de vie du worker ; sans accès à la base."""
+        with self._lock:
+            self._progress = (current, total, message[:255] if message else message)
+            self._version += 1
+
+    def pending_progress(self):
+        """(version, (current, total, message)) à écrire, ou None si rien n'a changé."""
+        with self._lock:
+            if self._version == self._written:
+                return None
+            return self._version, self._progress
+
+    def progress_written(self, version):
+        with self._lock:
+            self._written = max(self._written, version)
+
+    @property
+    def last_progress(self):
+        with self._lock:
+            return self._progress
+
+    def file_path(self, suffix):
+        """Chemin du fichier produit par la tâche, servi ensuite par GET /jobs/<id>/download."""
+        os.makedirs(self.files_dir, exist_ok=True)
+        return os.path.join(self.files_dir, f"job_{self.job_id}{suffix}")
+
+
+class Worker:
+    """Réserve et exécute les tâches prêtes ; publie leur avancement ; reprend les tâches abandonnées."""
+
+    def __init__(self, app, threads=None):
+        self.app = app
+        self.threads = threads or app.config.get('JOB_WORKER_THREADS', DEFAULT_THREADS)
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+        self.stale_after = app.config.get('JOB_STALE_AFTER', DEFAULT_STALE_AFTER)
+        self.retention = timedelta(days=app.config.get('JOB_RETENTION_DAYS', DEFAULT_RETENTION_DAYS))
+        self.files_dir = app.config['JOB_FILES_DIR']
+        self.host = socket.gethostname()
+        self.name = f"{self.host}:{os.getpid()}"
+        self.running = {}
+        self._reserved = 0
+        self._lock = threading.Lock()
+        self._purged_at = None
+
+    def free_slots(self):
+        with self._lock:
+            return self.threads - self._reserved
+
+    def claim(self, limit):
+        """Réserve au plus `limit` tâches prêtes, dans l'ordre d'arrivée, selon la limite de chaque type."""
+        if limit <= 0:
+            return []
+        known = kinds()
+        now = current_time()
+        running = dict(db.session.execute(
+            select(Job.kind, func.count()).where(Job.state == RUNNING).group_by(Job.kind)
+        ).all())
+        candidates = db.session.execute(
+            select(Job.id, Job.kind).where(Job.state == QUEUED, Job.run_after <= now).order_by(Job.id).limit(100)
+        ).all()
+        claimed = []
+        for job_id, kind in candidates:
+            if len(claimed) >= limit:
+                break
+            spec = known.get(kind)
+            if spec is None:
+                self._finish(job_id, QUEUED, state=FAILED, finished_at=now,
+                             error=f"Type de tâche inconnu : {kind}")
+                continue
+            if running.get(kind, 0) >= spec.concurrency:
+                continue
+            result = db.session.execute(
+                update(Job)
+                .where(Job.id == job_id, Job.state == QUEUED)
+                .values(state=RUNNING, attempts=Job.attempts + 1, started_at=now, heartbeat_at=now,
+                        finished_at=None, worker=self.name)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                running[kind] = running.get(kind, 0) + 1
+                claimed.append(job_id)
+        db.session.commit()
+        return claimed
+
+    def _finish(self, job_id, expected_state, **values):
+        """Change l'état d'une tâche si elle est toujours dans l'état attendu ; retourne True si c'est le cas."""
+        criteria = [Job.id == job_id, Job.state == expected_state]
+        if expected_state == RUNNING:
+            criteria.append(Job.worker == self.name)
+        result = db.session.execute(
+            update(Job).where(*criteria).values(**values).execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def execute(self, job_id):
+        """Exécute une tâche réservée (dans un thread du pool, avec son propre contexte d'application)."""
+        with self.app.app_context():
+            try:
+                job = db.session.get(Job, job_id)
+                spec = kinds()[job.kind]
+                context = JobContext(job, self.files_dir)
+                db.session.commit()
+                with self._lock:
+                    self.running[job_id] = context
+                try:
+                    result = spec.function(context)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    self._failed(context, spec, e)
+                else:
+                    self._succeeded(context, result)
+            except Exception as e:
+                # Tâche laissée en cours : reprise par recover_stale
+                db.session.rollback()
+                self.app.logger.error(f"Error in job worker: {e}")
+            finally:
+                with self._lock:
+                    self.running.pop(job_id, None)
+                    self._reserved -= 1
+
+    def _succeeded(self, context, result):
+        now = current_time()
+        current, total, message = context.last_progress
+        if not self._finish(context.job_id, RUNNING, state=SUCCEEDED, result=result, error=None,
+                            finished_at=now, heartbeat_at=now,
+                            progress_current=total if total is not None else current,
+                            progress_total=total, progress_message=message):
+            self.app.logger.warning(f"Tâche {context.job_id} ({context.kind}) reprise par un autre worker")
+        db.session.commit()
+        self.app.logger.info(f"Tâche {context.job_id} ({context.kind}) terminée")
+
+    def _failed(self, context, spec, error):
+        now = current_time()
+        message = (str(error) or error.__class__.__name__)[:ERROR_MAX_LENGTH]
+        if not isinstance(error, JobError) and context.attempt < spec.max_attempts:
+            delay = spec.retry_delay * 2 ** (context.attempt - 1)
+            self._finish(context.job_id, RUNNING, state=QUEUED, error=message, worker=None, heartbeat_at=None,
+                         run_after=now + timedelta(seconds=delay))
+            self.app.logger.warning(f"Error in job {context.kind} #{context.job_id} "
+                                    f"(essai {context.attempt}/{spec.max_attempts}, nouvel essai dans {delay} s): {error}")
+        else:
+            self._finish(context.job_id, RUNNING, state=FAILED, error=message, finished_at=now, heartbeat_at=now)
+            self.app.logger.error(f"Error in job {context.kind} #{context.job_id}: {error}")
+        db.session.commit()
+
+    def heartbeat(self):
+        """Signe de vie et avancement des tâches en cours de ce worker (un UPDATE par tâche)."""
+        with self._lock:
+            contexts = list(self.running.values())
+        if not contexts:
+            return
+        now = current_time()
+        written = []
+        for context in contexts:
+            values = {'heartbeat_at': now}
+            pending = context.pending_progress()
+            if pending is not None:
+                version, (current, total, message) = pending
+                values.update(progress_current=current, progress_total=total, progress_message=message)
+                written.append((context, version))
+            self._finish(context.job_id, RUNNING, **values)
+        db.session.commit()
+        for context, version in written:
+            context.progress_written(version)
+
+    def recover_stale(self, restarted=False):
+        """
+        Tâches en cours sans signe de vie depuis stale_after secondes : remises en file s'il reste un
+        essai, sinon en échec. Au démarrage (restarted), celles d'un précédent worker du même hôte
+        (un seul programme 'jobs' par conteneur) sont reprises sans attendre.
+        """
+        now = current_time()
+        limit = now - timedelta(seconds=self.stale_after)
+        criteria = [Job.state == RUNNING, Job.heartbeat_at < limit]
+        rows = db.session.execute(select(Job.id, Job.attempts, Job.max_attempts).where(*criteria)).all()
+        if restarted:
+            orphaned = [Job.state == RUNNING, Job.worker.like(f"{self.host}:%"), Job.worker != self.name]
+            rows += db.session.execute(select(Job.id, Job.attempts, Job.max_attempts).where(*orphaned)).all()
+            criteria = [Job.state == RUNNING, Job.worker != self.name]
+        recovered = set()
+        for job_id, attempts, max_attempts in rows:
+            if job_id in recovered:
+                continue
+            recovered.add(job_id)
+            if attempts < max_attempts:
+                values = dict(state=QUEUED, run_after=now, worker=None, heartbeat_at=None, error=INTERRUPTED)
+            else:
+                values = dict(state=FAILED, finished_at=now, error=INTERRUPTED)
+            db.session.execute(
+                update(Job).where(Job.id == job_id, *criteria).values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        db.session.commit()
+        if recovered:
+            self.app.logger.warning(f"{len(recovered)} tâche(s) abandonnée(s) reprise(s) : "
+                                    f"{', '.join(str(job_id) for job_id in sorted(recovered))}")
+        return len(recovered)
+
+    def purge(self):
+        """Supprime les tâches terminées depuis plus de JOB_RETENTION_DAYS jours, et leurs fichiers."""
+        limit = current_time() - self.retention
+        jobs = db.session.execute(
+            select(Job).where(Job.state.in_(FINISHED), Job.finished_at < limit)
+        ).scalars().all()
+        for job in jobs:
+            path = result_file(job, self.files_dir)
+            if path:
+                os.remove(path)
+        for chunk in chunked([job.id for job in jobs]):
+            db.session.execute(delete(Job).where(Job.id.in_(chunk)).execution_options(synchronize_session=False))
+        db.session.commit()
+        return len(jobs)
+
+    def tick(self, restarted=False):
+        """Un tour : signes de vie, tâches abandonnées, purge horaire, réservation. Retourne les tâches réservées."""
+        self.heartbeat()
+        self.recover_stale(restarted)
+        if self._purged_at is None or (current_time() - self._purged_at).total_seconds() >= PURGE_INTERVAL:
+            self.purge()
+            self._purged_at = current_time()
+        claimed = self.claim(self.free_slots())
+        with self._lock:
+            self._reserved += len(claimed)
+        return claimed
+
+    def run(self, stop):
+        """
+        Boucle jusqu'à stop.set() ; une erreur de base n'interrompt pas le worker. À l'arrêt, plus
+        aucune tâche n'est réservée et celles en cours sont menées à terme (signes de vie compris).
+        """
+        executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='job')
+        restarted = True
+        with self.app.app_context():
+            self.app.logger.info(f"Worker de tâches {self.name} : {self.threads} thread(s)")
+            while not stop.is_set():
+                try:
+                    for job_id in self.tick(restarted):
+                        executor.submit(self.execute, job_id)
+                    restarted = False
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Error in job worker: {e}")
+                stop.wait(self.poll_interval)
+            while self.free_slots() < self.threads:
+                try:
+                    self.heartbeat()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Error in job worker: {e}")
+                time.sleep(self.poll_interval)
+        executor.shutdown(wait=True)
+
+    def run_once(self):
+        """Exécute dans ce thread toutes les tâches prêtes (CLI --once, scripts de contrôle)."""
+        done = 0
+        with self.app.app_context():
+            while True:
+                claimed = self.tick()
+                if not claimed:
+                    return done
+                for job_id in claimed:
+                    self.execute(job_id)
+                    done += 1
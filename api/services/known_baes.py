@@ -0,0 +1,120 @@
+"""
+Cache en mémoire des BAES connus (id -> (name, label)), pour le chemin d'ingestion (POST /status/).
+
+Chargé en une requête au démarrage (wsgi.py, avant le fork des workers uwsgi) ou à la première
+utilisation, puis tenu à jour par les écritures de BAES de ce processus (création, modification,
+import, suppression, suppression de site). Un status d'un BAES connu ne demande donc aucune
+lecture de la table baes ; name et label servent à la réponse de POST /status/.
+
+Le cache n'est qu'un indice, la base reste l'autorité :
+- un BAES créé par un autre worker est absent d'ici : ensure() tente l'insertion dans un
+  SAVEPOINT, et une violation de clé primaire signifie simplement qu'il existe déjà ;
+- un BAES supprimé par un autre worker reste ici : l'insertion du status échoue sur la clé
+  étrangère, l'appelant appelle discard() et recommence par ensure() ;
+- un BAES renommé par un autre worker garde ici son ancien nom, dans la réponse seulement.
+
+Exception : les BAES d'un site en cours de suppression (Baes.is_deleting) sont refusés
+(BaesDeletingError), pour que la purge par lots de leur historique se termine. La suppression
+incrémente KNOWN_BAES_COUNTER ; chaque worker relit ce compteur au plus toutes les
+CONFIG_CACHE_INTERVAL secondes et retire alors de son cache les BAES marqués.
+"""
+import threading
+
+from flask import current_app
+from sqlalchemy import false, select, true
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from models import db, Baes
+from services.config_store import KNOWN_BAES_COUNTER, VersionWatch
+
+_known = {}
+_state = {'loaded': False, 'version': None}
+_lock = threading.Lock()
+_version = VersionWatch(KNOWN_BAES_COUNTER)
+
+
+class BaesDeletingError(Exception):
+    """BAES d'un site en cours de suppression : son status est refusé (réponse 409)."""
+
+
+def warm():
+    """Charge tous les BAES (une requête) ; retourne leur nombre."""
+    version = _version.current()
+    entries = {baes_id: (name, label) for baes_id, name, label in
+               db.session.execute(select(Baes.id, Baes.name, Baes.label).where(Baes.is_deleting == false()))}
+    with _lock:
+        _known.clear()
+        _known.update(entries)
+        _state.update(loaded=True, version=version)
+    current_app.logger.debug(f"BAES connus chargés : {len(entries)}")
+    return len(entries)
+
+
+def preload(app):
+    """Chargement au démarrage ; sans base ou sans schéma, le cache se chargera à la première utilisation."""
+    with app.app_context():
+        try:
+            warm()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            app.logger.warning(f"Cache des BAES connus non chargé au démarrage : {e}")
+
+
+def lookup(baes_id):
+    """(name, label) du BAES s'il est connu, sinon None."""
+    if not _state['loaded']:
+        warm()
+    else:
+        _discard_deleting()
+    return _known.get(baes_id)
+
+
+def _discard_deleting():
+    """Retire les BAES marqués is_deleting si une suppression de site a eu lieu depuis la dernière vérification."""
+    version = _version.current()
+    if version == _state['version']:
+        return
+    deleting = db.session.execute(select(Baes.id).where(Baes.is_deleting == true())).scalars().all()
+    discard(deleting)
+    _state['version'] = version
+
+
+def remember(entries):
+    """entries : {id: (name, label)}."""
+    with _lock:
+        _known.update(entries)
+
+
+def discard(baes_ids):
+    with _lock:
+        for baes_id in baes_ids:
+            _known.pop(baes_id, None)
+
+
+def ensure(baes_id, name=None, label=None):
+    """
+    Crée le BAES (etage_id NULL, position par défaut) s'il n'existe pas, sans lecture préalable
+    quand il est déjà connu. Retourne (name, label, créé) ; la création reste dans la transaction
+    de l'appelant, non validée.
+    """
+    known = lookup(baes_id)
+    if known is not None:
+        return known + (False,)
+    name = name or f"BAES-{baes_id}"
+    try:
+        with db.session.begin_nested():
+            db.session.add(Baes(id=baes_id, name=name, label=label, position={"x": 0, "y": 0}, etage_id=None))
+        created = True
+    except IntegrityError:
+        # Créé entre-temps par un autre worker ; sinon le conflit porte sur autre chose (nom déjà pris)
+        row = db.session.execute(
+            select(Baes.name, Baes.label, Baes.is_deleting).where(Baes.id == baes_id)
+        ).first()
+        if row is None:
+            raise
+        name, label, is_deleting = row
+        if is_deleting:
+            raise BaesDeletingError(f"BAES {baes_id} en cours de suppression (suppression de son site)")
+        created = False
+    remember({baes_id: (name, label)})
+    return name, label, created
@@ -0,0 +1,46 @@
+from flask import request
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+
+
+def get_page_args(default_per_page=DEFAULT_PER_PAGE, max_per_page=MAX_PER_PAGE):
+    """
+    Lit les paramètres ?page=&per_page= de la requête.
+    Retourne (None, None) si aucun n'est fourni, pour conserver les réponses non paginées existantes.
+    """
+    page = request.args.get('page', type=int)
+    per_page = request.args.get('per_page', type=int)
+    if page is None and per_page is None:
+        return None, None
+    page = max(page or 1, 1)
+    per_page = min(max(per_page or default_per_page, 1), max_per_page)
+    return page, per_page
+
+
+def paginate(query, page, per_page):
+    """Applique LIMIT/OFFSET à une requête ordonnée et retourne (lignes, total)."""
+    if page is None:
+        rows = query.all()
+        return rows, len(rows)
+    total = query.order_by(None).count()
+    rows = query.offset((page - 1) * per_page).limit(per_page).all()
+    return rows, total
+
+
+def pagination_headers(total, page, per_page):
+    """En-têtes ajoutés aux réponses de type liste (le corps reste un tableau JSON)."""
+    if page is None:
+        return {}
+    return {
+        'X-Total-Count': str(total),
+        'X-Page': str(page),
+        'X-Per-Page': str(per_page),
+    }
+
+
+def pagination_payload(total, page, per_page):
+    """Métadonnées ajoutées aux réponses de type objet."""
+    if page is None:
+        return {}
+    return {'pagination': {'total': total, 'page': page, 'per_page': per_page}}
@@ -0,0 +1,358 @@
+"""
+Profilage à la demande de requêtes de production.
+
+Une requête est profilée si elle porte l'en-tête X-Profile égal à PROFILING_TOKEN, ou si elle
+est tirée au sort (PROFILING_SAMPLE_RATE, 0.01 = 1 %). Deux modes (PROFILING_MODE) :
+  - sampler (défaut) : un thread unique relève la pile du thread de la requête toutes les
+    PROFILING_INTERVAL secondes (sys._current_frames) ; coût négligeable pour les autres requêtes,
+    résultat en piles repliées (flamegraph.pl, speedscope) ;
+  - cprofile : cProfile sur le thread de la requête, plus précis mais plus coûteux ; le rapport
+    pstats (temps cumulé) est conservé en plus.
+Les instructions SQL exécutées (texte et durée, sans les paramètres) accompagnent le profil.
+
+Les profils sont écrits en JSON dans PROFILING_DIR et seuls les PROFILING_BUFFER_SIZE plus récents
+sont gardés : le tampon circulaire est ainsi partagé par tous les workers uwsgi, et
+GET /admin/profiles les liste quel que soit le worker qui répond.
+
+Les connexions du serveur de flux (greenlets gevent) ne sont pas visibles du sampler.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILE_HEADER = 'X-Profile'
+DEFAULT_INTERVAL = 0.005
+DEFAULT_BUFFER_SIZE = 50
+MAX_STATEMENTS = 500
+MAX_STATEMENT_LENGTH = 2000
+MODES = ('sampler', 'cprofile')
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# ===== Échantillonneur de piles =====
+
+_labels = {}
+_path_prefixes = sorted({os.path.abspath(p) + os.sep for p in sys.path if p}, key=len, reverse=True)
+
+
+def _frame_label(code):
+    """'sqlalchemy/engine/base.py:Connection._execute_context' (mis en cache par objet code)."""
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for prefix in _path_prefixes:
+            if filename.startswith(prefix):
+                filename = filename[len(prefix):]
+                break
+        label = _labels[code] = f"{filename}:{getattr(code, 'co_qualname', code.co_name)}"
+    return label
+
+
+def collapse(frame):
+    """Pile d'une frame au format replié : appelants d'abord, séparés par ';'."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class StackSampler:
+    """Thread unique qui échantillonne les piles des threads inscrits, endormi quand il n'y en a aucun."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._targets.pop(thread_id, None)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                targets = list(self._targets.items())
+            if not targets:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            for thread_id, samples in targets:
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != own_id:
+                    samples[collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler(interval):
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = StackSampler(interval)
+        return _sampler
+
+
+# ===== Tampon circulaire sur disque =====
+
+class ProfileStore:
+    """Profils JSON dans un répertoire, limités aux `size` plus récents (partagé entre workers)."""
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def _new_id(self):
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        # Trié chronologiquement par nom ; le pid et le compteur le rendent unique entre workers
+        return f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{sequence}"
+
+    def _path(self, profile_id):
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        profile['id'] = self._new_id()
+        tmp_path = self._path(profile['id']) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f)
+        os.replace(tmp_path, self._path(profile['id']))
+        self._prune()
+        return profile['id']
+
+    def _ids(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith('.json'))
+
+    def _prune(self):
+        for profile_id in self._ids()[:-self.size]:
+            try:
+                os.remove(self._path(profile_id))
+            except FileNotFoundError:
+                pass  # supprimé entre-temps par un autre worker
+
+    def get(self, profile_id):
+        if os.path.basename(profile_id) != profile_id:
+            return None
+        try:
+            with open(self._path(profile_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def list(self):
+        """Résumés des profils, du plus récent au plus ancien."""
+        summaries = []
+        for profile_id in reversed(self._ids()):
+            profile = self.get(profile_id)
+            if profile is not None:
+                summaries.append({key: value for key, value in profile.items()
+                                  if key not in ('stacks', 'statements', 'pstats')})
+        return summaries
+
+    def clear(self):
+        removed = 0
+        for profile_id in self._ids():
+            try:
+                os.remove(self._path(profile_id))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def get_store(app=None):
+    app = app or current_app
+    return app.extensions['profiling']
+
+
+def collapsed_text(profile):
+    """Piles repliées 'a;b;c N', une par ligne, pour flamegraph.pl ou speedscope."""
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(profile.get('stacks', {}).items()))
+
+
+# ===== Instructions SQL du profil =====
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'profile' in g:
+        conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('profile_start')
+    if not starts or not has_request_context() or 'profile' not in g:
+        return
+    duration = time.perf_counter() - starts.pop()
+    statements = g.profile['statements']
+    if len(statements) < MAX_STATEMENTS:
+        statements.append({'sql': statement[:MAX_STATEMENT_LENGTH], 'ms': round(duration * 1000, 3),
+                           'executemany': executemany})
+    else:
+        g.profile['statements_dropped'] += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None:
+        starts = connection.info.get('profile_start')
+        if starts:
+            starts.pop()
+
+
+# ===== Hooks de requête =====
+
+def _should_profile():
+    token = current_app.config.get('PROFILING_TOKEN')
+    header = request.headers.get(PROFILE_HEADER)
+    if header is not None and token and header == token:
+        return True
+    rate = current_app.config.get('PROFILING_SAMPLE_RATE', 0.0)
+    return bool(rate) and random.random() < rate
+
+
+def _start_profile():
+    if request.path.startswith('/admin/profiles') or not _should_profile():
+        return
+    mode = current_app.config['PROFILING_MODE']
+    g.profile = {'mode': mode, 'statements': [], 'statements_dropped': 0,
+                 'thread_id': threading.get_ident(), 'start': time.perf_counter()}
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        g.profile['profiler'] = profiler
+        profiler.enable()
+    else:
+        g.profile['samples'] = get_sampler(current_app.config['PROFILING_INTERVAL']).start(g.profile['thread_id'])
+
+
+def _stop_profile(state):
+    """Arrête la collecte ; idempotent (after_request puis teardown_request)."""
+    if state.get('stopped'):
+        return
+    state['stopped'] = True
+    state['duration'] = time.perf_counter() - state['start']
+    if 'profiler' in state:
+        state['profiler'].disable()
+    else:
+        get_sampler(current_app.config['PROFILING_INTERVAL']).stop(state['thread_id'])
+
+
+def _cprofile_results(profiler):
+    """Piles repliées (appelant;appelé, temps propre en µs) et rapport pstats par temps cumulé."""
+    stats = pstats.Stats(profiler)
+    stacks = Counter()
+    for (filename, line, name), (_, _, own_time, _, callers) in stats.stats.items():
+        callee = f"{os.path.basename(filename)}:{name}"
+        if not callers:
+            stacks[callee] += max(int(own_time * 1e6), 1)
+        for (caller_file, _, caller_name), caller_stats in callers.items():
+            caller = f"{os.path.basename(caller_file)}:{caller_name}"
+            stacks[f"{caller};{callee}"] += max(int(caller_stats[2] * 1e6), 1)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(60)
+    return dict(stacks), report.getvalue()
+
+
+def _finish_profile(response):
+    state = g.pop('profile', None)
+    if state is None:
+        return response
+    _stop_profile(state)
+    profile = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'worker': os.getpid(),
+        'mode': state['mode'],
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round(state['duration'] * 1000, 2),
+        'sql_count': len(state['statements']) + state['statements_dropped'],
+        'sql_ms': round(sum(statement['ms'] for statement in state['statements']), 2),
+        'statements': state['statements'],
+        'statements_dropped': state['statements_dropped'],
+    }
+    if 'profiler' in state:
+        profile['stacks'], profile['pstats'] = _cprofile_results(state['profiler'])
+    else:
+        profile['stacks'] = dict(state['samples'])
+        profile['interval_ms'] = current_app.config['PROFILING_INTERVAL'] * 1000
+    profile['samples'] = sum(profile['stacks'].values())
+    try:
+        response.headers['X-Profile-Id'] = get_store().save(profile)
+    except OSError as e:
+        current_app.logger.error(f"Error in profiling store: {e}")
+    return response
+
+
+def _cleanup_profile(exc):
+    # Requête interrompue avant after_request : le thread ne doit pas rester échantillonné
+    state = g.pop('profile', None)
+    if state is not None:
+        _stop_profile(state)
+
+
+def init_app(app):
+    app.config.setdefault('PROFILING_ENABLED', _env_bool('PROFILING_ENABLED', False))
+    app.config.setdefault('PROFILING_TOKEN', os.environ.get('PROFILING_TOKEN') or None)
+    app.config.setdefault('PROFILING_SAMPLE_RATE', float(os.environ.get('PROFILING_SAMPLE_RATE', 0.0)))
+    app.config.setdefault('PROFILING_MODE', os.environ.get('PROFILING_MODE', 'sampler'))
+    app.config.setdefault('PROFILING_INTERVAL', float(os.environ.get('PROFILING_INTERVAL', DEFAULT_INTERVAL)))
+    app.config.setdefault('PROFILING_BUFFER_SIZE', int(os.environ.get('PROFILING_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)))
+    app.config.setdefault('PROFILING_DIR', os.environ.get('PROFILING_DIR')
+                          or os.path.join(tempfile.gettempdir(), 'baes-profiles'))
+    if app.config['PROFILING_MODE'] not in MODES:
+        raise ValueError(f"PROFILING_MODE doit valoir {' ou '.join(MODES)}")
+    app.extensions['profiling'] = ProfileStore(app.config['PROFILING_DIR'], app.config['PROFILING_BUFFER_SIZE'])
+    if not app.config['PROFILING_ENABLED']:
+        return
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.teardown_request(_cleanup_profile)
@@ -0,0 +1,114 @@
+"""
+Suppression d'un site et de tout ce qui en dépend : bâtiments, étages, BAES, historique des
+status, incidents, cartes et compteurs d'alarmes. Les liaisons user-site-role sont conservées
+avec site_id=NULL.
+
+Tout passe par des DELETE ensemblistes, sans charger les lignes. L'historique, de loin le plus
+volumineux, est supprimé BAES_BATCH BAES à la fois. Sans checkpoint, l'ensemble se fait dans la
+transaction de l'appelant. Avec checkpoint (tâche de fond), checkpoint(faits, total) est appelé
+après chaque lot et peut le valider : une tâche interrompue reprend avec l'historique restant.
+
+Avant la purge, les BAES sont marqués is_deleting : l'ingestion (services.known_baes) refuse
+leurs status, dans chaque worker au plus CONFIG_CACHE_INTERVAL secondes après la validation du
+marquage. Les status et incidents arrivés entre-temps sont supprimés juste avant les BAES, dans
+un SAVEPOINT rejoué si un dernier status se glisse entre les deux DELETE.
+"""
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Baes, Batiment, Carte, Etage, Incident, Site, Status, UserSiteRole
+from services import alarm_counters, config_store, known_baes
+from services.batching import chunked
+
+# BAES dont l'historique est supprimé par requête (et par transaction avec checkpoint)
+BAES_BATCH = 20
+# Essais de la suppression finale des BAES (status arrivé entre la purge des restes et le DELETE)
+FINAL_ATTEMPTS = 3
+
+
+def _ids(model, column, values):
+    ids = []
+    for chunk in chunked(values):
+        ids.extend(db.session.execute(select(model.id).where(column.in_(chunk))).scalars())
+    return ids
+
+
+def _delete(model, column, values):
+    count = 0
+    for chunk in chunked(values):
+        count += db.session.execute(
+            delete(model).where(column.in_(chunk)).execution_options(synchronize_session=False)
+        ).rowcount
+    return count
+
+
+def _mark_deleting(baes_ids):
+    """Refuse désormais les status de ces BAES, dans tous les workers (compteur KNOWN_BAES_COUNTER)."""
+    for chunk in chunked(baes_ids):
+        db.session.execute(
+            update(Baes).where(Baes.id.in_(chunk)).values(is_deleting=True)
+            .execution_options(synchronize_session=False)
+        )
+    config_store.bump_version(config_store.KNOWN_BAES_COUNTER)
+    known_baes.discard(baes_ids)
+
+
+def _delete_baes(baes_ids):
+    """Restes d'historique puis BAES ; retourne (status, incidents, BAES) supprimés."""
+    for attempt in range(1, FINAL_ATTEMPTS + 1):
+        try:
+            with db.session.begin_nested():
+                incidents_count = _delete(Incident, Incident.baes_id, baes_ids)
+                statuses_count = _delete(Status, Status.baes_id, baes_ids)
+                return statuses_count, incidents_count, _delete(Baes, Baes.id, baes_ids)
+        except IntegrityError:
+            if attempt == FINAL_ATTEMPTS:
+                raise
+
+
+def delete_site(site_id, checkpoint=None):
+    """Supprime le site ; retourne les nombres d'éléments supprimés, ou None si le site n'existe pas."""
+    if db.session.execute(select(Site.id).where(Site.id == site_id)).scalar() is None:
+        return None
+    batiment_ids = _ids(Batiment, Batiment.site_id, [site_id])
+    etage_ids = _ids(Etage, Etage.batiment_id, batiment_ids)
+    baes_ids = _ids(Baes, Baes.etage_id, etage_ids)
+    _mark_deleting(baes_ids)
+    if checkpoint is not None:
+        checkpoint(0, len(baes_ids))
+
+    statuses_count = incidents_count = 0
+    for done, chunk in enumerate(chunked(baes_ids, BAES_BATCH), 1):
+        incidents_count += _delete(Incident, Incident.baes_id, chunk)
+        statuses_count += _delete(Status, Status.baes_id, chunk)
+        if checkpoint is not None:
+            checkpoint(min(done * BAES_BATCH, len(baes_ids)), len(baes_ids))
+
+    cartes_count = db.session.execute(
+        delete(Carte).where(Carte.site_id == site_id).execution_options(synchronize_session=False)
+    ).rowcount + _delete(Carte, Carte.etage_id, etage_ids)
+    late_statuses, late_incidents, baes_count = _delete_baes(baes_ids)
+    statuses_count += late_statuses
+    incidents_count += late_incidents
+    etages_count = _delete(Etage, Etage.id, etage_ids)
+    batiments_count = _delete(Batiment, Batiment.id, batiment_ids)
+    # Les relations user-role sont conservées sans site
+    user_site_roles_count = db.session.execute(
+        update(UserSiteRole).where(UserSiteRole.site_id == site_id).values(site_id=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.execute(delete(Site).where(Site.id == site_id).execution_options(synchronize_session=False))
+    alarm_counters.discard_scopes('etage', etage_ids)
+    alarm_counters.discard_scopes('batiment', batiment_ids)
+    alarm_counters.discard_scopes('site', [site_id])
+    known_baes.discard(baes_ids)
+    return {
+        'batiments_deleted': batiments_count,
+        'etages_deleted': etages_count,
+        'baes_deleted': baes_count,
+        'statuses_deleted': statuses_count,
+        'incidents_deleted': incidents_count,
+        'cartes_deleted': cartes_count,
+        'user_site_roles_preserved': user_site_roles_count
+    }
+
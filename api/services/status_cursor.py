@@ -0,0 +1,162 @@
+"""
+Lecture des nouveaux status par id croissant, sans perdre ceux validés en retard.
+
+Les id de status (IDENTITY sous MSSQL) sont attribués à l'insertion, pas à la validation : un
+status inséré par une transaction plus longue (lot de POST /status/bulk, passerelle MQTT) devient
+visible après des status d'id supérieur. Un curseur « id > dernier id lu » le saute pour toujours.
+
+StatusCursor retient les trous de la séquence déjà parcourue (plages d'id absentes à la lecture)
+et les relit à chaque passage. Un status validé en retard est rendu au passage suivant, une seule
+fois : sa plage est redécoupée autour de lui. Un trou encore vide après GAP_GRACE secondes est
+abandonné (transaction annulée, saut du cache IDENTITY, status supprimé).
+
+Les acquittements ont le même défaut : acknowledged_at est fixé avant la validation.
+AcknowledgementCursor relit donc les GAP_GRACE secondes qui précèdent sa position.
+"""
+import time
+from datetime import timedelta, timezone
+
+from sqlalchemy import func, or_, select
+
+from models import db, Status
+from services.batching import chunked
+from templates.TimestampMixin import current_time
+
+# Délai de validation au-delà duquel un id manquant n'est plus attendu (secondes)
+GAP_GRACE = 60.0
+# Plages relues à chaque passage (deux paramètres chacune) ; au-delà, les plus anciennes sont abandonnées
+MAX_GAPS = 200
+# Derniers id examinés au démarrage : les transactions en cours à cet instant y laissent leurs trous
+START_WINDOW = 1000
+
+
+def _row_id(row):
+    return row[0]
+
+
+class StatusCursor:
+    """
+    Position de lecture dans la table status :
+        cursor = StatusCursor()
+        cursor.start()
+        rows = cursor.fetch(select(Status.id, Status.baes_id), limit)
+    """
+
+    def __init__(self, grace=GAP_GRACE, clock=time.monotonic):
+        self.last_id = 0
+        self.gaps = []  # [(premier id, dernier id, remarqué à)], dans l'ordre des id
+        self.grace = grace
+        self.clock = clock
+
+    def start(self):
+        """Se place après le dernier status ; retourne son id. Une requête pour les trous récents."""
+        last_id = db.session.execute(select(func.max(Status.id))).scalar() or 0
+        self.last_id, self.gaps = max(last_id - START_WINDOW, 0), []
+        self._advance(db.session.execute(
+            select(Status.id).where(Status.id > self.last_id).order_by(Status.id)
+        ).scalars().all())
+        return last_id
+
+    def fetch(self, query, limit, id_of=_row_id):
+        """
+        Rangées de `query` (select portant sur Status) des status non encore rendus, par id
+        croissant : status validés en retard dans les trous, puis nouveaux status. Au plus `limit`
+        rangées ; l'appelant relance tant qu'il en reçoit `limit`. `id_of` extrait l'id d'une rangée.
+        """
+        self._expire()
+        criteria = [Status.id > self.last_id]
+        criteria.extend(Status.id.between(low, high) for low, high, _ in self.gaps)
+        rows = db.session.execute(query.where(or_(*criteria)).order_by(Status.id).limit(limit)).all()
+        ids = [id_of(row) for row in rows]
+        self._fill([status_id for status_id in ids if status_id <= self.last_id])
+        self._advance([status_id for status_id in ids if status_id > self.last_id])
+        return rows
+
+    def _advance(self, ids):
+        """Nouveaux id lus (croissants) : les id sautés deviennent des trous."""
+        now = self.clock()
+        for status_id in ids:
+            if status_id > self.last_id + 1:
+                self.gaps.append((self.last_id + 1, status_id - 1, now))
+            self.last_id = status_id
+        if len(self.gaps) > MAX_GAPS:
+            del self.gaps[:len(self.gaps) - MAX_GAPS]
+
+    def _fill(self, ids):
+        """Id lus dans les trous : chaque plage est redécoupée autour d'eux."""
+        if not ids:
+            return
+        found = sorted(ids)
+        gaps = []
+        for low, high, noticed in self.gaps:
+            start = low
+            for status_id in found:
+                if low <= status_id <= high:
+                    if status_id > start:
+                        gaps.append((start, status_id - 1, noticed))
+                    start = status_id + 1
+            if start <= high:
+                gaps.append((start, high, noticed))
+        self.gaps = gaps
+
+    def _expire(self):
+        limit = self.clock() - self.grace
+        self.gaps = [gap for gap in self.gaps if gap[2] > limit]
+
+
+def _aware(value):
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _acknowledgement_key(row):
+    return row[0], row[1]
+
+
+class AcknowledgementCursor:
+    """
+    Position de lecture des acquittements (index ix_status_acknowledged : acknowledged_at, id).
+
+    Un acquittement en masse validé en retard porte une date déjà dépassée par la position. Chaque
+    passage relit donc les clés (id, acknowledged_at) des GAP_GRACE secondes qui la précèdent, depuis
+    l'index seul, et ne charge que les acquittements pas encore rendus. Un status acquitté de
+    nouveau (autre date) est rendu de nouveau.
+    """
+
+    def __init__(self, grace=GAP_GRACE):
+        self.grace = grace
+        self.position = None
+        self.seen = set()  # clés (id, acknowledged_at) déjà rendues, dans la fenêtre relue
+
+    def _window(self):
+        return db.session.execute(
+            select(Status.id, Status.acknowledged_at)
+            .where(Status.acknowledged_at >= self.position - timedelta(seconds=self.grace))
+            .order_by(Status.acknowledged_at, Status.id)
+        ).all()
+
+    def start(self):
+        """Se place à l'instant présent ; les acquittements déjà validés de la fenêtre ne seront pas rendus."""
+        self.position = current_time()
+        self.seen = {tuple(key) for key in self._window()}
+
+    def fetch(self, query, limit, key_of=_acknowledgement_key):
+        """
+        Rangées de `query` (select portant sur Status) des acquittements pas encore rendus, dans
+        l'ordre des acquittements ; au plus `limit`. `key_of` extrait (id, acknowledged_at) d'une rangée.
+        """
+        keys = [tuple(key) for key in self._window()]
+        pending = [key for key in keys if key not in self.seen][:limit]
+        rows = []
+        for chunk in chunked([status_id for status_id, _ in pending]):
+            rows.extend(db.session.execute(query.where(Status.id.in_(chunk))).all())
+        # Date relue avec la rangée : un acquittement plus récent entre les deux lectures est rendu tel quel
+        rows = [row for row in rows if key_of(row)[1] is not None]
+        rows.sort(key=lambda row: (_aware(key_of(row)[1]), key_of(row)[0]))
+        returned = {key_of(row) for row in rows}
+        self.seen = {key for key in keys if key in self.seen} | returned | set(pending)
+        for key in keys:
+            if key not in self.seen:
+                break
+            if _aware(key[1]) > self.position:
+                self.position = _aware(key[1])
+        return rows
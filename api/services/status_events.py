@@ -0,0 +1,248 @@
+"""
+Diffusion des nouveaux status aux tableaux de bord (flux SSE et long-poll).
+
+Un seul poller par processus interroge la table status toutes les STATUS_EVENTS_INTERVAL
+secondes (nouveaux status et acquittements, y compris ceux validés en retard, voir
+services.status_cursor), puis répartit les événements dans la file de chaque abonné selon son
+périmètre de visibilité. Le coût en base ne dépend donc pas du nombre de connexions ouvertes.
+
+Un client qui se reconnecte (Last-Event-ID, ?since=) reçoit le rattrapage de fetch_backlog,
+ou une demande de resynchronisation s'il dépasse MAX_BACKLOG status.
+
+Servi par stream_server.py (gevent), chaque connexion est un greenlet ; les appels pyodbc,
+bloquants, passent par le pool de threads natifs du hub (run_blocking) pour ne pas figer la
+boucle. Sous uwsgi (threads), le même code fonctionne mais chaque connexion occupe un thread :
+STREAM_MAX_CLIENTS le limite alors à quelques clients.
+"""
+import json
+import queue
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from models import db, Baes, Batiment, Etage, Status
+from services.status_cursor import GAP_GRACE, AcknowledgementCursor, StatusCursor
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_BATCH = 500
+DEFAULT_QUEUE_SIZE = 1000
+# Status rejoués au plus à un client qui se reconnecte ; au-delà, il doit recharger l'état complet
+MAX_BACKLOG = 5000
+# Clients simultanés par processus : greenlets sous gevent, threads sous uwsgi
+DEFAULT_MAX_CLIENTS_GEVENT = 5000
+DEFAULT_MAX_CLIENTS_THREADS = 2
+
+# Marqueur envoyé à un abonné dont la file a débordé : il doit recharger l'état complet
+RESYNC = object()
+
+
+def gevent_active():
+    """Vrai si le processus a été patché par gevent (stream_server.py)."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def run_blocking(func, *args):
+    """Exécute un appel bloquant (pyodbc) dans un thread natif si gevent est actif, directement sinon."""
+    if gevent_active():
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+def status_event(status, etage_id, site_id, kind='status'):
+    return {
+        'type': kind,
+        'id': status.id,
+        'baes_id': status.baes_id,
+        'etage_id': etage_id,
+        'site_id': site_id,
+        'erreur': status.erreur,
+        'is_solved': status.is_solved,
+        'temperature': status.temperature,
+        'vibration': status.vibration,
+        'timestamp': status.timestamp.isoformat() if status.timestamp else None,
+        'acknowledged_by_user_id': status.acknowledged_by_user_id,
+        'acknowledged_at': status.acknowledged_at.isoformat() if status.acknowledged_at else None,
+    }
+
+
+def format_sse(event, resume_id=None):
+    """
+    Sérialise un événement au format text/event-stream ; seul un nouveau status porte un id de
+    reprise, le sien par défaut (resume_id : plus grand id déjà envoyé, pour un status validé en retard).
+    """
+    lines = [f"event: {event['type']}"]
+    if event['type'] == 'status':
+        lines.append(f"id: {resume_id or event['id']}")
+    lines.append(f"data: {json.dumps(event)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def _located(query):
+    """Ajoute étage et site du BAES (jointures externes : un BAES peut être non attribué)."""
+    return (
+        query.add_columns(Baes.etage_id, Batiment.site_id)
+        .outerjoin(Baes, Baes.id == Status.baes_id)
+        .outerjoin(Etage, Etage.id == Baes.etage_id)
+        .outerjoin(Batiment, Batiment.id == Etage.batiment_id)
+    )
+
+
+def fetch_since(last_id, limit=DEFAULT_BATCH):
+    """Nouveaux status (id > last_id) sous forme d'événements, du plus ancien au plus récent."""
+    rows = db.session.execute(
+        _located(select(Status)).where(Status.id > last_id).order_by(Status.id).limit(limit)
+    ).all()
+    return [status_event(status, etage_id, site_id) for status, etage_id, site_id in rows]
+
+
+def fetch_new(cursor, limit=DEFAULT_BATCH):
+    """Status pas encore rendus par le curseur (nouveaux ou validés en retard), sous forme d'événements."""
+    rows = cursor.fetch(_located(select(Status)), limit, id_of=lambda row: row[0].id)
+    return [status_event(status, etage_id, site_id) for status, etage_id, site_id in rows]
+
+
+def fetch_acknowledged(cursor, limit=DEFAULT_BATCH):
+    """Acquittements pas encore rendus par le curseur (y compris validés en retard), sous forme d'événements."""
+    rows = cursor.fetch(_located(select(Status)), limit,
+                        key_of=lambda row: (row[0].id, row[0].acknowledged_at))
+    return [status_event(status, etage_id, site_id, 'acknowledged') for status, etage_id, site_id in rows]
+
+
+def fetch_backlog(last_id, late=True, limit=MAX_BACKLOG):
+    """
+    Rattrapage d'un client qui se reconnecte (Last-Event-ID, since) : (événements, complet).
+    Tous les status d'id > last_id, par pages de DEFAULT_BATCH. Avec late, aussi ceux d'id inférieur
+    insérés dans les GAP_GRACE secondes qui précèdent last_id : validés en retard, le client ne les
+    a peut-être pas reçus (il déduplique par id ceux qu'il a déjà). complet est faux au-delà de
+    `limit` status : le client doit recharger l'état complet.
+    """
+    events = []
+    if late and last_id:
+        reference = db.session.execute(select(Status.timestamp).where(Status.id == last_id)).scalar()
+        if reference is not None:
+            rows = db.session.execute(
+                _located(select(Status))
+                .where(Status.id < last_id, Status.timestamp >= reference - timedelta(seconds=GAP_GRACE))
+                .order_by(Status.id).limit(limit + 1)
+            ).all()
+            events.extend(status_event(status, etage_id, site_id) for status, etage_id, site_id in rows)
+    position = last_id
+    while len(events) <= limit:
+        requested = min(DEFAULT_BATCH, limit + 1 - len(events))
+        page = fetch_since(position, requested)
+        events.extend(page)
+        if len(page) < requested:
+            break
+        position = page[-1]['id']
+    if len(events) > limit:
+        return events[:limit], False
+    return events, True
+
+
+class Subscription:
+    """File d'événements d'une connexion, filtrée par périmètre (Visibility) et éventuellement par site."""
+
+    def __init__(self, scope, site_id=None, maxsize=DEFAULT_QUEUE_SIZE):
+        self.scope = scope
+        self.site_id = site_id
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def accepts(self, event):
+        site_id = event['site_id']
+        if self.site_id is not None and site_id != self.site_id:
+            return False
+        # Les BAES non attribués à un étage sont visibles de tous, comme dans /status/user/<id>
+        return site_id is None or self.scope is None or self.scope.can_see_site(site_id)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Client trop lent : on vide sa file et on lui demande de se resynchroniser
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait(RESYNC)
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class StatusBroker:
+    """Poller unique par processus, démarré au premier abonné et arrêté quand il n'en reste plus."""
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config.get('STATUS_EVENTS_INTERVAL', DEFAULT_INTERVAL)
+        default_max = DEFAULT_MAX_CLIENTS_GEVENT if gevent_active() else DEFAULT_MAX_CLIENTS_THREADS
+        self.max_clients = app.config.get('STREAM_MAX_CLIENTS') or default_max
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def call(self, func, *args):
+        """Exécute func dans un contexte d'application, hors de la boucle gevent si besoin."""
+        def task():
+            with self.app.app_context():
+                return func(*args)
+        return run_blocking(task)
+
+    def current_id(self):
+        return self.call(lambda: db.session.execute(select(func.max(Status.id))).scalar() or 0)
+
+    def subscribe(self, scope, site_id=None):
+        """Retourne une Subscription, ou None si le nombre maximal de clients est atteint."""
+        subscription = Subscription(scope, site_id)
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients:
+                return None
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='status-events', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def _poll(self, cursor, acknowledgements):
+        """Une interrogation : nouveaux status, puis nouveaux acquittements."""
+        return fetch_new(cursor) + fetch_acknowledged(acknowledgements)
+
+    def _run(self):
+        cursor, acknowledgements = StatusCursor(), AcknowledgementCursor()
+        self.call(cursor.start)
+        self.call(acknowledgements.start)
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._thread = None
+                    return
+                subscribers = list(self._subscribers)
+            try:
+                events = self.call(self._poll, cursor, acknowledgements)
+            except Exception as e:
+                self.app.logger.error(f"Error in status events poller: {e}")
+                events = []
+            for event in events:
+                for subscription in subscribers:
+                    if subscription.accepts(event):
+                        subscription.put(event)
+            time.sleep(self.interval)
+
+
+def get_broker(app):
+    broker = app.extensions.get('status_events')
+    if broker is None:
+        broker = app.extensions['status_events'] = StatusBroker(app)
+    return broker
@@ -0,0 +1,246 @@
+"""
+Historique des status : filtres, pagination par clé et agrégats calculés en SQL.
+
+- history() : status d'une période, du plus récent au plus ancien, paginés par clé (timestamp, id)
+  et non par OFFSET : une page coûte le même prix en début ou en fin d'historique et reste
+  stable si de nouveaux status arrivent pendant la lecture. Le curseur est opaque pour le client.
+- aggregate_counts() / aggregate_temperature() : GROUP BY sur des tranches horaires ou
+  journalières (time_bucket, traduit pour chaque dialecte) ; seules les lignes agrégées sortent
+  de la base.
+
+Les filtres s'appuient sur les index ix_status_timestamp (timestamp, id) et
+ix_status_baes_timestamp (baes_id, timestamp, id).
+"""
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import DateTime, and_, func, or_, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from models import db, Status
+from services.status_queries import located_in
+
+BUCKETS = ('hour', 'day')
+# Étendue maximale d'une agrégation (nombre de tranches raisonnable pour un rapport)
+MAX_RANGE = {'hour': timedelta(days=31), 'day': timedelta(days=366)}
+DEFAULT_RANGE = {'hour': timedelta(days=1), 'day': timedelta(days=30)}
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+
+class HistoryQueryError(ValueError):
+    """Paramètre de requête invalide (message destiné au client, réponse 400)."""
+
+
+# ===== Tranches de temps =====
+
+class time_bucket(FunctionElement):
+    """Début de la tranche ('hour' ou 'day', en UTC) contenant la date `column`."""
+    type = DateTime()
+    inherit_cache = True
+    name = 'time_bucket'
+
+    def __init__(self, unit, column):
+        if unit not in BUCKETS:
+            raise ValueError(f"unité de tranche inconnue : {unit}")
+        self.unit = unit
+        super().__init__(column)
+
+
+@compiles(time_bucket)
+def _time_bucket_default(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    return f"date_trunc('{element.unit}', {column})"
+
+
+@compiles(time_bucket, 'mssql')
+def _time_bucket_mssql(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    # Nombre d'heures ou de jours depuis 1900-01-01, réajouté à cette origine (datetime UTC)
+    return f"DATEADD({element.unit}, DATEDIFF({element.unit}, 0, {column}), 0)"
+
+
+@compiles(time_bucket, 'sqlite')
+def _time_bucket_sqlite(element, compiler, **kw):
+    column = compiler.process(list(element.clauses)[0], **kw)
+    fmt = '%Y-%m-%d %H:00:00' if element.unit == 'hour' else '%Y-%m-%d 00:00:00'
+    return f"strftime('{fmt}', {column})"
+
+
+# ===== Paramètres =====
+
+def parse_datetime(value, name):
+    """Date ISO 8601 ramenée en UTC ; une date sans fuseau est considérée en UTC."""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HistoryQueryError(f"Paramètre {name} invalide. Utilisez le format ISO 8601 (ex: 2023-01-01T12:00:00Z)")
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def parse_int_list(value, name):
+    if value is None or value == '':
+        return None
+    try:
+        return [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise HistoryQueryError(f"Paramètre {name} invalide : liste d'entiers séparés par des virgules attendue")
+
+
+def parse_bool(value, name):
+    if value is None:
+        return None
+    lowered = value.strip().lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise HistoryQueryError(f"Paramètre {name} invalide : true ou false attendu")
+
+
+def _as_utc(value):
+    """Date lue en base (aware, naïve UTC ou texte SQLite) en datetime UTC."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def iso(value):
+    value = _as_utc(value)
+    return value.isoformat().replace('+00:00', 'Z') if value is not None else None
+
+
+def encode_cursor(status):
+    payload = json.dumps([_as_utc(status.timestamp).isoformat(), status.id])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, status_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(timestamp), int(status_id)
+    except (ValueError, TypeError):
+        raise HistoryQueryError("Paramètre cursor invalide")
+
+
+# ===== Filtres =====
+
+class HistoryFilter:
+    """Critères communs à l'historique et aux agrégats, lus depuis la query string."""
+
+    def __init__(self, args, scope=None):
+        self.start = parse_datetime(args.get('from'), 'from')
+        self.end = parse_datetime(args.get('to'), 'to')
+        if self.start and self.end and self.start >= self.end:
+            raise HistoryQueryError("Le paramètre from doit précéder to")
+        self.baes_ids = parse_int_list(args.get('baes_id'), 'baes_id')
+        self.erreurs = parse_int_list(args.get('erreur'), 'erreur')
+        self.is_solved = parse_bool(args.get('is_solved'), 'is_solved')
+        self.acknowledged = parse_bool(args.get('acknowledged'), 'acknowledged')
+        self.etage_id = args.get('etage_id', type=int)
+        self.batiment_id = args.get('batiment_id', type=int)
+        self.site_id = args.get('site_id', type=int)
+        self.scope = scope
+
+    def with_default_range(self, bucket):
+        """Borne la période d'une agrégation : défaut si absente, erreur si trop longue."""
+        if self.end is None:
+            self.end = datetime.now(timezone.utc)
+        if self.start is None:
+            self.start = self.end - DEFAULT_RANGE[bucket]
+        if self.end - self.start > MAX_RANGE[bucket]:
+            raise HistoryQueryError(f"Période trop longue pour des tranches '{bucket}' "
+                                    f"({MAX_RANGE[bucket].days} jours au maximum)")
+        return self
+
+    def criteria(self):
+        criteria = []
+        if self.start is not None:
+            criteria.append(Status.timestamp >= self.start)
+        if self.end is not None:
+            criteria.append(Status.timestamp < self.end)
+        if self.baes_ids:
+            criteria.append(Status.baes_id.in_(self.baes_ids))
+        if self.erreurs:
+            criteria.append(Status.erreur.in_(self.erreurs))
+        if self.is_solved is not None:
+            criteria.append(Status.is_solved == self.is_solved)
+        if self.acknowledged is not None:
+            criteria.append(Status.acknowledged_at.is_not(None) if self.acknowledged
+                            else Status.acknowledged_at.is_(None))
+        located = located_in(self.etage_id, self.batiment_id, self.site_id)
+        if located is not None:
+            criteria.append(located)
+        if self.scope is not None:
+            criteria.append(self.scope.status(include_unassigned=True))
+        return criteria
+
+
+# ===== Requêtes =====
+
+def history(filters, limit=DEFAULT_LIMIT, cursor=None):
+    """(status de la page, curseur de la page suivante ou None), du plus récent au plus ancien."""
+    query = select(Status).where(*filters.criteria())
+    if cursor:
+        timestamp, status_id = decode_cursor(cursor)
+        query = query.where(or_(Status.timestamp < timestamp,
+                                and_(Status.timestamp == timestamp, Status.id < status_id)))
+    rows = db.session.execute(
+        query.order_by(Status.timestamp.desc(), Status.id.desc()).limit(limit + 1)
+    ).scalars().all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def aggregate_counts(filters, bucket, by_baes=False):
+    """Nombre de status par tranche et par code d'erreur (et par BAES si demandé)."""
+    bucket_expr = time_bucket(bucket, Status.timestamp)
+    keys = [bucket_expr, Status.erreur] + ([Status.baes_id] if by_baes else [])
+    query = (
+        select(bucket_expr.label('bucket'), *keys[1:], func.count().label('count'),
+               func.count(Status.acknowledged_at).label('acknowledged'))
+        .where(*filters.criteria())
+        .group_by(*keys)
+        .order_by(*keys)
+    )
+    result = []
+    for row in db.session.execute(query):
+        item = {'bucket': iso(row.bucket), 'erreur': row.erreur, 'count': row.count,
+                'acknowledged': row.acknowledged}
+        if by_baes:
+            item['baes_id'] = row.baes_id
+        result.append(item)
+    return result
+
+
+def aggregate_temperature(filters, bucket, by_baes=False):
+    """Température min, max et moyenne par tranche (et par BAES si demandé), status sans mesure exclus."""
+    bucket_expr = time_bucket(bucket, Status.timestamp)
+    keys = [bucket_expr] + ([Status.baes_id] if by_baes else [])
+    query = (
+        select(bucket_expr.label('bucket'), *([Status.baes_id] if by_baes else []),
+               func.min(Status.temperature).label('min'), func.max(Status.temperature).label('max'),
+               func.avg(Status.temperature).label('avg'), func.count(Status.temperature).label('count'))
+        .where(*filters.criteria(), Status.temperature.is_not(None))
+        .group_by(*keys)
+        .order_by(*keys)
+    )
+    result = []
+    for row in db.session.execute(query):
+        item = {'bucket': iso(row.bucket), 'min': row.min, 'max': row.max,
+                'avg': round(float(row.avg), 3) if row.avg is not None else None, 'count': row.count}
+        if by_baes:
+            item['baes_id'] = row.baes_id
+        result.append(item)
+    return result
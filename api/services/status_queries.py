@@ -0,0 +1,57 @@
+"""
+Requêtes ensemblistes sur les status.
+
+Le dernier status de chaque BAES est obtenu en une requête par ROW_NUMBER() OVER
+(PARTITION BY baes_id ORDER BY timestamp DESC), au lieu d'une requête par BAES.
+"""
+from sqlalchemy import func, select
+
+from models import db, Baes, Batiment, Etage, Status
+
+
+def latest_status_subquery(*criteria, order_by=None):
+    """
+    Sous-requête (status_id, baes_id, rn) ; rn = 1 désigne le dernier status de chaque BAES.
+    Les critères optionnels (prédicats sur Status) restreignent les BAES considérés.
+    `order_by` remplace l'ordre par défaut (timestamp puis id décroissants), ex. updated_at.
+    """
+    rn = func.row_number().over(
+        partition_by=Status.baes_id,
+        order_by=order_by or (Status.timestamp.desc(), Status.id.desc())
+    ).label('rn')
+    query = select(Status.id.label('status_id'), Status.baes_id, rn)
+    if criteria:
+        query = query.where(*criteria)
+    return query.subquery('latest_status')
+
+
+def latest_status_by_baes(*criteria, order_by=None):
+    """Retourne {baes_id: Status} avec le dernier status de chaque BAES (une requête)."""
+    latest = latest_status_subquery(*criteria, order_by=order_by)
+    statuses = db.session.execute(
+        select(Status)
+        .join(latest, Status.id == latest.c.status_id)
+        .where(latest.c.rn == 1)
+    ).scalars().all()
+    return {status.baes_id: status for status in statuses}
+
+
+def baes_located_in(etage_id=None, batiment_id=None, site_id=None):
+    """
+    Sous-requête des id de BAES de l'étage, du bâtiment ou du site (le plus précis fourni) ;
+    None si aucune portée n'est donnée.
+    """
+    if etage_id is not None:
+        return select(Baes.id).where(Baes.etage_id == etage_id)
+    if batiment_id is not None:
+        return select(Baes.id).join(Etage, Baes.etage_id == Etage.id).where(Etage.batiment_id == batiment_id)
+    if site_id is not None:
+        return (select(Baes.id).join(Etage, Baes.etage_id == Etage.id)
+                .join(Batiment, Etage.batiment_id == Batiment.id).where(Batiment.site_id == site_id))
+    return None
+
+
+def located_in(etage_id=None, batiment_id=None, site_id=None):
+    """Prédicat sur Status : BAES de la portée (voir baes_located_in), None si aucune portée n'est donnée."""
+    baes = baes_located_in(etage_id, batiment_id, site_id)
+    return Status.baes_id.in_(baes) if baes is not None else None
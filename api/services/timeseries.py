@@ -0,0 +1,202 @@
+"""
+Séries de température par BAES, réduites à un nombre de points donné pour les graphiques.
+
+Les mesures de tous les BAES demandés sont lues en une requête (index ix_status_baes_timestamp)
+puis réduites avec NumPy, toutes séries confondues :
+- 'lttb' (Largest-Triangle-Three-Buckets) : conserve la forme visuelle de la courbe ;
+- 'minmax' : minimum et maximum de chaque tranche, aucun pic n'est perdu.
+Une série qui a déjà moins de points que demandé est renvoyée telle quelle.
+
+Les status sont horodatés par le serveur à l'insertion : une fenêtre terminée depuis plus de
+TIMESERIES_CLOSED_DELAY secondes ne change plus. Ses séries réduites sont gardées en mémoire
+(TIMESERIES_CACHE_SIZE séries, TIMESERIES_CACHE_TTL secondes, pour refléter les suppressions).
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, Status
+from services.batching import chunked
+
+METHODS = ('lttb', 'minmax')
+DEFAULT_POINTS = 500
+MIN_POINTS = 10
+MAX_POINTS = 5000
+MAX_SERIES = 100
+MAX_RANGE = timedelta(days=366)
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 3600
+DEFAULT_CLOSED_DELAY = 60
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# ===== Réduction =====
+
+def _segment_argmax(values, offsets, lengths):
+    """Position (dans values) du premier maximum de chaque segment contigu."""
+    maxima = np.maximum.reduceat(values, offsets)
+    local = np.arange(len(values)) - np.repeat(offsets, lengths)
+    candidates = np.where(values == np.repeat(maxima, lengths), local, len(values))
+    return offsets + np.minimum.reduceat(candidates, offsets)
+
+
+def _bucket_bounds(starts, sizes, buckets):
+    """Bornes [début, fin) de `buckets` tranches égales dans chaque série, shape (séries, buckets + 1)."""
+    fractions = np.linspace(0.0, 1.0, buckets + 1)
+    return starts[:, None] + np.floor(fractions[None, :] * sizes[:, None]).astype(np.int64)
+
+
+def lttb_indices(x, y, starts, sizes, points):
+    """
+    Indices retenus par LTTB pour des séries concaténées de plus de `points` points.
+    Retourne un tableau (séries, points) d'indices dans x / y.
+    """
+    # Premier et dernier points conservés, les autres répartis en points - 2 tranches
+    inner = _bucket_bounds(starts + 1, sizes - 2, points - 2)
+    # Moyenne de chaque tranche (sommes cumulées), et dernier point après la dernière tranche
+    cx = np.concatenate(([0.0], np.cumsum(x)))
+    cy = np.concatenate(([0.0], np.cumsum(y)))
+    lo, hi = inner[:, :-1], inner[:, 1:]
+    avg_x = (cx[hi] - cx[lo]) / (hi - lo)
+    avg_y = (cy[hi] - cy[lo]) / (hi - lo)
+    last = starts + sizes - 1
+    next_x = np.concatenate((avg_x[:, 1:], x[last][:, None]), axis=1)
+    next_y = np.concatenate((avg_y[:, 1:], y[last][:, None]), axis=1)
+
+    selected = np.empty((len(starts), points), dtype=np.int64)
+    selected[:, 0] = starts
+    selected[:, -1] = last
+    anchor = starts.copy()
+    for step in range(points - 2):
+        # Tranche `step` de chaque série, concaténées : un seul calcul d'aires pour toutes les séries
+        seg_lo, seg_len = lo[:, step], hi[:, step] - lo[:, step]
+        offsets = np.concatenate(([0], np.cumsum(seg_len)[:-1]))
+        index = np.repeat(seg_lo - offsets, seg_len) + np.arange(seg_len.sum())
+        ax, ay = np.repeat(x[anchor], seg_len), np.repeat(y[anchor], seg_len)
+        nx, ny = np.repeat(next_x[:, step], seg_len), np.repeat(next_y[:, step], seg_len)
+        area = np.abs((ax - nx) * (y[index] - ay) - (ax - x[index]) * (ny - ay))
+        anchor = index[_segment_argmax(area, offsets, seg_len)]
+        selected[:, step + 1] = anchor
+    return selected
+
+
+def minmax_indices(y, starts, sizes, points):
+    """Indices du minimum et du maximum de points // 2 tranches par série, dans l'ordre chronologique."""
+    bounds = _bucket_bounds(starts, sizes, points // 2)
+    seg_lo = bounds[:, :-1].ravel()
+    seg_len = (bounds[:, 1:] - bounds[:, :-1]).ravel()
+    offsets = np.concatenate(([0], np.cumsum(seg_len)[:-1]))
+    index = np.repeat(seg_lo - offsets, seg_len) + np.arange(seg_len.sum())
+    values = y[index]
+    imax = index[_segment_argmax(values, offsets, seg_len)]
+    imin = index[_segment_argmax(-values, offsets, seg_len)]
+    return np.sort(np.stack((imin, imax), axis=1), axis=1).reshape(len(starts), -1)
+
+
+def downsample(x, y, starts, sizes, points, method):
+    """Liste, par série, des indices retenus (toute la série si elle a au plus `points` points)."""
+    result = [np.arange(start, start + size) for start, size in zip(starts, sizes)]
+    long_series = np.flatnonzero(sizes > points)
+    if len(long_series):
+        if method == 'lttb':
+            kept = lttb_indices(x, y, starts[long_series], sizes[long_series], points)
+        else:
+            kept = minmax_indices(y, starts[long_series], sizes[long_series], points)
+        for row, series in enumerate(long_series):
+            # minmax : une tranche d'un seul point donne deux fois le même indice
+            result[series] = np.unique(kept[row])
+    return result
+
+
+# ===== Lecture =====
+
+def _epoch(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _load(baes_ids, start, end):
+    """Mesures des BAES sur [start, end) : (baes_ids, x en secondes epoch, températures)."""
+    owners, times, values = [], [], []
+    for chunk in chunked(sorted(baes_ids)):
+        rows = db.session.execute(
+            select(Status.baes_id, Status.timestamp, Status.temperature)
+            .where(Status.baes_id.in_(chunk), Status.timestamp >= start, Status.timestamp < end,
+                   Status.temperature.is_not(None))
+            .order_by(Status.baes_id, Status.timestamp, Status.id)
+        )
+        for baes_id, timestamp, temperature in rows:
+            owners.append(baes_id)
+            times.append(_epoch(timestamp))
+            values.append(temperature)
+    return (np.asarray(owners, dtype=np.int64), np.asarray(times, dtype=np.float64),
+            np.asarray(values, dtype=np.float64))
+
+
+def _compute(baes_ids, start, end, points, method):
+    owners, x, y = _load(baes_ids, start, end)
+    series = {baes_id: {'baes_id': baes_id, 'count': 0, 'points': []} for baes_id in baes_ids}
+    if not len(owners):
+        return series
+    present, starts, sizes = np.unique(owners, return_index=True, return_counts=True)
+    kept_by_series = downsample(x, y, starts, sizes, points, method)
+    for baes_id, count, kept in zip(present.tolist(), sizes.tolist(), kept_by_series):
+        series[baes_id] = {
+            'baes_id': baes_id,
+            'count': count,
+            'points': [[_iso(t), v] for t, v in zip(x[kept].tolist(), y[kept].tolist())],
+        }
+    return series
+
+
+def _is_closed(end):
+    delay = current_app.config.get('TIMESERIES_CLOSED_DELAY', DEFAULT_CLOSED_DELAY)
+    return end <= datetime.now(timezone.utc) - timedelta(seconds=delay)
+
+
+def temperature_series(baes_ids, start, end, points=DEFAULT_POINTS, method='lttb'):
+    """(séries dans l'ordre de baes_ids, nombre de séries servies depuis le cache)."""
+    ttl = current_app.config.get('TIMESERIES_CACHE_TTL', DEFAULT_CACHE_TTL)
+    size = current_app.config.get('TIMESERIES_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    cacheable = ttl > 0 and size > 0 and _is_closed(end)
+    keys = {baes_id: (baes_id, start.isoformat(), end.isoformat(), points, method) for baes_id in baes_ids}
+
+    found = {}
+    if cacheable:
+        now = time.monotonic()
+        with _cache_lock:
+            for baes_id, key in keys.items():
+                entry = _cache.get(key)
+                if entry and entry[0] > now:
+                    _cache.move_to_end(key)
+                    found[baes_id] = entry[1]
+    missing = [baes_id for baes_id in baes_ids if baes_id not in found]
+    if missing:
+        computed = _compute(missing, start, end, points, method)
+        found.update(computed)
+        if cacheable:
+            expires = time.monotonic() + ttl
+            with _cache_lock:
+                for baes_id, series in computed.items():
+                    _cache[keys[baes_id]] = (expires, series)
+                    _cache.move_to_end(keys[baes_id])
+                while len(_cache) > size:
+                    _cache.popitem(last=False)
+    return [found[baes_id] for baes_id in baes_ids], len(baes_ids) - len(missing)
+
+
+def invalidate():
+    with _cache_lock:
+        _cache.clear()
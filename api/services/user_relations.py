@@ -0,0 +1,157 @@
+"""
+Synchronisation des relations user-site-role par différence.
+
+Le plan est calculé en mémoire à partir des lignes UserSiteRole existantes (une requête),
+puis appliqué par DELETE / UPDATE / INSERT en masse. Aucun commit n'est fait ici :
+l'appelant valide ou annule l'ensemble en une seule transaction.
+"""
+from sqlalchemy import delete, insert, select, update
+
+from models import db, Role, Site, UserSiteRole
+from services.batching import IN_CLAUSE_CHUNK, chunked
+from templates.TimestampMixin import current_time
+
+
+def parse_roles_by_site(roles_by_site):
+    """
+    Convertit {"site_id": role_id} (clés JSON en chaîne) en {int: int}.
+    Les clés non numériques sont ignorées ; un role_id invalide lève ValueError.
+    """
+    parsed = {}
+    for site_id_str, role_id in roles_by_site.items():
+        try:
+            site_id = int(site_id_str)
+        except (TypeError, ValueError):
+            continue
+        try:
+            parsed[site_id] = int(role_id)
+        except (TypeError, ValueError):
+            raise ValueError(f'ID de rôle invalide: {role_id}')
+    return parsed
+
+
+def names_by_id(model, ids, column='name'):
+    """Retourne {id: <column>} pour les IDs existants (une requête par lot)."""
+    names = {}
+    label = getattr(model, column)
+    for chunk in chunked(set(ids)):
+        names.update(db.session.execute(select(model.id, label).where(model.id.in_(chunk))).all())
+    return names
+
+
+class RelationPlan:
+    """Ensemble des écritures à appliquer pour atteindre l'état souhaité."""
+
+    def __init__(self):
+        self.inserts = []
+        self.updates = []
+        self.deletes = []
+        self.relations = []
+
+    @property
+    def is_empty(self):
+        return not (self.inserts or self.updates or self.deletes)
+
+
+def plan_user_relations(user_id, desired, replace=False, site_names=None, role_names=None):
+    """
+    Calcule les ajouts / modifications / suppressions pour un utilisateur.
+
+    desired: {site_id: role_id}. Pour chaque site, une relation identique est conservée,
+    sinon une relation existante sur ce site change de rôle, sinon une relation est créée.
+    Avec replace=True, toutes les autres relations de l'utilisateur (y compris globales) sont supprimées.
+    """
+    site_names = site_names if site_names is not None else names_by_id(Site, desired.keys())
+    current = db.session.execute(
+        select(UserSiteRole.id, UserSiteRole.site_id, UserSiteRole.role_id)
+        .where(UserSiteRole.user_id == user_id)
+        .order_by(UserSiteRole.id)
+    ).all()
+    by_site = {}
+    for row in current:
+        by_site.setdefault(row.site_id, []).append(row)
+
+    role_names = dict(role_names or {})
+    missing_roles = (set(desired.values()) | {row.role_id for row in current}) - role_names.keys()
+    if missing_roles:
+        role_names.update(names_by_id(Role, missing_roles))
+
+    plan = RelationPlan()
+    now = current_time()
+    kept_ids = set()
+    for site_id, role_id in desired.items():
+        rows = by_site.get(site_id, [])
+        exact = next((r for r in rows if r.role_id == role_id), None)
+        report = {
+            'site_id': site_id,
+            'site_name': site_names.get(site_id),
+            'role_id': role_id,
+            'role_name': role_names.get(role_id),
+        }
+        if exact:
+            kept_ids.add(exact.id)
+            report['status'] = 'unchanged'
+        elif rows:
+            target = rows[0]
+            kept_ids.add(target.id)
+            plan.updates.append({'id': target.id, 'role_id': role_id, 'updated_at': now})
+            report.update({
+                'old_role_id': target.role_id,
+                'old_role_name': role_names.get(target.role_id),
+                'status': 'updated'
+            })
+        else:
+            plan.inserts.append({
+                'user_id': user_id, 'site_id': site_id, 'role_id': role_id,
+                'created_at': now, 'updated_at': now
+            })
+            report['status'] = 'created'
+        plan.relations.append(report)
+
+    if replace:
+        plan.deletes = [row.id for row in current if row.id not in kept_ids]
+    return plan
+
+
+def apply_relation_plan(plan):
+    """Applique le plan par écritures en masse (sans commit)."""
+    for chunk in chunked(plan.deletes):
+        db.session.execute(delete(UserSiteRole).where(UserSiteRole.id.in_(chunk)))
+    if plan.updates:
+        db.session.execute(update(UserSiteRole), plan.updates)
+    if plan.inserts:
+        db.session.execute(insert(UserSiteRole), plan.inserts)
+
+
+def bulk_assign_role(role_id, user_ids, site_ids=None):
+    """
+    Attribue un rôle à chaque couple (utilisateur, site) qui ne l'a pas encore.
+    Sans site_ids, le rôle est attribué globalement (site_id = NULL).
+    Retourne (créées, déjà présentes). Aucun commit n'est fait ici.
+    """
+    targets = list(dict.fromkeys(site_ids)) if site_ids else [None]
+    existing = set()
+    # Utilisateurs et sites dans la même requête : deux listes IN de moitié de lot au plus
+    half = IN_CLAUSE_CHUNK // 2
+    for user_chunk in chunked(set(user_ids), half):
+        for site_chunk in chunked(targets, half):
+            query = select(UserSiteRole.user_id, UserSiteRole.site_id).where(
+                UserSiteRole.role_id == role_id,
+                UserSiteRole.user_id.in_(user_chunk)
+            )
+            if site_ids:
+                query = query.where(UserSiteRole.site_id.in_(site_chunk))
+            else:
+                query = query.where(UserSiteRole.site_id.is_(None))
+            existing.update(tuple(row) for row in db.session.execute(query).all())
+
+    now = current_time()
+    rows = [
+        {'user_id': user_id, 'site_id': site_id, 'role_id': role_id, 'created_at': now, 'updated_at': now}
+        for user_id in dict.fromkeys(user_ids)
+        for site_id in targets
+        if (user_id, site_id) not in existing
+    ]
+    if rows:
+        db.session.execute(insert(UserSiteRole), rows)
+    return len(rows), len(existing)
@@ -0,0 +1,189 @@
+"""
+Périmètre de visibilité d'un utilisateur, exprimé en prédicats SQL.
+
+Un utilisateur voit les sites auxquels il est associé via UserSiteRole ; le rôle
+'super-admin' donne un accès global. Le périmètre résolu (global ou ensemble de
+site_id) est mis en cache par utilisateur pendant VISIBILITY_CACHE_TTL secondes au plus.
+
+Toute transaction qui modifie UserSiteRole ou Role incrémente le compteur VISIBILITY_COUNTER de
+config_version avant sa validation. Chaque worker relit ce compteur au plus toutes les
+CONFIG_CACHE_INTERVAL secondes (services.config_store.VersionWatch) et écarte les périmètres
+résolus sous une version antérieure : un droit retiré disparaît de tous les workers après cet
+intervalle, et immédiatement dans le worker qui a validé la modification. Les contrôles d'accès
+(administration, acquittements) résolvent le périmètre sans cache : get_visibility(user_id, cached=False).
+
+Exemple :
+    scope = get_visibility(user_id)
+    Baes.query.filter(scope.baes(include_unassigned=True))
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, false, or_, select, true
+from sqlalchemy.orm import Session
+
+from models import db, Baes, Batiment, Etage, Role, Site, Status, UserSiteRole
+from services.batching import IN_CLAUSE_CHUNK
+from services.config_store import VISIBILITY_COUNTER, VersionWatch, bump_version
+
+SUPER_ADMIN_ROLE = 'super-admin'
+DEFAULT_CACHE_TTL = 60
+
+_cache = {}
+_cache_lock = threading.Lock()
+_version = VersionWatch(VISIBILITY_COUNTER)
+
+
+class Visibility:
+    """Périmètre résolu d'un utilisateur ; chaque méthode retourne un prédicat SQL."""
+
+    __slots__ = ('user_id', 'is_global', 'site_ids')
+
+    def __init__(self, user_id, is_global, site_ids):
+        self.user_id = user_id
+        self.is_global = is_global
+        self.site_ids = frozenset(site_ids)
+
+    def _site_predicate(self, column):
+        if self.is_global:
+            return true()
+        if not self.site_ids:
+            return false()
+        if len(self.site_ids) > IN_CLAUSE_CHUNK:
+            # Au-delà de la limite de paramètres MSSQL, on repasse par une sous-requête
+            return column.in_(
+                select(UserSiteRole.site_id).where(UserSiteRole.user_id == self.user_id)
+            )
+        return column.in_(sorted(self.site_ids))
+
+    def can_see_site(self, site_id):
+        return self.is_global or site_id in self.site_ids
+
+    def sites(self):
+        return self._site_predicate(Site.id)
+
+    def batiments(self):
+        return self._site_predicate(Batiment.site_id)
+
+    def etages(self):
+        if self.is_global:
+            return true()
+        return Etage.batiment_id.in_(select(Batiment.id).where(self.batiments()))
+
+    def baes(self, include_unassigned=False):
+        if self.is_global:
+            return true()
+        visible_etages = select(Etage.id).join(Batiment, Etage.batiment_id == Batiment.id).where(self.batiments())
+        predicate = Baes.etage_id.in_(visible_etages)
+        if include_unassigned:
+            predicate = or_(predicate, Baes.etage_id.is_(None))
+        return predicate
+
+    def status(self, include_unassigned=False):
+        if self.is_global:
+            return true()
+        return Status.baes_id.in_(select(Baes.id).where(self.baes(include_unassigned)))
+
+    def __repr__(self):
+        scope = 'global' if self.is_global else sorted(self.site_ids)
+        return f"<Visibility user_id={self.user_id} scope={scope}>"
+
+
+def _resolve(user_id):
+    rows = db.session.execute(
+        select(UserSiteRole.site_id, Role.name)
+        .join(Role, Role.id == UserSiteRole.role_id)
+        .where(UserSiteRole.user_id == user_id)
+    ).all()
+    is_global = any(role_name == SUPER_ADMIN_ROLE for _, role_name in rows)
+    site_ids = {site_id for site_id, _ in rows if site_id is not None}
+    return Visibility(user_id, is_global, site_ids)
+
+
+def get_visibility(user_id, cached=True):
+    """
+    Retourne le périmètre de l'utilisateur, depuis le cache s'il est encore valide.
+    cached=False relit les droits en base (contrôle d'accès).
+    """
+    if not cached:
+        return _resolve(user_id)
+    now = time.monotonic()
+    version = _version.current()
+    with _cache_lock:
+        cached_entry = _cache.get(user_id)
+    if cached_entry and cached_entry[0] > now and cached_entry[1] == version:
+        return cached_entry[2]
+
+    scope = _resolve(user_id)
+    ttl = current_app.config.get('VISIBILITY_CACHE_TTL', DEFAULT_CACHE_TTL)
+    if ttl > 0:
+        with _cache_lock:
+            _cache[user_id] = (now + ttl, version, scope)
+    return scope
+
+
+def invalidate(user_id=None):
+    """Invalide le périmètre d'un utilisateur, ou de tous si user_id est None."""
+    with _cache_lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+
+# --- Invalidation automatique à la validation des transactions -----------------
+# Les modifications sont notées dans session.info pendant la transaction ; le compteur partagé
+# est incrémenté dans la transaction elle-même, le cache local vidé seulement après le commit
+# (rien n'est invalidé sur rollback).
+
+_PENDING_KEY = 'visibility_invalidate'
+_ALL = object()
+
+
+def _mark(session, user_id):
+    pending = session.info.setdefault(_PENDING_KEY, set())
+    pending.add(_ALL if user_id is None else user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _track_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, UserSiteRole):
+            _mark(session, obj.user_id)
+        elif isinstance(obj, Role):
+            _mark(session, None)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None and table.name in (UserSiteRole.__tablename__, Role.__tablename__):
+            _mark(orm_execute_state.session, None)
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_version(session):
+    # Les modifications encore en attente de flush doivent être notées avant de décider
+    session.flush()
+    if session.info.get(_PENDING_KEY):
+        bump_version(VISIBILITY_COUNTER, session=session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    _version.expire()
+    if _ALL in pending:
+        invalidate()
+    else:
+        for user_id in pending:
+            invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,229 @@
+"""
+Détection des BAES silencieux.
+
+Un seul processus (flask --app app watchdog run, programme supervisord 'watchdog') lit les
+status ingérés au fil de l'eau (services.status_cursor : nouveaux id et status validés en retard),
+quel que soit leur chemin : POST /status/ ou passerelle MQTT. Il garde en mémoire le dernier signe de vie de chaque BAES et son échéance
+(dernier signe de vie + seuil de silence) dans un tas à une entrée par BAES. Une trame ne fait
+que mettre à jour last_seen ; l'entrée n'est repoussée que lorsqu'elle arrive en tête du tas,
+soit au plus une fois par seuil pour un BAES actif. Chaque tour ne touche donc que les entrées
+arrivées à échéance, jamais tout le parc.
+
+Un BAES silencieux plus longtemps que son seuil (Baes.silence_threshold, sinon
+WATCHDOG_SILENCE_THRESHOLD) reçoit un status synthétique erreur 0 (connexion perdue), une seule
+fois jusqu'à sa prochaine trame ; ce status ouvre un incident de connexion (services.incidents).
+Un status erreur 0 n'est pas un signe de vie. Les BAES ignorés (is_ignored) ne sont pas surveillés.
+"""
+import heapq
+import time
+from datetime import timezone
+
+from sqlalchemy import false, or_, select, true
+
+from models import db, Baes, Status
+from services import alarm_counters, incidents
+from services.batching import chunked
+from services.status_cursor import StatusCursor
+from services.status_queries import latest_status_subquery
+
+CONNECTION_ERROR = 0
+DEFAULT_SILENCE_THRESHOLD = 900
+DEFAULT_INTERVAL = 5.0
+DEFAULT_REFRESH_INTERVAL = 60.0
+DEFAULT_BATCH = 1000
+
+
+def _epoch(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class SilenceSchedule:
+    """Échéances de silence par BAES (secondes epoch), sans accès à la base."""
+
+    def __init__(self, default_threshold=DEFAULT_SILENCE_THRESHOLD):
+        self.default_threshold = default_threshold
+        self.thresholds = {}
+        self.last_seen = {}
+        self._heap = []
+        self._queued = set()
+
+    def __len__(self):
+        return len(self.last_seen)
+
+    def threshold(self, baes_id):
+        return self.thresholds.get(baes_id, self.default_threshold)
+
+    def _push(self, deadline, baes_id):
+        heapq.heappush(self._heap, (deadline, baes_id))
+        self._queued.add(baes_id)
+
+    def seen(self, baes_id, at):
+        """Signe de vie du BAES à `at` ; O(1) si le BAES a déjà une entrée dans le tas."""
+        previous = self.last_seen.get(baes_id)
+        if previous is not None and previous >= at:
+            return
+        self.last_seen[baes_id] = at
+        if baes_id not in self._queued:
+            self._push(at + self.threshold(baes_id), baes_id)
+
+    def forget(self, baes_id, at=None):
+        """
+        Le BAES n'est plus surveillé ; son entrée est écartée quand elle arrive en tête. Avec `at`,
+        sauf signe de vie postérieur (status validé en retard, lu après une trame plus récente).
+        """
+        last = self.last_seen.get(baes_id)
+        if at is not None and last is not None and last > at:
+            return
+        self.last_seen.pop(baes_id, None)
+
+    def set_thresholds(self, thresholds):
+        """Seuils propres à certains BAES ; un seuil raccourci est pris en compte immédiatement."""
+        previous, self.thresholds = self.thresholds, dict(thresholds)
+        for baes_id, threshold in self.thresholds.items():
+            last = self.last_seen.get(baes_id)
+            if last is not None and threshold < previous.get(baes_id, self.default_threshold):
+                self._push(last + threshold, baes_id)
+
+    def expired(self, now):
+        """[(baes_id, dernier signe de vie)] des BAES silencieux à `now`, qui cessent d'être surveillés."""
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, baes_id = heapq.heappop(self._heap)
+            last = self.last_seen.get(baes_id)
+            if last is None:
+                self._queued.discard(baes_id)
+                continue
+            deadline = last + self.threshold(baes_id)
+            if deadline <= now:
+                expired.append((baes_id, last))
+                del self.last_seen[baes_id]
+                self._queued.discard(baes_id)
+            else:
+                # Trames reçues depuis la mise en tas : l'entrée est repoussée à la vraie échéance
+                heapq.heappush(self._heap, (deadline, baes_id))
+        return expired
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+
+class Watchdog:
+    """Alimente un SilenceSchedule depuis la table status et enregistre les pertes de connexion."""
+
+    def __init__(self, app):
+        self.app = app
+        self.schedule = SilenceSchedule(app.config.get('WATCHDOG_SILENCE_THRESHOLD', DEFAULT_SILENCE_THRESHOLD))
+        self.interval = app.config.get('WATCHDOG_INTERVAL', DEFAULT_INTERVAL)
+        self.refresh_interval = app.config.get('WATCHDOG_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+        self.batch = DEFAULT_BATCH
+        self.cursor = StatusCursor()
+        self.ignored = set()
+        self._refreshed_at = None
+
+    def refresh_settings(self):
+        """Seuils propres et BAES ignorés (seulement les BAES concernés, pas tout le parc)."""
+        rows = db.session.execute(
+            select(Baes.id, Baes.silence_threshold, Baes.is_ignored)
+            .where(or_(Baes.silence_threshold.is_not(None), Baes.is_ignored == true()))
+        ).all()
+        self.schedule.set_thresholds({baes_id: threshold for baes_id, threshold, _ in rows if threshold})
+        ignored = {baes_id for baes_id, _, is_ignored in rows if is_ignored}
+        for baes_id in ignored - self.ignored:
+            self.schedule.forget(baes_id)
+        self.ignored = ignored
+        self._refreshed_at = time.monotonic()
+
+    def load(self):
+        """État initial : dernier status de chaque BAES (une requête, au démarrage seulement)."""
+        self.refresh_settings()
+        # Position lue avant l'état initial : les status insérés entre-temps seront relus, sans effet
+        self.cursor.start()
+        latest = latest_status_subquery()
+        rows = db.session.execute(
+            select(Status.baes_id, Status.timestamp, Status.erreur)
+            .join(latest, Status.id == latest.c.status_id)
+            .where(latest.c.rn == 1)
+        )
+        for baes_id, timestamp, erreur in rows:
+            if erreur != CONNECTION_ERROR and baes_id not in self.ignored:
+                self.schedule.seen(baes_id, _epoch(timestamp))
+
+    def ingest(self):
+        """Status arrivés depuis le dernier tour ; retourne leur nombre."""
+        count = 0
+        while True:
+            rows = self.cursor.fetch(
+                select(Status.id, Status.baes_id, Status.timestamp, Status.erreur), self.batch
+            )
+            for _, baes_id, timestamp, erreur in rows:
+                if erreur == CONNECTION_ERROR:
+                    self.schedule.forget(baes_id, _epoch(timestamp))
+                elif baes_id not in self.ignored:
+                    self.schedule.seen(baes_id, _epoch(timestamp))
+            count += len(rows)
+            if len(rows) < self.batch:
+                return count
+
+    def emit(self, expired):
+        """
+        Un status erreur 0 par BAES silencieux encore existant (et dont le site n'est pas en cours
+        de suppression), compteurs d'alarmes compris.
+        """
+        existing = set()
+        for chunk in chunked([baes_id for baes_id, _ in expired]):
+            existing.update(db.session.execute(
+                select(Baes.id).where(Baes.id.in_(chunk), Baes.is_deleting == false())
+            ).scalars())
+        baes_ids = [baes_id for baes_id, _ in expired if baes_id in existing]
+        if not baes_ids:
+            return []
+        counters = alarm_counters.track_baes(baes_ids)
+        statuses = [Status(baes_id=baes_id, erreur=CONNECTION_ERROR, is_solved=False) for baes_id in baes_ids]
+        db.session.add_all(statuses)
+        incidents.record(statuses)
+        counters.apply()
+        db.session.commit()
+        self.app.logger.warning(f"Watchdog : connexion perdue pour {len(baes_ids)} BAES "
+                                f"({', '.join(str(baes_id) for baes_id in baes_ids[:20])}"
+                                f"{', ...' if len(baes_ids) > 20 else ''})")
+        return baes_ids
+
+    def tick(self, now=None):
+        """Un tour : réglages si besoin, nouveaux status, BAES arrivés à échéance. Retourne les BAES signalés."""
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh_settings()
+        self.ingest()
+        expired = self.schedule.expired(time.time() if now is None else now)
+        try:
+            emitted = self.emit(expired) if expired else []
+        except Exception:
+            # Échéances remises en tas, déjà dépassées : nouvel essai au prochain tour
+            for baes_id, last in expired:
+                self.schedule.seen(baes_id, last)
+            raise
+        # Fin de la transaction de lecture (verrous partagés MSSQL)
+        db.session.commit()
+        return emitted
+
+    def run(self, stop):
+        """
+        Boucle jusqu'à stop.set() ; une erreur de base n'interrompt pas la surveillance. L'état
+        initial est rechargé tant qu'il n'a pas pu être lu (base en cours de bootstrap).
+        """
+        loaded = False
+        with self.app.app_context():
+            while not stop.is_set():
+                try:
+                    if not loaded:
+                        self.load()
+                        db.session.commit()
+                        loaded = True
+                        self.app.logger.info(f"Watchdog : {len(self.schedule)} BAES surveillés, "
+                                             f"seuil par défaut {self.schedule.default_threshold} s")
+                    self.tick()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Error in watchdog: {e}")
+                stop.wait(self.interval)
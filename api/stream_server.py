@@ -0,0 +1,56 @@
+"""
+Serveur des connexions longues (SSE /status/stream, long-poll /status/poll) en greenlets gevent.
+
+Les milliers de tableaux de bord connectés ne coûtent qu'un greenlet chacun ; un seul poller par
+processus interroge la base (services.status_events) et les appels pyodbc passent par un petit
+pool de threads natifs (STREAM_DB_THREADS). Les routes CRUD restent servies par uwsgi : ce
+serveur répond 404 à tout autre chemin. Le reverse proxy envoie STREAM_PATHS sur STREAM_PORT.
+
+  pip install ".[stream]"
+  python api/stream_server.py
+"""
+from gevent import monkey
+
+# Doit précéder tout autre import (threading, socket, queue deviennent coopératifs)
+monkey.patch_all()
+
+import json
+import os
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+STREAM_PATHS = ('/status/stream', '/status/poll', '/general/ready')
+
+# Le pool SQLAlchemy est dimensionné sur les threads natifs qui accèdent réellement à la base
+DB_THREADS = max(int(os.environ.get('STREAM_DB_THREADS', 4)), 1)
+os.environ.setdefault('WORKER_THREADS', str(DB_THREADS))
+
+from app import app  # noqa: E402
+import bootstrap  # noqa: E402
+
+
+def only_stream_paths(wsgi_app):
+    """Limite ce serveur aux routes de flux : les autres accès bloqueraient la boucle gevent."""
+    def middleware(environ, start_response):
+        if environ.get('PATH_INFO', '').rstrip('/') in STREAM_PATHS:
+            return wsgi_app(environ, start_response)
+        body = json.dumps({'error': 'Route non servie par le serveur de flux.'}).encode('utf-8')
+        start_response('404 NOT FOUND', [('Content-Type', 'application/json'),
+                                         ('Content-Length', str(len(body)))])
+        return [body]
+    return middleware
+
+
+def main():
+    gevent.get_hub().threadpool.maxsize = DB_THREADS
+    bootstrap.check_schema(app)
+    port = int(os.environ.get('STREAM_PORT', 5001))
+    server = WSGIServer(('0.0.0.0', port), only_stream_paths(app),
+                        log='default' if app.debug else None)
+    app.logger.info(f"Serveur de flux sur le port {port} ({DB_THREADS} threads base de données)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Configuration Swagger (Flasgger) et cache de la spécification OpenAPI.
+
+La spec est construite à partir des dicts @swag_from de tous les modules de routes. Plutôt que de
+la recalculer dans chaque worker, elle est générée une fois au build (flask --app app swagger build)
+dans SWAGGER_SPEC_FILE, puis servie telle quelle par CachedSwagger. Sans fichier, Flasgger la
+calcule à la première requête comme auparavant.
+"""
+import json
+import os
+
+from flask import Response
+from flasgger import Swagger
+
+DEFAULT_SPEC_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'swagger', 'apispec.json')
+
+swagger_config = {
+    "headers": [],
+    "specs": [
+        {
+            "endpoint": "apispec",
+            "route": "/apispec.json",
+            # Exclure certaines routes legacy de la documentation pour éviter les doublons
+            "rule_filter": lambda rule: not (rule.rule.startswith('/erreurs') or rule.rule.startswith('/user-site-roles')),
+            "model_filter": lambda tag: True,
+        }
+    ],
+    "static_url_path": "/flasgger_static",
+    "swagger_ui": True,
+    "specs_route": "/swagger/",
+    "title": "BAES API - Documentation",
+    "description": "API de gestion des BAES, avec endpoints pour l'authentification, les sites, bâtiments, étages, BAES, statuts et cartes.",
+    "termsOfService": "",
+    "version": "1.0",
+}
+
+swagger_template = {
+    "swagger": "2.0",
+    "info": {
+        "title": "BAES API",
+        "description": "API pour la gestion des BAES",
+        "version": "1.0",
+    },
+    "tags": [
+        {"name": "Authentication", "description": "Authentification (login, logout)"},
+        {"name": "User CRUD", "description": "Gestion des utilisateurs"},
+        {"name": "Site CRUD", "description": "Gestion des sites"},
+        {"name": "Batiment CRUD", "description": "Gestion des bâtiments"},
+        {"name": "Etage CRUD", "description": "Gestion des étages"},
+        {"name": "BAES CRUD", "description": "Gestion des BAES (Blocs Autonomes d'Éclairage de Sécurité)"},
+        {"name": "Status CRUD", "description": "Gestion des statuts/erreurs des BAES"},
+        {"name": "Incidents", "description": "Épisodes de panne des BAES (alarmes ouvertes, MTTR, acquittement)"},
+        {"name": "Jobs", "description": "Tâches de fond (suppressions, imports, exports, recalculs) et leur avancement"},
+        {"name": "carte crud", "description": "Gestion des cartes (plans, coordonnées, zoom)"},
+        {"name": "general", "description": "Routes utilitaires et agrégées (ex: version API, données consolidées)"},
+        {"name": "Configuration CRUD", "description": "Paramètres de configuration"},
+        {"name": "Administration", "description": "Outils d'exploitation réservés aux super-admins (profils de requêtes)"}
+    ],
+    "definitions": {
+        "Baes": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "name": {"type": "string"},
+                "label": {"type": "string"},
+                "position": {"type": "object"},
+                "etage_id": {"type": "integer", "format": "int64"},
+                "is_ignored": {"type": "boolean"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "User": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "login": {"type": "string"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "Carte": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "chemin": {"type": "string"},
+                "etage_id": {"type": "integer", "format": "int64", "nullable": "true" },
+                "site_id": {"type": "integer", "format": "int64", "nullable": "true"},
+                "center_lat": {"type": "number", "format": "float"},
+                "center_lng": {"type": "number", "format": "float"},
+                "zoom": {"type": "number", "format": "float"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "Batiment": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "name": {"type": "string"},
+                "site_id": {"type": "integer", "format": "int64"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "Etage": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "name": {"type": "string"},
+                "batiment_id": {"type": "integer", "format": "int64"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "Status": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "baes_id": {"type": "integer", "format": "int64"},
+                "erreur": {"type": "integer"},
+                "is_solved": {"type": "boolean"},
+                "acknowledged_by_user_id": {"type": "integer", "nullable": True},
+                "acknowledged_at": {"type": "string", "format": "date-time", "nullable": True},
+                "timestamp": {"type": "string", "format": "date-time"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "Role": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "name": {"type": "string"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "Site": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "name": {"type": "string"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        },
+        "UserSiteRole": {
+            "type": "object",
+            "properties": {
+                "id": {"type": "integer", "format": "int64"},
+                "user_id": {"type": "integer", "format": "int64"},
+                "site_id": {"type": "integer", "format": "int64"},
+                "role_id": {"type": "integer", "format": "int64"},
+                "created_at": {"type": "string", "format": "date-time"},
+                "updated_at": {"type": "string", "format": "date-time"}
+            }
+        }
+    }
+}
+
+
+class CachedSwagger(Swagger):
+    """Swagger servant la spec depuis un fichier pré-généré, rechargé une seule fois par processus."""
+
+    def __init__(self, *args, spec_file=None, **kwargs):
+        self.spec_file = spec_file
+        self._file_specs = None
+        super().__init__(*args, **kwargs)
+
+    def _load_spec_file(self):
+        if self._file_specs is None:
+            self._file_specs = {}
+            if self.spec_file and os.path.exists(self.spec_file):
+                with open(self.spec_file, encoding='utf-8') as f:
+                    self._file_specs = json.load(f)
+        return self._file_specs
+
+    def get_apispecs(self, endpoint='apispec_1'):
+        specs = self._load_spec_file()
+        if endpoint in specs:
+            return specs[endpoint]
+        return super().get_apispecs(endpoint)
+
+    def register_views(self, app):
+        super().register_views(app)
+        # Sert le JSON déjà encodé : jsonify re-sérialiserait la spec à chaque requête
+        blueprint = self.config.get('endpoint', 'flasgger')
+        for spec in self.config['specs']:
+            view_name = f"{blueprint}.{spec['endpoint']}"
+            if view_name in app.view_functions:
+                app.view_functions[view_name] = self._file_view(spec['endpoint'], app.view_functions[view_name])
+
+    def _file_view(self, endpoint, fallback):
+        encoded = {}
+
+        def view():
+            if endpoint not in self._load_spec_file():
+                return fallback()
+            if endpoint not in encoded:
+                encoded[endpoint] = json.dumps(self._file_specs[endpoint], ensure_ascii=False).encode('utf-8')
+            return Response(encoded[endpoint], mimetype='application/json')
+        return view
+
+    def generate_apispecs(self):
+        """Calcule toutes les specs déclarées (sans passer par le fichier)."""
+        with self.app.test_request_context():
+            return {spec['endpoint']: Swagger.get_apispecs(self, spec['endpoint']) for spec in self.config['specs']}
+
+
+def build_spec_file(app, path=None):
+    """Génère le fichier de spec pour l'application donnée ; retourne son chemin."""
+    path = path or app.config.get('SWAGGER_SPEC_FILE') or DEFAULT_SPEC_FILE
+    swag = getattr(app, 'swag', None)
+    if swag is None:
+        raise RuntimeError("Swagger n'est pas activé (SWAGGER_ENABLED=false)")
+    specs = swag.generate_apispecs()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(specs, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def init_app(app):
+    """Active la documentation Swagger si SWAGGER_ENABLED, en servant le fichier pré-généré s'il existe."""
+    if not app.config.get('SWAGGER_ENABLED', True):
+        return None
+    return CachedSwagger(
+        app,
+        config=swagger_config,
+        template=swagger_template,
+        spec_file=app.config.get('SWAGGER_SPEC_FILE') or DEFAULT_SPEC_FILE,
+    )
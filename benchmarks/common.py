@@ -0,0 +1,180 @@
+"""
+Outils partagés par les benchmarks : chemins d'import, mesure de latence, serveur de test,
+rapport et comparaison à une référence enregistrée (benchmarks/baselines).
+"""
+import contextlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+API_DIR = os.path.join(ROOT, 'api')
+BASELINE_DIR = os.path.join(ROOT, 'benchmarks', 'baselines')
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+
+def percentile(sorted_values, pct):
+    """Percentile par interpolation linéaire sur une liste déjà triée."""
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+class Recorder:
+    """Collecte thread-safe des latences (secondes) et des erreurs par opération."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, name, exc):
+        with self._lock:
+            self.errors.setdefault(name, []).append(repr(exc))
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        result = {'elapsed_s': round(elapsed, 3), 'operations': {}}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(name, []))
+            result['operations'][name] = {
+                'count': len(values),
+                'errors': len(self.errors.get(name, [])),
+                'throughput_per_s': round(len(values) / elapsed, 1) if elapsed else 0.0,
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+            }
+        return result
+
+
+def timed(recorder, name, func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        recorder.error(name, e)
+        return None
+    recorder.record(name, time.perf_counter() - start)
+    return result
+
+
+def print_table(title, summary):
+    print(f"\n== {title} ({summary['elapsed_s']} s)")
+    print(f"{'opération':<24}{'n':>8}{'err':>6}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in summary['operations'].items():
+        print(f"{name:<24}{stats['count']:>8}{stats['errors']:>6}{stats['throughput_per_s']:>10}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+
+
+def write_json(path, payload):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultats écrits dans {path}")
+
+
+def server_command(mode):
+    """Commande et variables d'environnement d'un serveur de test : dev, flask ou uwsgi."""
+    if mode == 'dev':
+        # Configuration historique du conteneur : serveur Flask en debug avec rechargement
+        return [sys.executable, os.path.join(API_DIR, 'app.py')], {'FLASK_DEBUG': '1'}
+    if mode == 'flask':
+        return [sys.executable, os.path.join(API_DIR, 'app.py')], {'FLASK_DEBUG': '0'}
+    return ['uwsgi', '--ini', os.path.join(ROOT, 'uwsgi.ini')], {}
+
+
+def wait_until_up(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/general/version', timeout=2):
+                return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    return False
+
+
+@contextlib.contextmanager
+def running_server(mode, env, port, startup_timeout=60.0):
+    """Démarre le serveur `mode` sur `port` et retourne son URL ; l'arrête (enfants compris) à la sortie."""
+    command, extra_env = server_command(mode)
+    server_env = dict(env, PORT=str(port), **extra_env)
+    process = subprocess.Popen(command, cwd=ROOT, env=server_env, start_new_session=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        if not wait_until_up(base_url, startup_timeout):
+            raise SystemExit(f"Le serveur '{mode}' n'a pas démarré")
+        yield base_url
+    finally:
+        # Arrête le serveur et ses enfants (rechargeur Flask, workers uwsgi)
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def baseline_path(name):
+    """Un nom simple désigne benchmarks/baselines/<nom>.json ; un chemin est utilisé tel quel."""
+    if os.sep in name or name.endswith('.json'):
+        return name
+    return os.path.join(BASELINE_DIR, f'{name}.json')
+
+
+def load_baseline(name):
+    with open(baseline_path(name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_to_baseline(summary, baseline, tolerance):
+    """
+    Affiche l'écart des percentiles de chaque opération par rapport à la référence et retourne
+    les régressions : p95 ou p99 plus de `tolerance` (0.2 = 20 %) au-dessus de la référence.
+    """
+    regressions = []
+    print(f"\n== Comparaison à la référence ({baseline.get('label', '?')}, tolérance {tolerance:.0%})")
+    print(f"{'opération':<24}" + ''.join(f"{key:>24}" for key in ('p50 ms', 'p95 ms', 'p99 ms')))
+    reference = baseline.get('summary', baseline)['operations']
+    for name, stats in summary['operations'].items():
+        ref = reference.get(name)
+        if ref is None:
+            print(f"{name:<24}{'(absente de la référence)':>72}")
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            delta = (stats[key] - ref[key]) / ref[key] if ref[key] else 0.0
+            cells.append(f"{ref[key]}→{stats[key]} ({delta:+.0%})")
+            if key != 'p50_ms' and delta > tolerance:
+                regressions.append(f"{name}: {key} {ref[key]} -> {stats[key]} ({delta:+.0%})")
+        print(f"{name:<24}" + ''.join(f"{cell:>24}" for cell in cells))
+    return regressions
+
+
+def save_baseline(name, label, summary, parameters):
+    path = baseline_path(name)
+    write_json(path, {'label': label, 'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                      'parameters': parameters, 'summary': summary})
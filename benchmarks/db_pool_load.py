@@ -0,0 +1,160 @@
+"""
+Test de charge du moteur SQLAlchemy : options par défaut (configuration historique de app.py)
+contre options réglées (database.engine_options).
+
+Chaque thread simule un worker uwsgi et enchaîne, jusqu'à la fin de la durée :
+  - read_latest   : dernier status de 50 BAES tirés au hasard (lecture de tableau de bord)
+  - ingest_batch  : insertion de --batch status en une requête executemany, puis rollback
+                    (mesure fast_executemany sans polluer l'historique, sauf --commit)
+
+Exemples :
+  DB_HOST=localhost python benchmarks/db_pool_load.py --threads 8 --duration 30 --seed 500
+  python benchmarks/db_pool_load.py --uri sqlite:///benchmarks/results/pool.sqlite --seed 500
+"""
+import argparse
+import random
+import threading
+import time
+
+from common import Recorder, print_table, timed, write_json
+
+from sqlalchemy import create_engine, func, insert, select
+
+import database
+from models import db, Baes, Status
+from services.status_queries import latest_status_subquery
+
+SEED_ID_OFFSET = 9_000_000_000
+
+
+def seed(engine, count):
+    """Crée les tables si besoin et ajoute `count` BAES de test avec quelques status."""
+    db.metadata.create_all(engine)
+    now = time.time()
+    with engine.begin() as conn:
+        existing = conn.execute(
+            select(func.count()).select_from(Baes.__table__).where(Baes.id >= SEED_ID_OFFSET)
+        ).scalar()
+        if existing >= count:
+            return
+        from templates.TimestampMixin import current_time
+        ts = current_time()
+        baes_rows = [
+            {'id': SEED_ID_OFFSET + i, 'name': f'bench-{i}', 'position': {'x': 0, 'y': 0}, 'pos_x': 0, 'pos_y': 0,
+             'is_ignored': False, 'etage_id': None, 'created_at': ts, 'updated_at': ts}
+            for i in range(existing, count)
+        ]
+        conn.execute(insert(Baes.__table__), baes_rows)
+        status_rows = [
+            {'baes_id': row['id'], 'erreur': random.choice((0, 4, 6, 6, 6)), 'is_solved': False,
+             'vibration': False, 'timestamp': ts, 'created_at': ts, 'updated_at': ts}
+            for row in baes_rows for _ in range(3)
+        ]
+        conn.execute(insert(Status.__table__), status_rows)
+    print(f"Jeu de test : {count} BAES ({time.time() - now:.1f} s)")
+
+
+def load_baes_ids(engine):
+    with engine.connect() as conn:
+        ids = conn.execute(select(Baes.id).where(Baes.id >= SEED_ID_OFFSET)).scalars().all()
+        if not ids:
+            ids = conn.execute(select(Baes.id).limit(5000)).scalars().all()
+    if not ids:
+        raise SystemExit("Aucun BAES en base : relancer avec --seed N")
+    return ids
+
+
+def read_latest(engine, baes_ids):
+    sample = random.sample(baes_ids, min(50, len(baes_ids)))
+    latest = latest_status_subquery(Status.baes_id.in_(sample))
+    with engine.connect() as conn:
+        return conn.execute(
+            select(Status.id, Status.baes_id, Status.erreur)
+            .join(latest, Status.id == latest.c.status_id)
+            .where(latest.c.rn == 1)
+        ).all()
+
+
+def ingest_batch(engine, baes_ids, batch, commit):
+    from templates.TimestampMixin import current_time
+    ts = current_time()
+    rows = [
+        {'baes_id': random.choice(baes_ids), 'erreur': 6, 'is_solved': False, 'vibration': False,
+         'timestamp': ts, 'created_at': ts, 'updated_at': ts}
+        for _ in range(batch)
+    ]
+    with engine.connect() as conn:
+        trans = conn.begin()
+        conn.execute(insert(Status.__table__), rows)
+        if commit:
+            trans.commit()
+        else:
+            trans.rollback()
+
+
+def run(engine, baes_ids, args):
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            if random.random() < args.write_ratio:
+                timed(recorder, 'ingest_batch', ingest_batch, engine, baes_ids, args.batch, args.commit)
+            else:
+                timed(recorder, 'read_latest', read_latest, engine, baes_ids)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    recorder.stop()
+    return recorder.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=None, help="URI de la base (défaut : DATABASE_URL ou variables DB_*)")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help="durée par configuration, en secondes")
+    parser.add_argument('--batch', type=int, default=200, help="status insérés par ingest_batch")
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0, help="crée N BAES de test si absents")
+    parser.add_argument('--commit', action='store_true', help="valide les insertions au lieu d'un rollback")
+    parser.add_argument('--only', choices=('baseline', 'tuned'), default=None)
+    parser.add_argument('--json', default=None, help="fichier de résultats JSON")
+    args = parser.parse_args()
+
+    uri = args.uri or database.database_uri()
+    if uri.startswith('mssql+pyodbc'):
+        database.configure_odbc_pooling()
+
+    configs = {
+        'baseline': {},
+        'tuned': database.engine_options(uri),
+    }
+    if args.only:
+        configs = {args.only: configs[args.only]}
+
+    setup_engine = create_engine(uri)
+    if args.seed:
+        seed(setup_engine, args.seed)
+    baes_ids = load_baes_ids(setup_engine)
+    setup_engine.dispose()
+
+    results = {'uri': uri.split('?')[0], 'threads': args.threads, 'batch': args.batch, 'configs': {}}
+    for name, options in configs.items():
+        engine = create_engine(uri, **options)
+        try:
+            summary = run(engine, baes_ids, args)
+        finally:
+            engine.dispose()
+        summary['engine_options'] = options
+        results['configs'][name] = summary
+        print_table(f"{name} {options}", summary)
+
+    write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Export en flux de l'historique (GET /status/export) : débit et mémoire sur un gros volume.
+
+Sans --uri, un parc synthétique est généré dans une base SQLite jetable (fleet.py, une trame par
+minute et par BAES). Chaque format est exporté en entier à travers l'application (client de test,
+réponse non mise en tampon). Pendant l'export, la mémoire résidente du processus est échantillonnée
+toutes les 50 ms. Échec (code de sortie 1) si elle croît de plus de --max-rss-mb : la mémoire
+d'un export ne doit dépendre que de la taille d'un paquet, pas du nombre de lignes.
+
+Exemples :
+  # ~10 millions de status : 700 BAES sur 10 jours
+  python benchmarks/export_load.py --sites 1 --etages 10 --baes 70 --days 10 --formats csv parquet
+  python benchmarks/export_load.py --preset small --formats csv --json benchmarks/results/export.json
+  python benchmarks/export_load.py --uri sqlite:///benchmarks/results/fleet.db --site-id 1
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from common import write_json
+from fleet import add_topology_arguments, device_count, frames_per_device, generate_subprocess, topology_from_args
+
+
+def rss_bytes():
+    """Mémoire résidente actuelle du processus (Linux), ou pic depuis le démarrage à défaut."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler:
+    """Pic de mémoire résidente pendant un bloc `with`, échantillonné dans un thread."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self.start = self.peak = rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+    @property
+    def growth_mb(self):
+        return (self.peak - self.start) / 1e6
+
+
+def export_once(client, fmt, query, output_dir):
+    """Exporte un format à travers l'application ; retourne les mesures."""
+    path = os.path.join(output_dir, f'export.{fmt}') if output_dir else os.devnull
+    size = 0
+    started = time.perf_counter()
+    with RssSampler() as memory, open(path, 'wb') as out:
+        response = client.get(f'/status/export?format={fmt}{query}', buffered=False)
+        if response.status_code != 200:
+            raise SystemExit(f"{fmt} : statut HTTP {response.status_code} {response.get_data(as_text=True)}")
+        first_byte = None
+        for block in response.response:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            out.write(block)
+            size += len(block)
+        response.close()
+    elapsed = time.perf_counter() - started
+    return {'format': fmt, 'seconds': round(elapsed, 2), 'first_byte_ms': round((first_byte or 0) * 1000, 1),
+            'bytes': size, 'rss_start_mb': round(memory.start / 1e6, 1),
+            'rss_growth_mb': round(memory.growth_mb, 1), 'path': path if output_dir else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_topology_arguments(parser)
+    parser.add_argument('--uri', default=None, help="base existante (défaut : parc SQLite jetable généré)")
+    parser.add_argument('--formats', nargs='+', choices=['csv', 'parquet'], default=['csv'])
+    parser.add_argument('--site-id', type=int, default=None, help="exporte un seul site (défaut : tout l'historique)")
+    parser.add_argument('--output-dir', default=None, help="conserve les fichiers exportés (défaut : /dev/null)")
+    parser.add_argument('--max-rss-mb', type=float, default=256.0,
+                        help="croissance maximale de la mémoire résidente pendant un export")
+    parser.add_argument('--json', default=None, help="fichier de résultats JSON")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.uri:
+        uri = args.uri
+    else:
+        topology = topology_from_args(args)
+        print(f"Génération du parc : {device_count(topology)} BAES, "
+              f"~{device_count(topology) * frames_per_device(topology):,} status")
+        uri = f"sqlite:///{os.path.join(tmp.name, 'fleet.db')}"
+        generate_subprocess(topology, args.seed, os.path.join(tmp.name, 'fleet.json'),
+                            dict(os.environ, DATABASE_URL=uri, SWAGGER_ENABLED='false', LOG_LEVEL='WARNING'))
+    os.environ['DATABASE_URL'] = uri
+    os.environ.setdefault('SWAGGER_ENABLED', 'false')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from app import app
+    from sqlalchemy import func, select
+    from models import db, Status
+    from services import status_history
+    from werkzeug.datastructures import MultiDict
+
+    query = f'&site_id={args.site_id}' if args.site_id is not None else ''
+    with app.app_context():
+        filters = status_history.HistoryFilter(MultiDict({'site_id': args.site_id} if args.site_id is not None else {}))
+        rows = db.session.execute(select(func.count()).select_from(Status).where(*filters.criteria())).scalar()
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if 'parquet' in args.formats:
+        # Import unique de pyarrow, hors de la mesure de mémoire de l'export
+        import pyarrow.parquet  # noqa: F401
+
+    client = app.test_client()
+    results, failures = [], []
+    print(f"\n{'format':<10}{'status':>14}{'s':>10}{'status/s':>12}{'Mo':>10}{'1er octet ms':>14}{'RSS +Mo':>10}")
+    for fmt in args.formats:
+        result = export_once(client, fmt, query, args.output_dir)
+        result['rows'] = rows
+        result['rows_per_s'] = round(rows / result['seconds']) if result['seconds'] else 0
+        results.append(result)
+        print(f"{fmt:<10}{rows:>14,}{result['seconds']:>10}{result['rows_per_s']:>12,}"
+              f"{result['bytes'] / 1e6:>10.1f}{result['first_byte_ms']:>14}{result['rss_growth_mb']:>10}")
+        if result['rss_growth_mb'] > args.max_rss_mb:
+            failures.append(f"{fmt}: +{result['rss_growth_mb']} Mo de mémoire résidente (max {args.max_rss_mb})")
+
+    write_json(args.json, {'database': uri.split('?')[0].split('@')[-1], 'rows': rows, 'results': results,
+                           'failures': failures})
+    tmp.cleanup()
+    if failures:
+        print('\nÉCHEC :')
+        for failure in failures:
+            print(f"  - {failure}")
+        raise SystemExit(1)
+    print('\nOK : mémoire constante pendant les exports.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+"""
+Générateur de parc synthétique à la topologie de production, pour les benchmarks.
+
+  - sites × bâtiments, --etages étages par site (~50 en production), --baes BAES par étage (~60),
+    un plan (carte) par étage ;
+  - un historique de status à une trame par minute et par BAES sur --days jours : majorité de
+    status OK (6), pannes de connexion (0) et de batterie (4) qui durent quelques dizaines de
+    minutes, température avec cycle journalier ; la moitié des pannes de plus d'une heure sont
+    acquittées ;
+  - un administrateur de tous les sites (bench-admin) et un utilisateur par site (bench-user-<n>) ;
+  - les compteurs d'alarmes recalculés à la fin.
+
+Les identifiants de BAES sont déterministes (adresses 64 bits FLEET_BAES_BASE + n) : ingest_load.py
+rejoue des trames front_baes/data sur ces BAES à partir de la seule topologie. Un manifeste JSON
+(identifiants de sites, étages, utilisateurs) est écrit pour read_scenarios.py.
+
+Volumes : preset production (10 sites × 50 étages × 60 BAES, 90 jours) = 30 000 BAES et
+~3,9 milliards de status, à réserver à une base MSSQL dédiée ; small tient sur SQLite.
+
+Exemples :
+  python benchmarks/fleet.py generate --preset small --uri sqlite:///benchmarks/results/fleet.db
+  DATABASE_URL=mssql+pyodbc://... python benchmarks/fleet.py generate --sites 4 --days 30 --reset
+  python benchmarks/fleet.py frames --preset small --count 100000 --output benchmarks/results/frames.jsonl
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from common import ROOT, write_json
+
+FLEET_BAES_BASE = 0x00124B0000000000
+FRAME_TOPIC = 'front_baes/data'
+DEFAULT_MANIFEST = os.path.join(ROOT, 'benchmarks', 'results', 'fleet.json')
+INSERT_CHUNK = 5000
+
+PRESETS = {
+    'tiny': {'sites': 1, 'batiments': 1, 'etages': 3, 'baes': 10, 'days': 0.25},
+    'small': {'sites': 2, 'batiments': 2, 'etages': 10, 'baes': 20, 'days': 1},
+    'medium': {'sites': 4, 'batiments': 2, 'etages': 50, 'baes': 60, 'days': 7},
+    'production': {'sites': 10, 'batiments': 2, 'etages': 50, 'baes': 60, 'days': 90},
+}
+
+# Probabilités par trame (une minute) : entrée en panne, retour à la normale
+P_CONNECTION_FAULT = 0.0002
+P_BATTERY_FAULT = 0.0001
+P_RECOVERY = 0.03
+
+
+def add_topology_arguments(parser):
+    """Options de topologie partagées par fleet.py, ingest_load.py et read_scenarios.py."""
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    for name, help_text in (('sites', "nombre de sites"), ('batiments', "bâtiments par site"),
+                            ('etages', "étages par site"), ('baes', "BAES par étage")):
+        parser.add_argument(f'--{name}', type=int, default=None, help=f"{help_text} (remplace le preset)")
+    parser.add_argument('--days', type=float, default=None, help="jours d'historique (remplace le preset)")
+    parser.add_argument('--frame-interval', type=int, default=60, help="secondes entre deux trames d'un BAES")
+    parser.add_argument('--seed', type=int, default=42, help="graine du générateur pseudo-aléatoire")
+
+
+def topology_from_args(args):
+    topology = dict(PRESETS[args.preset])
+    for key in ('sites', 'batiments', 'etages', 'baes', 'days'):
+        value = getattr(args, key)
+        if value is not None:
+            topology[key] = value
+    topology['batiments'] = max(1, min(topology['batiments'], topology['etages']))
+    topology['frame_interval'] = args.frame_interval
+    return topology
+
+
+def device_count(topology):
+    return topology['sites'] * topology['etages'] * topology['baes']
+
+
+def frames_per_device(topology):
+    return int(topology['days'] * 86400 // topology['frame_interval'])
+
+
+def baes_id(index):
+    return FLEET_BAES_BASE + index
+
+
+def mac(baes_id_value):
+    """Adresse au format des trames : '00:12:4b:00:00:00:00:2a'."""
+    return ':'.join(f'{byte:02x}' for byte in baes_id_value.to_bytes(8, 'big'))
+
+
+class Device:
+    """État simulé d'un BAES : code courant et température de base."""
+
+    __slots__ = ('id', 'erreur', 'base_temperature', 'fault_since')
+
+    def __init__(self, device_id, rng):
+        self.id = device_id
+        self.erreur = 6
+        self.base_temperature = rng.uniform(18.0, 26.0)
+        self.fault_since = None
+
+    def step(self, rng, minute_of_day, frame_index):
+        if self.erreur == 6:
+            draw = rng.random()
+            if draw < P_CONNECTION_FAULT:
+                self.erreur, self.fault_since = 0, frame_index
+            elif draw < P_CONNECTION_FAULT + P_BATTERY_FAULT:
+                self.erreur, self.fault_since = 4, frame_index
+        elif rng.random() < P_RECOVERY:
+            self.erreur, self.fault_since = 6, None
+        daily = 2.5 * math.sin(2 * math.pi * (minute_of_day - 480) / 1440)
+        temperature = round(self.base_temperature + daily + rng.gauss(0, 0.3), 1)
+        vibration = rng.random() < 0.001
+        return self.erreur, temperature, vibration
+
+
+def iter_frames(topology, count, seed=42):
+    """Trames front_baes/data de la flotte, une par BAES à tour de rôle, indéfiniment si count vaut 0."""
+    rng = random.Random(seed)
+    devices = [Device(baes_id(i), rng) for i in range(device_count(topology))]
+    emitted = 0
+    frame_index = 0
+    while True:
+        minute_of_day = (frame_index * topology['frame_interval'] // 60) % 1440
+        for device in devices:
+            erreur, temperature, vibration = device.step(rng, minute_of_day, frame_index)
+            yield {'baes_id': mac(device.id), 'baes_state': erreur, 'temperature': str(temperature),
+                   'vibration': vibration}
+            emitted += 1
+            if count and emitted >= count:
+                return
+        frame_index += 1
+
+
+def status_payload(frame):
+    """Corps POST /status/ produit par le bridge (scripts/mqtt_to_baesapi.py) pour une trame."""
+    erreur_raw = frame.get('baes_state', frame.get('erreur', 6))
+    erreur = int(erreur_raw) if isinstance(erreur_raw, (int, float)) or (
+        isinstance(erreur_raw, str) and erreur_raw.isdigit()) else 6
+    data = {'baes_id': int(frame['baes_id'].replace(':', ''), 16) & 0xFFFFFFFFFFFFFFFF, 'erreur': erreur}
+    temperature = frame.get('temperature')
+    if temperature is not None and temperature != 'nan':
+        data['temperature'] = float(temperature)
+    if frame.get('vibration') is not None:
+        data['vibration'] = frame['vibration']
+    return data
+
+
+# ===== Génération en base =====
+
+def _create_hierarchy(topology):
+    """Sites, bâtiments, étages, plans et utilisateurs (ORM) ; retourne le manifeste partiel."""
+    from models import db, Batiment, Carte, Etage, Role, Site, User, UserSiteRole
+
+    roles = {role.name: role.id for role in Role.query.all()}
+    admin = User(login='bench-admin')
+    admin.set_password('bench')
+    db.session.add(admin)
+
+    manifest = {'sites': [], 'users': {}}
+    etages = []
+    per_batiment = math.ceil(topology['etages'] / topology['batiments'])
+    for s in range(topology['sites']):
+        site = Site(name=f'fleet-site-{s}')
+        db.session.add(site)
+        db.session.flush()
+        user = User(login=f'bench-user-{s}')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.flush()
+        db.session.add_all([UserSiteRole(user_id=admin.id, site_id=site.id, role_id=roles['admin']),
+                            UserSiteRole(user_id=user.id, site_id=site.id, role_id=roles['user'])])
+        site_entry = {'id': site.id, 'user_id': user.id, 'batiments': [], 'etages': []}
+        for b in range(topology['batiments']):
+            batiment = Batiment(name=f'fleet-bat-{s}-{b}', site_id=site.id, polygon_points={})
+            db.session.add(batiment)
+            db.session.flush()
+            site_entry['batiments'].append(batiment.id)
+            for e in range(b * per_batiment, min((b + 1) * per_batiment, topology['etages'])):
+                etage = Etage(name=f'fleet-etage-{s}-{e}', batiment_id=batiment.id)
+                db.session.add(etage)
+                db.session.flush()
+                db.session.add(Carte(chemin=f'uploads/fleet-{etage.id}.png', etage_id=etage.id))
+                site_entry['etages'].append(etage.id)
+                etages.append(etage.id)
+        manifest['sites'].append(site_entry)
+    db.session.flush()
+    manifest['users'] = {'admin': admin.id}
+    return manifest, etages
+
+
+def _insert_baes(etages, topology):
+    from sqlalchemy import insert
+    from models import db, Baes
+    from templates.TimestampMixin import current_time
+
+    now = current_time()
+    rows = []
+    for position, etage_id in enumerate(etages):
+        for n in range(topology['baes']):
+            index = position * topology['baes'] + n
+            x, y = 40 + 30 * (n % 20), 40 + 30 * (n // 20)
+            rows.append({'id': baes_id(index), 'name': f'fleet-{index}', 'label': None,
+                         'position': {'x': x, 'y': y}, 'pos_x': x, 'pos_y': y,
+                         'is_ignored': False, 'etage_id': etage_id, 'created_at': now, 'updated_at': now})
+    for start in range(0, len(rows), INSERT_CHUNK):
+        db.session.execute(insert(Baes.__table__), rows[start:start + INSERT_CHUNK])
+
+
+def _insert_history(topology, admin_id, seed):
+    """Historique minute par minute, dans l'ordre chronologique (les id croissent avec le temps)."""
+    from sqlalchemy import insert
+    from models import db, Status
+    from templates.TimestampMixin import current_time
+
+    rng = random.Random(seed)
+    devices = [Device(baes_id(i), rng) for i in range(device_count(topology))]
+    total_frames = frames_per_device(topology)
+    interval = timedelta(seconds=topology['frame_interval'])
+    start = current_time() - interval * total_frames
+    ack_after = max(1, 3600 // topology['frame_interval'])
+
+    inserted = 0
+    rows = []
+    started = time.perf_counter()
+    for frame_index in range(total_frames):
+        ts = start + interval * frame_index
+        minute_of_day = ts.hour * 60 + ts.minute
+        for device in devices:
+            erreur, temperature, vibration = device.step(rng, minute_of_day, frame_index)
+            acknowledged = (erreur != 6 and frame_index - device.fault_since >= ack_after
+                            and device.id % 2 == 0)
+            rows.append({'baes_id': device.id, 'erreur': erreur, 'is_solved': False,
+                         'temperature': temperature, 'vibration': vibration, 'timestamp': ts,
+                         'acknowledged_by_user_id': admin_id if acknowledged else None,
+                         'acknowledged_at': ts if acknowledged else None,
+                         'created_at': ts, 'updated_at': ts})
+            if len(rows) >= INSERT_CHUNK:
+                db.session.execute(insert(Status.__table__), rows)
+                db.session.commit()
+                inserted += len(rows)
+                rows = []
+        if frame_index % 60 == 0:
+            rate = inserted / max(time.perf_counter() - started, 1e-9)
+            print(f"\r  {frame_index}/{total_frames} minutes, {inserted} status ({rate:,.0f}/s)", end='', flush=True)
+    if rows:
+        db.session.execute(insert(Status.__table__), rows)
+        db.session.commit()
+        inserted += len(rows)
+    print(f"\r  {total_frames} minutes, {inserted} status en {time.perf_counter() - started:.1f} s" + ' ' * 20)
+    return inserted
+
+
+def generate(app, topology, seed, reset):
+    from models import db, Site
+    from services import alarm_counters
+    import bootstrap
+
+    with app.app_context():
+        if reset:
+            db.drop_all()
+        bootstrap.run()
+        if Site.query.filter(Site.name.like('fleet-site-%')).first() is not None:
+            raise SystemExit("Un parc synthétique existe déjà dans cette base : relancer avec --reset")
+
+        print(f"Parc : {topology['sites']} sites, {device_count(topology)} BAES, "
+              f"{frames_per_device(topology) * device_count(topology):,} status à générer")
+        manifest, etages = _create_hierarchy(topology)
+        _insert_baes(etages, topology)
+        db.session.commit()
+        manifest['status_count'] = _insert_history(topology, manifest['users']['admin'], seed)
+
+        alarm_counters.refresh_sites([site['id'] for site in manifest['sites']])
+        db.session.commit()
+    manifest['topology'] = topology
+    manifest['baes_ids'] = [FLEET_BAES_BASE, FLEET_BAES_BASE + device_count(topology) - 1]
+    return manifest
+
+
+def generate_subprocess(topology, seed, manifest_path, env):
+    """Génère le parc dans un processus séparé (base DATABASE_URL de `env`), pour les scripts --serve."""
+    command = [sys.executable, os.path.abspath(__file__), 'generate', '--manifest', manifest_path,
+               '--seed', str(seed), '--frame-interval', str(topology['frame_interval'])]
+    for key in ('sites', 'batiments', 'etages', 'baes', 'days'):
+        command += [f'--{key}', str(topology[key])]
+    subprocess.run(command, env=env, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help="crée le parc et son historique en base")
+    add_topology_arguments(gen)
+    gen.add_argument('--uri', default=None, help="base cible (défaut : DATABASE_URL ou variables DB_*)")
+    gen.add_argument('--reset', action='store_true', help="supprime toutes les tables avant génération")
+    gen.add_argument('--manifest', default=DEFAULT_MANIFEST, help="fichier manifeste JSON")
+
+    frames = sub.add_parser('frames', help="écrit des trames front_baes/data (JSON lines) pour ingest_load.py")
+    add_topology_arguments(frames)
+    frames.add_argument('--count', type=int, default=100000)
+    frames.add_argument('--output', default='-', help="fichier de sortie (- : sortie standard)")
+
+    args = parser.parse_args()
+    topology = topology_from_args(args)
+
+    if args.command == 'frames':
+        out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        try:
+            for frame in iter_frames(topology, args.count, args.seed):
+                out.write(json.dumps(frame) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return
+
+    if args.uri:
+        os.environ['DATABASE_URL'] = args.uri
+    os.environ.setdefault('SWAGGER_ENABLED', 'false')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from app import app
+
+    manifest = generate(app, topology, args.seed, args.reset)
+    manifest['database'] = app.config['SQLALCHEMY_DATABASE_URI'].split('?')[0].split('@')[-1]
+    write_json(args.manifest, manifest)
+
+
+if __name__ == '__main__':
+    main()
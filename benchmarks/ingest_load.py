@@ -0,0 +1,252 @@
+"""
+Charge d'ingestion : rejoue des trames front_baes/data sur la flotte synthétique (fleet.py).
+
+  http : POST /status/ du corps que produit le bridge (scripts/mqtt_to_baesapi.py), sans broker ;
+         mesure la capacité d'ingestion de l'API seule.
+  mqtt : publication sur le topic front_baes/data d'un broker (nécessite paho-mqtt) ; la latence
+         mesurée est celle de l'accusé du broker (QoS 1). Avec --drain-uri, le nombre de status
+         effectivement écrits en base est suivi jusqu'à ce que le bridge ait tout absorbé :
+         c'est le débit de bout en bout trame -> bridge -> API -> base.
+
+Les trames viennent de --frames (JSON lines, ex. `fleet.py frames` ou une capture mosquitto_sub)
+ou sont générées à la volée pour la topologie demandée (mêmes identifiants que `fleet.py generate` :
+les BAES existent déjà en base). Avec --rate, la charge est à débit imposé et la latence est
+comptée depuis l'instant d'envoi prévu : un serveur qui prend du retard voit ses percentiles
+augmenter au lieu de ralentir le générateur.
+
+--serve flask|uwsgi démarre l'API sur --uri ou, à défaut, sur un parc SQLite jetable généré pour
+la topologie demandée (comme read_scenarios.py).
+
+Exemples :
+  python benchmarks/ingest_load.py --serve flask --preset tiny --clients 4 --baseline ingest-sqlite-tiny
+  python benchmarks/ingest_load.py --base-url http://127.0.0.1:5000 --preset small --rate 500 --duration 30
+  python benchmarks/ingest_load.py --target mqtt --mqtt-host localhost --rate 1000 \\
+      --drain-uri sqlite:///benchmarks/results/fleet.db
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+
+from common import (Recorder, compare_to_baseline, load_baseline, print_table, running_server,
+                    save_baseline, write_json)
+from fleet import (FRAME_TOPIC, add_topology_arguments, generate_subprocess, iter_frames, status_payload,
+                   topology_from_args)
+
+
+def frame_source(args, topology):
+    """Itérateur partagé (thread-safe) de trames : fichier rejoué en boucle ou flotte générée."""
+    if args.frames:
+        with open(args.frames, encoding='utf-8') as f:
+            frames = [json.loads(line) for line in f if line.strip()]
+        if not frames:
+            raise SystemExit(f"Aucune trame dans {args.frames}")
+        iterator = itertools.cycle(frames)
+    else:
+        iterator = iter_frames(topology, 0, args.seed)
+    lock = threading.Lock()
+
+    def next_frame():
+        with lock:
+            return next(iterator)
+    return next_frame
+
+
+def http_sender(base_url, timeout):
+    url = base_url.rstrip('/') + '/status/'
+
+    def send(frame):
+        body = json.dumps(status_payload(frame)).encode('utf-8')
+        req = urllib.request.Request(url, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+    return send, 'http_post_status'
+
+
+def mqtt_sender(args):
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        raise SystemExit("paho-mqtt est requis pour --target mqtt (pip install paho-mqtt)")
+    local = threading.local()
+    clients = []
+
+    def client():
+        # Un client par thread : les accusés QoS 1 d'un thread ne bloquent pas les autres
+        if not hasattr(local, 'client'):
+            c = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+            if args.mqtt_user:
+                c.username_pw_set(args.mqtt_user, args.mqtt_password)
+            c.connect(args.mqtt_host, args.mqtt_port, 60)
+            c.loop_start()
+            local.client = c
+            clients.append(c)
+        return local.client
+
+    def send(frame):
+        info = client().publish(FRAME_TOPIC, json.dumps(frame), qos=args.qos)
+        info.wait_for_publish(timeout=args.timeout)
+        if not info.is_published():
+            raise TimeoutError("publication non acquittée par le broker")
+
+    def close():
+        for c in clients:
+            c.loop_stop()
+            c.disconnect()
+    send.close = close
+    return send, 'mqtt_publish'
+
+
+def run_load(send, name, next_frame, args):
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.duration
+    # Débit imposé : chaque thread envoie à rate / clients trames par seconde
+    interval = args.clients / args.rate if args.rate else 0.0
+
+    def worker(offset):
+        scheduled = time.perf_counter() + interval * offset / args.clients
+        while True:
+            if interval:
+                wait = scheduled - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            start = scheduled if interval else time.perf_counter()
+            if start >= deadline:
+                return
+            try:
+                send(next_frame())
+            except Exception as e:
+                recorder.error(name, e)
+            else:
+                recorder.record(name, time.perf_counter() - start)
+            scheduled += interval
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    recorder.stop()
+    return recorder.summary()
+
+
+def status_max_id(engine):
+    from sqlalchemy import func, select
+    from models import Status
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(Status.id))).scalar() or 0
+
+
+def wait_for_drain(engine, start_id, sent, started, stall_timeout):
+    """Suit l'écriture en base des trames publiées ; s'arrête à `sent` status ou après un arrêt du flux."""
+    written, last_progress = 0, time.perf_counter()
+    while written < sent and time.perf_counter() - last_progress < stall_timeout:
+        time.sleep(0.5)
+        current = status_max_id(engine) - start_id
+        if current > written:
+            written, last_progress = current, time.perf_counter()
+    elapsed = last_progress - started
+    return {'sent': sent, 'written': written, 'elapsed_s': round(elapsed, 2),
+            'end_to_end_per_s': round(written / elapsed, 1) if elapsed > 0 else 0.0}
+
+
+def run_target(args, topology, next_frame):
+    if args.target == 'http':
+        send, name = http_sender(args.base_url, args.timeout)
+    else:
+        send, name = mqtt_sender(args)
+
+    engine = None
+    if args.drain_uri:
+        from sqlalchemy import create_engine
+        engine = create_engine(args.drain_uri)
+        start_id = status_max_id(engine)
+
+    started = time.perf_counter()
+    try:
+        summary = run_load(send, name, next_frame, args)
+    finally:
+        if hasattr(send, 'close'):
+            send.close()
+    parameters = {'target': args.target, 'rate': args.rate, 'clients': args.clients,
+                  'duration': args.duration, 'topology': topology, 'frames': args.frames}
+    results = {'parameters': parameters, 'summary': summary}
+    sent = summary['operations'].get(name, {}).get('count', 0)
+    print_table(f"ingestion {args.target} : {round(sent / summary['elapsed_s'], 1)} trames/s", summary)
+    if engine is not None:
+        results['drain'] = wait_for_drain(engine, start_id, sent, started, args.drain_timeout)
+        engine.dispose()
+        print(f"\nBout en bout : {results['drain']['written']}/{sent} status écrits, "
+              f"{results['drain']['end_to_end_per_s']} status/s")
+    return summary, results, name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_topology_arguments(parser)
+    parser.add_argument('--target', choices=('http', 'mqtt'), default='http')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000', help="API cible (mode http)")
+    parser.add_argument('--serve', choices=('flask', 'uwsgi'), default=None, help="démarre l'API (mode http)")
+    parser.add_argument('--uri', default=None, help="base servie avec --serve (défaut : parc SQLite temporaire)")
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--frames', default=None, help="trames JSON lines à rejouer (défaut : générées)")
+    parser.add_argument('--rate', type=float, default=0.0, help="trames par seconde au total (0 : au plus vite)")
+    parser.add_argument('--clients', type=int, default=8, help="threads émetteurs")
+    parser.add_argument('--duration', type=float, default=30.0, help="durée en secondes")
+    parser.add_argument('--timeout', type=float, default=10.0, help="délai maximal d'un envoi, en secondes")
+    parser.add_argument('--mqtt-host', default=os.getenv('MQTT_HOST', 'localhost'))
+    parser.add_argument('--mqtt-port', type=int, default=int(os.getenv('MQTT_PORT', '1883')))
+    parser.add_argument('--mqtt-user', default=os.getenv('MQTT_USER'))
+    parser.add_argument('--mqtt-password', default=os.getenv('MQTT_PASSWORD'))
+    parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=1)
+    parser.add_argument('--drain-uri', default=None,
+                        help="base de l'API : mesure le débit de bout en bout (mode mqtt)")
+    parser.add_argument('--drain-timeout', type=float, default=30.0,
+                        help="arrêt du suivi après N secondes sans nouveau status")
+    parser.add_argument('--baseline', default=None, help="référence à comparer (nom dans benchmarks/baselines ou chemin)")
+    parser.add_argument('--save-baseline', default=None, help="enregistre le résultat comme référence")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="régression tolérée sur p95/p99 (0.2 = 20 %%)")
+    parser.add_argument('--json', default=None, help="fichier de résultats JSON")
+    args = parser.parse_args()
+
+    if args.serve == 'uwsgi' and shutil.which('uwsgi') is None:
+        parser.error("uwsgi introuvable (pip install \".[prod]\")")
+
+    topology = topology_from_args(args)
+    next_frame = frame_source(args, topology)
+    with contextlib.ExitStack() as stack:
+        if args.serve:
+            env = dict(os.environ, SWAGGER_ENABLED='false', LOG_LEVEL='WARNING')
+            if args.uri:
+                env['DATABASE_URL'] = args.uri
+            else:
+                tmp = stack.enter_context(tempfile.TemporaryDirectory())
+                env['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'fleet.db')}"
+                generate_subprocess(topology, args.seed, os.path.join(tmp, 'fleet.json'), env)
+            args.base_url = stack.enter_context(running_server(args.serve, env, args.port))
+            args.drain_uri = args.drain_uri or env['DATABASE_URL']
+        summary, results, name = run_target(args, topology, next_frame)
+
+    regressions = []
+    if args.baseline:
+        regressions = compare_to_baseline(summary, load_baseline(args.baseline), args.tolerance)
+        results['regressions'] = regressions
+    if args.save_baseline:
+        save_baseline(args.save_baseline, f"ingestion {args.target}", summary, results['parameters'])
+    write_json(args.json, results)
+    if regressions:
+        print('\nRÉGRESSIONS :')
+        for regression in regressions:
+            print(f"  - {regression}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
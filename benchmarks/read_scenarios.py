@@ -0,0 +1,168 @@
+"""
+Scénarios de lecture des tableaux de bord : latence p50/p95/p99 et débit par endpoint.
+
+Des --clients threads enchaînent pendant --duration secondes des GET tirés selon le poids de
+chaque scénario (SCENARIOS), sur les sites, étages et utilisateurs du parc décrit par le
+manifeste de fleet.py. Un scénario correspond à un écran : liste des BAES d'un utilisateur,
+état d'un site, compteurs, plan d'un étage, etc.
+
+Cibles :
+  --base-url URL       API déjà démarrée sur une base peuplée par fleet.py (manifeste --manifest) ;
+  --serve flask|uwsgi  démarre le serveur sur --uri (défaut : DATABASE_URL) ; sans --uri, un parc
+                       est d'abord généré dans une base SQLite temporaire (options de topologie).
+
+Références : --save-baseline NOM enregistre le résultat dans benchmarks/baselines/NOM.json,
+--baseline NOM compare p95/p99 par scénario et échoue (code 1) au-delà de --tolerance.
+
+Exemples :
+  python benchmarks/read_scenarios.py --serve flask --preset tiny --baseline read-sqlite-tiny
+  python benchmarks/read_scenarios.py --base-url http://127.0.0.1:5000 --manifest benchmarks/results/fleet.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+
+from common import (Recorder, compare_to_baseline, load_baseline, print_table, running_server,
+                    save_baseline, write_json)
+from fleet import DEFAULT_MANIFEST, add_topology_arguments, generate_subprocess, topology_from_args
+
+# nom -> (chemin, poids) ; {user_id}, {site_id}, {etage_id} tirés au hasard dans le manifeste
+SCENARIOS = {
+    'status_user': ('/status/user/{user_id}', 20),
+    'status_admin': ('/status/user/{admin_id}', 5),
+    'site_latest': ('/status/site/{site_id}/latest', 15),
+    'site_summary': ('/status/site/{site_id}/summary', 15),
+    'kpi_site': ('/status/kpi/site/{site_id}', 15),
+    'etage_status': ('/status/etage/{etage_id}', 15),
+    'general_alldata': ('/general/user/{user_id}/alldata', 5),
+    'site_full': ('/sites/{site_id}/full', 5),
+    'baes_user': ('/baes/user/{user_id}', 5),
+}
+
+
+def pick_path(rng, manifest, names, weights):
+    name = rng.choices(names, weights)[0]
+    site = rng.choice(manifest['sites'])
+    path = SCENARIOS[name][0].format(user_id=site['user_id'], admin_id=manifest['users']['admin'],
+                                     site_id=site['id'], etage_id=rng.choice(site['etages']))
+    return name, path
+
+
+def run_scenarios(base_url, manifest, args):
+    recorder = Recorder()
+    names = args.scenario or list(SCENARIOS)
+    weights = [SCENARIOS[name][1] for name in names]
+    deadline = time.perf_counter() + args.duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            name, path = pick_path(rng, manifest, names, weights)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + path, timeout=args.timeout) as response:
+                    response.read()
+            except Exception as e:
+                recorder.error(name, e)
+                continue
+            recorder.record(name, time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(args.seed + n,)) for n in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    recorder.stop()
+    return recorder.summary()
+
+
+def warm_up(base_url, manifest, args):
+    """Un appel par scénario et par site : caches de visibilité, compteurs et plans de requêtes."""
+    for site in manifest['sites']:
+        for name in args.scenario or SCENARIOS:
+            path = SCENARIOS[name][0].format(user_id=site['user_id'], admin_id=manifest['users']['admin'],
+                                             site_id=site['id'], etage_id=site['etages'][0])
+            try:
+                with urllib.request.urlopen(base_url + path, timeout=args.timeout) as response:
+                    response.read()
+            except Exception as e:
+                print(f"Préchauffage {path} : {e}")
+
+
+def measure(base_url, manifest, args):
+    warm_up(base_url, manifest, args)
+    return run_scenarios(base_url, manifest, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_topology_arguments(parser)
+    parser.add_argument('--base-url', default=None, help="API déjà démarrée")
+    parser.add_argument('--serve', choices=('flask', 'uwsgi'), default=None, help="démarre le serveur")
+    parser.add_argument('--uri', default=None, help="base servie avec --serve (défaut : parc SQLite temporaire)")
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST, help="manifeste écrit par fleet.py generate")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), default=None,
+                        help="limite la charge à ce scénario (répétable)")
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20.0, help="durée en secondes")
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--port', type=int, default=5056)
+    parser.add_argument('--baseline', default=None, help="référence à comparer (nom dans benchmarks/baselines ou chemin)")
+    parser.add_argument('--save-baseline', default=None, help="enregistre le résultat comme référence")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="régression tolérée sur p95/p99 (0.2 = 20 %%)")
+    parser.add_argument('--json', default=None, help="fichier de résultats JSON")
+    args = parser.parse_args()
+    if not args.base_url and not args.serve:
+        parser.error("--base-url ou --serve est requis")
+    if args.serve == 'uwsgi' and shutil.which('uwsgi') is None:
+        parser.error("uwsgi introuvable (pip install \".[prod]\")")
+
+    parameters = {'clients': args.clients, 'duration': args.duration, 'scenarios': args.scenario or list(SCENARIOS),
+                  'target': args.base_url or args.serve}
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.serve:
+            env = dict(os.environ, SWAGGER_ENABLED='false', LOG_LEVEL='WARNING')
+            if args.uri:
+                env['DATABASE_URL'] = args.uri
+            else:
+                # Parc jetable à la topologie demandée
+                env['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'fleet.db')}"
+                args.manifest = os.path.join(tmp, 'fleet.json')
+                parameters['topology'] = topology_from_args(args)
+                generate_subprocess(parameters['topology'], args.seed, args.manifest, env)
+        with open(args.manifest, encoding='utf-8') as f:
+            manifest = json.load(f)
+        parameters['status_count'] = manifest.get('status_count')
+
+        if args.serve:
+            with running_server(args.serve, env, args.port) as base_url:
+                summary = measure(base_url, manifest, args)
+        else:
+            summary = measure(args.base_url.rstrip('/'), manifest, args)
+
+    total = sum(stats['count'] for stats in summary['operations'].values())
+    print_table(f"lecture : {round(total / summary['elapsed_s'], 1)} req/s, {args.clients} clients", summary)
+    results = {'parameters': parameters, 'summary': summary}
+
+    regressions = []
+    if args.baseline:
+        regressions = compare_to_baseline(summary, load_baseline(args.baseline), args.tolerance)
+        results['regressions'] = regressions
+    if args.save_baseline:
+        save_baseline(args.save_baseline, f"lecture {parameters['target']}", summary, parameters)
+    write_json(args.json, results)
+    if regressions:
+        print('\nRÉGRESSIONS :')
+        for regression in regressions:
+            print(f"  - {regression}")
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
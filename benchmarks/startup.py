@@ -0,0 +1,105 @@
+"""
+Coût de démarrage d'un worker : import de app.py (create_app) et latence de la première requête.
+
+Chaque mesure est faite dans un interpréteur neuf, comme un worker uwsgi (re)lancé, pour trois
+configurations de la documentation :
+  - generated : spec Swagger construite à la première requête /apispec.json (comportement historique)
+  - cached    : spec générée une fois (swagger build) puis servie depuis le fichier
+  - disabled  : SWAGGER_ENABLED=false (production)
+
+Exemples :
+  python benchmarks/startup.py --runs 10
+  python benchmarks/startup.py --runs 5 --json benchmarks/results/startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import API_DIR, percentile, write_json
+
+# Exécuté dans le processus enfant : mesure l'import puis les premières requêtes
+CHILD = r"""
+import json, logging, sys, time
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+logging.disable(logging.CRITICAL)
+client = app_module.app.test_client()
+result = {'import_s': t1 - t0}
+for name, path in (('version', '/general/version'), ('apispec', '/apispec.json')):
+    start = time.perf_counter()
+    response = client.get(path)
+    result[name + '_s'] = time.perf_counter() - start
+    result[name + '_status'] = response.status_code
+print('@@' + json.dumps(result))
+"""
+
+
+def run_child(env):
+    completed = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=API_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith('@@'):
+            return json.loads(line[2:])
+    raise RuntimeError("Pas de résultat du processus enfant")
+
+
+def build_spec(env, path):
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'swagger', 'build', '--output', path],
+        cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+    )
+
+
+def summarize(samples):
+    summary = {}
+    for key in ('import_s', 'version_s', 'apispec_s'):
+        values = sorted(sample[key] for sample in samples)
+        summary[key.replace('_s', '')] = {
+            'p50_ms': round(percentile(values, 50) * 1000, 1),
+            'p95_ms': round(percentile(values, 95) * 1000, 1),
+            'max_ms': round(values[-1] * 1000, 1),
+        }
+    summary['apispec_status'] = samples[-1]['apispec_status']
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help="processus lancés par configuration")
+    parser.add_argument('--uri', default='sqlite://', help="URI de la base (défaut : SQLite en mémoire)")
+    parser.add_argument('--json', default=None, help="fichier de résultats JSON")
+    args = parser.parse_args()
+
+    base_env = dict(os.environ, DATABASE_URL=args.uri, PYTHONDONTWRITEBYTECODE='1')
+    with tempfile.TemporaryDirectory() as tmp:
+        spec_file = os.path.join(tmp, 'apispec.json')
+        build_spec(dict(base_env, SWAGGER_ENABLED='true'), spec_file)
+
+        scenarios = {
+            'generated': dict(base_env, SWAGGER_ENABLED='true',
+                              SWAGGER_SPEC_FILE=os.path.join(tmp, 'absent.json')),
+            'cached': dict(base_env, SWAGGER_ENABLED='true', SWAGGER_SPEC_FILE=spec_file),
+            'disabled': dict(base_env, SWAGGER_ENABLED='false'),
+        }
+        run_child(base_env)  # préchauffe les caches disque et le bytecode des dépendances
+
+        results = {'runs': args.runs, 'scenarios': {}}
+        print(f"{'configuration':<14}{'import p50':>12}{'1re req p50':>13}{'apispec p50':>13}{'apispec':>9}")
+        for name, env in scenarios.items():
+            samples = [run_child(env) for _ in range(args.runs)]
+            summary = summarize(samples)
+            results['scenarios'][name] = summary
+            print(f"{name:<14}{summary['import']['p50_ms']:>12}{summary['version']['p50_ms']:>13}"
+                  f"{summary['apispec']['p50_ms']:>13}{summary['apispec_status']:>9}")
+
+    write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Débit HTTP du runtime de production (uwsgi, uwsgi.ini) comparé au serveur de développement Flask
+lancé jusqu'ici par supervisord (python api/app.py avec debug et rechargement).
+
+Chaque mode démarre son serveur sur une base SQLite temporaire initialisée par `flask bootstrap`,
+puis --clients threads enchaînent des GET sur les chemins demandés pendant --duration secondes
+(une connexion par requête).
+
+  dev    : FLASK_DEBUG=1 python api/app.py (configuration historique du conteneur)
+  uwsgi  : uwsgi --ini uwsgi.ini (nécessite `pip install ".[prod]"`)
+
+Exemples :
+  python benchmarks/wsgi_throughput.py --clients 16 --duration 20
+  python benchmarks/wsgi_throughput.py --modes uwsgi --path /status/ --json benchmarks/results/wsgi.json
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+from common import API_DIR, Recorder, print_table, running_server, write_json
+
+DEFAULT_PATHS = ('/general/version', '/general/ready', '/status/')
+
+
+def load(base_url, paths, clients, duration):
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def fetch(url):
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+
+    def worker(offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                fetch(base_url + path)
+            except Exception as e:
+                recorder.error(path, e)
+                continue
+            recorder.record(path, time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    recorder.stop()
+    return recorder.summary()
+
+
+def run_mode(mode, args, env):
+    with running_server(mode, env, args.port, args.startup_timeout) as base_url:
+        load(base_url, args.path, args.clients, min(2.0, args.duration))  # préchauffage
+        return load(base_url, args.path, args.clients, args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=('dev', 'uwsgi'), default=['dev', 'uwsgi'])
+    parser.add_argument('--clients', type=int, default=16, help="threads clients simultanés")
+    parser.add_argument('--duration', type=float, default=15.0, help="durée par mode, en secondes")
+    parser.add_argument('--path', action='append', default=None,
+                        help=f"chemin à interroger (répétable, défaut : {', '.join(DEFAULT_PATHS)})")
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--json', default=None, help="fichier de résultats JSON")
+    args = parser.parse_args()
+    args.path = args.path or list(DEFAULT_PATHS)
+
+    if 'uwsgi' in args.modes and shutil.which('uwsgi') is None:
+        print("uwsgi introuvable (pip install \".[prod]\") : mode uwsgi ignoré")
+        args.modes = [mode for mode in args.modes if mode != 'uwsgi']
+
+    results = {'clients': args.clients, 'paths': args.path, 'cpu_count': os.cpu_count(), 'modes': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                   SWAGGER_ENABLED='false', LOG_LEVEL='WARNING')
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap', '--no-wait'],
+                       cwd=API_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+        for mode in args.modes:
+            summary = run_mode(mode, args, env)
+            results['modes'][mode] = summary
+            total = sum(stats['count'] for stats in summary['operations'].values())
+            print_table(f"{mode} : {round(total / summary['elapsed_s'], 1)} req/s", summary)
+
+    write_json(args.json, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -42,8 +42,11 @@ def on_message(client, userdata, message):
         # Remove colons and convert hex string to integer
         baes_id = int(baes_id_raw.replace(":", ""), 16)
 
-        # Ensure it's within 64-bit unsigned range
+        # Keep 64 bits and read them as two's complement: baes.id is a signed BIGINT
+        # (same conversion as the API's BAES import)
         baes_id &= 0xFFFFFFFFFFFFFFFF
+        if baes_id >= 1 << 63:
+            baes_id -= 1 << 64
 
         # Get temperature and vibration from the JSON data if they exist
         temperature = json_data.get("temperature")
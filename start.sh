@@ -1,6 +1,7 @@
 #!/bin/sh
+(cd api && flask --app app bootstrap)
 python scripts/mqtt_to_baesapi.py &
-python api/app.py &
+uwsgi --ini uwsgi.ini &
 
 
 
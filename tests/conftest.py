@@ -0,0 +1,128 @@
+"""
+Fixtures partagées par les tests : application sur une base SQLite temporaire (ou une base
+jetable donnée par TEST_DATABASE_URL) et hiérarchie sites × bâtiments × étages × BAES × status
+peuplée à plusieurs tailles (SCALES).
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+API_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'api'))
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+# Avant tout import de l'application (le paquet racine l'importe dès la collecte) : base jetable
+_tmp = tempfile.TemporaryDirectory()
+os.environ['DATABASE_URL'] = (os.environ.get('TEST_DATABASE_URL')
+                              or f"sqlite:///{os.path.join(_tmp.name, 'test.db')}")
+os.environ.setdefault('SWAGGER_ENABLED', 'false')
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('QUERY_BUDGET', '0')
+
+# Tailles de jeu de données, de la plus petite à la plus grande : sites x bâtiments x étages x BAES x status
+SCALES = ['1x1x1x2x2', '3x2x3x6x4']
+
+
+def parse_scale(text):
+    parts = [int(part) for part in text.lower().split('x')]
+    if len(parts) != 5 or min(parts) < 1:
+        raise ValueError("format attendu : sitesxbatimentsxetagesxbaesxstatus, ex. 2x2x3x5x3")
+    return dict(zip(('sites', 'batiments', 'etages', 'baes', 'statuses'), parts))
+
+
+def seed(scale):
+    """Peuple la base (déjà vide et bootstrapée) ; retourne les identifiants utilisés dans les chemins."""
+    from models import db, Baes, Batiment, Carte, Etage, Role, Site, Status, User, UserSiteRole
+    from services import incidents
+    from templates.TimestampMixin import current_time
+
+    admin = User(login='test-admin')
+    admin.set_password('test')
+    db.session.add(admin)
+    admin_role = Role.query.filter_by(name='admin').one()
+    superadmin = User.query.filter_by(login='superadmin').one()
+
+    baes_id = 1
+    ids = {}
+    now = current_time()
+    for s in range(scale['sites']):
+        site = Site(name=f'test-site-{s}')
+        db.session.add(site)
+        db.session.flush()
+        db.session.add(UserSiteRole(user_id=admin.id, site_id=site.id, role_id=admin_role.id))
+        for b in range(scale['batiments']):
+            batiment = Batiment(name=f'bat-{s}-{b}', site_id=site.id, polygon_points={})
+            db.session.add(batiment)
+            db.session.flush()
+            for e in range(scale['etages']):
+                etage = Etage(name=f'etage-{s}-{b}-{e}', batiment_id=batiment.id)
+                db.session.add(etage)
+                db.session.flush()
+                db.session.add(Carte(chemin=f'uploads/plan-{etage.id}.png', etage_id=etage.id))
+                for _ in range(scale['baes']):
+                    db.session.add(Baes(id=baes_id, name=f'baes-{baes_id}', position={'x': 0, 'y': 0},
+                                        etage_id=etage.id))
+                    for k in range(scale['statuses']):
+                        acknowledged = k % 2 == 0
+                        db.session.add(Status(
+                            baes_id=baes_id, erreur=(0, 4, 6)[k % 3], is_solved=False, timestamp=now,
+                            acknowledged_by_user_id=admin.id if acknowledged else None,
+                            acknowledged_at=now if acknowledged else None,
+                        ))
+                    baes_id += 1
+                ids.setdefault('etage_id', etage.id)
+            ids.setdefault('batiment_id', batiment.id)
+        ids.setdefault('site_id', site.id)
+    db.session.flush()
+    incidents.rebuild()
+    db.session.commit()
+    ids.update(admin_id=admin.id, superadmin_id=superadmin.id)
+    return ids
+
+
+class StatementCounter:
+    """Compte les instructions SQL exécutées par tous les moteurs depuis le dernier reset()."""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(' '.join(statement.split())[:160])
+
+    def reset(self):
+        self.count = 0
+        self.statements = []
+
+
+@pytest.fixture(scope='session')
+def app():
+    """Application de api/app.py, sur la base jetable configurée ci-dessus."""
+    from app import app
+    return app
+
+
+@pytest.fixture(scope='session')
+def statement_counter():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    counter = StatementCounter()
+    event.listen(Engine, 'before_cursor_execute', counter.on_execute)
+    yield counter
+    event.remove(Engine, 'before_cursor_execute', counter.on_execute)
+
+
+@pytest.fixture(scope='module', params=SCALES)
+def dataset(request, app):
+    """Base recréée, bootstrapée et peuplée à la taille du paramètre ; retourne les identifiants."""
+    from models import db
+    import bootstrap
+
+    with app.app_context():
+        db.drop_all()
+        bootstrap.run()
+        return seed(parse_scale(request.param))
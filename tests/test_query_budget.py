@@ -0,0 +1,52 @@
+"""
+Garde-fou contre les N+1 : nombre d'instructions SQL par endpoint de lecture.
+
+Chaque endpoint est appelé une fois (caches de visibilité vidés) sur chaque taille de jeu de
+données (conftest.SCALES) et ne doit pas dépasser son budget. Les budgets ne dépendent pas du
+volume : un chargement paresseux en boucle le dépasse sur le plus grand jeu.
+
+  python -m pytest tests/test_query_budget.py -v
+"""
+import pytest
+
+# Budgets d'instructions SQL par appel, indépendants du volume de données (valeur mesurée + 1)
+ENDPOINTS = {
+    'general_user_alldata': ('/general/user/{admin_id}/alldata', 10),
+    'general_batiment_alldata': ('/general/batiment/{batiment_id}/alldata', 6),
+    'site_full': ('/sites/{site_id}/full', 8),
+    'status_user': ('/status/user/{admin_id}', 5),
+    'status_user_superadmin': ('/status/user/{superadmin_id}', 5),
+    'status_etage': ('/status/etage/{etage_id}', 3),
+    'status_site_latest': ('/status/site/{site_id}/latest', 3),
+    # Premier appel : jeu peuplé sans les routes de création, les compteurs d'alarmes du site sont
+    # calculés dans un SAVEPOINT (SAVEPOINT et RELEASE compris), puis 1 à 2 requêtes
+    'status_site_summary': ('/status/site/{site_id}/summary', 14),
+    'status_kpi_site': ('/status/kpi/site/{site_id}', 2),
+    # Visibilité de l'utilisateur, page de l'historique, logins des acquitteurs
+    'status_history': ('/status/history?user_id={admin_id}&limit=200', 4),
+    'status_history_aggregate': ('/status/history/aggregate?site_id={site_id}&bucket=day', 2),
+    'status_timeseries': ('/status/timeseries/temperature?etage_id={etage_id}&points=100', 3),
+    'incidents_open': ('/incidents/?user_id={admin_id}', 4),
+    'incidents_stats': ('/incidents/stats?site_id={site_id}', 4),
+    'baes_user': ('/baes/user/{admin_id}', 5),
+    # Étage, zoom de la carte, groupes
+    'etage_baes_clusters': ('/etages/{etage_id}/baes/clusters', 4),
+    'users': ('/users/', 3),
+    'sites': ('/sites/', 2),
+}
+
+
+@pytest.mark.parametrize('template, budget', ENDPOINTS.values(), ids=ENDPOINTS.keys())
+def test_statement_budget(app, dataset, statement_counter, template, budget):
+    from services import visibility
+
+    visibility.invalidate()
+    path = template.format(**dataset)
+    statement_counter.reset()
+    response = app.test_client().get(path)
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert statement_counter.count <= budget, (
+        f"{path} : {statement_counter.count} requêtes SQL, budget {budget}\n"
+        + '\n'.join(statement_counter.statements)
+    )
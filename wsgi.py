@@ -8,3 +8,28 @@ except ModuleNotFoundError:
 from werkzeug.middleware.proxy_fix import ProxyFix
 application.wsgi_app = ProxyFix(application.wsgi_app, x_for=1, x_proto=1, x_host=1, x_port=1)
 
+# Les modules de l'application sont importables directement (pythonpath = api dans uwsgi.ini)
+import bootstrap
+from models import db
+
+# Lecture de la version du schéma uniquement : le schéma et les données par défaut
+# sont appliqués une fois par déploiement par `flask --app app bootstrap`
+bootstrap.check_schema(application)
+
+# BAES connus chargés une fois dans le master : les workers forkés en héritent (services.known_baes)
+from services import known_baes
+known_baes.preload(application)
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    postfork = None
+
+if postfork is not None:
+    @postfork
+    def _reset_connection_pools():
+        # L'application est préchargée dans le master : chaque worker forké repart de pools vides
+        # sans fermer les connexions ouvertes avant le fork, qui appartiennent au master
+        with application.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)